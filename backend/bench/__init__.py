@@ -0,0 +1,7 @@
+"""
+性能基准测试包
+
+- synthetic: 合成数据生成器（用户、查询、评估轨迹、文件）
+- bench_forms: 表单层各方法的吞吐量/延迟/峰值内存基准
+- bench_startup: 基于 -X importtime 的启动耗时基准，带每个场景的耗时预算
+"""
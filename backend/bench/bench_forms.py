@@ -0,0 +1,400 @@
+"""
+表单层基准测试
+
+对 UserForm / QueryForm / EvaluationForm / FilesForm 的每个
+add_* / get_* / update_* / delete_* / list_all_* 方法测量：
+- 吞吐量 (ops/s)
+- 延迟分布 (mean / p50 / p95 / p99 / max，毫秒)
+- 峰值内存 (tracemalloc，KB)
+
+每个规模会新建一个数据库，用 SyntheticDataGenerator 批量灌入 N 行数据后再测量，
+结果保存为 JSON，可通过 --baseline 与历史结果对比以发现性能回退。
+
+用法（在 backend 目录下）：
+    python -m bench.bench_forms --scales 1000 100000 1000000 --ops 200
+    python -m bench.bench_forms --scales 1000 --baseline bench/results/forms_old.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import sqlalchemy
+from rich.console import Console
+from rich.table import Table
+
+from src.db.Forms.user_form import UserForm
+from src.db.Forms.query_form import QueryForm
+from src.db.Forms.evaluation_form import EvaluationForm
+from src.db.Forms.files_form import FilesForm
+from .synthetic import SyntheticDataGenerator, AGENTS, FILE_TYPES
+
+console = Console()
+
+DEFAULT_SCALES = (1_000, 100_000, 1_000_000)
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+@contextlib.contextmanager
+def _quiet():
+    """表单方法内部会用 rich 打印结果，测量时丢弃输出"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class FormBenchmark:
+    """表单层基准测试"""
+
+    def __init__(
+        self, scales=DEFAULT_SCALES, ops: int = 200, list_repeats: int = 3,
+        memory_ops: int = 5, file_size: int = 4096, seed: int = 0,
+        work_dir: str = None, keep_db: bool = False
+    ):
+        """
+        Args:
+            scales: 数据规模列表（每张业务表的行数）
+            ops: 每个单行方法的调用次数
+            list_repeats: list_all_* 的调用次数（全表加载，代价较高）
+            memory_ops: 峰值内存测量时额外调用的次数
+            file_size: 生成文件内容的字节数
+            seed: 随机种子
+            work_dir: 存放临时数据库的目录，默认使用系统临时目录
+            keep_db: 测量结束后是否保留数据库文件
+        """
+        self.scales = list(scales)
+        self.ops = ops
+        self.list_repeats = list_repeats
+        self.memory_ops = memory_ops
+        self.file_size = file_size
+        self.seed = seed
+        self.work_dir = work_dir
+        self.keep_db = keep_db
+
+    def run(self) -> dict:
+        """运行所有规模，返回完整结果"""
+        work_dir = self.work_dir or tempfile.mkdtemp(prefix="agenteval_bench_")
+        os.makedirs(work_dir, exist_ok=True)
+        result = {"meta": self._meta(), "scales": {}}
+        try:
+            for scale in self.scales:
+                console.print(f"[cyan]▶ 规模 {scale:,} 行[/cyan]")
+                result["scales"][str(scale)] = self.run_scale(scale, os.path.join(work_dir, f"forms_{scale}.db"))
+        finally:
+            if not self.keep_db and not self.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        return result
+
+    def run_scale(self, scale: int, db_path: str) -> dict:
+        """在指定规模的数据库上测量所有方法"""
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+        gen = SyntheticDataGenerator(seed=self.seed, file_size=self.file_size)
+        start = time.perf_counter()
+        ids = gen.seed_database(
+            db_path, users=max(10, scale // 100), queries=scale,
+            evaluations=scale, files=scale,
+        )
+        seed_seconds = time.perf_counter() - start
+
+        forms = {
+            "UserForm": UserForm(db_path),
+            "QueryForm": QueryForm(db_path),
+            "EvaluationForm": EvaluationForm(db_path),
+            "FilesForm": FilesForm(db_path),
+        }
+        methods = {}
+        for name, make_calls in self._plan(forms, gen, ids):
+            methods[name] = self._measure(make_calls)
+            console.print(
+                f"  {name:<45} {methods[name]['throughput_ops_s']:>10.1f} ops/s  "
+                f"p50 {methods[name]['latency_ms']['p50']:.3f} ms"
+            )
+
+        for form in forms.values():
+            form.engine.dispose()
+        db_size = os.path.getsize(db_path)
+        if not self.keep_db:
+            os.remove(db_path)
+
+        return {
+            "rows": scale,
+            "seed_seconds": round(seed_seconds, 3),
+            "db_size_bytes": db_size,
+            "methods": methods,
+        }
+
+    def _plan(self, forms: dict, gen: SyntheticDataGenerator, ids: dict):
+        """生成 (方法名, 调用工厂) 列表；调用工厂接收次数 n，返回 n 个无参调用，参数生成不计入耗时"""
+        rng = random.Random(self.seed)
+        user_form, query_form = forms["UserForm"], forms["QueryForm"]
+        evaluation_form, files_form = forms["EvaluationForm"], forms["FilesForm"]
+        user_ids, query_ids = ids["user_ids"], ids["query_ids"]
+        evaluation_ids, file_ids = ids["evaluation_ids"], ids["file_ids"]
+        counter = iter(range(10**9))
+
+        # delete_* 需要互不重复的 ID，预先打乱后依次取用
+        delete_pools = {
+            key: rng.sample(values, len(values)) for key, values in ids.items()
+        }
+        usernames = [f"user_{self.seed}_{i - user_ids[0]}" for i in user_ids]
+
+        def pick(values):
+            return rng.choice(values)
+
+        def take(key, n):
+            pool = delete_pools[key]
+            taken, delete_pools[key] = pool[:n], pool[n:]
+            return taken
+
+        def new_user(n):
+            rows = []
+            for _ in range(n):
+                i = next(counter)
+                rows.append(lambda i=i: user_form.add_user(f"bench_{i}", "pw", f"bench_{i}"))
+            return rows
+
+        def new_query(n):
+            rows = []
+            for row in gen.queries(n, user_ids):
+                row.pop("created_at")
+                rows.append(lambda row=row: query_form.add_query(**row))
+            return rows
+
+        def new_evaluation(n):
+            rows = []
+            for row in gen.evaluations(n, query_ids, user_ids):
+                row.pop("created_at")
+                rows.append(lambda row=row: evaluation_form.add_evaluation(**row))
+            return rows
+
+        def new_file(n):
+            rows = []
+            for row in gen.files(n, evaluation_ids):
+                row.pop("created_at")
+                rows.append(lambda row=row: files_form.add_file(**row))
+            return rows
+
+        def repeat(fn, arg_fn):
+            return lambda n: [(lambda a=arg_fn(): fn(a)) for _ in range(n)]
+
+        def listing(fn):
+            return lambda n: [fn for _ in range(min(n, self.list_repeats))]
+
+        plan = [
+            ("UserForm.add_user", new_user),
+            ("UserForm.get_user_by_username", repeat(user_form.get_user_by_username, lambda: pick(usernames))),
+            ("UserForm.update_user", lambda n: [
+                (lambda u=pick(usernames): user_form.update_user(u, nickname="bench")) for _ in range(n)
+            ]),
+            ("UserForm.get_lines", listing(user_form.get_lines)),
+
+            ("QueryForm.add_query", new_query),
+            ("QueryForm.get_query_by_id", repeat(query_form.get_query_by_id, lambda: pick(query_ids))),
+            ("QueryForm.get_queries_by_creator", repeat(query_form.get_queries_by_creator, lambda: pick(user_ids))),
+            ("QueryForm.update_query", lambda n: [
+                (lambda q=pick(query_ids): query_form.update_query(q, priority=rng.randint(1, 5))) for _ in range(n)
+            ]),
+            ("QueryForm.list_all_queries", listing(query_form.list_all_queries)),
+
+            ("EvaluationForm.add_evaluation", new_evaluation),
+            ("EvaluationForm.get_evaluation_by_id", repeat(evaluation_form.get_evaluation_by_id, lambda: pick(evaluation_ids))),
+            ("EvaluationForm.get_evaluations_by_query", repeat(evaluation_form.get_evaluations_by_query, lambda: pick(query_ids))),
+            ("EvaluationForm.get_evaluations_by_evaluator", repeat(evaluation_form.get_evaluations_by_evaluator, lambda: pick(user_ids))),
+            ("EvaluationForm.update_evaluation", lambda n: [
+                (lambda e=pick(evaluation_ids): evaluation_form.update_evaluation(e, quality_score=rng.randint(0, 100)))
+                for _ in range(n)
+            ]),
+            ("EvaluationForm.list_all_evaluations", listing(evaluation_form.list_all_evaluations)),
+
+            ("FilesForm.add_file", new_file),
+            ("FilesForm.get_file_by_id", repeat(files_form.get_file_by_id, lambda: pick(file_ids))),
+            ("FilesForm.get_file_content", repeat(files_form.get_file_content, lambda: pick(file_ids))),
+            ("FilesForm.get_files_by_evaluation", repeat(files_form.get_files_by_evaluation, lambda: pick(evaluation_ids))),
+            ("FilesForm.get_files_by_type", listing(lambda: files_form.get_files_by_type(rng.choice(FILE_TYPES)))),
+            ("FilesForm.update_file", lambda n: [
+                (lambda f=pick(file_ids): files_form.update_file(f, file_size=rng.randint(1, 10**6))) for _ in range(n)
+            ]),
+            ("FilesForm.list_all_files", listing(files_form.list_all_files)),
+
+            # 删除放在最后，按依赖的反方向执行
+            ("FilesForm.delete_file", lambda n: [
+                (lambda f=f: files_form.delete_file(f)) for f in take("file_ids", n)
+            ]),
+            ("EvaluationForm.delete_evaluation", lambda n: [
+                (lambda e=e: evaluation_form.delete_evaluation(e)) for e in take("evaluation_ids", n)
+            ]),
+            ("QueryForm.delete_query", lambda n: [
+                (lambda q=q: query_form.delete_query(q)) for q in take("query_ids", n)
+            ]),
+            ("UserForm.delete_user", lambda n: [
+                (lambda u=u: user_form.delete_user(f"user_{self.seed}_{u - user_ids[0]}"))
+                for u in take("user_ids", n)
+            ]),
+        ]
+        return plan
+
+    def _measure(self, make_calls) -> dict:
+        """测量延迟与吞吐，再单独用 tracemalloc 测峰值内存（避免追踪开销污染延迟）"""
+        calls = make_calls(self.ops)
+        latencies = []
+        failures = 0
+        with _quiet():
+            total_start = time.perf_counter()
+            for call in calls:
+                start = time.perf_counter()
+                result = call()
+                latencies.append(time.perf_counter() - start)
+                if result is False or result is None:
+                    failures += 1
+            total = time.perf_counter() - total_start
+
+        peak_kb = None
+        if self.memory_ops:
+            memory_calls = make_calls(self.memory_ops)
+            peak = 0
+            with _quiet():
+                tracemalloc.start()
+                try:
+                    for call in memory_calls:
+                        tracemalloc.reset_peak()
+                        call()
+                        peak = max(peak, tracemalloc.get_traced_memory()[1])
+                finally:
+                    tracemalloc.stop()
+            peak_kb = round(peak / 1024, 1)
+
+        latencies.sort()
+        ms = [value * 1000 for value in latencies]
+        return {
+            "ops": len(latencies),
+            "failures": failures,
+            "total_s": round(total, 6),
+            "throughput_ops_s": round(len(latencies) / total, 2) if total > 0 else 0.0,
+            "latency_ms": {
+                "mean": round(sum(ms) / len(ms), 4) if ms else 0.0,
+                "p50": round(_percentile(ms, 50), 4),
+                "p95": round(_percentile(ms, 95), 4),
+                "p99": round(_percentile(ms, 99), 4),
+                "max": round(ms[-1], 4) if ms else 0.0,
+            },
+            "peak_memory_kb": peak_kb,
+        }
+
+    def _meta(self) -> dict:
+        return {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "sqlite": sqlite3.sqlite_version,
+            "ops": self.ops,
+            "list_repeats": self.list_repeats,
+            "file_size": self.file_size,
+            "seed": self.seed,
+            "agents": AGENTS,
+        }
+
+
+def save_results(result: dict, output: str = None) -> str:
+    """保存结果 JSON，默认写入 bench/results/forms_<时间戳>.json"""
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output = str(RESULTS_DIR / f"forms_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return output
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = 0.10) -> list:
+    """对比两次结果，返回 (规模, 方法, 基线吞吐, 当前吞吐, 变化比例, 是否回退) 列表"""
+    rows = []
+    for scale, scale_result in current["scales"].items():
+        base_methods = baseline.get("scales", {}).get(scale, {}).get("methods", {})
+        for name, stats in scale_result["methods"].items():
+            base = base_methods.get(name)
+            if not base or not base["throughput_ops_s"]:
+                continue
+            change = stats["throughput_ops_s"] / base["throughput_ops_s"] - 1
+            rows.append((scale, name, base["throughput_ops_s"], stats["throughput_ops_s"], change, change < -threshold))
+    return rows
+
+
+def display_comparison(rows: list):
+    """展示与基线的对比"""
+    table = Table(title="与基线对比 (吞吐量 ops/s)")
+    table.add_column("规模", style="cyan", justify="right")
+    table.add_column("方法", style="white")
+    table.add_column("基线", style="blue", justify="right")
+    table.add_column("当前", style="green", justify="right")
+    table.add_column("变化", justify="right")
+    for scale, name, base, current, change, regressed in rows:
+        style = "red" if regressed else "green"
+        table.add_row(scale, name, f"{base:.1f}", f"{current:.1f}", f"[{style}]{change:+.1%}[/{style}]")
+    console.print(table)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="表单层基准测试")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES), help="数据规模（行数）")
+    parser.add_argument("--ops", type=int, default=200, help="每个单行方法的调用次数")
+    parser.add_argument("--list-repeats", type=int, default=3, help="list_all_* 的调用次数")
+    parser.add_argument("--memory-ops", type=int, default=5, help="峰值内存测量的调用次数，0 表示不测")
+    parser.add_argument("--file-size", type=int, default=4096, help="文件内容字节数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--work-dir", default=None, help="临时数据库目录")
+    parser.add_argument("--keep-db", action="store_true", help="保留生成的数据库")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    parser.add_argument("--baseline", default=None, help="用于对比的历史结果 JSON")
+    args = parser.parse_args(argv)
+
+    benchmark = FormBenchmark(
+        scales=args.scales, ops=args.ops, list_repeats=args.list_repeats,
+        memory_ops=args.memory_ops, file_size=args.file_size, seed=args.seed,
+        work_dir=args.work_dir, keep_db=args.keep_db,
+    )
+    result = benchmark.run()
+    output = save_results(result, args.output)
+    console.print(f"[green]✓ 结果已保存: {output}[/green]")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            rows = compare_results(json.load(f), result)
+        display_comparison(rows)
+        if any(row[-1] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
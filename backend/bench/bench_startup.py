@@ -0,0 +1,183 @@
+"""
+启动耗时基准测试
+
+每个场景在新的子进程里用 python -X importtime 执行，测量：
+- 场景语句本身的耗时（毫秒，取多次运行的中位数）
+- 导入耗时最多的模块（importtime 的 self 时间，与 cumulative 一起列出）
+- 不应出现的模块：例如 import src.db 不应加载 SQLAlchemy / rich / numpy
+
+每个场景有耗时预算，超出预算或加载了不应出现的模块时返回非零退出码，可直接用于 CI。
+第一次运行会写 .pyc 缓存，作为预热丢弃。
+
+用法（在 backend 目录下）：
+    python -m bench.bench_startup
+    python -m bench.bench_startup --repeats 9 --top 20
+    python -m bench.bench_startup --scenarios import_package --budget import_package=30
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# 场景名 -> (语句, 预算毫秒, 不应加载的顶层模块)；语句中的 {db} 替换为临时数据库路径
+SCENARIOS = {
+    "import_package": ("import src.db", 50, ("sqlalchemy", "rich", "numpy", "msgspec")),
+    "query_form": ("from src.db import QueryForm; QueryForm({db!r})", 500, ("rich", "numpy")),
+    "database_manager": ("from src.db import DatabaseManager; DatabaseManager({db!r})", 500, ("rich", "numpy")),
+    "cli_help": ("from src.db.cli import build_parser; build_parser().format_help()", 50, ("sqlalchemy", "rich", "numpy")),
+}
+
+_CHILD = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({{"elapsed_ms": elapsed}}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """解析 -X importtime 输出，返回 [{module, self_us, cumulative_us, depth}]，按导入完成顺序"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # 表头 "self [us] | cumulative | imported package"
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        rows.append({
+            "module": stripped,
+            "self_us": int(parts[0]),
+            "cumulative_us": int(parts[1]),
+            "depth": (len(name) - len(stripped) - 1) // 2,
+        })
+    return rows
+
+
+def run_scenario(statement: str, db_path: str, python: str = sys.executable) -> dict:
+    """在子进程中执行一次场景，返回耗时与 importtime 明细"""
+    code = _CHILD.format(statement=statement.format(db=db_path))
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"场景执行失败: {statement}\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+
+def summarize(runs: list, budget_ms: float, forbidden: tuple, top: int = 10) -> dict:
+    """合并同一场景的多次运行：耗时取中位数，模块按 self 时间中位数排序"""
+    self_times, cumulative = {}, {}
+    for run in runs:
+        for row in run["imports"]:
+            self_times.setdefault(row["module"], []).append(row["self_us"])
+            cumulative.setdefault(row["module"], []).append(row["cumulative_us"])
+    elapsed = statistics.median(run["elapsed_ms"] for run in runs)
+    loaded = {module.split(".")[0] for module in self_times}
+    modules = sorted(self_times, key=lambda m: statistics.median(self_times[m]), reverse=True)
+    return {
+        "elapsed_ms": round(elapsed, 2),
+        "budget_ms": budget_ms,
+        "over_budget": elapsed > budget_ms,
+        "modules_loaded": len(self_times),
+        "forbidden_loaded": sorted(set(forbidden) & loaded),
+        "top_modules": [
+            {
+                "module": module,
+                "self_ms": round(statistics.median(self_times[module]) / 1000, 2),
+                "cumulative_ms": round(statistics.median(cumulative[module]) / 1000, 2),
+            }
+            for module in modules[:top]
+        ],
+    }
+
+
+def run_benchmark(names=None, repeats: int = 5, top: int = 10, budgets: dict = None) -> dict:
+    """运行场景并返回 {场景名: 汇总}"""
+    budgets = budgets or {}
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, "startup.db")
+        for name in names or SCENARIOS:
+            statement, budget_ms, forbidden = SCENARIOS[name]
+            run_scenario(statement, db_path)  # 预热 .pyc
+            runs = [run_scenario(statement, db_path) for _ in range(repeats)]
+            results[name] = summarize(runs, budgets.get(name, budget_ms), forbidden, top)
+    return results
+
+
+def display_results(results: dict):
+    """展示每个场景的耗时与导入最慢的模块"""
+    table = Table(title="启动耗时 (中位数)")
+    table.add_column("场景", style="cyan")
+    table.add_column("耗时 ms", justify="right")
+    table.add_column("预算 ms", style="blue", justify="right")
+    table.add_column("模块数", justify="right")
+    table.add_column("不应加载", style="red")
+    for name, result in results.items():
+        style = "red" if result["over_budget"] else "green"
+        table.add_row(
+            name, f"[{style}]{result['elapsed_ms']:.1f}[/{style}]", f"{result['budget_ms']:.0f}",
+            str(result["modules_loaded"]), ", ".join(result["forbidden_loaded"]) or "-",
+        )
+    console.print(table)
+
+    for name, result in results.items():
+        modules = Table(title=f"{name}: 导入最慢的模块")
+        modules.add_column("模块", style="white")
+        modules.add_column("self ms", justify="right")
+        modules.add_column("cumulative ms", style="blue", justify="right")
+        for row in result["top_modules"]:
+            modules.add_row(row["module"], f"{row['self_ms']:.2f}", f"{row['cumulative_ms']:.2f}")
+        console.print(modules)
+
+
+def _parse_budget(value: str):
+    name, _, ms = value.partition("=")
+    if name not in SCENARIOS or not ms:
+        raise argparse.ArgumentTypeError(f"预算格式为 场景名=毫秒，场景名可选: {', '.join(SCENARIOS)}")
+    return name, float(ms)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="启动耗时基准测试")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=None, help="要运行的场景")
+    parser.add_argument("--repeats", type=int, default=5, help="每个场景的运行次数")
+    parser.add_argument("--top", type=int, default=10, help="列出导入最慢的模块数")
+    parser.add_argument("--budget", type=_parse_budget, action="append", default=[], help="覆盖预算，如 query_form=800")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.scenarios, repeats=args.repeats, top=args.top, budgets=dict(args.budget))
+    display_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        console.print(f"[green]✓ 结果已保存: {args.output}[/green]")
+
+    failed = [name for name, result in results.items() if result["over_budget"] or result["forbidden_loaded"]]
+    if failed:
+        console.print(f"[red]✗ 超出启动预算: {', '.join(failed)}[/red]")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""
+轨迹解析基准测试
+
+对同一批轨迹 JSON 测量各解析方式的吞吐量 (MB/s)：
+- json.loads: 标准库解码，不校验
+- msgspec.decode: msgspec 无类型解码，不校验
+- normalize[msgspec]: 解码为带类型的步骤结构、规范化并重新编码（导入时实际使用的路径）
+- parse_trajectory[msgspec]: 解码为带类型的步骤结构并规范化为 dict
+- parse_trajectory[stdlib] / normalize[stdlib]: 标准库解码 + 逐字段校验（未安装 msgspec 时的回退路径）
+
+默认用 SyntheticDataGenerator 生成约 --target-mb 的轨迹；--files 指定真实轨迹文件时使用真实数据。
+每种方式重复 --repeats 次取最快一次，结果保存为 JSON。
+
+用法（在 backend 目录下）：
+    python -m bench.bench_trajectory --target-mb 100
+    python -m bench.bench_trajectory --files runs/*/*/trajectory.json
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+
+from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
+
+from src.db.trajectory_schema import msgspec, parse_trajectory, normalize_trajectory_json
+from .bench_forms import RESULTS_DIR, _git_commit
+from .synthetic import SyntheticDataGenerator
+
+console = Console()
+
+
+def synthetic_corpus(target_mb: float, seed: int = 0, min_steps: int = 20, max_steps: int = 60) -> list:
+    """生成总大小约 target_mb 的轨迹（bytes 列表），步数较多以接近真实运行的体积"""
+    gen = SyntheticDataGenerator(seed=seed, min_steps=min_steps, max_steps=max_steps, trajectory_pool=0)
+    corpus, total = [], 0
+    target = target_mb * 1024 * 1024
+    while total < target:
+        data = json.dumps(gen.trajectory(), ensure_ascii=False).encode("utf-8")
+        corpus.append(data)
+        total += len(data)
+    return corpus
+
+
+def file_corpus(paths: list) -> list:
+    corpus = []
+    for path in paths:
+        with open(path, "rb") as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def parsers() -> dict:
+    """可用的解析方式 {名称: 函数}"""
+    result = {"json.loads": json.loads}
+    if msgspec is not None:
+        result["msgspec.decode"] = msgspec.json.decode
+        result["normalize[msgspec]"] = lambda data: normalize_trajectory_json(data, use_msgspec=True)
+        result["parse_trajectory[msgspec]"] = lambda data: parse_trajectory(data, use_msgspec=True)
+    result["normalize[stdlib]"] = lambda data: normalize_trajectory_json(data, use_msgspec=False)
+    result["parse_trajectory[stdlib]"] = lambda data: parse_trajectory(data, use_msgspec=False)
+    return result
+
+
+def run_benchmark(corpus: list, repeats: int = 3) -> dict:
+    """对 corpus 运行全部解析方式，返回结果 dict"""
+    total_bytes = sum(len(data) for data in corpus)
+    total_mb = total_bytes / (1024 * 1024)
+    methods = {}
+    for name, parse in parsers().items():
+        timings, failures = [], 0
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for data in corpus:
+                try:
+                    parse(data)
+                except ValueError:
+                    failures += 1
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        methods[name] = {
+            "best_s": round(best, 6),
+            "mean_s": round(sum(timings) / len(timings), 6),
+            "mb_per_s": round(total_mb / best, 2) if best > 0 else 0.0,
+            "failures": failures // repeats,
+        }
+    baseline = methods["json.loads"]["mb_per_s"]
+    for stats in methods.values():
+        stats["vs_json"] = round(stats["mb_per_s"] / baseline, 2) if baseline else 0.0
+    return {
+        "meta": {
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "msgspec": getattr(msgspec, "__version__", None),
+            "repeats": repeats,
+        },
+        "corpus": {"files": len(corpus), "bytes": total_bytes, "mb": round(total_mb, 2)},
+        "methods": methods,
+    }
+
+
+def display_results(result: dict):
+    corpus = result["corpus"]
+    table = Table(title=f"轨迹解析吞吐量（{corpus['files']} 个文件，{corpus['mb']} MB）")
+    table.add_column("方式", style="cyan")
+    table.add_column("最快 (s)", style="white", justify="right")
+    table.add_column("MB/s", style="green", justify="right")
+    table.add_column("相对 json.loads", style="yellow", justify="right")
+    table.add_column("失败", style="red", justify="right")
+    for name, stats in result["methods"].items():
+        table.add_row(escape(name), f"{stats['best_s']:.3f}", f"{stats['mb_per_s']:.1f}",
+                      f"{stats['vs_json']:.2f}x", str(stats["failures"]))
+    console.print(table)
+
+
+def save_results(result: dict, output: str = None) -> str:
+    """保存结果 JSON，默认写入 bench/results/trajectory_<时间戳>.json"""
+    if output is None:
+        RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+        output = str(RESULTS_DIR / f"trajectory_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="轨迹解析基准测试")
+    parser.add_argument("--files", nargs="+", default=None, help="真实轨迹文件（不指定时生成合成数据）")
+    parser.add_argument("--target-mb", type=float, default=100, help="合成数据总大小 (MB)")
+    parser.add_argument("--repeats", type=int, default=3, help="每种方式的重复次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", default=None, help="结果 JSON 路径")
+    args = parser.parse_args(argv)
+
+    corpus = file_corpus(args.files) if args.files else synthetic_corpus(args.target_mb, args.seed)
+    result = run_benchmark(corpus, args.repeats)
+    display_results(result)
+    output = save_results(result, args.output)
+    console.print(f"[green]✓ 结果已保存: {output}[/green]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+合成数据生成器
+
+按固定随机种子生成可复现的测试数据：
+- 用户 (user_form)
+- 查询 (query_form)
+- 评估 (evaluation_form)，trajectory 为前端轨迹查看器使用的 JSON 格式
+- 文件 (files_form)，内容大小可配置
+
+轨迹格式（JSON 数组，每个元素是一个步骤）：
+    step, task, timing, token_usage, model_input_messages,
+    tool_calls, model_output_message, error
+
+用法：
+    gen = SyntheticDataGenerator(seed=42)
+    ids = gen.seed_database("bench.db", users=100, queries=1000,
+                            evaluations=1000, files=1000)
+"""
+
+import json
+import random
+import string
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from sqlalchemy import insert, func, select
+
+from src.db.engine import create_sqlite_engine
+from src.db.migrations import MigrationRunner
+from src.db.models import UserModel, QueryModel, EvaluationModel, FilesModel
+
+AGENTS = ["gpt-agent", "claude-agent", "qwen-agent", "deepseek-agent", "glm-agent"]
+TOOLS = ["web_search", "read_file", "write_file", "python_exec", "browser_open"]
+FILE_TYPES = ["trajectory", "report", "deliverable", "pre_data"]
+WORDS = (
+    "agent evaluation query report search result file data analysis model "
+    "tool step answer summary plan check verify source table chart user task"
+).split()
+
+
+class SyntheticDataGenerator:
+    """可复现的合成数据生成器"""
+
+    def __init__(
+        self, seed: int = 0, min_steps: int = 3, max_steps: int = 8,
+        file_size: int = 4096, trajectory_pool: int = 64
+    ):
+        """
+        Args:
+            seed: 随机种子，相同种子生成相同数据
+            min_steps/max_steps: 每条轨迹的步骤数范围
+            file_size: 生成文件内容的默认字节数
+            trajectory_pool: 预生成的轨迹数量，大规模数据循环复用以降低生成开销（0 表示每条都新生成）
+        """
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.min_steps = min_steps
+        self.max_steps = max_steps
+        self.file_size = file_size
+        self.trajectory_pool = trajectory_pool
+        self._pool = []
+        self._base_time = datetime(2025, 1, 1)
+
+    # ---------- 基础字段 ----------
+
+    def _sentence(self, n_words: int) -> str:
+        return " ".join(self.rng.choice(WORDS) for _ in range(n_words))
+
+    def _timestamp(self) -> str:
+        delta = timedelta(seconds=self.rng.randint(0, 180 * 24 * 3600))
+        return (self._base_time + delta).strftime("%Y-%m-%d %H:%M:%S")
+
+    # ---------- 轨迹 ----------
+
+    def trajectory(self, n_steps: int = None) -> list:
+        """生成一条轨迹；每一步的 model_input_messages 都是完整历史（与真实数据一致）"""
+        if n_steps is None:
+            n_steps = self.rng.randint(self.min_steps, self.max_steps)
+
+        task = self._sentence(20)
+        history = [
+            {"role": "system", "content": [{"type": "text", "text": "You are a helpful agent."}]},
+            {"role": "user", "content": [{"type": "text", "text": task}]},
+        ]
+        start = self._base_time + timedelta(seconds=self.rng.randint(0, 10**6))
+        steps = []
+        for i in range(1, n_steps + 1):
+            duration = round(self.rng.uniform(0.5, 30.0), 3)
+            input_tokens = self.rng.randint(500, 8000)
+            output_tokens = self.rng.randint(20, 1500)
+            tool = self.rng.choice(TOOLS)
+            tool_calls = [{
+                "id": f"call_{i}_{self.rng.randint(0, 10**6)}",
+                "type": "function",
+                "function": {
+                    "name": tool,
+                    "arguments": json.dumps({"query": self._sentence(6)}),
+                },
+            }]
+            output = {"role": "assistant", "content": self._sentence(40)}
+            has_error = self.rng.random() < 0.05
+            steps.append({
+                "step": i,
+                "task": task if i == 1 else None,
+                "timing": {
+                    "start_time": start.timestamp(),
+                    "end_time": start.timestamp() + duration,
+                    "duration": duration,
+                },
+                "token_usage": {
+                    "input_tokens": input_tokens,
+                    "output_tokens": output_tokens,
+                    "total_tokens": input_tokens + output_tokens,
+                },
+                "model_input_messages": list(history),
+                "tool_calls": tool_calls,
+                "model_output_message": output,
+                "error": f"{tool} timeout" if has_error else None,
+            })
+            start += timedelta(seconds=duration)
+            history.append({"role": "assistant", "content": [{"type": "text", "text": output["content"]}]})
+            history.append({"role": "tool", "content": [{"type": "text", "text": self._sentence(30)}]})
+        return steps
+
+    def trajectory_json(self) -> str:
+        """返回序列化后的轨迹；启用轨迹池时循环复用"""
+        if not self.trajectory_pool:
+            return json.dumps(self.trajectory(), ensure_ascii=False)
+        if len(self._pool) < self.trajectory_pool:
+            self._pool.append(json.dumps(self.trajectory(), ensure_ascii=False))
+            return self._pool[-1]
+        return self.rng.choice(self._pool)
+
+    def file_content(self, size: int = None) -> bytes:
+        size = self.file_size if size is None else size
+        chunk = "".join(self.rng.choice(string.ascii_letters) for _ in range(min(size, 256))).encode()
+        return (chunk * (size // max(len(chunk), 1) + 1))[:size]
+
+    # ---------- 行数据 ----------
+
+    def users(self, n: int, start: int = 0) -> Iterator[dict]:
+        for i in range(start, start + n):
+            yield {
+                "username": f"user_{self.seed}_{i}",
+                "password": "".join(self.rng.choices(string.ascii_letters + string.digits, k=16)),
+                "nickname": f"测试用户{i}",
+                "full_name": self._sentence(2),
+                "created_at": self._timestamp(),
+            }
+
+    def queries(self, n: int, creator_ids: list) -> Iterator[dict]:
+        for _ in range(n):
+            yield {
+                "lazy_query": self._sentence(8),
+                "detail_query": self._sentence(60),
+                "creator_id": self.rng.choice(creator_ids) if creator_ids else None,
+                "priority": self.rng.randint(1, 5),
+                "created_at": self._timestamp(),
+            }
+
+    def evaluations(self, n: int, query_ids: list, evaluator_ids: list) -> Iterator[dict]:
+        for _ in range(n):
+            yield {
+                "query_id": self.rng.choice(query_ids),
+                "agent": self.rng.choice(AGENTS),
+                "evaluator_id": self.rng.choice(evaluator_ids) if evaluator_ids else None,
+                "quality_score": self.rng.randint(0, 100),
+                "trajectory": self.trajectory_json(),
+                "report_content": "# 评估报告\n\n" + self._sentence(80),
+                "created_at": self._timestamp(),
+            }
+
+    def files(self, n: int, evaluation_ids: list, size: int = None) -> Iterator[dict]:
+        content = self.file_content(size)
+        for i in range(n):
+            file_type = self.rng.choice(FILE_TYPES)
+            yield {
+                "evaluation_id": self.rng.choice(evaluation_ids),
+                "filename": f"{file_type}_{i}.bin",
+                "content": content,
+                "file_type": file_type,
+                "file_size": len(content),
+                "created_at": self._timestamp(),
+            }
+
+    # ---------- 批量写入 ----------
+
+    def seed_database(
+        self, db_path: str, users: int, queries: int, evaluations: int,
+        files: int, batch_size: int = 5000
+    ) -> dict:
+        """建表并批量写入合成数据，返回各表的 ID 列表"""
+        engine = create_sqlite_engine(db_path)
+        MigrationRunner(db_path, engine=engine).ensure()
+        try:
+            user_ids = self._bulk_insert(engine, UserModel, self.users(users), batch_size)
+            query_ids = self._bulk_insert(engine, QueryModel, self.queries(queries, user_ids), batch_size)
+            evaluation_ids = self._bulk_insert(
+                engine, EvaluationModel, self.evaluations(evaluations, query_ids, user_ids), batch_size
+            )
+            file_ids = self._bulk_insert(engine, FilesModel, self.files(files, evaluation_ids), batch_size)
+        finally:
+            engine.dispose()
+        return {
+            "user_ids": user_ids,
+            "query_ids": query_ids,
+            "evaluation_ids": evaluation_ids,
+            "file_ids": file_ids,
+        }
+
+    @staticmethod
+    def _bulk_insert(engine, model, rows: Iterator[dict], batch_size: int) -> list:
+        """按批次 executemany 写入，返回新行 ID"""
+        table = model.__table__
+        with engine.begin() as conn:
+            last_id = conn.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                with engine.begin() as conn:
+                    conn.execute(insert(table), batch)
+                batch = []
+        if batch:
+            with engine.begin() as conn:
+                conn.execute(insert(table), batch)
+        with engine.connect() as conn:
+            return list(conn.scalars(select(table.c.id).where(table.c.id > last_id).order_by(table.c.id)))
@@ -1,6 +1,5 @@
 import sys
-from src.db import UserForm, QueryForm, EvaluationForm, FilesForm
-from src.db.database import DatabaseManager
+from src.db import QueryForm, DatabaseManager
 
 
 def main():
@@ -9,10 +8,8 @@ def main():
 
     db_manager.display_database_info()
 
-    user_form = UserForm()
+    # 表单的引擎在第一次读写时才创建，只构造用到的表单
     query_form = QueryForm()
-    evaluation_form = EvaluationForm()
-    files_form = FilesForm()
 
 
     #创建表
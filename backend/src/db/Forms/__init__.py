@@ -8,16 +8,42 @@
 - QueryForm: 查询表单管理  
 - EvaluationForm: 评估表单管理
 - FilesForm: 文件表单管理
+
+表单类在第一次访问时才导入所在模块，见 src/db/__init__.py。
 """
 
-from .user_form import UserForm
-from .query_form import QueryForm
-from .evaluation_form import EvaluationForm
-from .files_form import FilesForm
+import importlib
+from typing import TYPE_CHECKING
+
+_EXPORTS = {
+    'UserForm': '.user_form',
+    'QueryForm': '.query_form',
+    'EvaluationForm': '.evaluation_form',
+    'FilesForm': '.files_form',
+}
+
+if TYPE_CHECKING:
+    from .user_form import UserForm
+    from .query_form import QueryForm
+    from .evaluation_form import EvaluationForm
+    from .files_form import FilesForm
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
+
 
 __all__ = [
     'UserForm',
     'QueryForm', 
     'EvaluationForm',
     'FilesForm'
-] 
\ No newline at end of file
+]
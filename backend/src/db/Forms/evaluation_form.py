@@ -10,6 +10,7 @@ evaluation_form 表结构：
 │ id           │ INTEGER │ 否       │ 自增   │ 是   │
 │ query_id     │ INTEGER │ 否       │ NULL   │ 否   │
 │ agent        │ TEXT    │ 是       │ NULL   │ 否   │
+│ run_id       │ TEXT    │ 是       │ NULL   │ 否   │
 │ evaluator_id │ INTEGER │ 是       │ NULL   │ 否   │
 │ quality_score│ INTEGER │ 是       │ NULL   │ 否   │
 │ trajectory   │ TEXT    │ 是       │ NULL   │ 否   │
@@ -18,26 +19,35 @@ evaluation_form 表结构：
 │ updated_at   │ TEXT    │ 是       │ NULL   │ 否   │
 └──────────────┴─────────┴──────────┴────────┴──────┘
 
+trajectory 以前缀共享的紧凑格式存储（见 trajectory_store.py）：get_evaluation_by_id、list_all_evaluations
+等返回的对象的 .trajectory 是存储的紧凑文本，读取时不还原；步骤数组用 get_trajectory / get_trajectory_step 获取
+
 可用方法
 add_evaluation
+upsert_evaluation
+upsert_evaluations
 delete_evaluation
 get_evaluation_by_id
+get_trajectory
+get_trajectory_step
 get_evaluations_by_query
 get_evaluations_by_evaluator
 update_evaluation
 list_all_evaluations
+update_evaluations
+delete_evaluations
 """
 
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
+from ..lazy_rich import Console, Panel, Table
 
 from ..base_form import BaseForm
 from ..models import EvaluationModel
+from ..trajectory_schema import normalize_trajectory_json
+from ..trajectory_store import CompactTrajectory, load_trajectory
 
 table_name = EvaluationModel.__tablename__
 
@@ -45,22 +55,29 @@ class EvaluationForm(BaseForm):
     """评估表单管理器 - SQLAlchemy版本"""
 
     def __init__(self, db_path="app.db"):
-        super().__init__(db_path, table_name)
+        super().__init__(db_path, EvaluationModel)
 
     def add_evaluation(
         self, query_id: int, agent: str = None, evaluator_id: int = None,
         quality_score: int = None, trajectory: str = None, report_content: str = None,
-        deliverables: list = None
+        deliverables: list = None, run_id: str = None, validate: bool = False
     ) -> bool:
-        """添加评估 - 支持同时添加若干交付文件（deliverable），并通过FilesForm.add_file方法写入"""
+        """添加评估 - 支持同时添加若干交付文件（deliverable），并通过FilesForm.add_file方法写入
+
+        validate=True 时先按 trajectory_schema 校验并规范化轨迹，格式错误的运行直接拒绝
+        """
         from .files_form import FilesForm
         try:
+            if validate and trajectory:
+                trajectory = normalize_trajectory_json(trajectory)
+
             session = self.Session()
 
             # 创建新评估
             new_evaluation = EvaluationModel(
                 query_id=query_id,
                 agent=agent,
+                run_id=run_id,
                 evaluator_id=evaluator_id,
                 quality_score=quality_score,
                 trajectory=trajectory,
@@ -115,7 +132,7 @@ class EvaluationForm(BaseForm):
     def get_evaluation_by_id(self, evaluation_id: int) -> EvaluationModel:
         """根据ID获取评估"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             evaluation = session.query(EvaluationModel).filter_by(id=evaluation_id).first()
             session.close()
             return evaluation
@@ -124,10 +141,34 @@ class EvaluationForm(BaseForm):
             console.print(f"[red]✗ 查询失败: {e}[/red]")
             return None
 
+    def get_trajectory(self, evaluation_id: int, lazy: bool = False):
+        """获取评估的轨迹步骤数组（由紧凑格式还原）
+
+        lazy=True 时返回 CompactTrajectory，按步访问时才还原该步的 model_input_messages
+        """
+        try:
+            session = self.ReadSession()
+            text = session.query(EvaluationModel.trajectory).filter_by(id=evaluation_id).scalar()
+            session.close()
+            return load_trajectory(text, lazy=lazy)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 查询失败: {e}[/red]")
+            return None
+
+    def get_trajectory_step(self, evaluation_id: int, index: int) -> dict:
+        """获取轨迹的第 index 步（从 0 开始），只还原这一步"""
+        trajectory = self.get_trajectory(evaluation_id, lazy=True)
+        if trajectory is None or not 0 <= index < len(trajectory):
+            return None
+        if isinstance(trajectory, CompactTrajectory):
+            return trajectory.step(index)
+        return trajectory[index]
+
     def get_evaluations_by_query(self, query_id: int) -> list:
         """根据查询ID获取评估列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             evaluations = session.query(EvaluationModel).filter_by(query_id=query_id).all()
             session.close()
             return evaluations
@@ -139,7 +180,7 @@ class EvaluationForm(BaseForm):
     def get_evaluations_by_evaluator(self, evaluator_id: int) -> list:
         """根据评估者ID获取评估列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             evaluations = session.query(EvaluationModel).filter_by(evaluator_id=evaluator_id).all()
             session.close()
             return evaluations
@@ -213,7 +254,7 @@ class EvaluationForm(BaseForm):
     def list_all_evaluations(self) -> list:
         """获取所有评估列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             evaluations = session.query(EvaluationModel).all()
             session.close()
             return evaluations
@@ -267,4 +308,34 @@ class EvaluationForm(BaseForm):
             )
 
         console = Console()
-        console.print(table) 
\ No newline at end of file
+        console.print(table)
+
+    def upsert_evaluation(
+        self, query_id: int, agent: str, run_id: str, evaluator_id: int = None,
+        quality_score: int = None, trajectory: str = None, report_content: str = None
+    ) -> int:
+        """添加或更新评估 - 以 (query_id, agent, run_id) 为自然键原子 upsert（值为 None 的字段保留原值），返回评估ID，失败返回 None"""
+        row = {
+            "query_id": query_id,
+            "agent": agent,
+            "run_id": run_id,
+            "evaluator_id": evaluator_id,
+            "quality_score": quality_score,
+            "trajectory": trajectory,
+            "report_content": report_content,
+        }
+        # 未传入的可选字段不参与更新，保留已有值
+        ids = self.upsert_evaluations([{k: v for k, v in row.items() if v is not None}])
+        return ids[0] if ids else None
+
+    def upsert_evaluations(self, rows: list, key=("query_id", "agent", "run_id")) -> list:
+        """批量添加或更新评估 - 单条 INSERT … ON CONFLICT DO UPDATE … RETURNING，返回ID列表"""
+        return self.upsert(rows, key)
+
+    def update_evaluations(self, where, values: dict) -> int:
+        """批量更新评估 - 单条 UPDATE 语句，where 见 BaseForm._build_where，返回更新行数"""
+        return self.bulk_update(where, values)
+
+    def delete_evaluations(self, where) -> int:
+        """批量删除评估 - 单条 DELETE 语句，关联的文件随之级联删除，返回删除行数"""
+        return self.bulk_delete(where)
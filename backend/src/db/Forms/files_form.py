@@ -31,18 +31,20 @@ get_files_by_evaluation
 get_files_by_type
 update_file
 list_all_files
+update_files
+delete_files
 """
 
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, LargeBinary, Enum
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
+from ..lazy_rich import Console, Panel, Table
 
 from ..base_form import BaseForm
 from ..models import FilesModel
+from ..media_extract import write_media
+from ..trajectory_store import pack_trajectory_bytes, unpack_trajectory_bytes
 
 table_name = FilesModel.__tablename__
 
@@ -50,7 +52,7 @@ class FilesForm(BaseForm):
     """文件表单管理器 - SQLAlchemy版本"""
 
     def __init__(self, db_path="app.db"):
-        super().__init__(db_path, table_name)
+        super().__init__(db_path, FilesModel)
 
     def add_file(
         self, evaluation_id: int, filename: str, file_type: str,
@@ -69,6 +71,11 @@ class FilesForm(BaseForm):
                 session.close()
                 return False
 
+            # 轨迹文件以前缀共享的紧凑格式存储，读取时还原；抽出的图片与文件在同一事务中写入
+            media = {}
+            if file_type == "trajectory" and content:
+                content = pack_trajectory_bytes(content, media)
+
             # 创建新文件记录
             new_file = FilesModel(
                 evaluation_id=evaluation_id,
@@ -80,6 +87,7 @@ class FilesForm(BaseForm):
             )
 
             session.add(new_file)
+            write_media(session.connection(), media)
             session.commit()
 
             console = Console()
@@ -98,7 +106,7 @@ class FilesForm(BaseForm):
     def get_file_by_id(self, file_id: int) -> FilesModel:
         """根据ID获取文件"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             file_record = session.query(FilesModel).filter_by(id=file_id).first()
             session.close()
             return file_record
@@ -110,7 +118,7 @@ class FilesForm(BaseForm):
     def get_files_by_evaluation(self, evaluation_id: int) -> list:
         """根据评估ID获取文件列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             files = session.query(FilesModel).filter_by(evaluation_id=evaluation_id).all()
             session.close()
             return files
@@ -122,7 +130,7 @@ class FilesForm(BaseForm):
     def get_files_by_type(self, file_type: str) -> list:
         """根据文件类型获取文件列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             files = session.query(FilesModel).filter_by(file_type=file_type).all()
             session.close()
             return files
@@ -196,7 +204,7 @@ class FilesForm(BaseForm):
     def list_all_files(self) -> list:
         """获取所有文件列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             files = session.query(FilesModel).all()
             session.close()
             return files
@@ -252,11 +260,13 @@ class FilesForm(BaseForm):
     def get_file_content(self, file_id: int) -> bytes:
         """获取文件内容"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             file_record = session.query(FilesModel).filter_by(id=file_id).first()
             session.close()
             
             if file_record and file_record.content:
+                if file_record.file_type == "trajectory":
+                    return unpack_trajectory_bytes(file_record.content)
                 return file_record.content
             else:
                 console = Console()
@@ -265,4 +275,12 @@ class FilesForm(BaseForm):
         except SQLAlchemyError as e:
             console = Console()
             console.print(f"[red]✗ 获取文件内容失败: {e}[/red]")
-            return None 
\ No newline at end of file
+            return None
+
+    def update_files(self, where, values: dict) -> int:
+        """批量更新文件 - 单条 UPDATE 语句，where 见 BaseForm._build_where，返回更新行数"""
+        return self.bulk_update(where, values)
+
+    def delete_files(self, where) -> int:
+        """批量删除文件 - 单条 DELETE 语句，返回删除行数"""
+        return self.bulk_delete(where)
@@ -10,6 +10,7 @@ query_form 表结构：
 │ id           │ INTEGER │ 否       │ 自增   │ 是   │
 │ lazy_query   │ TEXT    │ 是       │ NULL   │ 否   │
 │ detail_query │ TEXT    │ 是       │ NULL   │ 否   │
+│ content_hash │ TEXT    │ 是       │ NULL   │ 否   │
 │ creator_id   │ INTEGER │ 是       │ NULL   │ 否   │
 │ priority     │ INTEGER │ 是       │ NULL   │ 否   │
 │ created_at   │ TEXT    │ 否       │ NULL   │ 否   │
@@ -18,23 +19,27 @@ query_form 表结构：
 
 可用方法
 add_query
+upsert_query
+upsert_queries
 delete_query
 get_query_by_id
 get_queries_by_creator
 update_query
 list_all_queries
+update_queries
+delete_queries
 """
 
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, select
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
+from ..lazy_rich import Console, Panel, Table
 
 from ..base_form import BaseForm
-from ..models import QueryModel
+from ..models import QueryModel, compute_query_hash
+from ..query_dedup import index_queries
+from ..upsert import insert_ignore
 
 table_name = QueryModel.__tablename__
 
@@ -42,45 +47,50 @@ class QueryForm(BaseForm):
     """查询表单管理器 - SQLAlchemy版本"""
 
     def __init__(self, db_path="app.db"):
-        super().__init__(db_path, table_name)
+        super().__init__(db_path, QueryModel)
 
     def add_query(
         self, lazy_query: str = None, detail_query: str = None, 
         creator_id: int = None, priority: int = None
-    ) -> bool:
-        """添加查询 - 使用ORM方式"""
-        try:
-            session = self.Session()
-
-            # 创建新查询
-            new_query = QueryModel(
-                lazy_query=lazy_query,
-                detail_query=detail_query,
-                creator_id=creator_id,
-                priority=priority,
-                created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            )
+    ) -> int:
+        """添加查询 - 单条 INSERT … ON CONFLICT DO NOTHING，detail_query 内容已存在时不重复插入
 
-            session.add(new_query)
-            session.commit()
+        Returns:
+            新查询的ID；内容已存在时返回已有查询的ID（不修改已有查询）；失败返回 None
+        """
+        try:
+            with self.engine.begin() as conn:
+                query_id = insert_ignore(conn, QueryModel, {
+                    "lazy_query": lazy_query,
+                    "detail_query": detail_query,
+                    "creator_id": creator_id,
+                    "priority": priority,
+                })
+                if query_id is None:
+                    existing = conn.execute(
+                        select(QueryModel.__table__.c.id)
+                        .where(QueryModel.__table__.c.content_hash == compute_query_hash(detail_query))
+                    ).scalar()
+                else:
+                    # 同一事务内为新查询建近似重复索引
+                    index_queries(conn, [query_id])
 
             console = Console()
-            console.print(f"[green]✓ 查询添加成功！ID: {new_query.id}[/green]")
-            session.close()
-            return True
+            if query_id is None:
+                console.print(f"[yellow]查询内容已存在，ID: {existing}[/yellow]")
+                return existing
+            console.print(f"[green]✓ 查询添加成功！ID: {query_id}[/green]")
+            return query_id
 
         except SQLAlchemyError as e:
             console = Console()
             console.print(f"[red]✗ 添加查询失败: {e}[/red]")
-            if "session" in locals():
-                session.rollback()
-                session.close()
-            return False
+            return None
 
     def get_query_by_id(self, query_id: int) -> QueryModel:
         """根据ID获取查询"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             query = session.query(QueryModel).filter_by(id=query_id).first()
             session.close()
             return query
@@ -92,7 +102,7 @@ class QueryForm(BaseForm):
     def get_queries_by_creator(self, creator_id: int) -> list:
         """根据创建者ID获取查询列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             queries = session.query(QueryModel).filter_by(creator_id=creator_id).all()
             session.close()
             return queries
@@ -121,6 +131,9 @@ class QueryForm(BaseForm):
             # 设置更新时间
             query.updated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+            # 文本变化时触发器已删除旧签名，这里在同一事务内重建
+            session.flush()
+            index_queries(session.connection(), [query_id])
             session.commit()
             console = Console()
             console.print(f"[green]✓ 查询 ID '{query_id}' 更新成功！[/green]")
@@ -166,7 +179,7 @@ class QueryForm(BaseForm):
     def list_all_queries(self) -> list:
         """获取所有查询列表"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             queries = session.query(QueryModel).all()
             session.close()
             return queries
@@ -212,4 +225,50 @@ class QueryForm(BaseForm):
             )
 
         console = Console()
-        console.print(table) 
\ No newline at end of file
+        console.print(table)
+
+    def upsert_query(
+        self, detail_query: str, lazy_query: str = None,
+        creator_id: int = None, priority: int = None
+    ) -> int:
+        """添加或更新查询 - 以 detail_query 的内容哈希为自然键原子 upsert（值为 None 的字段保留原值），返回查询ID，失败返回 None"""
+        row = {
+            "detail_query": detail_query,
+            "lazy_query": lazy_query,
+            "creator_id": creator_id,
+            "priority": priority,
+        }
+        # 未传入的可选字段不参与更新，保留已有值
+        ids = self.upsert_queries([{k: v for k, v in row.items() if v is not None}])
+        return ids[0] if ids else None
+
+    def upsert_queries(self, rows: list, key=("content_hash",)) -> list:
+        """批量添加或更新查询 - content_hash 由 detail_query 自动计算，返回ID列表"""
+        ids = self.upsert(rows, key)
+        self._index_pending(ids)
+        return ids
+
+    def update_queries(self, where, values: dict) -> int:
+        """批量更新查询 - 单条 UPDATE 语句，where 见 BaseForm._build_where，返回更新行数"""
+        if "detail_query" in values:
+            values = dict(values, content_hash=compute_query_hash(values["detail_query"]))
+        updated = self.bulk_update(where, values)
+        if updated and ("detail_query" in values or "lazy_query" in values):
+            self._index_pending()
+        return updated
+
+    def _index_pending(self, query_ids: list = None) -> int:
+        """为未建近似重复索引的查询补上签名（见 query_dedup.py）"""
+        if query_ids is not None and not query_ids:
+            return 0
+        try:
+            with self.engine.begin() as conn:
+                return index_queries(conn, query_ids)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 更新查询索引失败: {e}[/red]")
+            return 0
+
+    def delete_queries(self, where) -> int:
+        """批量删除查询 - 单条 DELETE 语句，关联的评估与文件随之级联删除，返回删除行数"""
+        return self.bulk_delete(where)
@@ -18,9 +18,13 @@ user_form 表结构：
 
 可用方法
 add_user
+upsert_user
+upsert_users
 delete_user
 get_user_by_username
 update_user
+update_users
+delete_users
 """
 
 from datetime import datetime
@@ -28,12 +32,11 @@ from sqlalchemy import Column, Integer, String, Text, DateTime, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
+from ..lazy_rich import Console, Panel, Table
 
 from ..base_form import BaseForm
 from ..models import UserModel
+from ..upsert import insert_ignore
 
 class UserForm(BaseForm):
     """用户表单管理器 - SQLAlchemy版本"""
@@ -44,47 +47,50 @@ class UserForm(BaseForm):
     def add_user(
         self, username: str, password: str, nickname: str, full_name: str = None
     ) -> bool:
-        """添加用户 - 使用ORM方式"""
+        """添加用户 - 单条 INSERT … ON CONFLICT DO NOTHING，用户名判重与插入是原子的"""
         try:
-            session = self.Session()
+            with self.engine.begin() as conn:
+                new_id = insert_ignore(conn, UserModel, {
+                    "username": username,
+                    "password": password,
+                    "nickname": nickname,
+                    "full_name": full_name,
+                })
 
-            # 检查用户名是否已存在
-            existing_user = session.query(UserModel).filter_by(username=username).first()
-            if existing_user:
-                console = Console()
+            console = Console()
+            if new_id is None:
                 console.print(f"[red]✗ 用户名 '{username}' 已存在[/red]")
-                session.close()
                 return False
-
-            # 创建新用户
-            new_user = UserModel(
-                username=username,
-                password=password,
-                nickname=nickname,
-                full_name=full_name,
-                created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            )
-
-            session.add(new_user)
-            session.commit()
-
-            console = Console()
             console.print(f"[green]✓ 用户 '{username}' 添加成功！[/green]")
-            session.close()
             return True
 
         except SQLAlchemyError as e:
             console = Console()
             console.print(f"[red]✗ 添加用户失败: {e}[/red]")
-            if "session" in locals():
-                session.rollback()
-                session.close()
             return False
 
+    def upsert_user(
+        self, username: str, password: str, nickname: str, full_name: str = None
+    ) -> int:
+        """添加或更新用户 - 按用户名原子 upsert（值为 None 的字段保留原值），返回用户ID，失败返回 None"""
+        row = {
+            "username": username,
+            "password": password,
+            "nickname": nickname,
+            "full_name": full_name,
+        }
+        # 未传入的可选字段不参与更新，保留已有值
+        ids = self.upsert_users([{k: v for k, v in row.items() if v is not None}])
+        return ids[0] if ids else None
+
+    def upsert_users(self, rows: list, key=("username",)) -> list:
+        """批量添加或更新用户 - 单条 INSERT … ON CONFLICT DO UPDATE … RETURNING，返回ID列表"""
+        return self.upsert(rows, key)
+
     def get_user_by_username(self, username: str) -> UserModel:
         """根据用户名获取用户"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             user = session.query(UserModel).filter_by(username=username).first()
             session.close()
             return user
@@ -153,4 +159,12 @@ class UserForm(BaseForm):
             if "session" in locals():
                 session.rollback()
                 session.close()
-            return False
\ No newline at end of file
+            return False
+
+    def update_users(self, where, values: dict) -> int:
+        """批量更新用户 - 单条 UPDATE 语句，where 见 BaseForm._build_where，返回更新行数"""
+        return self.bulk_update(where, values)
+
+    def delete_users(self, where) -> int:
+        """批量删除用户 - 单条 DELETE 语句，其创建的查询与评估的关联字段置为 NULL，返回删除行数"""
+        return self.bulk_delete(where)
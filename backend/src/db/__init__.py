@@ -1,8 +1,63 @@
-from .Forms.user_form import UserForm
-from .Forms.query_form import QueryForm
-from .Forms.evaluation_form import EvaluationForm
-from .Forms.files_form import FilesForm
-from .database import DatabaseManager
+"""
+数据库包
+
+导出的类在第一次访问时才导入所在模块（PEP 562），import src.db 本身不加载 SQLAlchemy / rich / numpy，
+CLI 的 --help 等不需要数据库的路径因此启动更快。用法不变：
+    from src.db import QueryForm
+"""
+
+import importlib
+from typing import TYPE_CHECKING
+
+# 导出名 -> 所在模块
+_EXPORTS = {
+    "UserForm": ".Forms.user_form",
+    "QueryForm": ".Forms.query_form",
+    "EvaluationForm": ".Forms.evaluation_form",
+    "FilesForm": ".Forms.files_form",
+    "DatabaseManager": ".database",
+    "ChangeFeed": ".change_feed",
+    "WriteQueue": ".write_queue",
+    "MediaStore": ".media_store",
+    "WorkScheduler": ".work_scheduler",
+    "RunExecutor": ".run_executor",
+    "ScoringPipeline": ".scoring",
+    "UsageAccounting": ".usage_accounting",
+    "TrajectoryDiff": ".trajectory_diff",
+    "QueryDedupIndex": ".query_dedup",
+    "VectorIndex": ".vector_index",
+    "MigrationRunner": ".migrations",
+}
+
+if TYPE_CHECKING:
+    from .Forms.user_form import UserForm
+    from .Forms.query_form import QueryForm
+    from .Forms.evaluation_form import EvaluationForm
+    from .Forms.files_form import FilesForm
+    from .database import DatabaseManager
+    from .change_feed import ChangeFeed
+    from .write_queue import WriteQueue
+    from .media_store import MediaStore
+    from .work_scheduler import WorkScheduler
+    from .run_executor import RunExecutor
+    from .scoring import ScoringPipeline
+    from .usage_accounting import UsageAccounting
+    from .trajectory_diff import TrajectoryDiff
+    from .query_dedup import QueryDedupIndex
+    from .vector_index import VectorIndex
+    from .migrations import MigrationRunner
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
 
 
 __all__ = [
@@ -10,5 +65,16 @@ __all__ = [
     "QueryForm",
     "EvaluationForm",
     "FilesForm",
-    "DatabaseManager"
-]   
\ No newline at end of file
+    "DatabaseManager",
+    "ChangeFeed",
+    "WriteQueue",
+    "MediaStore",
+    "WorkScheduler",
+    "RunExecutor",
+    "ScoringPipeline",
+    "UsageAccounting",
+    "TrajectoryDiff",
+    "QueryDedupIndex",
+    "VectorIndex",
+    "MigrationRunner"
+]
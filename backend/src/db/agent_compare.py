@@ -0,0 +1,286 @@
+"""
+agent 对比统计
+
+把评估分数载入为 agent × 查询 的矩阵（缺失为 NaN，同一 agent 对同一查询有多次运行时取平均），
+在共享的查询上比较 agent：
+- 各 agent 的平均分与自助法 (bootstrap) 置信区间
+- 两两之间的配对差值（只在双方都有分数的查询上）、差值的置信区间与双侧 p 值
+- 胜率（平局记 0.5）及其置信区间
+
+全部重抽样完全向量化：所有 agent、所有 agent 对共用同一组重抽样，每组重抽样表示为
+各查询被抽中的次数（n_boot × 查询数的计数矩阵 C），于是
+    重抽样均值 = (C @ 值) / (C @ 掩码)
+一次矩阵乘法同时算出全部重抽样、全部 agent（或一批 agent 对）的结果，没有逐次重抽样的 Python 循环。
+agent 对较多时可以用 processes 把 agent 对分块到多个进程（各进程用相同种子重建 C，不传输大矩阵）。
+
+依赖 numpy（可选依赖）：pip install "backend[analytics]"
+
+用法：
+    comparison = AgentComparison.from_database("app.db", n_boot=2000)
+    comparison.display_summary(comparison.agent_summary())
+    comparison.display_pairs(comparison.compare_pairs(processes=4))
+
+可用方法
+from_database
+agent_summary
+compare_pairs
+win_rate_matrix
+display_summary
+display_pairs
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select, func
+from .lazy_rich import Console, Table
+
+from .engine import create_read_engine
+from .models import EvaluationModel
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+PAIR_BLOCK = 128
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('agent 对比需要 numpy: pip install "backend[analytics]"')
+
+
+def build_score_matrix(agents, query_ids, scores):
+    """由三列数组构建 (agent 名称列表, 查询ID数组, agent × 查询 的平均分矩阵)"""
+    _require_numpy()
+    agent_names, agent_index = np.unique(np.asarray(agents, dtype=object).astype(str), return_inverse=True)
+    query_values, query_index = np.unique(np.asarray(query_ids, dtype=np.int64), return_inverse=True)
+    shape = (len(agent_names), len(query_values))
+    flat = agent_index * shape[1] + query_index
+    sums = np.bincount(flat, weights=np.asarray(scores, dtype=np.float64), minlength=shape[0] * shape[1])
+    counts = np.bincount(flat, minlength=shape[0] * shape[1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        matrix = (sums / counts).reshape(shape)
+    return list(agent_names), query_values, matrix
+
+
+def resample_counts(n_queries: int, n_boot: int, seed: int):
+    """n_boot 组有放回重抽样，每组各查询被抽中的次数 (n_boot × n_queries, float32)"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, n_queries, size=(n_boot, n_queries), dtype=np.int64)
+    picks += (np.arange(n_boot, dtype=np.int64) * n_queries)[:, None]
+    return np.bincount(picks.ravel(), minlength=n_boot * n_queries).reshape(n_boot, n_queries).astype(np.float32)
+
+
+def _quantiles(samples, alpha: float):
+    """按列计算置信区间；只有共享查询极少时才会出现 NaN（某组重抽样没有抽到共享查询），此时才用较慢的 nanquantile"""
+    quantile = np.nanquantile if np.isnan(samples).any() else np.quantile
+    low, high = quantile(samples, [alpha / 2, 1 - alpha / 2], axis=0)
+    return low, high
+
+
+def _pair_block(values, mask, counts, pairs, alpha: float) -> list:
+    """计算一批 agent 对；每个 agent 对占 C 的 3 列：差值、共享掩码、胜负得分"""
+    a, b = pairs[:, 0], pairs[:, 1]
+    shared = mask[a] & mask[b]
+    diff = np.where(shared, values[a] - values[b], 0.0)
+    wins = np.where(shared, (diff > 0) + 0.5 * (diff == 0), 0.0)
+    shared_f = shared.astype(np.float32)
+    stacked = np.concatenate([diff.astype(np.float32), shared_f, wins.astype(np.float32)]).T
+    boot = counts @ stacked  # n_boot × 3k，一次乘法覆盖全部重抽样与整批 agent 对
+    k = len(pairs)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        boot_diff = boot[:, :k] / boot[:, k:2 * k]
+        boot_win = boot[:, 2 * k:] / boot[:, k:2 * k]
+    n_shared = shared.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_diff = diff.sum(axis=1) / n_shared
+        win_rate = wins.sum(axis=1) / n_shared
+        mean_a = np.where(shared, values[a], 0.0).sum(axis=1) / n_shared
+        mean_b = np.where(shared, values[b], 0.0).sum(axis=1) / n_shared
+    diff_low, diff_high = _quantiles(boot_diff, alpha)
+    win_low, win_high = _quantiles(boot_win, alpha)
+    valid = np.isfinite(boot_diff)
+    below = np.where(valid, boot_diff <= 0, False).sum(axis=0)
+    above = np.where(valid, boot_diff >= 0, False).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p_value = np.minimum(1.0, 2 * np.minimum(below, above) / valid.sum(axis=0))
+    return [
+        {
+            "a": int(a[i]), "b": int(b[i]), "n_shared": int(n_shared[i]),
+            "mean_a": float(mean_a[i]), "mean_b": float(mean_b[i]), "mean_diff": float(mean_diff[i]),
+            "ci_low": float(diff_low[i]), "ci_high": float(diff_high[i]), "p_value": float(p_value[i]),
+            "win_rate": float(win_rate[i]), "win_ci_low": float(win_low[i]), "win_ci_high": float(win_high[i]),
+        }
+        for i in range(k)
+    ]
+
+
+_worker_state = {}
+
+
+def _init_worker(values, mask, n_boot, seed):
+    _worker_state.update(values=values, mask=mask, counts=resample_counts(values.shape[1], n_boot, seed))
+
+
+def _worker_block(pairs, alpha):
+    state = _worker_state
+    return _pair_block(state["values"], state["mask"], state["counts"], pairs, alpha)
+
+
+class AgentComparison:
+    """agent 对比"""
+
+    def __init__(self, agents: list, query_ids, matrix, n_boot: int = 2000, confidence: float = 0.95, seed: int = 0):
+        """
+        Args:
+            agents: agent 名称列表（矩阵的行）
+            query_ids: 查询ID数组（矩阵的列）
+            matrix: agent × 查询 的分数矩阵，缺失为 NaN
+            n_boot: 重抽样次数
+            confidence: 置信水平
+            seed: 随机种子，相同种子结果可复现
+        """
+        _require_numpy()
+        self.agents = list(agents)
+        self.query_ids = np.asarray(query_ids)
+        self.mask = ~np.isnan(matrix)
+        self.values = np.where(self.mask, matrix, 0.0).astype(np.float32)
+        self.n_boot = n_boot
+        self.alpha = 1 - confidence
+        self.seed = seed
+        self._counts = None
+
+    @classmethod
+    def from_database(cls, db_path: str = "app.db", agents: list = None, run_id: str = None, **kwargs):
+        """从 evaluation_form 载入已打分的评估（只读引擎）"""
+        _require_numpy()
+        table = EvaluationModel.__table__
+        stmt = (
+            select(table.c.agent, table.c.query_id, func.avg(table.c.quality_score))
+            .where(table.c.quality_score.isnot(None), table.c.agent.isnot(None))
+            .group_by(table.c.agent, table.c.query_id)
+        )
+        if agents is not None:
+            stmt = stmt.where(table.c.agent.in_(list(agents)))
+        if run_id is not None:
+            stmt = stmt.where(table.c.run_id == run_id)
+        engine = create_read_engine(db_path)
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(stmt).all()
+        finally:
+            engine.dispose()
+        if not rows:
+            return cls([], np.array([], dtype=np.int64), np.empty((0, 0)), **kwargs)
+        names, query_ids, scores = zip(*rows)
+        return cls(*build_score_matrix(names, query_ids, scores), **kwargs)
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = resample_counts(self.values.shape[1], self.n_boot, self.seed)
+        return self._counts
+
+    def agent_summary(self) -> list:
+        """各 agent 的平均分与置信区间，按平均分降序"""
+        if not self.agents:
+            return []
+        boot = self.counts @ np.concatenate([self.values, self.mask.astype(np.float32)]).T
+        k = len(self.agents)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            boot_mean = boot[:, :k] / boot[:, k:]
+            n = self.mask.sum(axis=1)
+            mean = self.values.sum(axis=1) / n
+        low, high = _quantiles(boot_mean, self.alpha)
+        rows = [
+            {"agent": agent, "n": int(n[i]), "mean": float(mean[i]), "ci_low": float(low[i]), "ci_high": float(high[i])}
+            for i, agent in enumerate(self.agents)
+        ]
+        return sorted(rows, key=lambda row: (-np.nan_to_num(row["mean"], nan=-np.inf), row["agent"]))
+
+    def _pair_indices(self, pairs):
+        index = {agent: i for i, agent in enumerate(self.agents)}
+        if pairs is None:
+            a, b = np.triu_indices(len(self.agents), k=1)
+            return np.stack([a, b], axis=1)
+        missing = [agent for pair in pairs for agent in pair if agent not in index]
+        if missing:
+            raise ValueError(f"没有分数的 agent: {', '.join(sorted(set(missing)))}")
+        return np.array([[index[a], index[b]] for a, b in pairs], dtype=np.int64).reshape(-1, 2)
+
+    def compare_pairs(self, pairs: list = None, processes: int = None, block_size: int = PAIR_BLOCK) -> list:
+        """两两比较（mean_diff = mean_a - mean_b，只在共享查询上）
+
+        Args:
+            pairs: [(agent_a, agent_b)]，默认全部无序对
+            processes: 大于 1 时把 agent 对分块到多个进程
+
+        Returns:
+            [{agent_a, agent_b, n_shared, mean_a, mean_b, mean_diff, ci_low, ci_high, p_value,
+              win_rate, win_ci_low, win_ci_high}]
+        """
+        indices = self._pair_indices(pairs)
+        blocks = [indices[start:start + block_size] for start in range(0, len(indices), block_size)]
+        if processes and processes > 1 and len(blocks) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(processes, len(blocks)), initializer=_init_worker,
+                initargs=(self.values, self.mask, self.n_boot, self.seed),
+            ) as pool:
+                results = list(pool.map(_worker_block, blocks, [self.alpha] * len(blocks)))
+        else:
+            results = [_pair_block(self.values, self.mask, self.counts, block, self.alpha) for block in blocks]
+        rows = []
+        for block in results:
+            for row in block:
+                a, b = row.pop("a"), row.pop("b")
+                rows.append({"agent_a": self.agents[a], "agent_b": self.agents[b], **row})
+        return rows
+
+    def win_rate_matrix(self):
+        """胜率矩阵 W[i, j] = agent i 在与 j 共享的查询上胜过 j 的比例（平局记 0.5），无共享查询为 NaN"""
+        k = len(self.agents)
+        wins = np.zeros((k, k))
+        mask = self.mask.astype(np.float32)
+        for i in range(k):  # 每次处理一行 agent，向量化覆盖全部对手与查询
+            both = self.mask[i] & self.mask
+            diff = self.values[i] - self.values
+            wins[i] = ((diff > 0) & both).sum(axis=1) + 0.5 * ((diff == 0) & both).sum(axis=1)
+        shared = mask @ mask.T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            matrix = wins / shared
+        np.fill_diagonal(matrix, np.nan)
+        return self.agents, matrix
+
+    def display_summary(self, rows: list):
+        """展示各 agent 的平均分"""
+        console = Console()
+        table = Table(title=f"agent 平均分（{int(round((1 - self.alpha) * 100))}% 置信区间，{self.n_boot} 次重抽样）")
+        table.add_column("agent", style="cyan")
+        table.add_column("查询数", style="white", justify="right")
+        table.add_column("平均分", style="green", justify="right")
+        table.add_column("置信区间", style="yellow", justify="right")
+        for row in rows:
+            table.add_row(row["agent"], str(row["n"]), f"{row['mean']:.2f}",
+                          f"[{row['ci_low']:.2f}, {row['ci_high']:.2f}]")
+        console.print(table)
+
+    def display_pairs(self, rows: list, limit: int = 50):
+        """展示两两比较结果（按 p 值升序，最多 limit 行）"""
+        console = Console()
+        table = Table(title="agent 两两比较")
+        table.add_column("A", style="cyan")
+        table.add_column("B", style="cyan")
+        table.add_column("共享查询", style="white", justify="right")
+        table.add_column("A - B", style="green", justify="right")
+        table.add_column("置信区间", style="yellow", justify="right")
+        table.add_column("p", style="magenta", justify="right")
+        table.add_column("A 胜率", style="blue", justify="right")
+        ordered = sorted(rows, key=lambda row: (np.nan_to_num(row["p_value"], nan=2.0), -abs(row["mean_diff"])))
+        for row in ordered[:limit]:
+            table.add_row(
+                row["agent_a"], row["agent_b"], str(row["n_shared"]), f"{row['mean_diff']:+.2f}",
+                f"[{row['ci_low']:+.2f}, {row['ci_high']:+.2f}]", f"{row['p_value']:.4f}",
+                f"{row['win_rate']:.1%}",
+            )
+        console.print(table)
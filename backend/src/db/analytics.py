@@ -0,0 +1,262 @@
+"""
+分析模式（DuckDB）
+
+按 agent 统计分数分布、按查询优先级统计 token 用量这类聚合需要扫描全部评估与轨迹 JSON，
+在行存的 SQLite + ORM 上很慢。这里把数据库挂到嵌入式 DuckDB 上，用列存、向量化、
+多线程执行固定报表；写入（OLTP）仍然只走 SQLite。
+
+数据来源（三选一，统一暴露为 DuckDB 中 app schema 下的同名表/视图）：
+- attach: 通过 DuckDB 的 sqlite 扩展只读挂载 app.db，零拷贝（需要能加载 sqlite_scanner 扩展）
+- copy: 扩展不可用时（例如离线环境）按块把业务表读入 DuckDB 内存表（二进制列除外）
+- parquet: 读取 export_parquet 导出的 Parquet 目录，适合在另一台机器上离线分析
+
+依赖 duckdb（copy 模式另需 numpy），均为可选依赖：pip install "backend[analytics]"
+
+用法：
+    with AnalyticsEngine("app.db") as analytics:
+        rows = analytics.score_distribution(bucket_width=10)
+        rows = analytics.token_usage_by_priority()
+        analytics.export_parquet("exports/")
+
+可用方法
+query
+export_parquet
+score_distribution
+token_usage_by_priority
+"""
+
+import os
+import sqlite3
+
+from sqlalchemy import Integer, Float, LargeBinary
+
+from .engine import read_only_uri
+from .models import UserModel, QueryModel, EvaluationModel, FilesModel
+
+SCHEMA = "app"
+SOURCES = ("auto", "attach", "copy", "parquet")
+ANALYTIC_MODELS = (UserModel, QueryModel, EvaluationModel, FilesModel)
+COPY_CHUNK_ROWS = 20000
+
+
+def _import_duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError('分析模式需要 duckdb: pip install "backend[analytics]"') from e
+    return duckdb
+
+
+def _duckdb_type(column) -> str:
+    if isinstance(column.type, Integer):
+        return "BIGINT"
+    if isinstance(column.type, Float):
+        return "DOUBLE"
+    return "VARCHAR"
+
+
+def _copy_columns(model) -> list:
+    """copy/parquet 模式下导出的列（不含二进制内容）"""
+    return [column for column in model.__table__.columns if not isinstance(column.type, LargeBinary)]
+
+
+def _step_values(column: str, field: str) -> str:
+    """取出轨迹每一步某个字段的 SQL 表达式，兼容原始步骤数组与紧凑格式（见 trajectory_store.py）"""
+    return (
+        f"CASE WHEN json_type({column}) = 'OBJECT' THEN json_extract({column}, '$.steps[*].{field}') "
+        f"ELSE json_extract({column}, '$[*].{field}') END"
+    )
+
+
+def _step_count(column: str) -> str:
+    return (
+        f"CASE WHEN json_type({column}) = 'OBJECT' THEN json_array_length({column}, '$.steps') "
+        f"ELSE json_array_length({column}) END"
+    )
+
+
+class AnalyticsEngine:
+    """DuckDB 分析引擎"""
+
+    def __init__(self, db_path: str = "app.db", source: str = "auto", parquet_dir: str = None, threads: int = None):
+        """
+        Args:
+            db_path: SQLite 数据库路径（parquet 模式下不使用）
+            source: auto（先尝试 attach，失败则 copy）/ attach / copy / parquet
+            parquet_dir: parquet 模式下的数据目录
+            threads: DuckDB 线程数，默认使用全部核心
+        """
+        if source not in SOURCES:
+            raise ValueError(f"source 必须为 {', '.join(SOURCES)} 之一")
+        if source == "parquet" and not parquet_dir:
+            raise ValueError("parquet 模式需要指定 parquet_dir")
+        duckdb = _import_duckdb()
+        self.db_path = db_path
+        self.conn = duckdb.connect()
+        if threads:
+            self.conn.execute(f"SET threads = {int(threads)}")
+
+        if source == "parquet":
+            self._load_parquet(parquet_dir)
+        elif source == "attach":
+            self._attach()
+        elif source == "copy":
+            self._copy()
+        else:
+            try:
+                self._attach()
+            except duckdb.Error:
+                self._copy()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    # ---------- 数据源 ----------
+
+    def _attach(self):
+        if not os.path.exists(self.db_path):
+            raise FileNotFoundError(self.db_path)
+        path = os.path.abspath(self.db_path).replace("'", "''")
+        self.conn.execute(f"ATTACH '{path}' AS {SCHEMA} (TYPE sqlite, READ_ONLY)")
+        self.source = "attach"
+
+    def _copy(self):
+        """按块读取 SQLite（只读连接），经 numpy 数组批量写入 DuckDB"""
+        import numpy as np
+
+        if not os.path.exists(self.db_path):
+            raise FileNotFoundError(self.db_path)
+        self.conn.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+        source = sqlite3.connect(read_only_uri(self.db_path), uri=True)
+        try:
+            existing = {row[0] for row in source.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for model in ANALYTIC_MODELS:
+                table = model.__tablename__
+                columns = _copy_columns(model)
+                definition = ", ".join(f'"{column.name}" {_duckdb_type(column)}' for column in columns)
+                self.conn.execute(f'CREATE TABLE {SCHEMA}."{table}" ({definition})')
+                if table not in existing:
+                    continue
+                names = ", ".join(f'"{column.name}"' for column in columns)
+                cursor = source.execute(f'SELECT {names} FROM "{table}"')
+                while True:
+                    rows = cursor.fetchmany(COPY_CHUNK_ROWS)
+                    if not rows:
+                        break
+                    chunk = {
+                        column.name: np.array([row[i] for row in rows], dtype=object)
+                        for i, column in enumerate(columns)
+                    }
+                    self.conn.register("_chunk", chunk)
+                    self.conn.execute(f'INSERT INTO {SCHEMA}."{table}" SELECT * FROM _chunk')
+                    self.conn.unregister("_chunk")
+        finally:
+            source.close()
+        self.source = "copy"
+
+    def _load_parquet(self, parquet_dir: str):
+        self.conn.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+        for model in ANALYTIC_MODELS:
+            path = os.path.join(parquet_dir, f"{model.__tablename__}.parquet")
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            path = os.path.abspath(path).replace("'", "''")
+            self.conn.execute(f"CREATE VIEW {SCHEMA}.\"{model.__tablename__}\" AS SELECT * FROM read_parquet('{path}')")
+        self.source = "parquet"
+
+    def export_parquet(self, out_dir: str) -> dict:
+        """把业务表（不含二进制内容）导出为 Parquet，返回 {表名: 文件路径}"""
+        os.makedirs(out_dir, exist_ok=True)
+        paths = {}
+        for model in ANALYTIC_MODELS:
+            table = model.__tablename__
+            path = os.path.abspath(os.path.join(out_dir, f"{table}.parquet"))
+            names = ", ".join(f'"{column.name}"' for column in _copy_columns(model))
+            escaped = path.replace("'", "''")
+            self.conn.execute(
+                f"COPY (SELECT {names} FROM {SCHEMA}.\"{table}\") TO '{escaped}' (FORMAT parquet, COMPRESSION zstd)"
+            )
+            paths[table] = path
+        return paths
+
+    # ---------- 查询 ----------
+
+    def query(self, sql: str, params: list = None) -> list:
+        """执行任意 SQL（表位于 app schema，如 app.evaluation_form），返回行 dict 列表"""
+        result = self.conn.execute(sql, params or [])
+        names = [column[0] for column in result.description]
+        return [dict(zip(names, row)) for row in result.fetchall()]
+
+    def score_distribution(self, bucket_width: int = 10) -> list:
+        """按 agent 统计分数分布
+
+        Returns:
+            [{agent, runs, scored, mean, stddev, min, p25, median, p75, max, histogram: {桶下界: 数量}}]
+        """
+        rows = self.query(f"""
+            SELECT
+                coalesce(agent, '(未知)') AS agent,
+                count(*) AS runs,
+                count(quality_score) AS scored,
+                round(avg(quality_score), 2) AS mean,
+                round(stddev_samp(quality_score), 2) AS stddev,
+                min(quality_score) AS min,
+                quantile_cont(quality_score, 0.25) AS p25,
+                median(quality_score) AS median,
+                quantile_cont(quality_score, 0.75) AS p75,
+                max(quality_score) AS max,
+                histogram(floor(quality_score / $1) * $1) FILTER (WHERE quality_score IS NOT NULL) AS histogram
+            FROM {SCHEMA}.evaluation_form
+            GROUP BY 1
+            ORDER BY mean DESC NULLS LAST, agent
+        """, [bucket_width])
+        for row in rows:
+            row["histogram"] = {int(key): value for key, value in sorted((row["histogram"] or {}).items())}
+        return rows
+
+    def token_usage_by_priority(self) -> list:
+        """按查询优先级统计轨迹中的 token 用量
+
+        Returns:
+            [{priority, evaluations, steps, input_tokens, output_tokens, total_tokens,
+              mean_tokens_per_evaluation, mean_steps}]
+        """
+        return self.query(f"""
+            WITH usage AS (
+                SELECT
+                    e.query_id,
+                    CASE WHEN json_valid(e.trajectory) THEN {_step_count("e.trajectory")} END AS steps,
+                    CASE WHEN json_valid(e.trajectory) THEN
+                        list_sum({_step_values("e.trajectory", "token_usage.input_tokens")}::BIGINT[]) END AS input_tokens,
+                    CASE WHEN json_valid(e.trajectory) THEN
+                        list_sum({_step_values("e.trajectory", "token_usage.output_tokens")}::BIGINT[]) END AS output_tokens,
+                    CASE WHEN json_valid(e.trajectory) THEN
+                        list_sum({_step_values("e.trajectory", "token_usage.total_tokens")}::BIGINT[]) END AS total_tokens
+                FROM {SCHEMA}.evaluation_form AS e
+            )
+            SELECT
+                q.priority,
+                count(*) AS evaluations,
+                coalesce(sum(u.steps), 0) AS steps,
+                coalesce(sum(u.input_tokens), 0) AS input_tokens,
+                coalesce(sum(u.output_tokens), 0) AS output_tokens,
+                coalesce(sum(u.total_tokens), 0) AS total_tokens,
+                round(avg(u.total_tokens), 1) AS mean_tokens_per_evaluation,
+                round(avg(u.steps), 1) AS mean_steps
+            FROM usage AS u
+            JOIN {SCHEMA}.query_form AS q ON q.id = u.query_id
+            GROUP BY q.priority
+            ORDER BY q.priority NULLS LAST
+        """)
+
+
+REPORTS = {
+    "score_distribution": AnalyticsEngine.score_distribution,
+    "token_usage_by_priority": AnalyticsEngine.token_usage_by_priority,
+}
@@ -0,0 +1,176 @@
+"""
+在线热备份与恢复
+
+直接复制正在写入的 app.db 既不安全（可能拷到写了一半的页，且丢失 WAL 中的提交），
+也会长时间占用 IO。这里提供两种在线备份方式，都不阻塞写入者（依赖 WAL）：
+- backup: SQLite 在线备份 API，每步复制 step_pages 页后释放锁并休眠 step_sleep 秒；
+  备份期间其他连接写入时 SQLite 会从头重新复制，持续高频写入时建议用 vacuum
+- vacuum: VACUUM INTO，在一个读事务中写出紧凑的副本，即某一时刻的快照（时间点备份）
+
+备份可选 gzip 压缩（.gz），恢复时自动解压、校验完整性，再通过备份 API 覆盖目标库，
+已打开的连接随后读到的就是恢复后的数据。
+
+用法：
+    report = backup_database("app.db", "backups/app-20250101.db.gz", compress=True)
+    restore_database("backups/app-20250101.db.gz", "app.db")
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+BACKUP_METHODS = ("backup", "vacuum")
+COPY_CHUNK = 1024 * 1024
+
+
+def default_backup_path(db_path: str, compress: bool = True) -> str:
+    """默认备份路径: <库目录>/backups/<库名>-<时间>.db[.gz]"""
+    directory = os.path.join(os.path.dirname(os.path.abspath(db_path)), "backups")
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    name = f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    return os.path.join(directory, name + (".gz" if compress else ""))
+
+
+def backup_database(
+    db_path: str, dest: str, method: str = "backup", compress: bool = None,
+    step_pages: int = 1024, step_sleep: float = 0.0, progress=None
+) -> dict:
+    """在线备份
+
+    Args:
+        db_path: 源数据库
+        dest: 目标路径，以 .gz 结尾时默认压缩
+        method: backup（分步备份 API）或 vacuum（VACUUM INTO 快照）
+        compress: 是否 gzip 压缩，None 表示按 dest 扩展名判断
+        step_pages: backup 方式每步复制的页数，越小持锁时间越短
+        step_sleep: backup 方式两步之间的休眠（秒）
+        progress: 回调 progress(copied_pages, total_pages)
+
+    Returns:
+        {method, source, dest, source_bytes, backup_bytes, compressed, pages, steps, seconds, mb_per_s}
+    """
+    if method not in BACKUP_METHODS:
+        raise ValueError(f"method 必须为 {', '.join(BACKUP_METHODS)} 之一")
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    if compress is None:
+        compress = dest.endswith(".gz")
+    os.makedirs(os.path.dirname(os.path.abspath(dest)) or ".", exist_ok=True)
+
+    raw_path = dest[:-3] if compress and dest.endswith(".gz") else dest
+    raw_path = raw_path + ".partial"
+    if os.path.exists(raw_path):
+        os.remove(raw_path)
+
+    start = time.perf_counter()
+    steps, pages = 0, 0
+    source = sqlite3.connect(db_path)
+    try:
+        if method == "vacuum":
+            source.execute("VACUUM INTO ?", (raw_path,))
+            pages = source.execute("PRAGMA page_count").fetchone()[0]
+            steps = 1
+        else:
+            target = sqlite3.connect(raw_path)
+            try:
+                def on_progress(status, remaining, total):
+                    nonlocal steps, pages
+                    steps += 1
+                    pages = total
+                    if progress:
+                        progress(total - remaining, total)
+
+                source.backup(target, pages=step_pages, progress=on_progress, sleep=step_sleep)
+                # 备份为独立文件，不保留 WAL 模式，便于直接拷贝/压缩
+                target.execute("PRAGMA journal_mode = DELETE")
+            finally:
+                target.close()
+    except BaseException:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+        raise
+    finally:
+        source.close()
+
+    backup_bytes = os.path.getsize(raw_path)
+    if compress:
+        final_path = dest if dest.endswith(".gz") else dest + ".gz"
+        with open(raw_path, "rb") as src, gzip.open(final_path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK)
+        os.remove(raw_path)
+    else:
+        final_path = dest
+        os.replace(raw_path, final_path)
+
+    seconds = time.perf_counter() - start
+    source_bytes = _database_bytes(db_path)
+    return {
+        "method": method,
+        "source": db_path,
+        "dest": final_path,
+        "source_bytes": source_bytes,
+        "backup_bytes": backup_bytes,
+        "output_bytes": os.path.getsize(final_path),
+        "compressed": compress,
+        "pages": pages,
+        "steps": steps,
+        "seconds": round(seconds, 3),
+        "mb_per_s": round(backup_bytes / 1024 / 1024 / seconds, 2) if seconds > 0 else None,
+    }
+
+
+def restore_database(backup_path: str, db_path: str, step_pages: int = 1024, check: bool = True) -> dict:
+    """从备份恢复到 db_path（覆盖其全部内容）
+
+    先把备份解压到临时文件并执行 quick_check，通过后用备份 API 写入目标库；
+    目标库不存在时直接创建。恢复期间目标库被写锁定。
+    """
+    if not os.path.exists(backup_path):
+        raise FileNotFoundError(backup_path)
+    start = time.perf_counter()
+    staged = db_path + ".restore"
+    if backup_path.endswith(".gz"):
+        with gzip.open(backup_path, "rb") as src, open(staged, "wb") as dst:
+            shutil.copyfileobj(src, dst, COPY_CHUNK)
+    else:
+        shutil.copyfile(backup_path, staged)
+
+    try:
+        source = sqlite3.connect(staged)
+        try:
+            if check:
+                result = source.execute("PRAGMA quick_check").fetchone()[0]
+                if result != "ok":
+                    raise sqlite3.DatabaseError(f"备份文件校验失败: {result}")
+            target = sqlite3.connect(db_path)
+            try:
+                source.backup(target, pages=step_pages)
+                target.execute("PRAGMA journal_mode = WAL")
+            finally:
+                target.close()
+        finally:
+            source.close()
+        restored_bytes = os.path.getsize(staged)
+    finally:
+        os.remove(staged)
+
+    seconds = time.perf_counter() - start
+    return {
+        "source": backup_path,
+        "dest": db_path,
+        "restored_bytes": restored_bytes,
+        "seconds": round(seconds, 3),
+        "mb_per_s": round(restored_bytes / 1024 / 1024 / seconds, 2) if seconds > 0 else None,
+    }
+
+
+def _database_bytes(db_path: str) -> int:
+    """数据库文件与 WAL 的总大小"""
+    total = os.path.getsize(db_path)
+    wal = db_path + "-wal"
+    if os.path.exists(wal):
+        total += os.path.getsize(wal)
+    return total
@@ -6,18 +6,23 @@
 """
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from math import degrees
+from datetime import datetime
 from typing import Type
-from sqlalchemy import create_engine, text, inspect
+from sqlalchemy import inspect, update, delete, and_
+from sqlalchemy.sql.elements import ColumnElement
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from rich.console import Console
-from rich.panel import Panel
-from rich.table import Table
+from .lazy_rich import Console, Panel, Table, lazy_console
 
 from .models import Base
+from .engine import create_sqlite_engine, create_read_engine
+from .migrations import MigrationRunner
+from .table_stats import get_row_counts
+from .upsert import upsert_rows
 
-console = Console()
+console = lazy_console()
 
 class BaseForm(ABC):
     
@@ -26,33 +31,82 @@ class BaseForm(ABC):
         self.model = table_Model
         self.table_name = table_Model.__tablename__
         
-        # 创建SQLAlchemy引擎和会话
-        self.engine = create_engine(f'sqlite:///{self.db_path}', echo=False)
-        self.Session = sessionmaker(bind=self.engine)
+        # SQLAlchemy引擎和会话在第一次使用时创建：只构造表单、不读写的命令不打开连接池
+        self._engine = None
+        self._Session = None
+        self._read_engine = None
+        self._ReadSession = None
 
-    def _create_tables(self) -> bool:
-        """创建Base 绑定的所有表 - 使用ORM"""
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = create_sqlite_engine(self.db_path)
+        return self._engine
+
+    @property
+    def Session(self):
+        if self._Session is None:
+            self._Session = sessionmaker(bind=self.engine)
+        return self._Session
+
+    @property
+    def read_engine(self):
+        """只读引擎：get_*/list_*/display_* 使用，独立连接池，不与写入争用连接"""
+        if self._read_engine is None:
+            self._read_engine = create_read_engine(self.db_path)
+        return self._read_engine
+
+    @property
+    def ReadSession(self):
+        if self._ReadSession is None:
+            self._ReadSession = sessionmaker(bind=self.read_engine)
+        return self._ReadSession
+
+    @contextmanager
+    def read_session(self):
+        """快照一致的只读会话：with 块内的多条查询读取同一时刻的数据，结束时释放快照
+
+        用法：
+            with form.read_session() as session:
+                queries = session.query(QueryModel).all()
+                evaluations = session.query(EvaluationModel).all()
+        """
+        session = self.ReadSession()
         try:
-            # 方式1: 使用SQLAlchemy ORM创建表
-            # 绑定Base到引擎
-            Base.metadata.bind = self.engine
-            # 创建所有表
-            Base.metadata.create_all(self.engine)
+            with session.begin():
+                yield session
+        finally:
+            session.close()
+
+    def _create_tables(self, repair: bool = False) -> bool:
+        """确保 Base 绑定的所有表为最新表结构 - 使用ORM
+
+        只读取一次 PRAGMA user_version 与 SCHEMA_VERSION 比较，版本落后时才执行迁移（见 migrations.py）
+
+        Args:
+            repair: 不看版本，重新执行 create_all 与各项补建并重跑回填
+        """
+        try:
+            runner = MigrationRunner(self.db_path, engine=self.engine)
+            if not (runner.repair() if repair else runner.ensure()):
+                return False
             console = Console()
             console.print(
                 f"[green]✓ all Forms 绑定到 {self.db_path} 成功！(使用ORM)[/green]"
             )
             return True
         except SQLAlchemyError as e:
-            # 方式2: 回退到原生SQL方式
             console = Console()
-            console.print(f"[yellow]ORM创建失败，尝试使用原生SQL: {e}[/yellow]")
+            console.print(f"[yellow]ORM创建失败: {e}[/yellow]")
             return False
     
-    def get_structure(self):
-        """获取表信息 - 通用方法"""
+    def get_structure(self, count_mode: str = "cached"):
+        """获取表信息 - 通用方法
+
+        count_mode: cached（触发器维护的统计，默认）/ estimate（估算）/ exact（COUNT(*)）
+        """
         try:
-            inspector = inspect(self.engine)
+            inspector = inspect(self.read_engine)
             
             # 检查表是否存在
             if self.table_name not in inspector.get_table_names():
@@ -76,22 +130,22 @@ class BaseForm(ABC):
                 ])
             
             # 获取行数
-            with self.engine.connect() as conn:
-                result = conn.execute(text(f"SELECT COUNT(*) FROM {self.table_name}"))
-                row_count = result.scalar()
+            with self.read_engine.connect() as conn:
+                row_count, exact = get_row_counts(conn, [self.table_name], count_mode)[self.table_name]
             
             return {
                 'columns': formatted_columns,
-                'row_count': row_count
+                'row_count': row_count,
+                'row_count_exact': exact
             }
             
         except SQLAlchemyError as e:
             console.print(f"[red]✗ 获取表信息失败: {e}[/red]")
             return None
     
-    def display_structure(self):
+    def display_structure(self, count_mode: str = "cached"):
         """展示表信息 - 通用方法"""
-        info = self.get_structure()
+        info = self.get_structure(count_mode)
         
         if not info:
             console.print(Panel(
@@ -126,7 +180,7 @@ class BaseForm(ABC):
         
         stats_table.add_row("表名", self.table_name)
         stats_table.add_row("字段数", str(len(info['columns'])))
-        stats_table.add_row("行数", str(info['row_count']))
+        stats_table.add_row("行数", str(info['row_count']) if info['row_count_exact'] else f"≈{info['row_count']}")
         
         # 显示信息
         console.print(Panel(
@@ -137,10 +191,78 @@ class BaseForm(ABC):
         
         console.print(structure_table)
     
+    def _build_where(self, where):
+        """把条件转换为 SQL 表达式
+
+        where 可以是:
+        - dict: {列名: 值} 按 AND 组合，值为 list/tuple/set 时使用 IN，值为 None 时使用 IS NULL
+        - SQLAlchemy 表达式: 例如 EvaluationModel.quality_score < 60
+        """
+        if isinstance(where, ColumnElement):
+            return where
+        if not isinstance(where, dict) or not where:
+            raise ValueError("where 必须为非空 dict 或 SQLAlchemy 表达式（禁止无条件的批量操作）")
+        conditions = []
+        for key, value in where.items():
+            if key not in self.model.__table__.c:
+                raise ValueError(f"表 '{self.table_name}' 没有字段 '{key}'")
+            column = self.model.__table__.c[key]
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(column.in_(list(value)))
+            elif value is None:
+                conditions.append(column.is_(None))
+            else:
+                conditions.append(column == value)
+        return and_(*conditions)
+
+    def bulk_update(self, where, values: dict) -> int:
+        """按条件批量更新 - 编译为单条 UPDATE 语句，返回更新的行数"""
+        try:
+            unknown = [key for key in values if key not in self.model.__table__.c]
+            if unknown:
+                raise ValueError(f"表 '{self.table_name}' 没有字段: {', '.join(unknown)}")
+            values = dict(values)
+            if "updated_at" in self.model.__table__.c:
+                values.setdefault("updated_at", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            stmt = update(self.model.__table__).where(self._build_where(where)).values(**values)
+            with self.engine.begin() as conn:
+                count = conn.execute(stmt).rowcount
+            console.print(f"[green]✓ {self.table_name} 批量更新 {count} 行[/green]")
+            return count
+        except (SQLAlchemyError, ValueError) as e:
+            console.print(f"[red]✗ {self.table_name} 批量更新失败: {e}[/red]")
+            return 0
+
+    def bulk_delete(self, where) -> int:
+        """按条件批量删除 - 编译为单条 DELETE 语句，子表行由外键 ON DELETE 级联处理，返回删除的行数"""
+        try:
+            stmt = delete(self.model.__table__).where(self._build_where(where))
+            with self.engine.begin() as conn:
+                count = conn.execute(stmt).rowcount
+            console.print(f"[green]✓ {self.table_name} 批量删除 {count} 行[/green]")
+            return count
+        except (SQLAlchemyError, ValueError) as e:
+            console.print(f"[red]✗ {self.table_name} 批量删除失败: {e}[/red]")
+            return 0
+
+    def upsert(self, rows: list, key=None, update_columns=None) -> list:
+        """按自然键原子地插入或更新 - 单条 INSERT … ON CONFLICT DO UPDATE … RETURNING，返回与 rows 对应的 ID 列表
+
+        key 默认见 upsert.NATURAL_KEYS；update_columns 默认为除自然键外的所有传入列
+        """
+        try:
+            with self.engine.begin() as conn:
+                ids = upsert_rows(conn, self.model, rows, key, update_columns)
+            console.print(f"[green]✓ {self.table_name} upsert {len(ids)} 行[/green]")
+            return ids
+        except (SQLAlchemyError, ValueError) as e:
+            console.print(f"[red]✗ {self.table_name} upsert 失败: {e}[/red]")
+            return []
+
     def get_lines(self):
         """获取所有行"""
         try:
-            session = self.Session()
+            session = self.ReadSession()
             models = session.query(self.model).all()
             session.close()
             return models
@@ -181,8 +303,11 @@ class BaseForm(ABC):
 
     def __del__(self):
         """析构函数，确保连接被正确关闭"""
-        if hasattr(self, 'engine'):
-            self.engine.dispose()
+        # 只释放已经创建的引擎，不在析构时新建
+        if getattr(self, '_engine', None) is not None:
+            self._engine.dispose()
+        if getattr(self, '_read_engine', None) is not None:
+            self._read_engine.dispose()
 
 def main():
     base_form = BaseForm("app.db", "默认表")
@@ -190,4 +315,4 @@ def main():
     base_form.display_table_info()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,157 @@
+"""
+变更订阅（增量同步）
+
+user_form / query_form / evaluation_form / files_form 上的触发器会在每次
+INSERT / UPDATE / DELETE 后向 change_log 追加一条记录（见 models.py），
+seq 单调递增且不会复用（AUTOINCREMENT，清理后也不会从头分配）。下游只需保存上次同步到的游标，每次询问
+"游标 N 之后的变更"，同步代价与变更量成正比，而不是与表大小成正比。
+
+因为由触发器写入，表单方法、批量导入、原生 SQL 写入都会被记录。
+
+用法：
+    feed = ChangeFeed("app.db")
+    cursor = 0
+    while True:
+        batch = feed.get_changed_rows(since=cursor, tables=["evaluation_form"])
+        apply(batch["upserts"], batch["deletes"])
+        cursor = batch["cursor"]
+        if not batch["has_more"]:
+            break
+
+可用方法
+current_cursor
+get_changes
+get_changed_rows
+prune
+"""
+
+from sqlalchemy import select, delete, func, text, LargeBinary
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console
+
+from .base_form import BaseForm
+from .models import ChangeLogModel, UserModel, QueryModel, EvaluationModel, FilesModel
+
+TRACKED_MODELS = {
+    model.__tablename__: model
+    for model in (UserModel, QueryModel, EvaluationModel, FilesModel)
+}
+
+
+def last_change_seq(conn) -> int:
+    """已分配的最大变更序号（包括已被清理的记录），从未写入过变更时为 0"""
+    newest = conn.execute(select(func.max(ChangeLogModel.seq))).scalar() or 0
+    has_sequence = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_sequence'")
+    ).first()
+    if not has_sequence:
+        return newest
+    issued = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")).scalar() or 0
+    return max(newest, issued)
+
+
+class ChangeFeed(BaseForm):
+    """变更日志管理器"""
+
+    def __init__(self, db_path="app.db"):
+        super().__init__(db_path, ChangeLogModel)
+
+    def current_cursor(self) -> int:
+        """当前最新的变更序号，新客户端可从这里开始订阅"""
+        try:
+            with self.read_engine.connect() as conn:
+                return last_change_seq(conn)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 获取游标失败: {e}[/red]")
+            return 0
+
+    def get_changes(self, since: int = 0, limit: int = 1000, tables: list = None) -> dict:
+        """获取游标之后的原始变更记录
+
+        Returns:
+            {"changes": [{seq, table_name, row_id, op, changed_at}], "cursor": 下次使用的游标, "has_more": 是否还有}
+        """
+        try:
+            with self.read_engine.connect() as conn:
+                return self._read_changes(conn, since, limit, tables)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 获取变更失败: {e}[/red]")
+            return {"changes": [], "cursor": since, "has_more": False}
+
+    def get_changed_rows(
+        self, since: int = 0, limit: int = 1000, tables: list = None, include_content: bool = False
+    ) -> dict:
+        """获取游标之后变更过的行的最新状态
+
+        同一行的多次变更会被合并：最终仍存在的行放入 upserts，已删除的行放入 deletes。
+
+        Args:
+            include_content: 是否包含二进制列（如 files_form.content），默认不包含
+
+        Returns:
+            {"upserts": {表名: [行dict]}, "deletes": {表名: [ID]}, "cursor": int, "has_more": bool}
+        """
+        upserts, deletes = {}, {}
+        try:
+            # 变更页与行的当前状态在同一快照内读取：期间的新写入不会出现在行里，而游标之后的变更会在下一页给出
+            with self.read_session() as session:
+                batch = self._read_changes(session, since, limit, tables)
+                touched = {}
+                for change in batch["changes"]:
+                    touched.setdefault(change["table_name"], set()).add(change["row_id"])
+
+                for table_name, row_ids in touched.items():
+                    model = TRACKED_MODELS[table_name]
+                    columns = [
+                        column for column in model.__table__.columns
+                        if include_content or not isinstance(column.type, LargeBinary)
+                    ]
+                    rows = [
+                        row._asdict()
+                        for row in session.execute(select(*columns).where(model.__table__.c.id.in_(row_ids)))
+                    ]
+                    existing = {row["id"] for row in rows}
+                    if rows:
+                        upserts[table_name] = rows
+                    if row_ids - existing:
+                        deletes[table_name] = sorted(row_ids - existing)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 获取变更行失败: {e}[/red]")
+            return {"upserts": {}, "deletes": {}, "cursor": since, "has_more": False}
+
+        return {
+            "upserts": upserts,
+            "deletes": deletes,
+            "cursor": batch["cursor"],
+            "has_more": batch["has_more"],
+        }
+
+    def _read_changes(self, conn, since: int, limit: int, tables: list = None) -> dict:
+        table = ChangeLogModel.__table__
+        stmt = select(table).where(table.c.seq > since).order_by(table.c.seq).limit(limit + 1)
+        if tables:
+            stmt = stmt.where(table.c.table_name.in_(tables))
+        rows = [row._asdict() for row in conn.execute(stmt)]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "changes": rows,
+            "cursor": rows[-1]["seq"] if rows else since,
+            "has_more": has_more,
+        }
+
+    def prune(self, before: int) -> int:
+        """删除序号小于等于 before 的变更记录（所有客户端都已同步过的部分），返回删除条数"""
+        try:
+            with self.engine.begin() as conn:
+                result = conn.execute(delete(ChangeLogModel.__table__).where(ChangeLogModel.seq <= before))
+            console = Console()
+            console.print(f"[green]✓ 已清理 {result.rowcount} 条变更记录[/green]")
+            return result.rowcount
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 清理变更记录失败: {e}[/red]")
+            return 0
@@ -0,0 +1,533 @@
+"""
+数据库管理命令行
+
+把 DatabaseManager、各表单与导入/导出/维护/基准测试统一成子命令，不再需要修改脚本里的 main() 来做日常操作。
+大操作（导入、导出、备份、回收）带进度条，结束时输出耗时与吞吐量；成功返回 0，失败返回 1，便于写进脚本。
+
+用法（在 backend 目录下，--db 默认 app.db）：
+    python -m src.db.cli stats [--count-mode exact] [--json]
+    python -m src.db.cli init
+    python -m src.db.cli reset --yes
+    python -m src.db.cli migrate [--status] [--max-seconds 60] [--repair]
+    python -m src.db.cli import /data/root --username admin [--only queries|runs]
+    python -m src.db.cli export evaluation_form -o evals.jsonl [--format csv] [--expand-trajectories]
+    python -m src.db.cli list query_form [--page-size 20] [--after 100 | --page 3]
+    python -m src.db.cli vacuum [--full]
+    python -m src.db.cli maintain
+    python -m src.db.cli backup [-o backup.db.gz] / restore backup.db.gz --yes
+    python -m src.db.cli bench forms --scales 1000 / bench startup
+
+导出与分页按主键 keyset 分页读取，每批一个短的只读事务，内存占用与表大小无关，也不会长时间持有快照。
+子命令在执行时才导入所需模块，--help 不加载 SQLAlchemy。
+
+可用方法
+main
+build_parser
+iter_batches
+export_table
+list_page
+"""
+
+import argparse
+import base64
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from .lazy_rich import Table, Progress, TextColumn, BarColumn, TaskProgressColumn, MofNCompleteColumn, TimeElapsedColumn, lazy_console, unwrap
+
+console = lazy_console()
+# 导出到标准输出时，进度与统计写到标准错误
+err_console = lazy_console(stderr=True)
+
+EXPORT_FORMATS = ("jsonl", "csv")
+LIST_CELL_WIDTH = 60
+
+
+# ---------- 分页读取与导出 ----------
+
+def _get_table(name: str):
+    from .models import Base
+    table = Base.metadata.tables.get(name)
+    if table is None:
+        raise ValueError(f"未知的表: {name}，可选: {', '.join(sorted(Base.metadata.tables))}")
+    return table
+
+
+def _after_clause(table, after: list):
+    """主键大于 after 的条件；复合主键按元组比较"""
+    from sqlalchemy import Integer, tuple_
+    pk = list(table.primary_key.columns)
+    if len(after) != len(pk):
+        raise ValueError(f"{table.name} 的主键为 ({', '.join(c.name for c in pk)})，游标需要 {len(pk)} 个值")
+    values = [int(value) if isinstance(column.type, Integer) else value for column, value in zip(pk, after)]
+    if len(pk) == 1:
+        return pk[0] > values[0]
+    return tuple_(*pk) > tuple_(*values)
+
+
+def _select(table, columns: list = None):
+    """按主键排序的查询；返回 (语句, 输出的列名, 主键列名)，主键未被选中时也会额外读取用作游标"""
+    from sqlalchemy import select
+    pk = [column.name for column in table.primary_key.columns]
+    names = list(columns) if columns else [column.name for column in table.columns]
+    missing = [name for name in names if name not in table.c]
+    if missing:
+        raise ValueError(f"{table.name} 没有列: {', '.join(missing)}")
+    stmt = select(*[table.c[name] for name in names], *[table.c[name] for name in pk if name not in names])
+    return stmt.order_by(*table.primary_key.columns), names, pk
+
+
+def iter_batches(engine, table, batch_size: int = 1000, after: list = None, columns: list = None):
+    """按主键 keyset 分页读取表，逐批 yield (行 dict 列表, 本批最后一行的主键)
+
+    每批使用独立的连接与短事务；columns 为 None 时读取全部列。
+    """
+    stmt, names, pk = _select(table, columns)
+    stmt = stmt.limit(batch_size)
+    while True:
+        query = stmt if after is None else stmt.where(_after_clause(table, after))
+        with engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        if not rows:
+            return
+        after = [rows[-1][name] for name in pk]
+        yield [{name: row[name] for name in names} for row in rows], after
+        if len(rows) < batch_size:
+            return
+
+
+def _jsonable(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    return value
+
+
+def _encode_batch(rows: list, fmt: str, header: bool) -> bytes:
+    if fmt == "jsonl":
+        return "".join(
+            json.dumps({key: _jsonable(value) for key, value in row.items()}, ensure_ascii=False) + "\n"
+            for row in rows
+        ).encode("utf-8")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(rows[0].keys())
+    writer.writerows([_jsonable(value) for value in row.values()] for row in rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def export_table(
+    db_path: str, table_name: str, out, fmt: str = "jsonl", batch_size: int = 1000,
+    columns: list = None, expand_trajectories: bool = False, progress=None
+) -> dict:
+    """把整张表流式写入二进制文件对象 out，返回 {rows, bytes, seconds, rows_per_s, mb_per_s}
+
+    Args:
+        fmt: jsonl（每行一个 JSON 对象）或 csv（带表头）；二进制列输出为 base64
+        expand_trajectories: 把评估轨迹从前缀共享的紧凑格式还原为完整步骤数组（见 trajectory_store.py）
+        progress: 进度回调 progress(已导出行数, 预计总行数)
+    """
+    from .engine import create_read_engine
+    from .table_stats import get_row_counts
+    from .trajectory_store import unpack_trajectory_text
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"导出格式必须为 {', '.join(EXPORT_FORMATS)} 之一")
+    table = _get_table(table_name)
+    expand = expand_trajectories and table_name == "evaluation_form"
+    engine = create_read_engine(db_path)
+    start = time.perf_counter()
+    exported = written = 0
+    try:
+        with engine.connect() as conn:
+            total = get_row_counts(conn, [table_name])[table_name][0]
+        for rows, _ in iter_batches(engine, table, batch_size, columns=columns):
+            if expand and "trajectory" in rows[0]:
+                for row in rows:
+                    row["trajectory"] = unpack_trajectory_text(row["trajectory"])
+            data = _encode_batch(rows, fmt, header=exported == 0)
+            out.write(data)
+            exported += len(rows)
+            written += len(data)
+            if progress is not None:
+                progress(exported, max(total, exported))
+    finally:
+        engine.dispose()
+    seconds = time.perf_counter() - start
+    return {
+        "rows": exported,
+        "bytes": written,
+        "seconds": round(seconds, 3),
+        "rows_per_s": round(exported / seconds, 1) if seconds else None,
+        "mb_per_s": round(written / 1024 / 1024 / seconds, 2) if seconds else None,
+    }
+
+
+def list_page(
+    db_path: str, table_name: str, page_size: int = 20, after: list = None, page: int = None, columns: list = None
+) -> dict:
+    """读取一页，返回 {rows, next_after}
+
+    after 为上一页最后一行的主键（keyset，任意深度都只读一页）；page 为从 1 开始的页码（OFFSET，深页会变慢）。
+    next_after 为下一页的游标，None 表示没有下一页。
+    """
+    from .engine import create_read_engine
+
+    table = _get_table(table_name)
+    stmt, names, pk = _select(table, columns)
+    # 多读一行判断是否还有下一页
+    stmt = stmt.limit(page_size + 1)
+    if page is not None:
+        stmt = stmt.offset((page - 1) * page_size)
+    elif after is not None:
+        stmt = stmt.where(_after_clause(table, after))
+    engine = create_read_engine(db_path)
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(stmt).mappings().all()
+    finally:
+        engine.dispose()
+    next_after = [rows[page_size - 1][name] for name in pk] if len(rows) > page_size else None
+    return {"rows": [{name: row[name] for name in names} for row in rows[:page_size]], "next_after": next_after}
+
+
+# ---------- 子命令 ----------
+
+def _progress(console_=None):
+    return Progress(
+        TextColumn("[cyan]{task.description}"), BarColumn(), TaskProgressColumn(), MofNCompleteColumn(),
+        TimeElapsedColumn(), console=unwrap(console_ or console), transient=True,
+    )
+
+
+def _require_db(db_path: str) -> bool:
+    if not os.path.exists(db_path):
+        err_console.print(f"[red]✗ 数据库 '{db_path}' 不存在[/red]")
+        return False
+    return True
+
+
+def _cmd_stats(args) -> int:
+    from .database import DatabaseManager
+    db = DatabaseManager(args.db)
+    if not args.json:
+        db.display_database_info(count_mode=args.count_mode, include_storage=not args.no_storage)
+        return 0 if db.is_database_exists() else 1
+    info = db.get_database_info(count_mode=args.count_mode, include_storage=not args.no_storage)
+    print(json.dumps(info, ensure_ascii=False, default=str, indent=2))
+    return 0 if info else 1
+
+
+def _cmd_init(args) -> int:
+    from .Forms.user_form import UserForm
+    return 0 if UserForm(args.db)._create_tables() else 1
+
+
+def _cmd_reset(args) -> int:
+    if not args.yes:
+        console.print(f"[yellow]重置会删除 '{args.db}' 的全部数据，确认请加 --yes[/yellow]")
+        return 1
+    from .database import DatabaseManager
+    # 删除后按最新表结构版本重建
+    return 0 if DatabaseManager(args.db)._reset_database() else 1
+
+
+def _cmd_migrate(args) -> int:
+    if not _require_db(args.db):
+        return 1
+    from .migrations import MigrationRunner
+    runner = MigrationRunner(args.db, batch_size=args.batch_size, batch_sleep=args.batch_sleep)
+    if args.status:
+        runner.display_status()
+        return 0
+    # DDL 先行（包括启动时跳过的 manual 迁移），回填在下面带进度条分批执行
+    if not (runner.repair() if args.repair else runner.ensure(backfill="defer", manual=True)):
+        return 1
+    with _progress() as progress:
+        tasks = {}
+
+        def on_progress(name, done, total):
+            if name not in tasks:
+                tasks[name] = progress.add_task(f"回填 {name}", total=total)
+            progress.update(tasks[name], completed=done)
+
+        result = runner.run_backfills(max_seconds=args.max_seconds, progress=on_progress)
+    runner.display_status()
+    seconds = result["seconds"] or 1e-9
+    console.print(
+        f"回填 {result['rows']:,} 行 / {result['batches']} 批，{result['seconds']:.2f}s，{result['rows'] / seconds:,.0f} 行/s"
+    )
+    if not result["done"]:
+        console.print("[yellow]回填未完成，进度已保存，再次运行 migrate 继续[/yellow]")
+        return 1
+    return 0
+
+
+def _cmd_import(args) -> int:
+    from sqlalchemy import select
+    from .importer import DirectoryImporter
+    from .models import UserModel
+
+    with _progress() as progress:
+        tasks = {}
+
+        def on_progress(kind, done, total):
+            if kind not in tasks:
+                tasks[kind] = progress.add_task(f"导入 {kind}", total=total)
+            progress.update(tasks[kind], completed=done, total=total)
+
+        importer = DirectoryImporter(
+            args.db, priority=args.priority, batch_size=args.batch_size,
+            io_workers=args.io_workers, parse_workers=args.parse_workers, progress=on_progress,
+        )
+        if args.username:
+            users = UserModel.__table__
+            with importer.engine.connect() as conn:
+                importer.creator_id = conn.execute(select(users.c.id).where(users.c.username == args.username)).scalar()
+            if importer.creator_id is None:
+                console.print(f"[red]✗ 用户 {args.username} 不存在[/red]")
+                return 1
+        runner = {"all": importer.import_directory, "queries": importer.import_queries, "runs": importer.import_runs}[args.only]
+        stats = runner(args.root)
+    importer.display_stats(stats)
+    seconds = stats["seconds"] or 1e-9
+    console.print(f"[green]✓ 处理 {stats['scanned']:,} 个文件，{stats['scanned'] / seconds:,.1f} 个/s[/green]")
+    return 1 if stats["failed"] else 0
+
+
+def _cmd_export(args) -> int:
+    if not _require_db(args.db):
+        return 1
+    from sqlalchemy.exc import SQLAlchemyError
+    to_stdout = args.output in (None, "-")
+    # 导出到文件时进度条与统计照常写到标准输出，导出到标准输出时改写到标准错误
+    out_console = err_console if to_stdout else console
+    columns = args.columns.split(",") if args.columns else None
+    try:
+        with _progress(out_console) as progress:
+            task = progress.add_task(f"导出 {args.table}", total=None)
+            out = sys.stdout.buffer if to_stdout else open(args.output, "wb")
+            try:
+                report = export_table(
+                    args.db, args.table, out, fmt=args.format, batch_size=args.batch_size, columns=columns,
+                    expand_trajectories=args.expand_trajectories,
+                    progress=lambda done, total: progress.update(task, completed=done, total=total),
+                )
+            finally:
+                if to_stdout:
+                    out.flush()
+                else:
+                    out.close()
+    except BrokenPipeError:
+        raise
+    except (ValueError, OSError, SQLAlchemyError) as e:
+        out_console.print(f"[red]✗ 导出失败: {e}[/red]")
+        return 1
+    out_console.print(
+        f"[green]✓ 导出 {report['rows']:,} 行 / {report['bytes']:,} 字节，耗时 {report['seconds']}s"
+        f"（{report['rows_per_s'] or 0:,.0f} 行/s，{report['mb_per_s'] or 0} MB/s）[/green]"
+    )
+    return 0
+
+
+def _cell(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value):,} 字节>"
+    text = str(value).replace("\n", " ")
+    return text if len(text) <= LIST_CELL_WIDTH else text[:LIST_CELL_WIDTH - 1] + "…"
+
+
+def _cmd_list(args) -> int:
+    if not _require_db(args.db):
+        return 1
+    try:
+        result = list_page(
+            args.db, args.table, page_size=args.page_size, page=args.page,
+            after=args.after.split(",") if args.after else None,
+            columns=args.columns.split(",") if args.columns else None,
+        )
+    except ValueError as e:
+        console.print(f"[red]✗ {e}[/red]")
+        return 1
+    if args.json:
+        for row in result["rows"]:
+            print(json.dumps({key: _jsonable(value) for key, value in row.items()}, ensure_ascii=False))
+        return 0
+
+    rows = result["rows"]
+    table = Table(title=f"{args.table} ({len(rows)} 行)")
+    for name in (rows[0].keys() if rows else _select(_get_table(args.table), args.columns and args.columns.split(","))[1]):
+        table.add_column(name, style="cyan", overflow="fold")
+    for row in rows:
+        table.add_row(*[_cell(value) for value in row.values()])
+    console.print(table)
+    if result["next_after"] is not None:
+        console.print(f"[dim]下一页: --after {','.join(str(value) for value in result['next_after'])}[/dim]")
+    return 0
+
+
+def _cmd_vacuum(args) -> int:
+    if not _require_db(args.db):
+        return 1
+    from sqlalchemy.exc import SQLAlchemyError
+    from .maintenance import MaintenanceScheduler
+    # 手动执行时不受空闲页比例阈值限制
+    scheduler = MaintenanceScheduler(args.db, min_free_ratio=0.0)
+    try:
+        if args.full:
+            with _progress() as progress:
+                progress.add_task("VACUUM", total=None)
+                report = scheduler.run_full_vacuum()
+        else:
+            if args.enable_incremental and not scheduler.enable_incremental_vacuum():
+                return 1
+            report = scheduler.run_incremental_vacuum(max_pages=args.max_pages)
+    except SQLAlchemyError as e:
+        console.print(f"[red]✗ 回收失败: {e}[/red]")
+        return 1
+    scheduler.display_report([report])
+    if report["skipped"]:
+        return 1
+    seconds = report["seconds"] or 1e-9
+    console.print(
+        f"[green]✓ 文件 {report['file_size_before']:,} → {report['file_size_after']:,} 字节，"
+        f"{report['file_size_before'] / 1024 / 1024 / seconds:.2f} MB/s[/green]"
+    )
+    return 0
+
+
+def _cmd_maintain(args) -> int:
+    if not _require_db(args.db):
+        return 1
+    from .maintenance import MaintenanceScheduler
+    scheduler = MaintenanceScheduler(args.db)
+    reports = scheduler.run_pending(force=True)
+    scheduler.display_report(reports)
+    return 0 if all(report.get("ok", True) for report in reports) else 1
+
+
+def _cmd_backup(args) -> int:
+    from .database import DatabaseManager
+    report = DatabaseManager(args.db).backup(dest=args.output, method=args.method, compress=not args.no_compress)
+    return 0 if report else 1
+
+
+def _cmd_restore(args) -> int:
+    if not args.yes:
+        console.print(f"[yellow]恢复会覆盖 '{args.db}' 的全部内容，确认请加 --yes[/yellow]")
+        return 1
+    from .database import DatabaseManager
+    return 0 if DatabaseManager(args.db).restore(args.backup, check=not args.no_check) else 1
+
+
+def _cmd_bench(args) -> int:
+    try:
+        if args.suite == "forms":
+            from bench.bench_forms import main as bench_main
+        else:
+            from bench.bench_startup import main as bench_main
+    except ImportError as e:
+        console.print(f"[red]✗ 无法导入基准测试（需要在 backend 目录下运行）: {e}[/red]")
+        return 1
+    return bench_main(args.bench_args)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.db.cli", description="数据库管理命令行")
+    parser.add_argument("--db", default="app.db", help="数据库路径（默认 app.db）")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="命令")
+
+    stats = commands.add_parser("stats", help="数据库信息与每张表的行数/占用空间")
+    stats.add_argument("--count-mode", choices=("cached", "estimate", "exact"), default="cached", help="行数统计方式")
+    stats.add_argument("--no-storage", action="store_true", help="不统计每张表的占用空间（超大库更快）")
+    stats.add_argument("--json", action="store_true", help="以 JSON 输出")
+    stats.set_defaults(handler=_cmd_stats)
+
+    commands.add_parser("init", help="创建所有表（已存在的表不变）").set_defaults(handler=_cmd_init)
+
+    reset = commands.add_parser("reset", help="删除并重新创建数据库")
+    reset.add_argument("--yes", action="store_true", help="确认删除全部数据")
+    reset.set_defaults(handler=_cmd_reset)
+
+    migrate = commands.add_parser("migrate", help="升级表结构到最新版本并分批回填（可中断，下次继续）")
+    migrate.add_argument("--status", action="store_true", help="只查看各迁移的状态")
+    migrate.add_argument("--repair", action="store_true", help="不看版本，重建索引/触发器/统计行并重跑全部回填")
+    migrate.add_argument("--batch-size", type=int, default=1000, help="每批回填的行数")
+    migrate.add_argument("--batch-sleep", type=float, default=0.0, help="批次之间的休眠秒数，给其他写入者让出写锁")
+    migrate.add_argument("--max-seconds", type=float, default=None, help="最长回填时间，到时保存进度后退出")
+    migrate.set_defaults(handler=_cmd_migrate)
+
+    imp = commands.add_parser("import", help="目录批量导入（可断点续导，见 importer.py）")
+    imp.add_argument("root", help="导入目录；--only all 时为包含 queries/ 与 runs/ 的根目录")
+    imp.add_argument("--only", choices=("all", "queries", "runs"), default="all", help="只导入查询或运行")
+    imp.add_argument("--username", default=None, help="查询创建人用户名")
+    imp.add_argument("--priority", type=int, default=1, help="查询优先级")
+    imp.add_argument("--batch-size", type=int, default=500, help="每批写入数量")
+    imp.add_argument("--io-workers", type=int, default=8, help="读取线程数")
+    imp.add_argument("--parse-workers", type=int, default=None, help="解析进程数，0 表示不使用进程池")
+    imp.set_defaults(handler=_cmd_import)
+
+    export = commands.add_parser("export", help="流式导出整张表")
+    export.add_argument("table", help="表名，如 query_form / evaluation_form")
+    export.add_argument("-o", "--output", default=None, help="输出文件，省略或 - 表示标准输出")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl", help="输出格式")
+    export.add_argument("--columns", default=None, help="只导出这些列（逗号分隔）")
+    export.add_argument("--batch-size", type=int, default=1000, help="每批读取行数")
+    export.add_argument("--expand-trajectories", action="store_true", help="评估轨迹还原为完整步骤数组")
+    export.set_defaults(handler=_cmd_export)
+
+    listing = commands.add_parser("list", help="分页查看表")
+    listing.add_argument("table", help="表名")
+    listing.add_argument("--page-size", type=int, default=20, help="每页行数")
+    position = listing.add_mutually_exclusive_group()
+    position.add_argument("--after", default=None, help="上一页最后一行的主键（复合主键用逗号分隔）")
+    position.add_argument("--page", type=int, default=None, help="页码（从 1 开始，深页较慢）")
+    listing.add_argument("--columns", default=None, help="只显示这些列（逗号分隔）")
+    listing.add_argument("--json", action="store_true", help="每行输出一个 JSON 对象")
+    listing.set_defaults(handler=_cmd_list)
+
+    vacuum = commands.add_parser("vacuum", help="回收空闲页（默认增量回收，不阻塞读者）")
+    vacuum.add_argument("--full", action="store_true", help="完整 VACUUM（重写整个库，期间阻塞写入）")
+    vacuum.add_argument("--max-pages", type=int, default=None, help="增量回收的最大页数")
+    vacuum.add_argument("--enable-incremental", action="store_true", help="先把库切换为 auto_vacuum=INCREMENTAL")
+    vacuum.set_defaults(handler=_cmd_vacuum)
+
+    commands.add_parser("maintain", help="立即执行全部维护任务（检查点、回收、ANALYZE、完整性检查）").set_defaults(handler=_cmd_maintain)
+
+    backup = commands.add_parser("backup", help="在线热备份")
+    backup.add_argument("-o", "--output", default=None, help="备份路径，默认 <库目录>/backups/")
+    backup.add_argument("--method", choices=("backup", "vacuum"), default="backup", help="分步备份 API 或 VACUUM INTO")
+    backup.add_argument("--no-compress", action="store_true", help="不压缩")
+    backup.set_defaults(handler=_cmd_backup)
+
+    restore = commands.add_parser("restore", help="从备份恢复（覆盖当前库）")
+    restore.add_argument("backup", help="备份文件")
+    restore.add_argument("--no-check", action="store_true", help="跳过恢复后的完整性检查")
+    restore.add_argument("--yes", action="store_true", help="确认覆盖当前库")
+    restore.set_defaults(handler=_cmd_restore)
+
+    bench = commands.add_parser("bench", help="运行基准测试（其余参数原样传给对应脚本）")
+    bench.add_argument("suite", choices=("forms", "startup"), help="forms: 表单层吞吐量；startup: 启动耗时")
+    bench.add_argument("bench_args", nargs=argparse.REMAINDER, help="传给基准脚本的参数")
+    bench.set_defaults(handler=_cmd_bench)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except BrokenPipeError:
+        # 输出被 head 等提前关闭：丢弃剩余输出，避免解释器退出时再次报错
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -2,26 +2,33 @@
 数据库初始化 - SQLAlchemy版本
 """
 import os
+import sqlite3
 from datetime import datetime
-from sqlalchemy import create_engine, MetaData, inspect, text
+from sqlalchemy import inspect
 from sqlalchemy.orm import sessionmaker
-from rich.console import Console
-from rich.table import Table
-from rich.panel import Panel
-from rich.text import Text
+from .lazy_rich import Console, Table, Panel, Text, Progress, TextColumn, BarColumn, TaskProgressColumn, TimeElapsedColumn, lazy_console, unwrap
 
-console = Console()
+from .engine import create_sqlite_engine
+from .table_stats import get_row_counts, get_byte_totals, get_storage_sizes
+
+console = lazy_console()
 
 class DatabaseManager:
     def __init__(self, db_path='app.db'):
         self.db_path = db_path
         self.engine = None
         self.Session = None
-        self.metadata = MetaData()
         
     def get_database_url(self):
         """获取数据库URL"""
         return f"sqlite:///{self.db_path}"
+
+    def _get_engine(self):
+        """复用同一个引擎，避免每次查询信息都重新创建"""
+        if self.engine is None:
+            self.engine = create_sqlite_engine(self.db_path)
+            self.Session = sessionmaker(bind=self.engine)
+        return self.engine
     
     def is_database_exists(self):
         """检查数据库是否存在"""
@@ -30,11 +37,10 @@ class DatabaseManager:
     def create_database(self):
         """创建数据库"""
         try:
-            self.engine = create_engine(self.get_database_url(), echo=False)
-            self.Session = sessionmaker(bind=self.engine)
-            
-            # 创建所有表
-            self.metadata.create_all(self.engine)
+            # 建到最新表结构版本（见 migrations.py）
+            from .migrations import MigrationRunner
+            if not MigrationRunner(self.db_path, engine=self._get_engine()).ensure():
+                return False
             
             console.print(f"[green]✓ 数据库 '{self.db_path}' 创建成功！[/green]")
             return True
@@ -42,14 +48,21 @@ class DatabaseManager:
             console.print(f"[red]✗ 创建数据库失败: {e}[/red]")
             return False
     
-    def get_database_info(self):
-        """获取数据库信息"""
+    def get_database_info(self, count_mode="cached", include_storage=True):
+        """获取数据库信息
+
+        Args:
+            count_mode: 行数统计方式
+                - cached: 触发器维护的 table_stats（精确且不扫表，默认）
+                - estimate: sqlite_stat1 / rowid 范围估算
+                - exact: COUNT(*) 全表扫描
+            include_storage: 是否通过 dbstat 统计每张表的占用空间（需要遍历页，超大库可关闭）
+        """
         if not self.is_database_exists():
             return None
             
         try:
-            self.engine = create_engine(self.get_database_url(), echo=False)
-            inspector = inspect(self.engine)
+            inspector = inspect(self._get_engine())
             
             # 获取数据库文件信息
             file_stat = os.stat(self.db_path)
@@ -60,26 +73,38 @@ class DatabaseManager:
             # 获取表信息
             tables = inspector.get_table_names()
             
-            # 获取每个表的行数
-            table_info = []
-            for table_name in tables:
-                with self.engine.connect() as conn:
-                    result = conn.execute(text(f"SELECT COUNT(*) FROM {table_name}"))
-                    row_count = result.scalar()
-                    table_info.append((table_name, row_count))
+            # 所有统计在同一个连接中完成
+            with self.engine.connect() as conn:
+                counts = get_row_counts(conn, tables, count_mode)
+                byte_totals = get_byte_totals(conn)
+                storage = get_storage_sizes(conn) if include_storage else None
+
+            table_info = [(table_name, counts[table_name][0]) for table_name in tables]
+            table_stats = [
+                {
+                    'name': table_name,
+                    'rows': counts[table_name][0],
+                    'exact': counts[table_name][1],
+                    'content_bytes': byte_totals.get(table_name),
+                    'storage_bytes': storage.get(table_name) if storage is not None else None,
+                }
+                for table_name in tables
+            ]
             
             return {
                 'file_size': file_size,
                 'created_time': created_time,
                 'modified_time': modified_time,
-                'tables': table_info
+                'tables': table_info,
+                'table_stats': table_stats,
+                'count_mode': count_mode,
             }
             
         except Exception as e:
             console.print(f"[red]✗ 获取数据库信息失败: {e}[/red]")
             return None
     
-    def display_database_info(self):
+    def display_database_info(self, count_mode="cached", include_storage=True):
         """使用rich库美观展示数据库信息"""
         if not self.is_database_exists():
             console.print(Panel(
@@ -95,7 +120,7 @@ class DatabaseManager:
                 ))
             return
         
-        info = self.get_database_info()
+        info = self.get_database_info(count_mode, include_storage)
         if not info:
             return
         
@@ -115,9 +140,14 @@ class DatabaseManager:
             table_info = Table(title="数据库表信息")
             table_info.add_column("表名", style="cyan", no_wrap=True)
             table_info.add_column("行数", style="green", justify="right")
+            table_info.add_column("内容字节", style="yellow", justify="right")
+            table_info.add_column("占用空间", style="magenta", justify="right")
             
-            for table_name, row_count in info['tables']:
-                table_info.add_row(table_name, str(row_count))
+            for stats in info['table_stats']:
+                rows = f"{stats['rows']:,}" if stats['exact'] else f"≈{stats['rows']:,}"
+                content_bytes = f"{stats['content_bytes']:,}" if stats['content_bytes'] is not None else "-"
+                storage_bytes = f"{stats['storage_bytes']:,}" if stats['storage_bytes'] is not None else "-"
+                table_info.add_row(stats['name'], rows, content_bytes, storage_bytes)
         else:
             table_info = Text("暂无表", style="dim")
         
@@ -137,27 +167,199 @@ class DatabaseManager:
                 border_style="yellow"
             ))
 
+    def get_maintenance_scheduler(self, **kwargs):
+        """获取在线维护调度器（参数见 MaintenanceScheduler），可调用 start() 在后台运行"""
+        from .maintenance import MaintenanceScheduler
+        return MaintenanceScheduler(self.db_path, **kwargs)
+
+    def get_write_queue(self, **kwargs):
+        """获取单写入者组提交队列（参数见 WriteQueue），用 with 语句或 start()/stop() 管理写线程"""
+        from .write_queue import WriteQueue
+        return WriteQueue(self.db_path, **kwargs)
+
+    def get_work_scheduler(self, **kwargs):
+        """获取评估任务调度器（参数见 WorkScheduler），评估人与评分器通过 claim 领取任务"""
+        from .work_scheduler import WorkScheduler
+        return WorkScheduler(self.db_path, **kwargs)
+
+    def get_run_executor(self, adapters, **kwargs):
+        """获取 agent 运行编排器（参数见 RunExecutor），adapters 为 AgentAdapter 列表"""
+        from .run_executor import RunExecutor
+        return RunExecutor(self.db_path, adapters, **kwargs)
+
+    def get_scoring_pipeline(self, judges=None, **kwargs):
+        """获取自动评分流水线（参数见 ScoringPipeline），judges 为 Judge 列表，默认使用 LocalJudge"""
+        from .scoring import ScoringPipeline
+        return ScoringPipeline(self.db_path, judges, **kwargs)
+
+    def get_agent_comparison(self, **kwargs):
+        """载入已打分评估，返回 agent 对比（参数见 AgentComparison.from_database，需要 numpy）"""
+        from .agent_compare import AgentComparison
+        return AgentComparison.from_database(self.db_path, **kwargs)
+
+    def get_usage_accounting(self, prices=None):
+        """获取用量与费用统计（参数见 UsageAccounting），prices 为价格字典或价格表 JSON 路径"""
+        from .usage_accounting import UsageAccounting
+        return UsageAccounting(self.db_path, prices)
+
+    def get_trajectory_diff(self):
+        """获取轨迹对比（见 TrajectoryDiff），结果按评估对缓存"""
+        from .trajectory_diff import TrajectoryDiff
+        return TrajectoryDiff(self.db_path)
+
+    def get_query_dedup_index(self):
+        """获取近似重复查询索引（见 QueryDedupIndex）"""
+        from .query_dedup import QueryDedupIndex
+        return QueryDedupIndex(self.db_path)
+
+    def get_vector_index(self, embedder=None, **kwargs):
+        """获取向量检索索引（参数见 VectorIndex），默认使用 HashingEmbedder，需要 numpy"""
+        from .vector_index import VectorIndex
+        return VectorIndex(self.db_path, embedder, **kwargs)
+
+    def get_migration_runner(self, **kwargs):
+        """获取表结构迁移执行器（参数见 MigrationRunner），可查看版本、分批回填或在后台线程回填"""
+        from .migrations import MigrationRunner
+        return MigrationRunner(self.db_path, **kwargs)
+
+    def run_maintenance(self, **kwargs):
+        """立即执行一轮维护（WAL 检查点、增量回收、ANALYZE、完整性检查）并展示报告"""
+        if not self.is_database_exists():
+            console.print(f"[yellow]数据库 '{self.db_path}' 不存在[/yellow]")
+            return []
+        scheduler = self.get_maintenance_scheduler(**kwargs)
+        reports = scheduler.run_pending(force=True)
+        scheduler.display_report(reports)
+        return reports
+
+    def backup(self, dest=None, method="backup", compress=True, show_progress=True, **kwargs):
+        """在线热备份（不阻塞写入），返回报告；参数见 backup.backup_database
+
+        Args:
+            dest: 备份路径，默认 <库目录>/backups/<库名>-<时间>.db.gz
+            method: backup（分步备份 API）或 vacuum（VACUUM INTO 时间点快照）
+            compress: 是否 gzip 压缩
+        """
+        from .backup import backup_database, default_backup_path
+        if not self.is_database_exists():
+            console.print(f"[yellow]数据库 '{self.db_path}' 不存在[/yellow]")
+            return None
+        dest = dest or default_backup_path(self.db_path, compress)
+        try:
+            if show_progress:
+                with Progress(
+                    TextColumn("[cyan]备份中"), BarColumn(), TaskProgressColumn(),
+                    TimeElapsedColumn(), console=unwrap(console), transient=True
+                ) as progress:
+                    task = progress.add_task("backup", total=None)
+                    report = backup_database(
+                        self.db_path, dest, method=method, compress=compress,
+                        progress=lambda done, total: progress.update(task, completed=done, total=total),
+                        **kwargs
+                    )
+            else:
+                report = backup_database(self.db_path, dest, method=method, compress=compress, **kwargs)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            console.print(f"[red]✗ 备份失败: {e}[/red]")
+            return None
+        self.display_backup_report(report)
+        return report
+
+    def restore(self, backup_path, check=True):
+        """从备份恢复（覆盖当前库的全部内容），返回报告"""
+        from .backup import restore_database
+        try:
+            report = restore_database(backup_path, self.db_path, check=check)
+        except (OSError, sqlite3.Error) as e:
+            console.print(f"[red]✗ 恢复失败: {e}[/red]")
+            return None
+        console.print(
+            f"[green]✓ 已从 {backup_path} 恢复 {report['restored_bytes']:,} 字节，"
+            f"耗时 {report['seconds']}s（{report['mb_per_s']} MB/s）[/green]"
+        )
+        return report
+
+    def display_backup_report(self, report):
+        """展示备份报告"""
+        grid = Table.grid(padding=1)
+        grid.add_column("属性", style="cyan", no_wrap=True)
+        grid.add_column("值", style="white")
+        grid.add_row("方式", report['method'])
+        grid.add_row("备份文件", report['dest'])
+        grid.add_row("源库大小", f"{report['source_bytes']:,} 字节")
+        grid.add_row("备份大小", f"{report['backup_bytes']:,} 字节")
+        if report['compressed']:
+            ratio = report['output_bytes'] / report['backup_bytes'] if report['backup_bytes'] else 0
+            grid.add_row("压缩后", f"{report['output_bytes']:,} 字节（{ratio:.1%}）")
+        grid.add_row("页数/步数", f"{report['pages']:,} / {report['steps']:,}")
+        grid.add_row("耗时", f"{report['seconds']}s")
+        grid.add_row("吞吐", f"{report['mb_per_s']} MB/s" if report['mb_per_s'] is not None else "-")
+        console.print(Panel(grid, title="[bold green]备份完成[/bold green]", border_style="green"))
+
+    def get_analytics(self, **kwargs):
+        """获取 DuckDB 分析引擎（参数见 AnalyticsEngine），用完调用 close() 或使用 with 语句"""
+        from .analytics import AnalyticsEngine
+        return AnalyticsEngine(self.db_path, **kwargs)
+
+    def analytics_report(self, name, display=True, engine_options=None, **kwargs):
+        """运行固定分析报表（score_distribution / token_usage_by_priority），返回行 dict 列表"""
+        from .analytics import REPORTS
+        if name not in REPORTS:
+            console.print(f"[red]✗ 未知报表 '{name}'，可选: {', '.join(REPORTS)}[/red]")
+            return []
+        if not self.is_database_exists() and not (engine_options or {}).get("parquet_dir"):
+            console.print(f"[yellow]数据库 '{self.db_path}' 不存在[/yellow]")
+            return []
+        with self.get_analytics(**(engine_options or {})) as analytics:
+            rows = REPORTS[name](analytics, **kwargs)
+        if display:
+            self.display_rows(rows, title=f"分析报表: {name}")
+        return rows
+
+    def display_rows(self, rows, title="查询结果"):
+        """以表格展示行 dict 列表"""
+        if not rows:
+            console.print(Panel("[yellow]暂无数据[/yellow]", title=title, border_style="yellow"))
+            return
+        table = Table(title=title)
+        for key in rows[0]:
+            table.add_column(str(key), style="cyan" if key == next(iter(rows[0])) else "white")
+        for row in rows:
+            table.add_row(*[
+                ", ".join(f"{k}:{v}" for k, v in value.items()) if isinstance(value, dict)
+                else ("-" if value is None else str(value))
+                for value in row.values()
+            ])
+        console.print(table)
+
     def _reset_database(self):
-        """[内部使用] 删除并重新创建数据库（谨慎操作）"""
-        if self.is_database_exists():
-            try:
-                os.remove(self.db_path)
-                console.print(f"[yellow]⚠️ 已删除数据库文件: {self.db_path}[/yellow]")
-            except Exception as e:
-                console.print(f"[red]✗ 删除数据库失败: {e}[/red]")
-                return False
+        """[内部使用] 删除并重新创建数据库（谨慎操作）
+
+        WAL 模式下同时删除 -wal / -shm 文件：残留的 WAL 会被重放到新建的库中
+        """
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+        try:
+            for suffix in ("-wal", "-shm", "-journal", ""):
+                path = self.db_path + suffix
+                if os.path.exists(path):
+                    os.remove(path)
+                    console.print(f"[yellow]⚠️ 已删除数据库文件: {path}[/yellow]")
+        except Exception as e:
+            console.print(f"[red]✗ 删除数据库失败: {e}[/red]")
+            return False
 
         return self.create_database()
 
 
 def main():
-    """主函数"""
+    """主函数：展示数据库信息；重置、导入、导出等操作见 cli.py（python -m src.db.cli --help）"""
     console.print("[bold blue]数据库管理系统 (SQLAlchemy)[/bold blue]", justify="center")
     console.print()
-    
-    db_manager = DatabaseManager()
-    db_manager.display_database_info()
-    db_manager._reset_database()  # 重置数据库（谨慎操作）
+
+    from .cli import main as cli_main
+    return cli_main(["stats"])
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+"""
+SQLite 引擎工厂
+
+所有表单与管理器都通过这里创建引擎，保证每个连接的参数一致：
+- journal_mode=WAL: 读写互不阻塞，后台维护（检查点、增量回收）不会阻塞读
+- synchronous=NORMAL: WAL 模式下安全且减少 fsync
+- busy_timeout: 写锁被占用时等待而不是立即报错
+- auto_vacuum=INCREMENTAL: 对新建的库生效，删除数据后可用 PRAGMA incremental_vacuum 回收空闲页
+  （已有的库需要执行一次 MaintenanceScheduler.enable_incremental_vacuum）
+- foreign_keys=ON: 执行外键约束与 models.py 中声明的 ON DELETE CASCADE / SET NULL。
+  只在表结构版本（PRAGMA user_version）不低于 FOREIGN_KEYS_VERSION 时开启：更早的库的表没有 ON DELETE 子句，
+  开启后删除被引用的行会直接失败，要等 migrations.py 的 foreign_key_actions 迁移重建这些表之后才开启
+  （该迁移只由显式的 cli migrate 执行，启动检查不会执行）。
+  连接每次从连接池取出时检查一次，开启后不再检查
+
+读写分离：create_read_engine 创建只读引擎（mode=ro URI + PRAGMA query_only），
+拥有独立的连接池，长时间的读扫描不占用写引擎的连接；WAL 下读者与写者互不阻塞。
+只读引擎上的每个事务都显式 BEGIN，事务内的多条查询读取同一个快照。
+"""
+
+import os
+import sqlite3
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+from .media_extract import install_media_flush
+
+DEFAULT_BUSY_TIMEOUT_MS = 5000
+# 表结构版本达到该值后（外键带 ON DELETE 子句）才开启外键约束，见 migrations.py
+FOREIGN_KEYS_VERSION = 5
+DEFAULT_READ_POOL_SIZE = min(32, (os.cpu_count() or 1) + 4)
+
+
+def create_sqlite_engine(db_path: str, busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS, **kwargs):
+    """创建带统一 PRAGMA 设置的 SQLite 引擎"""
+    engine = create_engine(f"sqlite:///{db_path}", echo=False, **kwargs)
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        cursor.close()
+
+    @event.listens_for(engine, "checkout")
+    def _enable_foreign_keys(dbapi_connection, connection_record, connection_proxy):
+        # 取出时没有打开的事务，PRAGMA foreign_keys 可以生效；迁移完成前取出的连接在之后的取出中开启
+        if connection_record.info.get("foreign_keys"):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= FOREIGN_KEYS_VERSION:
+            cursor.execute("PRAGMA foreign_keys = ON")
+            connection_record.info["foreign_keys"] = True
+        cursor.close()
+
+    # 写入轨迹时抽出的内联图片在同一事务中写入 media 表
+    install_media_flush(engine)
+    return engine
+
+
+def read_only_uri(db_path: str) -> str:
+    """数据库文件的只读 URI（交给 sqlite3.connect(..., uri=True)），路径做百分号编码"""
+    return f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+
+
+def create_read_engine(
+    db_path: str, pool_size: int = DEFAULT_READ_POOL_SIZE,
+    busy_timeout_ms: int = DEFAULT_BUSY_TIMEOUT_MS, **kwargs
+):
+    """创建只读引擎：mode=ro 打开数据库文件，连接池大小独立配置，事务即快照
+
+    数据库文件还不存在时先用写引擎的设置建出空库（mode=ro 不能创建文件）。
+    文件 URI 由 sqlite3 直接解析：路径经过百分号编码，含空格、#、% 的路径也能打开
+    （不经过 SQLAlchemy 的 URL 解析，它会先把百分号编码解开）。
+    """
+    path = os.path.abspath(db_path)
+    if not os.path.exists(path):
+        writer = create_sqlite_engine(path)
+        with writer.connect():
+            pass
+        writer.dispose()
+    uri = read_only_uri(path)
+    engine = create_engine(
+        "sqlite://", echo=False, poolclass=QueuePool,
+        creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False),
+        pool_size=pool_size, max_overflow=pool_size, **kwargs
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_read_pragmas(dbapi_connection, connection_record):
+        # 由下面的 begin 事件自行发出 BEGIN，关闭 pysqlite 的隐式事务管理
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin_snapshot(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    return engine
@@ -0,0 +1,598 @@
+"""
+目录批量导入
+
+遍历目录树，把查询文本、智能体运行轨迹和交付文件批量写入数据库：
+- 线程池并行读取文件并计算 sha256
+- 进程池并行解析轨迹 JSON
+- 单个写入者按批次在一个事务内写入，并同时写入导入清单 (import_manifest)
+- 轨迹格式错误的运行整个跳过（计入 failed，不写评估与交付文件），下次运行时重新尝试
+- 重复运行时，大小和修改时间未变的文件直接跳过；内容哈希未变的文件不会重复写入，
+  内容变化的文件会更新原有的行，因此中断后可以直接重新运行继续导入
+- 查询按文件（清单）对应到查询行：内容相同的文件共用一行；文件内容变化时只原地更新该文件独占的查询，
+  与其他文件共用、或新内容已属于另一个查询时，改为指向新内容对应的查询，不会改写其他文件的查询
+
+目录约定：
+    <root>/
+      queries/**/*.txt                          -> query_form.detail_query
+      runs/<查询键或查询ID>/<agent>/
+          trajectory.json                       -> evaluation_form.trajectory
+          report.md                             -> evaluation_form.report_content
+          deliverables/**                       -> files_form (file_type=deliverable)
+
+查询键是查询文件相对 queries/ 的路径去掉扩展名（queries/a/q1.txt 的键为 a/q1，对应 runs/a/q1/<agent>/），
+不同子目录下的同名文件互不冲突。
+
+用法（在 backend 目录下）：
+    python -m src.db.importer /path/to/root --db app.db --username admin
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import insert, update, select, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, Table, lazy_console
+
+from .engine import create_sqlite_engine
+from .migrations import MigrationRunner
+from .models import UserModel, QueryModel, EvaluationModel, FilesModel, ImportManifestModel, compute_query_hash
+from .trajectory_schema import normalize_trajectory_json
+from .upsert import upsert_rows
+
+console = lazy_console()
+
+QUERY_SUFFIXES = (".txt", ".md")
+TRAJECTORY_NAME = "trajectory.json"
+REPORT_NAME = "report.md"
+DELIVERABLES_DIR = "deliverables"
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _read_and_hash(path: str):
+    """读取文件并计算 sha256（在线程池中执行）"""
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()
+
+
+def _query_key(folder: str, path: str) -> str:
+    """查询文件相对查询目录的路径（不含扩展名，分隔符统一为 /）"""
+    return os.path.splitext(os.path.relpath(path, folder))[0].replace(os.sep, "/")
+
+
+def _find_runs(folder: str) -> list:
+    """返回 [(查询键, agent, 运行目录)]
+
+    运行目录是 runs/ 下至少两层深、包含轨迹/报告/交付目录或没有子目录的目录，
+    其上级目录相对 runs/ 的路径即查询键
+    """
+    runs = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, folder)
+        if rel == "." or os.sep not in rel:
+            continue
+        if TRAJECTORY_NAME in filenames or REPORT_NAME in filenames or DELIVERABLES_DIR in dirnames or not dirnames:
+            dirnames[:] = []  # 不再进入运行目录内部
+            query_key, agent = os.path.split(rel)
+            runs.append((query_key.replace(os.sep, "/"), agent, os.path.abspath(dirpath)))
+    return runs
+
+
+def _parse_trajectory(data: bytes) -> str:
+    """解析、校验并规范化轨迹 JSON（在进程池中执行），返回紧凑的 JSON 文本
+
+    格式错误时抛出 TrajectoryValidationError（ValueError 子类），见 trajectory_schema.py
+    """
+    return normalize_trajectory_json(data)
+
+
+class DirectoryImporter:
+    """目录导入器"""
+
+    def __init__(
+        self, db_path: str = "app.db", creator_id: int = None, priority: int = 1,
+        batch_size: int = 500, io_workers: int = 8, parse_workers: int = None, progress=None
+    ):
+        """
+        Args:
+            db_path: 数据库路径
+            creator_id: 导入查询的创建人ID
+            priority: 导入查询的优先级
+            batch_size: 每个写入事务包含的文件/运行数
+            io_workers: 读取与哈希的线程数
+            parse_workers: 解析轨迹的进程数，0 表示在当前进程解析，None 表示 CPU 核数
+            progress: 进度回调 progress(kind, done, total)，每写完一批调用一次，kind 为 "queries" 或 "runs"
+        """
+        self.db_path = db_path
+        self.creator_id = creator_id
+        self.priority = priority
+        self.batch_size = batch_size
+        self.io_workers = io_workers
+        self.parse_workers = parse_workers
+        self.progress = progress
+        self.engine = create_sqlite_engine(db_path)
+        MigrationRunner(db_path, engine=self.engine).ensure()
+        self.manifest = {}
+        self.query_refs = Counter()
+        self.stats = {}
+        self.errors = []
+
+    # ---------- 入口 ----------
+
+    def import_directory(self, root: str) -> dict:
+        """导入 root/queries 与 root/runs"""
+        start = time.perf_counter()
+        self._reset_stats()
+        queries_dir = os.path.join(root, "queries")
+        runs_dir = os.path.join(root, "runs")
+        if os.path.isdir(queries_dir):
+            self._import_queries(queries_dir)
+        if os.path.isdir(runs_dir):
+            self._import_runs(runs_dir)
+        return self._finish(start)
+
+    def import_queries(self, folder: str) -> dict:
+        """只导入查询文本"""
+        start = time.perf_counter()
+        self._reset_stats()
+        self._import_queries(folder)
+        return self._finish(start)
+
+    def import_runs(self, folder: str) -> dict:
+        """只导入运行目录（轨迹、报告与交付文件）"""
+        start = time.perf_counter()
+        self._reset_stats()
+        self._import_runs(folder)
+        return self._finish(start)
+
+    # ---------- 查询 ----------
+
+    def _import_queries(self, folder: str):
+        paths = sorted(
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(folder)
+            for name in names
+            if name.endswith(QUERY_SUFFIXES)
+        )
+        self.stats["scanned"] += len(paths)
+        keys = {os.path.abspath(path): _query_key(folder, path) for path in paths}
+        self._refresh_keys(keys)
+        pending = [path for path in keys if not self._unchanged(path)]
+
+        with ThreadPoolExecutor(max_workers=self.io_workers) as pool:
+            for done, batch in self._chunks(pending):
+                loaded = self._load(pool, batch)
+                try:
+                    with self.engine.begin() as conn:
+                        manifest_rows = self._write_queries(conn, loaded, keys)
+                except SQLAlchemyError as e:
+                    self._fail(batch, e)
+                else:
+                    self._remember(manifest_rows)
+                self._report("queries", done, len(pending))
+
+    def _write_queries(self, conn, loaded: dict, keys: dict):
+        rows, new_paths, manifest_rows = [], [], []
+        for path, (data, digest) in loaded.items():
+            known = self.manifest.get(path)
+            if known and known["sha256"] == digest:
+                manifest_rows.append(self._manifest_row(path, "query", digest, known["target_id"], "query_form", keys[path]))
+                self.stats["skipped"] += 1
+                continue
+            content = data.decode("utf-8", errors="replace").strip()
+            if not content:
+                self.errors.append((path, "文件内容为空"))
+                self.stats["failed"] += 1
+                continue
+            if known:
+                query_id = self._update_query(conn, known["target_id"], content)
+                manifest_rows.append(self._manifest_row(path, "query", digest, query_id, "query_form", keys[path]))
+                self.stats["updated"] += 1
+            else:
+                rows.append({
+                    "detail_query": content,
+                    "creator_id": self.creator_id,
+                    "priority": self.priority,
+                    "created_at": _now(),
+                })
+                new_paths.append((path, digest))
+            self.stats["bytes"] += len(data)
+
+        if rows:
+            # 内容相同的查询文件（不同路径或库中已有）按内容哈希合并为同一行，只有新插入的行计入 imported
+            table = QueryModel.__table__
+            hashes = {compute_query_hash(row["detail_query"]) for row in rows}
+            existing = set(conn.execute(select(table.c.id).where(table.c.content_hash.in_(hashes))).scalars())
+            ids = upsert_rows(conn, QueryModel, rows, update_columns=())
+            for (path, digest), new_id in zip(new_paths, ids):
+                manifest_rows.append(self._manifest_row(path, "query", digest, new_id, "query_form", keys[path]))
+            self.stats["imported"] += len(set(ids) - existing)
+        self._write_manifest(conn, manifest_rows)
+        return manifest_rows
+
+    def _update_query(self, conn, query_id: int, content: str) -> int:
+        """查询文件内容变化，返回该文件应指向的查询ID
+
+        只被这一个文件引用的查询原地更新（UPDATE OR IGNORE：新内容已属于另一个查询时不报错也不更新）；
+        与其他文件共用的查询保持不变。没有原地更新时按内容 upsert，指向新内容对应的（新的或已有的）查询
+        """
+        table = QueryModel.__table__
+        if self.query_refs[query_id] <= 1:
+            updated = conn.execute(
+                update(table).prefix_with("OR IGNORE")
+                .where(table.c.id == query_id)
+                .values(detail_query=content, content_hash=compute_query_hash(content), updated_at=_now())
+            ).rowcount
+            if updated:
+                return query_id
+        row = {"detail_query": content, "creator_id": self.creator_id, "priority": self.priority, "created_at": _now()}
+        return upsert_rows(conn, QueryModel, [row], update_columns=())[0]
+
+    # ---------- 运行 ----------
+
+    def _import_runs(self, folder: str):
+        runs = _find_runs(folder)
+
+        parse_pool = None
+        if self.parse_workers != 0:
+            parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        try:
+            with ThreadPoolExecutor(max_workers=self.io_workers) as pool:
+                for done, batch in self._chunks(runs):
+                    self._import_run_batch(batch, pool, parse_pool)
+                    self._report("runs", done, len(runs))
+        finally:
+            if parse_pool:
+                parse_pool.shutdown()
+
+    def _run_files(self, run_dir: str) -> dict:
+        """返回运行目录下需要导入的文件 {路径: 类型}"""
+        files = {}
+        for name, kind in ((TRAJECTORY_NAME, "trajectory"), (REPORT_NAME, "report")):
+            path = os.path.join(run_dir, name)
+            if os.path.isfile(path):
+                files[path] = kind
+        deliverables_dir = os.path.join(run_dir, DELIVERABLES_DIR)
+        for dirpath, _, names in os.walk(deliverables_dir):
+            for name in sorted(names):
+                files[os.path.join(dirpath, name)] = "deliverable"
+        return files
+
+    def _import_run_batch(self, batch: list, pool, parse_pool):
+        run_files = {run_dir: self._run_files(run_dir) for _, _, run_dir in batch}
+        all_files = [path for files in run_files.values() for path in files]
+        self.stats["scanned"] += len(all_files)
+        pending = [path for path in all_files if not self._unchanged(path)]
+        loaded = self._load(pool, pending)
+
+        # 解析内容有变化的轨迹
+        trajectories = {}
+        to_parse = [
+            path for path, (_, digest) in loaded.items()
+            if path.endswith(TRAJECTORY_NAME)
+            and (self.manifest.get(path) or {}).get("sha256") != digest
+        ]
+        if parse_pool:
+            futures = {path: parse_pool.submit(_parse_trajectory, loaded[path][0]) for path in to_parse}
+            results = {}
+            for path, future in futures.items():
+                try:
+                    results[path] = future.result()
+                except ValueError as e:
+                    results[path] = e
+        else:
+            results = {}
+            for path in to_parse:
+                try:
+                    results[path] = _parse_trajectory(loaded[path][0])
+                except ValueError as e:
+                    results[path] = e
+        failed_runs = set()
+        for path, result in results.items():
+            if isinstance(result, Exception):
+                self.errors.append((path, f"轨迹解析失败: {result}"))
+                self.stats["failed"] += 1
+                failed_runs.add(os.path.dirname(path))
+            else:
+                trajectories[path] = result
+        # 轨迹格式错误的运行整个跳过（与 RunExecutor 一致）：不写评估与交付文件，也不记入清单，下次重新导入
+        for run_dir in failed_runs:
+            for path in run_files[run_dir]:
+                loaded.pop(path, None)
+        batch = [run for run in batch if run[2] not in failed_runs]
+
+        try:
+            with self.engine.begin() as conn:
+                manifest_rows = self._write_runs(conn, batch, run_files, loaded, trajectories)
+        except SQLAlchemyError as e:
+            self._fail(all_files, e)
+        else:
+            self._remember(manifest_rows)
+
+    def _write_runs(self, conn, batch, run_files, loaded, trajectories):
+        manifest_rows = []
+        new_runs, new_rows = [], []
+        evaluation_ids = {}
+
+        for query_key, agent, run_dir in batch:
+            values = {}
+            for path, kind in run_files[run_dir].items():
+                if kind == "trajectory" and path in trajectories:
+                    values["trajectory"] = trajectories[path]
+                elif kind == "report" and path in loaded:
+                    data, digest = loaded[path]
+                    if (self.manifest.get(path) or {}).get("sha256") != digest:
+                        values["report_content"] = data.decode("utf-8", errors="replace")
+
+            known = self.manifest.get(run_dir)
+            if known:
+                evaluation_ids[run_dir] = known["target_id"]
+                if values:
+                    values["updated_at"] = _now()
+                    conn.execute(
+                        update(EvaluationModel.__table__)
+                        .where(EvaluationModel.__table__.c.id == known["target_id"])
+                        .values(**values)
+                    )
+                    self.stats["updated"] += 1
+                continue
+
+            query_id = self._resolve_query(conn, query_key)
+            if query_id is None:
+                self.errors.append((run_dir, f"查询 '{query_key}' 未导入"))
+                self.stats["failed"] += 1
+                for path in run_files[run_dir]:
+                    loaded.pop(path, None)
+                continue
+            new_runs.append(run_dir)
+            new_rows.append({
+                "query_id": query_id,
+                "agent": agent,
+                "trajectory": values.get("trajectory"),
+                "report_content": values.get("report_content"),
+                "created_at": _now(),
+            })
+
+        if new_rows:
+            ids = self._insert_returning(conn, EvaluationModel, new_rows)
+            for run_dir, new_id in zip(new_runs, ids):
+                evaluation_ids[run_dir] = new_id
+                manifest_rows.append(self._manifest_row(run_dir, "run", None, new_id, "evaluation_form"))
+            self.stats["imported"] += len(new_rows)
+
+        # 轨迹/报告写入评估行本身，交付文件写入 files_form
+        file_rows, file_paths = [], []
+        for _, _, run_dir in batch:
+            if run_dir not in evaluation_ids:
+                continue
+            evaluation_id = evaluation_ids[run_dir]
+            for path, kind in run_files[run_dir].items():
+                if path not in loaded:
+                    continue
+                data, digest = loaded[path]
+                known = self.manifest.get(path)
+                if known and known["sha256"] == digest:
+                    manifest_rows.append(self._manifest_row(path, kind, digest, known["target_id"], known["target_table"]))
+                    self.stats["skipped"] += 1
+                    continue
+                self.stats["bytes"] += len(data)
+                if kind != "deliverable":
+                    manifest_rows.append(self._manifest_row(path, kind, digest, evaluation_id, "evaluation_form"))
+                    continue
+                if known:
+                    conn.execute(
+                        update(FilesModel.__table__)
+                        .where(FilesModel.__table__.c.id == known["target_id"])
+                        .values(content=data, file_size=len(data), updated_at=_now())
+                    )
+                    manifest_rows.append(self._manifest_row(path, kind, digest, known["target_id"], "files_form"))
+                    self.stats["updated"] += 1
+                    continue
+                file_rows.append({
+                    "evaluation_id": evaluation_id,
+                    "filename": os.path.relpath(path, os.path.join(run_dir, DELIVERABLES_DIR)),
+                    "content": data,
+                    "file_type": "deliverable",
+                    "file_size": len(data),
+                    "created_at": _now(),
+                })
+                file_paths.append((path, digest))
+
+        if file_rows:
+            ids = self._insert_returning(conn, FilesModel, file_rows)
+            for (path, digest), new_id in zip(file_paths, ids):
+                manifest_rows.append(self._manifest_row(path, "deliverable", digest, new_id, "files_form"))
+            self.stats["imported"] += len(file_rows)
+        self._write_manifest(conn, manifest_rows)
+        return manifest_rows
+
+    def _resolve_query(self, conn, query_key: str):
+        """运行目录的上级路径对应查询键（查询文件相对 queries/ 的路径，不含扩展名），或直接是查询ID"""
+        table = ImportManifestModel.__table__
+        query_id = conn.execute(
+            select(table.c.target_id)
+            .where(table.c.kind == "query", table.c.key == query_key)
+            .order_by(table.c.imported_at.desc())
+        ).scalar()
+        if query_id is None and query_key.isdigit():
+            query_id = conn.execute(
+                select(QueryModel.__table__.c.id).where(QueryModel.__table__.c.id == int(query_key))
+            ).scalar()
+        return query_id
+
+    # ---------- 清单与工具方法 ----------
+
+    def _reset_stats(self):
+        self.stats = {"scanned": 0, "imported": 0, "updated": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        self.errors = []
+        table = ImportManifestModel.__table__
+        with self.engine.connect() as conn:
+            self.manifest = {row.path: row._asdict() for row in conn.execute(select(table))}
+        self.query_refs = Counter(row["target_id"] for row in self.manifest.values() if row["kind"] == "query")
+
+    def _unchanged(self, path: str) -> bool:
+        """大小和修改时间都与清单一致时不再读取文件"""
+        known = self.manifest.get(path)
+        if not known:
+            return False
+        stat = os.stat(path)
+        if known["file_size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            self.stats["skipped"] += 1
+            return True
+        return False
+
+    def _load(self, pool, paths: list) -> dict:
+        loaded = {}
+        for path, result in zip(paths, pool.map(self._safe_read, paths)):
+            if isinstance(result, OSError):
+                self.errors.append((path, f"读取失败: {result}"))
+                self.stats["failed"] += 1
+            else:
+                loaded[path] = result
+        return loaded
+
+    @staticmethod
+    def _safe_read(path: str):
+        try:
+            return _read_and_hash(path)
+        except OSError as e:
+            return e
+
+    def _chunks(self, items: list):
+        """按批次切分，同时给出截至本批（含）的数量"""
+        for i in range(0, len(items), self.batch_size):
+            batch = items[i:i + self.batch_size]
+            yield i + len(batch), batch
+
+    def _report(self, kind: str, done: int, total: int):
+        if self.progress is not None:
+            self.progress(kind, done, total)
+
+    def _refresh_keys(self, keys: dict):
+        """更新清单中查询键已过时的行（旧版本用文件名作键），未变化的文件不会重写清单"""
+        stale = [
+            {"b_path": path, "b_key": key} for path, key in keys.items()
+            if path in self.manifest and self.manifest[path]["key"] != key
+        ]
+        if not stale:
+            return
+        table = ImportManifestModel.__table__
+        with self.engine.begin() as conn:
+            conn.execute(update(table).where(table.c.path == bindparam("b_path")).values(key=bindparam("b_key")), stale)
+        for row in stale:
+            self.manifest[row["b_path"]]["key"] = row["b_key"]
+
+    def _manifest_row(self, path, kind, digest, target_id, target_table, key=None) -> dict:
+        stat = os.stat(path)
+        return {
+            "path": path,
+            "kind": kind,
+            "key": key,
+            "sha256": digest,
+            "file_size": stat.st_size if kind != "run" else None,
+            "mtime": stat.st_mtime if kind != "run" else None,
+            "target_table": target_table,
+            "target_id": target_id,
+            "imported_at": _now(),
+        }
+
+    def _write_manifest(self, conn, rows: list):
+        if not rows:
+            return
+        stmt = sqlite_insert(ImportManifestModel.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["path"],
+            set_={name: stmt.excluded[name] for name in (
+                "key", "sha256", "file_size", "mtime", "target_id", "target_table", "imported_at"
+            )},
+        )
+        conn.execute(stmt, rows)
+
+    def _remember(self, rows: list):
+        """事务提交后再更新内存中的清单与查询的引用计数"""
+        for row in rows:
+            if row["kind"] == "query":
+                known = self.manifest.get(row["path"])
+                if known:
+                    self.query_refs[known["target_id"]] -= 1
+                self.query_refs[row["target_id"]] += 1
+            self.manifest[row["path"]] = row
+
+    @staticmethod
+    def _insert_returning(conn, model, rows: list) -> list:
+        table = model.__table__
+        result = conn.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+        )
+        return [row.id for row in result]
+
+    def _fail(self, paths: list, error: Exception):
+        console.print(f"[red]✗ 批次写入失败: {error}[/red]")
+        for path in paths:
+            self.errors.append((path, str(error)))
+        self.stats["failed"] += len(paths)
+
+    def _finish(self, start: float) -> dict:
+        self.stats["seconds"] = round(time.perf_counter() - start, 3)
+        self.stats["errors"] = list(self.errors)
+        return self.stats
+
+    def display_stats(self, stats: dict):
+        """展示导入统计"""
+        table = Table(title="导入统计")
+        table.add_column("项目", style="cyan")
+        table.add_column("数量", style="green", justify="right")
+        for key in ("scanned", "imported", "updated", "skipped", "failed"):
+            table.add_row(key, str(stats[key]))
+        seconds = stats["seconds"] or 1e-9
+        table.add_row("MB/s", f"{stats['bytes'] / 1024 / 1024 / seconds:.2f}")
+        table.add_row("耗时(秒)", str(stats["seconds"]))
+        console.print(table)
+        for path, message in stats["errors"][:20]:
+            console.print(f"[red]✗ {path}: {message}[/red]")
+
+    def __del__(self):
+        if hasattr(self, "engine"):
+            self.engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="目录批量导入")
+    parser.add_argument("root", help="导入根目录（包含 queries/ 与 runs/）")
+    parser.add_argument("--db", default="app.db", help="数据库路径")
+    parser.add_argument("--username", default=None, help="查询创建人用户名")
+    parser.add_argument("--priority", type=int, default=1, help="查询优先级")
+    parser.add_argument("--batch-size", type=int, default=500, help="每批写入数量")
+    parser.add_argument("--io-workers", type=int, default=8, help="读取线程数")
+    parser.add_argument("--parse-workers", type=int, default=None, help="解析进程数，0 表示不使用进程池")
+    args = parser.parse_args(argv)
+
+    importer = DirectoryImporter(
+        args.db, priority=args.priority, batch_size=args.batch_size,
+        io_workers=args.io_workers, parse_workers=args.parse_workers,
+    )
+    if args.username:
+        with importer.engine.connect() as conn:
+            importer.creator_id = conn.execute(
+                select(UserModel.__table__.c.id).where(UserModel.__table__.c.username == args.username)
+            ).scalar()
+        if importer.creator_id is None:
+            console.print(f"[red]✗ 用户 {args.username} 不存在[/red]")
+            return 1
+    stats = importer.import_directory(args.root)
+    importer.display_stats(stats)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,66 @@
+"""
+rich 的延迟导入
+
+导入 rich.console / panel / table / progress 约需 45ms，而大多数调用（读写表单、CLI 的非展示命令）并不输出表格。
+这里提供与 rich 同名的占位对象，第一次调用或访问属性时才导入真正的 rich 模块：
+    from .lazy_rich import Console, Table, escape
+    console = Console()          # 此时才导入 rich.console
+    Table.grid(padding=1)        # 类方法同样可用
+
+模块级的全局 console 用 lazy_console()，第一次 console.print 时才创建 Console；作为参数传给 rich 时用 unwrap()。
+占位对象不是类，不能用于 isinstance 判断或继承。
+"""
+
+import importlib
+
+
+class LazyObject:
+    """第一次使用时由 loader() 得到真正的对象，之后的调用与属性访问都转发给它"""
+
+    __slots__ = ("_loader", "_target")
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            self._target = self._loader()
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __repr__(self):
+        return f"<lazy {self._target!r}>" if self._target is not None else "<lazy (未加载)>"
+
+
+def lazy_import(module: str, name: str) -> LazyObject:
+    """module.name 的占位对象"""
+    return LazyObject(lambda: getattr(importlib.import_module(module), name))
+
+
+def lazy_console(**kwargs) -> LazyObject:
+    """模块级 Console 实例的占位对象"""
+    return LazyObject(lambda: Console(**kwargs))
+
+
+def unwrap(value):
+    """作为参数传给 rich 时（如 Progress(console=...)）需要真正的对象"""
+    return value._resolve() if isinstance(value, LazyObject) else value
+
+
+Console = lazy_import("rich.console", "Console")
+Panel = lazy_import("rich.panel", "Panel")
+Table = lazy_import("rich.table", "Table")
+Text = lazy_import("rich.text", "Text")
+escape = lazy_import("rich.markup", "escape")
+Progress = lazy_import("rich.progress", "Progress")
+TextColumn = lazy_import("rich.progress", "TextColumn")
+BarColumn = lazy_import("rich.progress", "BarColumn")
+TaskProgressColumn = lazy_import("rich.progress", "TaskProgressColumn")
+MofNCompleteColumn = lazy_import("rich.progress", "MofNCompleteColumn")
+TimeElapsedColumn = lazy_import("rich.progress", "TimeElapsedColumn")
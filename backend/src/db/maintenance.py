@@ -0,0 +1,353 @@
+"""
+在线维护
+
+后台按计划执行数据库维护，不阻塞读者（依赖 engine.py 中开启的 WAL）：
+- 增量回收: PRAGMA incremental_vacuum，每次只回收少量页并短暂持有写锁，分多步完成
+- 统计更新: ANALYZE（默认带 analysis_limit 的近似分析），并对比前后常用查询的执行计划（只做 EXPLAIN QUERY PLAN，不执行查询）
+- WAL 检查点: PRAGMA wal_checkpoint(PASSIVE)，不等待读者
+- 完整性检查: PRAGMA quick_check / integrity_check
+
+用法：
+    scheduler = MaintenanceScheduler("app.db", vacuum_interval=600)
+    scheduler.start()      # 后台线程
+    ...
+    scheduler.stop()
+
+    # 或者只执行一次到期任务
+    scheduler.run_pending()
+
+可用方法
+get_space_info
+enable_incremental_vacuum
+run_incremental_vacuum
+run_full_vacuum
+run_analyze
+run_checkpoint
+run_integrity_check
+run_pending
+start
+stop
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, Table, lazy_console
+
+from .engine import create_sqlite_engine
+
+console = lazy_console()
+
+# 用于观察 ANALYZE 前后执行计划变化的代表性查询
+PLANNER_PROBES = {
+    "evaluations_by_query": "SELECT id FROM evaluation_form WHERE query_id = 1",
+    "evaluations_by_evaluator": "SELECT id FROM evaluation_form WHERE evaluator_id = 1",
+    "evaluations_by_agent": "SELECT id FROM evaluation_form WHERE agent = 'agent'",
+    "files_by_evaluation": "SELECT id FROM files_form WHERE evaluation_id = 1",
+    "files_by_type": "SELECT id FROM files_form WHERE file_type = 'report'",
+    "queries_by_creator": "SELECT id FROM query_form WHERE creator_id = 1",
+}
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class MaintenanceScheduler:
+    """在线维护调度器"""
+
+    def __init__(
+        self, db_path: str = "app.db", vacuum_interval: float = 600,
+        analyze_interval: float = 3600, checkpoint_interval: float = 300,
+        integrity_interval: float = 86400, vacuum_step_pages: int = 256,
+        vacuum_step_sleep: float = 0.05, min_free_ratio: float = 0.05,
+        analysis_limit: int = 1000
+    ):
+        """
+        Args:
+            db_path: 数据库路径
+            *_interval: 各任务的执行间隔（秒），None 表示不调度该任务
+            vacuum_step_pages: 每一步回收的页数，越小持有写锁的时间越短
+            vacuum_step_sleep: 两步之间的休眠（秒），给其他写入者让出写锁
+            min_free_ratio: 空闲页比例低于该值时跳过回收
+            analysis_limit: 近似 ANALYZE 时每个索引最多检查的行数
+        """
+        self.db_path = db_path
+        self.intervals = {
+            "vacuum": vacuum_interval,
+            "analyze": analyze_interval,
+            "checkpoint": checkpoint_interval,
+            "integrity": integrity_interval,
+        }
+        self.vacuum_step_pages = vacuum_step_pages
+        self.vacuum_step_sleep = vacuum_step_sleep
+        self.min_free_ratio = min_free_ratio
+        self.analysis_limit = analysis_limit
+        self.engine = create_sqlite_engine(db_path)
+        self.history = []
+        self._last_run = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ---------- 空间信息 ----------
+
+    def get_space_info(self) -> dict:
+        """页大小、总页数、空闲页数、auto_vacuum 模式，以及主文件与 WAL 文件的大小"""
+        with self.engine.connect() as conn:
+            page_size = conn.execute(text("PRAGMA page_size")).scalar()
+            page_count = conn.execute(text("PRAGMA page_count")).scalar()
+            freelist = conn.execute(text("PRAGMA freelist_count")).scalar()
+            auto_vacuum = conn.execute(text("PRAGMA auto_vacuum")).scalar()
+        return {
+            "page_size": page_size,
+            "page_count": page_count,
+            "freelist_count": freelist,
+            "free_bytes": freelist * page_size,
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, str(auto_vacuum)),
+            "file_size": _file_size(self.db_path),
+            "wal_size": _file_size(self.db_path + "-wal"),
+        }
+
+    def enable_incremental_vacuum(self) -> bool:
+        """把已有的库切换为 auto_vacuum=INCREMENTAL（需要一次完整 VACUUM，会阻塞写入，只需执行一次）"""
+        try:
+            if self.get_space_info()["auto_vacuum"] == "incremental":
+                return True
+            with self.engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+                conn.execute(text("VACUUM"))
+            console.print("[green]✓ 已开启增量回收 (auto_vacuum=INCREMENTAL)[/green]")
+            return True
+        except SQLAlchemyError as e:
+            console.print(f"[red]✗ 开启增量回收失败: {e}[/red]")
+            return False
+
+    # ---------- 维护任务 ----------
+
+    def run_incremental_vacuum(self, max_pages: int = None) -> dict:
+        """分步回收空闲页，返回回收的页数与字节数
+
+        文件大小为主文件与 WAL 文件之和；先做一次检查点，最近的写入不会只算在回收之后
+        """
+        start = time.perf_counter()
+        self.run_checkpoint()
+        before = self.get_space_info()
+        report = {"task": "vacuum", "started_at": _now(), "skipped": None}
+
+        if before["auto_vacuum"] != "incremental":
+            report["skipped"] = "auto_vacuum 不是 incremental，请先执行 enable_incremental_vacuum"
+        elif before["page_count"] and before["freelist_count"] / before["page_count"] < self.min_free_ratio:
+            report["skipped"] = "空闲页比例低于阈值"
+        else:
+            remaining = before["freelist_count"] if max_pages is None else min(max_pages, before["freelist_count"])
+            while remaining > 0 and not self._stop_event.is_set():
+                step = min(self.vacuum_step_pages, remaining)
+                with self.engine.connect() as conn:
+                    # sqlite3 的 execute 只会 step 一次（只回收一页），executescript 会执行到结束
+                    conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({step});")
+                remaining -= step
+                if remaining > 0:
+                    time.sleep(self.vacuum_step_sleep)
+            self.run_checkpoint()
+
+        after = self.get_space_info()
+        freed = before["freelist_count"] - after["freelist_count"]
+        report.update({
+            "freed_pages": freed,
+            "bytes_reclaimed": freed * before["page_size"],
+            "file_size_before": before["file_size"] + before["wal_size"],
+            "file_size_after": after["file_size"] + after["wal_size"],
+            "seconds": round(time.perf_counter() - start, 3),
+        })
+        return self._record(report)
+
+    def run_full_vacuum(self) -> dict:
+        """完整 VACUUM：重写整个库并整理碎片（期间阻塞写入，只适合手动执行），报告格式同 run_incremental_vacuum"""
+        start = time.perf_counter()
+        # WAL 模式下最近的写入与 VACUUM 的结果都先进入 WAL，前后各做一次截断检查点，文件大小才可比
+        self.run_checkpoint("TRUNCATE")
+        before = self.get_space_info()
+        with self.engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+        self.run_checkpoint("TRUNCATE")
+        after = self.get_space_info()
+        freed = before["page_count"] - after["page_count"]
+        report = {
+            "task": "vacuum",
+            "started_at": _now(),
+            "skipped": None,
+            "mode": "full",
+            "freed_pages": freed,
+            "bytes_reclaimed": freed * before["page_size"],
+            "file_size_before": before["file_size"] + before["wal_size"],
+            "file_size_after": after["file_size"] + after["wal_size"],
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return self._record(report)
+
+    def run_analyze(self, full: bool = False) -> dict:
+        """更新查询规划器统计信息，并对比前后执行计划
+
+        Args:
+            full: True 执行完整 ANALYZE，否则设置 analysis_limit 做近似分析（大表上快得多）
+        """
+        start = time.perf_counter()
+        before = self._probe_planner()
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.execute(text(f"PRAGMA analysis_limit = {0 if full else self.analysis_limit}"))
+            conn.execute(text("ANALYZE"))
+        after = self._probe_planner()
+
+        probes = {}
+        for name in before:
+            probes[name] = {
+                "plan_before": before[name],
+                "plan_after": after[name],
+                "plan_changed": before[name] != after[name],
+            }
+        report = {
+            "task": "analyze",
+            "started_at": _now(),
+            "mode": "full" if full else f"limit={self.analysis_limit}",
+            "plans_changed": sum(1 for probe in probes.values() if probe["plan_changed"]),
+            "probes": probes,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return self._record(report)
+
+    def run_checkpoint(self, mode: str = "PASSIVE") -> dict:
+        """WAL 检查点；PASSIVE 不等待读者也不阻塞写者"""
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"无效的检查点模式: {mode}")
+        start = time.perf_counter()
+        with self.engine.connect() as conn:
+            busy, log_pages, checkpointed = conn.execute(text(f"PRAGMA wal_checkpoint({mode})")).one()
+        report = {
+            "task": "checkpoint",
+            "started_at": _now(),
+            "mode": mode,
+            "busy": bool(busy),
+            "wal_pages": log_pages,
+            "checkpointed_pages": checkpointed,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return self._record(report)
+
+    def run_integrity_check(self, quick: bool = True) -> dict:
+        """完整性检查；quick_check 跳过索引内容校验，速度快得多"""
+        start = time.perf_counter()
+        pragma = "quick_check" if quick else "integrity_check"
+        with self.engine.connect() as conn:
+            messages = [row[0] for row in conn.execute(text(f"PRAGMA {pragma}"))]
+        ok = messages == ["ok"]
+        if not ok:
+            console.print(f"[red]✗ 完整性检查发现问题: {messages[:5]}[/red]")
+        report = {
+            "task": "integrity",
+            "started_at": _now(),
+            "mode": pragma,
+            "ok": ok,
+            "messages": [] if ok else messages,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return self._record(report)
+
+    # ---------- 调度 ----------
+
+    def run_pending(self, force: bool = False) -> list:
+        """执行所有到期的任务（force=True 时全部执行），返回本次的报告"""
+        tasks = {
+            "checkpoint": self.run_checkpoint,
+            "vacuum": self.run_incremental_vacuum,
+            "analyze": self.run_analyze,
+            "integrity": self.run_integrity_check,
+        }
+        reports = []
+        with self._lock:
+            for name, task in tasks.items():
+                interval = self.intervals[name]
+                if interval is None and not force:
+                    continue
+                last = self._last_run.get(name)
+                if force or last is None or time.monotonic() - last >= interval:
+                    try:
+                        reports.append(task())
+                    except SQLAlchemyError as e:
+                        console.print(f"[red]✗ 维护任务 {name} 失败: {e}[/red]")
+                    self._last_run[name] = time.monotonic()
+        return reports
+
+    def start(self, tick: float = 5.0):
+        """启动后台维护线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+
+        def loop():
+            while not self._stop_event.is_set():
+                self.run_pending()
+                self._stop_event.wait(tick)
+
+        self._thread = threading.Thread(target=loop, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """停止后台维护线程（正在进行的增量回收会在当前步结束后退出）"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ---------- 工具方法 ----------
+
+    def _probe_planner(self) -> dict:
+        """每个代表性查询只取一次执行计划；不实际执行，避免在大表上做全表扫描"""
+        results = {}
+        with self.engine.connect() as conn:
+            tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for name, sql in PLANNER_PROBES.items():
+                table = sql.split(" FROM ")[1].split()[0]
+                if table not in tables:
+                    continue
+                plan = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+                results[name] = " | ".join(plan)
+        return results
+
+    def _record(self, report: dict) -> dict:
+        self.history.append(report)
+        del self.history[:-100]
+        return report
+
+    def display_report(self, reports: list):
+        """展示维护报告"""
+        table = Table(title="数据库维护报告")
+        table.add_column("任务", style="cyan")
+        table.add_column("结果", style="white")
+        table.add_column("耗时(秒)", style="green", justify="right")
+        for report in reports:
+            task = report["task"]
+            if task == "vacuum":
+                detail = report["skipped"] or f"回收 {report['freed_pages']} 页 / {report['bytes_reclaimed']:,} 字节"
+            elif task == "analyze":
+                detail = f"{report['mode']}，执行计划变化 {report['plans_changed']} 个"
+            elif task == "checkpoint":
+                detail = f"{report['mode']}，写回 {report['checkpointed_pages']}/{report['wal_pages']} 页"
+            else:
+                detail = "ok" if report["ok"] else f"发现 {len(report['messages'])} 个问题"
+            table.add_row(task, detail, str(report["seconds"]))
+        console.print(table)
+
+    def __del__(self):
+        if hasattr(self, "engine"):
+            self.engine.dispose()
@@ -0,0 +1,169 @@
+"""
+轨迹内联图片抽取
+
+轨迹消息中的图片以 data URI 内联（{"type": "image_url", "image_url": {"url": "data:image/png;base64,..."}}），
+单张就有数百 KB，且在每一步的历史里重复出现。写入轨迹时把图片解码后按 sha256 存入 media 表
+（内容寻址，相同图片只存一份），JSON 中的 url 改写为 MEDIA_URL_PREFIX + sha256，
+轨迹文本因此保持很小，图片由 MediaStore 单独提供并可长期缓存。
+
+抽取发生在 trajectory_store.pack_trajectory_text 中：
+- TrajectoryText 列的写入处理：install_media_flush 为写引擎注册的事件在每条语句开始执行时为该引擎
+  开启收集，绑定参数时抽出的图片在这条语句执行后、同一连接同一事务中写入 media 表，语句结束即停止收集，
+  因此 ORM、Core、批量写入、upsert 都无需额外处理。没有注册事件的引擎（只读引擎、普通 create_engine）
+  写入时不抽取，图片保留为内联 data URI，之后可用 MediaStore.extract_existing 回填。
+- 显式调用（轨迹文件内容）：调用方传入 media 字典收集图片，再用 write_media 在写入内容的同一事务中写入。
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+MEDIA_URL_PREFIX = "/media/"
+DATA_URI_MARKER = "data:"
+DATA_URI_RE = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+)?(?P<params>(;[\w.+-]+=[\w.+-]+)*);base64,(?P<data>.*)$", re.S)
+MEDIA_REF_RE = re.compile(r"^" + re.escape(MEDIA_URL_PREFIX) + r"(?P<sha>[0-9a-f]{64})$")
+
+MEDIA_INSERT_SQL = (
+    "INSERT OR IGNORE INTO media (sha256, mime_type, content, byte_size, created_at) VALUES (?, ?, ?, ?, ?)"
+)
+
+_collecting = threading.local()
+
+
+def _rewrite_image_urls(node, rewrite):
+    """对 node 中每个 image_url（{"url": ...} 或字符串）执行 rewrite(url) -> url"""
+    if isinstance(node, dict):
+        image = node.get("image_url")
+        if isinstance(image, dict) and "url" in image:
+            image["url"] = rewrite(image["url"])
+        elif isinstance(image, str):
+            node["image_url"] = rewrite(image)
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                _rewrite_image_urls(value, rewrite)
+    elif isinstance(node, list):
+        for value in node:
+            if isinstance(value, (dict, list)):
+                _rewrite_image_urls(value, rewrite)
+
+
+def extract_images(doc) -> dict:
+    """把 doc 中所有 image_url 的 data URI 替换为媒体引用（原地修改），返回 {sha256: (mime, bytes)}"""
+    media = {}
+
+    def replace(url):
+        match = DATA_URI_RE.match(url) if isinstance(url, str) else None
+        if not match:
+            return url
+        try:
+            data = base64.b64decode(match.group("data"), validate=False)
+        except (binascii.Error, ValueError):
+            return url
+        digest = hashlib.sha256(data).hexdigest()
+        media[digest] = (match.group("mime") or "application/octet-stream", data)
+        return MEDIA_URL_PREFIX + digest
+
+    _rewrite_image_urls(doc, replace)
+    return media
+
+
+def media_refs(text) -> set:
+    """文本中引用的全部媒体 sha256"""
+    if not text or MEDIA_URL_PREFIX not in text:
+        return set()
+    return set(re.findall(re.escape(MEDIA_URL_PREFIX) + r"([0-9a-f]{64})", text))
+
+
+def inline_images(doc, lookup) -> int:
+    """extract_images 的逆操作：把媒体引用还原为 data URI（原地修改），lookup(sha) -> (mime, bytes) 或 None"""
+    count = 0
+
+    def restore(url):
+        nonlocal count
+        match = MEDIA_REF_RE.match(url) if isinstance(url, str) else None
+        if not match:
+            return url
+        found = lookup(match.group("sha"))
+        if found is None:
+            return url
+        count += 1
+        mime, data = found
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+    _rewrite_image_urls(doc, restore)
+    return count
+
+
+def inline_images_text(text, lookup):
+    """对 JSON 文本执行 inline_images，没有引用时原样返回"""
+    if not media_refs(text):
+        return text
+    doc = json.loads(text)
+    inline_images(doc, lookup)
+    return json.dumps(doc, ensure_ascii=False)
+
+
+# ---------- 收集与写入 ----------
+
+def _collectors() -> dict:
+    if not hasattr(_collecting, "by_dialect"):
+        _collecting.by_dialect = {}
+    return _collecting.by_dialect
+
+
+def media_collector(dialect):
+    """本线程上该引擎（按 dialect 实例区分）正在执行的语句的图片收集字典；不在执行中时返回 None"""
+    return _collectors().get(dialect)
+
+
+def media_rows(media: dict) -> list:
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return [
+        (digest, mime, data, len(data), now)
+        for digest, (mime, data) in media.items()
+    ]
+
+
+def write_media(conn, media: dict):
+    """在 conn 当前的事务中写入显式收集的图片（已存在的 sha256 跳过）"""
+    if media:
+        conn.exec_driver_sql(MEDIA_INSERT_SQL, media_rows(media))
+
+
+def install_media_flush(engine):
+    """为写引擎注册事件：语句执行期间收集绑定参数中抽出的图片，执行成功后在同一连接与事务中写入"""
+    from sqlalchemy import event
+    from sqlalchemy.exc import OperationalError
+
+    dialect = engine.dialect
+
+    @event.listens_for(engine, "before_execute")
+    def _collect_media(conn, clauseelement, multiparams, params, execution_options):
+        # 绑定参数在 before_execute 之后处理；之前失败的语句残留的收集字典在这里被替换
+        _collectors()[dialect] = {}
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _flush_media(conn, cursor, statement, parameters, context, executemany):
+        media = _collectors().get(dialect)
+        if not media:
+            return
+        rows = media_rows(media)
+        media.clear()
+        try:
+            cursor.connection.executemany(MEDIA_INSERT_SQL, rows)
+        except sqlite3.Error as e:
+            # 包装为 SQLAlchemy 异常，调用方按统一的 SQLAlchemyError 处理并回滚
+            raise OperationalError(MEDIA_INSERT_SQL, None, e) from e
+
+    @event.listens_for(engine, "after_execute")
+    def _stop_collecting(conn, clauseelement, multiparams, params, execution_options, result):
+        _collectors().pop(dialect, None)
+
+    @event.listens_for(engine, "handle_error")
+    def _drop_media(exception_context):
+        _collectors().pop(dialect, None)
@@ -0,0 +1,182 @@
+"""
+媒体存储
+
+轨迹中抽出的内联图片（见 media_extract.py）按 sha256 存在 media 表。
+内容寻址意味着同一个地址的内容永远不变，可以用 immutable 长缓存提供给前端：
+    status, headers, body = store.get_media_response(sha256, if_none_match=request_etag)
+
+可用方法
+get_media
+get_media_response
+inline_trajectory
+extract_existing
+prune_unreferenced
+"""
+
+from sqlalchemy import select, update, delete, func, exists, literal, cast, or_, Text
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console
+
+from .base_form import BaseForm
+from .media_extract import MEDIA_URL_PREFIX, DATA_URI_MARKER, media_refs, inline_images_text, write_media
+from .models import MediaModel, EvaluationModel, FilesModel
+from .trajectory_store import pack_trajectory_bytes
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class MediaStore(BaseForm):
+    """媒体存储管理器"""
+
+    def __init__(self, db_path="app.db"):
+        super().__init__(db_path, MediaModel)
+
+    def get_media(self, sha256: str):
+        """返回 (mime_type, content)，不存在时返回 None"""
+        try:
+            with self.read_engine.connect() as conn:
+                row = conn.execute(
+                    select(MediaModel.mime_type, MediaModel.content).where(MediaModel.sha256 == sha256)
+                ).first()
+            return (row.mime_type, row.content) if row else None
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 获取媒体失败: {e}[/red]")
+            return None
+
+    def get_media_response(self, sha256: str, if_none_match: str = None):
+        """生成 HTTP 响应三元组 (status, headers, body)，支持 ETag 条件请求"""
+        etag = f'"{sha256}"'
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return 304, {"ETag": etag, "Cache-Control": CACHE_CONTROL}, b""
+        media = self.get_media(sha256)
+        if media is None:
+            return 404, {"Cache-Control": "no-store"}, b""
+        mime_type, content = media
+        return 200, {
+            "Content-Type": mime_type,
+            "Content-Length": str(len(content)),
+            "ETag": etag,
+            "Cache-Control": CACHE_CONTROL,
+        }, content
+
+    def inline_trajectory(self, text):
+        """把轨迹文本中的媒体引用还原为 data URI（例如导出给不经过后端的查看器）"""
+        refs = media_refs(text)
+        if not refs:
+            return text
+        with self.read_engine.connect() as conn:
+            rows = conn.execute(
+                select(MediaModel.sha256, MediaModel.mime_type, MediaModel.content).where(MediaModel.sha256.in_(refs))
+            ).all()
+        found = {row.sha256: (row.mime_type, row.content) for row in rows}
+        return inline_images_text(text, found.get)
+
+    def extract_existing(self, batch_size: int = 200) -> dict:
+        """回填：把已有评估轨迹与轨迹文件中的内联图片抽到 media 表，分批提交，返回统计"""
+        stats = {"evaluations": 0, "files": 0, "bytes_before": 0, "bytes_after": 0}
+        evaluation_table = EvaluationModel.__table__
+        files_table = FilesModel.__table__
+        console = Console()
+        try:
+            cursor = 0
+            while True:
+                with self.engine.begin() as conn:
+                    rows = conn.execute(
+                        select(evaluation_table.c.id, evaluation_table.c.trajectory)
+                        .where(evaluation_table.c.id > cursor)
+                        .where(evaluation_table.c.trajectory.contains(DATA_URI_MARKER))
+                        .order_by(evaluation_table.c.id).limit(batch_size)
+                    ).all()
+                    for row in rows:
+                        # TrajectoryText 在写入时抽取图片并压缩
+                        conn.execute(
+                            update(evaluation_table).where(evaluation_table.c.id == row.id)
+                            .values(trajectory=row.trajectory)
+                        )
+                        stats["bytes_before"] += len(row.trajectory)
+                        stats["bytes_after"] += conn.execute(
+                            select(func.length(evaluation_table.c.trajectory)).where(evaluation_table.c.id == row.id)
+                        ).scalar()
+                if not rows:
+                    break
+                stats["evaluations"] += len(rows)
+                cursor = rows[-1].id
+
+            cursor = 0
+            while True:
+                with self.engine.begin() as conn:
+                    rows = conn.execute(
+                        select(files_table.c.id, files_table.c.content)
+                        .where(files_table.c.id > cursor)
+                        .where(files_table.c.file_type == "trajectory")
+                        .order_by(files_table.c.id).limit(batch_size)
+                    ).all()
+                    for row in rows:
+                        if not row.content or DATA_URI_MARKER.encode() not in row.content:
+                            continue
+                        media = {}
+                        packed = pack_trajectory_bytes(row.content, media)
+                        write_media(conn, media)
+                        conn.execute(update(files_table).where(files_table.c.id == row.id).values(content=packed))
+                        stats["files"] += 1
+                        stats["bytes_before"] += len(row.content)
+                        stats["bytes_after"] += len(packed)
+                if not rows:
+                    break
+                cursor = rows[-1].id
+        except SQLAlchemyError as e:
+            console.print(f"[red]✗ 抽取内联图片失败: {e}[/red]")
+            return stats
+
+        console.print(
+            f"[green]✓ 已处理 {stats['evaluations']} 条评估轨迹、{stats['files']} 个轨迹文件，"
+            f"{stats['bytes_before']:,} → {stats['bytes_after']:,} 字节[/green]"
+        )
+        return stats
+
+    def prune_unreferenced(self, batch_size: int = 500) -> int:
+        """删除不再被任何轨迹引用的媒体（需要扫描全部轨迹，适合放在维护窗口），返回删除条数
+
+        先在只读快照中找出候选；删除时在写事务中对每个候选再检查一次当前的轨迹与轨迹文件，
+        扫描之后新写入、引用了已有图片的轨迹（INSERT OR IGNORE 不会新增 media 行）不会被删掉引用的图片
+        """
+        evaluation_table = EvaluationModel.__table__
+        files_table = FilesModel.__table__
+        try:
+            referenced = set()
+            with self.read_session() as session:
+                conn = session.connection()
+                for (text,) in conn.execute(
+                    select(evaluation_table.c.trajectory)
+                    .where(evaluation_table.c.trajectory.contains(MEDIA_URL_PREFIX))
+                ):
+                    referenced |= media_refs(text)
+                for (content,) in conn.execute(
+                    select(files_table.c.content).where(files_table.c.file_type == "trajectory")
+                ):
+                    if content:
+                        referenced |= media_refs(content.decode("utf-8", errors="ignore"))
+                stored = [row[0] for row in conn.execute(select(MediaModel.sha256))]
+
+            orphans = [sha256 for sha256 in stored if sha256 not in referenced]
+            ref = literal(MEDIA_URL_PREFIX) + MediaModel.sha256
+            still_referenced = or_(
+                exists().where(func.instr(evaluation_table.c.trajectory, ref) > 0),
+                exists().where(
+                    files_table.c.file_type == "trajectory", func.instr(cast(files_table.c.content, Text), ref) > 0
+                ),
+            )
+            deleted = 0
+            with self.engine.begin() as conn:
+                for start in range(0, len(orphans), batch_size):
+                    deleted += conn.execute(delete(MediaModel.__table__).where(
+                        MediaModel.sha256.in_(orphans[start:start + batch_size]), ~still_referenced
+                    )).rowcount
+            console = Console()
+            console.print(f"[green]✓ 已清理 {deleted} 个未被引用的媒体[/green]")
+            return deleted
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 清理媒体失败: {e}[/red]")
+            return 0
@@ -0,0 +1,538 @@
+"""
+表结构版本与在线迁移
+
+启动时只读取 PRAGMA user_version（库文件头中的一个整数，不反射任何表）与 SCHEMA_VERSION 比较，
+一致时直接返回；版本落后时才执行迁移：
+- 新建的库：一个事务内 create_all 到最新模型，所有迁移记为已完成
+- 已有的库：按版本号依次执行未执行过的迁移的 DDL（建表、加列、建索引、触发器），每个迁移一个短事务，
+  并在 schema_migrations 中记录
+- 需要改写已有行的迁移提供 backfill：按主键分批执行，每批一个短的写事务，游标与该批写入在同一事务中提交，
+  中断后从游标继续；批次之间释放写锁，其他连接的读写照常进行。回填可以在前台跑完，也可以交给后台线程
+- user_version 只推进到“该版本及之前的迁移全部完成（含回填）”的版本，因此有未完成的回填时
+  下次启动会自动续上，全部完成后启动检查又只剩一次 PRAGMA
+
+新增迁移：修改 models.py 后在 MIGRATIONS 末尾追加 Migration(下一个版本号, 名称, apply, backfill)。
+- 所有迁移的 DDL 先于回填执行，apply 不能依赖之前迁移的回填结果
+- apply 必须幂等（IF NOT EXISTS、先检查列是否存在等）：已有的库执行基线迁移时 create_all 已经补上了
+  当前模型中的可空列与索引
+- SQLite 不能修改已有表的约束（AUTOINCREMENT、外键的 ON DELETE 等），这类迁移用 _rebuild_tables 按当前模型重建表
+  （建新表、复制、删旧表、改名），在一个事务内完成，期间持有写锁
+- 重建大表等需要长时间持有写锁的迁移标记为 manual：启动检查（表单首次使用时的 ensure）在它之前停下，
+  只提示一次，由显式的 `python -m src.db.cli migrate`（ensure(manual=True)）执行；
+  它之前的版本照常推进，user_version 停在它之前，依赖它的功能（如外键约束）保持关闭
+- backfill(conn, cursor, batch_size) 处理游标之后的一批，返回 (新游标, 本批处理的行数)，新游标为 None 表示完成；
+  回填需要能与并发写入共存（只补缺失的值，或由触发器维护新写入的行）
+
+用法：
+    runner = MigrationRunner("app.db")
+    runner.ensure()                          # 启动时调用；backfill="background" 时回填交给后台线程
+    runner.ensure(manual=True)               # 显式迁移：同时执行 manual 迁移（cli migrate）
+    runner.run_backfills(max_seconds=30)     # 前台分批回填，可限定时长
+    runner.start() / runner.stop()           # 后台线程回填
+    runner.display_status()
+
+可用方法
+current_version
+ensure
+repair
+run_backfills
+start
+stop
+get_status
+display_status
+"""
+
+import json
+import re
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateTable
+from .lazy_rich import Table, lazy_console
+
+from .engine import create_sqlite_engine, FOREIGN_KEYS_VERSION
+from .models import Base, ChangeLogModel, SchemaMigrationModel, compute_query_hash, backfill_usage
+from .table_stats import get_row_counts
+
+console = lazy_console()
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Migration:
+    """一个迁移：DDL 与可选的分批回填"""
+
+    def __init__(
+        self, version: int, name: str, apply=None, backfill=None, table: str = None, batch_size: int = None,
+        manual: bool = False
+    ):
+        """
+        Args:
+            apply: apply(conn)，DDL，在持有写锁的事务中执行
+            backfill: backfill(conn, cursor, batch_size) -> (新游标或 None, 本批行数)
+            table: 回填扫描的表，用于估算进度
+            batch_size: 覆盖默认批大小（例如每行较大的表）
+            manual: apply 会长时间持有写锁（如重建大表），只在显式迁移时执行
+        """
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.backfill = backfill
+        self.table = table
+        self.batch_size = batch_size
+        self.manual = manual
+
+    def __repr__(self):
+        return f"<Migration(version={self.version}, name='{self.name}')>"
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ---------- 迁移 ----------
+
+def _create_all(conn):
+    """建表并补上可空列、索引、触发器与统计行（models.py 中 after_create 的各项补建）"""
+    Base.metadata.create_all(conn)
+
+
+def _rebuild_tables(conn, tables):
+    """按当前模型重建表：建新表、复制两边都有的列、删旧表、改名
+
+    被重建的表上的触发器、以及正文中引用这些表的触发器先删除（否则改名时 SQLite 校验触发器会失败），
+    最后由 _create_all 重新安装触发器并补建索引
+    """
+    names = [table.name for table in tables]
+    pattern = re.compile(r"\b(" + "|".join(map(re.escape, names)) + r")\b")
+    for name, sql in conn.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'")).all():
+        if pattern.search(sql or ""):
+            conn.exec_driver_sql(f'DROP TRIGGER "{name}"')
+    preparer = conn.dialect.identifier_preparer
+    for table in tables:
+        quoted = preparer.format_table(table)
+        temp = preparer.quote(f"_rebuild_{table.name}")
+        existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({quoted})")}
+        columns = ", ".join(preparer.quote(column.name) for column in table.columns if column.name in existing)
+        ddl = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+        conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {quoted} (", f"CREATE TABLE {temp} (", 1))
+        conn.exec_driver_sql(f"INSERT INTO {temp} ({columns}) SELECT {columns} FROM {quoted}")
+        conn.exec_driver_sql(f"DROP TABLE {quoted}")
+        conn.exec_driver_sql(f"ALTER TABLE {temp} RENAME TO {quoted}")
+    _create_all(conn)
+
+
+def _table_sql(conn, name: str):
+    return conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": name}
+    ).scalar()
+
+
+def _rebuild_change_log(conn):
+    """change_log 改为 AUTOINCREMENT：清理后序号不再从头分配"""
+    sql = _table_sql(conn, ChangeLogModel.__tablename__)
+    if sql is None or "AUTOINCREMENT" in sql.upper():
+        return
+    # 旧表清理后丢失了已分配的最大序号，用向量索引等记录的游标兜底，保证新序号大于任何已发出的游标
+    issued = conn.execute(text(
+        "SELECT MAX(COALESCE((SELECT MAX(seq) FROM change_log), 0), "
+        "COALESCE((SELECT MAX(change_cursor) FROM vector_index), 0))"
+    )).scalar()
+    _rebuild_tables(conn, [ChangeLogModel.__table__])
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'change_log'"))
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', :seq)"), {"seq": issued})
+
+
+def _foreign_key_actions(conn, table) -> set:
+    return {
+        (row[3], row[2], (row[6] or "NO ACTION").upper())
+        for row in conn.exec_driver_sql(f'PRAGMA foreign_key_list("{table}")')
+    }
+
+
+def _rebuild_foreign_keys(conn):
+    """重建外键缺少 ON DELETE 子句的表（早于外键约束的库），之后引擎才会开启外键约束
+
+    重建时旧表被删除，若外键约束开启，删除旧父表会级联删除子表的数据，因此必须在外键关闭的连接上执行；
+    user_version 达到 FOREIGN_KEYS_VERSION 之前引擎不会开启外键约束
+    """
+    if conn.exec_driver_sql("PRAGMA foreign_keys").scalar():
+        raise RuntimeError("重建外键表必须在关闭外键约束的连接上执行")
+    existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    stale = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing or not table.foreign_keys:
+            continue
+        declared = {
+            (key.parent.name, key.column.table.name, (key.ondelete or "NO ACTION").upper())
+            for key in table.foreign_keys
+        }
+        if _foreign_key_actions(conn, table.name) != declared:
+            stale.append(table)
+    if not stale:
+        return
+    _rebuild_tables(conn, stale)
+    orphans = conn.exec_driver_sql("PRAGMA foreign_key_check").all()
+    if orphans:
+        # 旧库没有执行外键约束时遗留的孤儿行：保留数据，只提示
+        console.print(
+            f"[yellow]⚠️ {len(orphans)} 行引用了不存在的父行（外键约束开启前遗留），"
+            f"可用 PRAGMA foreign_key_check 查看[/yellow]"
+        )
+
+
+def _backfill_query_hash(conn, cursor, batch_size):
+    """为早于 content_hash 列的查询补上哈希；内容重复的查询保持 NULL（唯一索引只允许一行）"""
+    rows = conn.execute(text(
+        "SELECT id, detail_query FROM query_form WHERE id > :after "
+        "AND content_hash IS NULL AND detail_query IS NOT NULL ORDER BY id LIMIT :limit"
+    ), {"after": cursor or 0, "limit": batch_size}).all()
+    if not rows:
+        return None, 0
+    conn.execute(
+        text("UPDATE OR IGNORE query_form SET content_hash = :hash WHERE id = :id AND content_hash IS NULL"),
+        [{"id": row.id, "hash": compute_query_hash(row.detail_query)} for row in rows],
+    )
+    return rows[-1].id, len(rows)
+
+
+def _backfill_usage(conn, cursor, batch_size):
+    """为缺少用量行的评估抽取用量（新写入的评估由触发器维护）"""
+    ids = conn.execute(
+        text("SELECT id FROM evaluation_form WHERE id > :after ORDER BY id LIMIT :limit"),
+        {"after": cursor or 0, "limit": batch_size},
+    ).scalars().all()
+    if not ids:
+        return None, 0
+    backfill_usage(conn, ids)
+    return ids[-1], len(ids)
+
+
+MIGRATIONS = (
+    Migration(1, "baseline", apply=_create_all),
+    Migration(2, "query_content_hash", backfill=_backfill_query_hash, table="query_form"),
+    Migration(3, "evaluation_usage", backfill=_backfill_usage, table="evaluation_form", batch_size=200),
+    Migration(4, "change_log_autoincrement", apply=_rebuild_change_log),
+    # 重建 query_form / evaluation_form / files_form，大库上持有写锁的时间与整表复制相当
+    Migration(FOREIGN_KEYS_VERSION, "foreign_key_actions", apply=_rebuild_foreign_keys, manual=True),
+)
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+# 已提示过需要手动迁移的库，每个进程只提示一次
+_manual_hinted = set()
+
+
+class MigrationRunner:
+    """迁移执行器"""
+
+    def __init__(
+        self, db_path: str = "app.db", engine=None, migrations=MIGRATIONS,
+        batch_size: int = DEFAULT_BATCH_SIZE, batch_sleep: float = 0.0
+    ):
+        """
+        Args:
+            engine: 复用调用方的写引擎（如表单的 engine），不传则自行创建
+            migrations: 迁移列表，版本号从 1 开始连续递增
+            batch_size: 回填的默认批大小
+            batch_sleep: 回填批次之间的休眠秒数，给其他写入者让出写锁
+        """
+        self.db_path = db_path
+        self._owns_engine = engine is None
+        self.engine = engine if engine is not None else create_sqlite_engine(db_path)
+        self.migrations = tuple(migrations)
+        self.latest = self.migrations[-1].version if self.migrations else 0
+        # 不执行 manual 迁移时能达到的最高版本
+        self.automatic_latest = self.latest
+        for migration in self.migrations:
+            if migration.manual:
+                self.automatic_latest = migration.version - 1
+                break
+        self.batch_size = batch_size
+        self.batch_sleep = batch_sleep
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # ---------- 版本检查 ----------
+
+    def current_version(self) -> int:
+        """已完成（含回填）的最高版本，即 PRAGMA user_version"""
+        with self.engine.connect() as conn:
+            return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+    def ensure(self, backfill: str = "foreground", manual: bool = False) -> bool:
+        """确保表结构为最新版本；版本一致时只读取一次 PRAGMA user_version
+
+        Args:
+            backfill: foreground（当前线程跑完回填）/ background（后台线程）/ defer（只执行 DDL）
+            manual: 同时执行 manual 迁移；为 False 时在第一个未执行的 manual 迁移之前停下并提示
+        """
+        if backfill not in ("foreground", "background", "defer"):
+            raise ValueError("backfill 必须为 foreground、background 或 defer")
+        version = self.current_version()
+        if version >= self.latest:
+            return True
+        if not manual and version >= self.automatic_latest:
+            self._hint_manual()
+            return True
+        try:
+            self._apply_pending(manual)
+        except SQLAlchemyError as e:
+            console.print(f"[red]✗ 表结构迁移失败: {e}[/red]")
+            return False
+        if not manual and self.automatic_latest < self.latest:
+            self._hint_manual()
+        if backfill == "foreground":
+            return self.run_backfills()["done"]
+        if backfill == "background":
+            self.start()
+        return True
+
+    def _hint_manual(self):
+        if self.db_path in _manual_hinted:
+            return
+        _manual_hinted.add(self.db_path)
+        pending = [migration.name for migration in self.migrations
+                   if migration.manual and migration.version > self.current_version()]
+        if pending:
+            console.print(
+                f"[yellow]⚠️ 迁移 {', '.join(pending)} 需要长时间持有写锁，未在启动时执行；"
+                f"请在维护窗口运行: python -m src.db.cli --db {self.db_path} migrate[/yellow]"
+            )
+
+    def repair(self) -> bool:
+        """不看版本，重新执行 create_all 与各项补建（触发器、统计行），并从头重跑所有回填"""
+        try:
+            self._apply_pending(manual=True)
+            with self.engine.begin() as conn:
+                self._lock_schema(conn)
+                _create_all(conn)
+                for migration in self.migrations:
+                    if migration.backfill is not None:
+                        conn.execute(
+                            text("UPDATE schema_migrations SET state = 'backfilling', cursor = NULL, "
+                                 "rows_done = 0, completed_at = NULL WHERE version = :version"),
+                            {"version": migration.version},
+                        )
+                self._advance_version(conn)
+        except SQLAlchemyError as e:
+            console.print(f"[red]✗ 修复表结构失败: {e}[/red]")
+            return False
+        return self.run_backfills()["done"]
+
+    # ---------- DDL ----------
+
+    def _prepare(self):
+        # schema_migrations 自身在加锁前创建（幂等），之后的检查与 DDL 都在持有写锁的事务中进行
+        with self.engine.begin() as conn:
+            SchemaMigrationModel.__table__.create(conn, checkfirst=True)
+
+    @staticmethod
+    def _lock_schema(conn):
+        """先执行一条写语句取得写锁：并发启动的进程在这里排队，之后读取到的迁移状态不会过期"""
+        conn.execute(text("UPDATE schema_migrations SET version = version WHERE 0"))
+
+    def _apply_pending(self, manual: bool = True):
+        self._prepare()
+        with self.engine.begin() as conn:
+            self._lock_schema(conn)
+            applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+            fresh = not applied and not conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                "AND name != 'schema_migrations' LIMIT 1"
+            )).first()
+            if fresh:
+                # 新库直接建到最新模型，没有需要回填的旧数据
+                start = time.perf_counter()
+                _create_all(conn)
+                seconds = round(time.perf_counter() - start, 3)
+                for migration in self.migrations:
+                    self._record(conn, migration, "done", seconds)
+                    seconds = 0
+                self._advance_version(conn)
+                console.print(f"[green]✓ 已创建数据库表结构 (版本 {self.latest})[/green]")
+                return
+        for migration in self.migrations:
+            if migration.version in applied:
+                continue
+            if migration.manual and not manual:
+                # 之后的迁移依赖它，一并留到显式迁移时执行
+                break
+            start = time.perf_counter()
+            with self.engine.begin() as conn:
+                self._lock_schema(conn)
+                # 其他进程可能已经执行过
+                if conn.execute(text("SELECT 1 FROM schema_migrations WHERE version = :version"),
+                                {"version": migration.version}).first():
+                    continue
+                if migration.apply is not None:
+                    migration.apply(conn)
+                state = "backfilling" if migration.backfill is not None else "done"
+                self._record(conn, migration, state, round(time.perf_counter() - start, 3))
+                self._advance_version(conn)
+            console.print(f"[green]✓ 迁移 {migration.version} {migration.name}: DDL 完成[/green]")
+
+    @staticmethod
+    def _record(conn, migration: Migration, state: str, seconds: float):
+        now = _now()
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, name, state, rows_done, applied_at, completed_at, seconds) "
+                 "VALUES (:version, :name, :state, 0, :now, :completed, :seconds)"),
+            {"version": migration.version, "name": migration.name, "state": state, "now": now,
+             "completed": now if state == "done" else None, "seconds": seconds},
+        )
+
+    def _advance_version(self, conn):
+        """user_version 推进到连续完成的最高版本"""
+        done = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations WHERE state = 'done'"))}
+        version = 0
+        for migration in self.migrations:
+            if migration.version not in done:
+                break
+            version = migration.version
+        conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+    # ---------- 回填 ----------
+
+    def run_backfills(self, max_seconds: float = None, progress=None) -> dict:
+        """按版本顺序分批执行未完成的回填，返回 {done, batches, rows, seconds}
+
+        Args:
+            max_seconds: 最长执行时间，到时后在当前批结束时返回（游标已保存，下次继续）
+            progress: 进度回调 progress(迁移名称, 已回填行数, 估计总行数或 None)
+        """
+        start = time.perf_counter()
+        report = {"done": False, "batches": 0, "rows": 0, "seconds": 0.0}
+        with self._lock:
+            try:
+                pending = self._pending_backfills()
+                for migration, cursor, rows_done in pending:
+                    total = self._estimate_rows(migration.table)
+                    while cursor is not False:
+                        if self._stop_event.is_set() or (max_seconds is not None and time.perf_counter() - start >= max_seconds):
+                            report["seconds"] = round(time.perf_counter() - start, 3)
+                            return report
+                        cursor, rows = self._run_batch(migration, cursor)
+                        rows_done += rows
+                        report["batches"] += 1
+                        report["rows"] += rows
+                        if progress is not None:
+                            progress(migration.name, rows_done, total)
+                        if cursor is not False and self.batch_sleep:
+                            time.sleep(self.batch_sleep)
+                report["done"] = True
+            except SQLAlchemyError as e:
+                console.print(f"[red]✗ 回填失败: {e}[/red]")
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        return report
+
+    def _pending_backfills(self) -> list:
+        by_version = {migration.version: migration for migration in self.migrations}
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT version, cursor, rows_done FROM schema_migrations WHERE state = 'backfilling' ORDER BY version"
+            )).all()
+        return [
+            (by_version[row.version], json.loads(row.cursor) if row.cursor is not None else None, row.rows_done)
+            for row in rows if row.version in by_version
+        ]
+
+    def _estimate_rows(self, table: str):
+        if table is None:
+            return None
+        with self.engine.connect() as conn:
+            return get_row_counts(conn, [table])[table][0]
+
+    def _run_batch(self, migration: Migration, cursor):
+        """执行一批回填并在同一事务中保存游标；返回 (新游标, 行数)，完成时新游标为 False"""
+        start = time.perf_counter()
+        with self.engine.begin() as conn:
+            self._lock_schema(conn)
+            next_cursor, rows = migration.backfill(conn, cursor, migration.batch_size or self.batch_size)
+            finished = next_cursor is None
+            conn.execute(
+                text("UPDATE schema_migrations SET cursor = :cursor, rows_done = rows_done + :rows, "
+                     "state = :state, completed_at = :completed, seconds = seconds + :seconds WHERE version = :version"),
+                {
+                    "cursor": None if finished else json.dumps(next_cursor),
+                    "rows": rows,
+                    "state": "done" if finished else "backfilling",
+                    "completed": _now() if finished else None,
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "version": migration.version,
+                },
+            )
+            if finished:
+                self._advance_version(conn)
+        return (False if finished else next_cursor), rows
+
+    # ---------- 后台线程 ----------
+
+    def start(self):
+        """在后台线程中执行未完成的回填，完成后线程退出"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_backfills, name="db-migrations", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """停止后台回填（当前批提交后退出，游标已保存）"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ---------- 状态 ----------
+
+    def get_status(self) -> dict:
+        """返回 {version, latest, migrations: [{version, name, state, rows_done, applied_at, completed_at, seconds}]}
+
+        未执行 DDL 的迁移 state 为 pending
+        """
+        try:
+            self._prepare()
+            with self.engine.connect() as conn:
+                version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+                rows = {row.version: row._asdict() for row in conn.execute(text(
+                    "SELECT version, name, state, rows_done, applied_at, completed_at, seconds FROM schema_migrations"
+                ))}
+        except SQLAlchemyError as e:
+            console.print(f"[red]✗ 获取迁移状态失败: {e}[/red]")
+            return {}
+        migrations = [
+            rows.get(migration.version) or {
+                "version": migration.version, "name": migration.name, "state": "pending", "rows_done": 0,
+                "applied_at": None, "completed_at": None, "seconds": 0,
+            }
+            for migration in self.migrations
+        ]
+        return {"version": version, "latest": self.latest, "migrations": migrations}
+
+    def display_status(self):
+        """展示迁移状态"""
+        status = self.get_status()
+        if not status:
+            return
+        table = Table(title=f"表结构版本 {status['version']} / {status['latest']}")
+        table.add_column("版本", style="cyan", justify="right")
+        table.add_column("名称", style="white")
+        table.add_column("状态")
+        table.add_column("回填行数", style="green", justify="right")
+        table.add_column("执行时间", style="blue")
+        table.add_column("耗时(秒)", justify="right")
+        styles = {"done": "green", "backfilling": "yellow", "pending": "red"}
+        for row in status["migrations"]:
+            style = styles.get(row["state"], "white")
+            table.add_row(
+                str(row["version"]), row["name"], f"[{style}]{row['state']}[/{style}]", f"{row['rows_done']:,}",
+                row["completed_at"] or row["applied_at"] or "-", str(row["seconds"]),
+            )
+        console.print(table)
+
+    def __del__(self):
+        if getattr(self, "_owns_engine", False):
+            self.engine.dispose()
@@ -34,28 +34,63 @@
 关系说明:
 1. user_form (用户表) 1:N query_form (查询表)
    - 一个用户可以创建多个查询
-   - 外键: query_form.creator_id → user_form.id
+   - 外键: query_form.creator_id → user_form.id (ON DELETE SET NULL)
 
 2. user_form (用户表) 1:N evaluation_form (评估表)
    - 一个用户可以进行多个评估
-   - 外键: evaluation_form.evaluator_id → user_form.id
+   - 外键: evaluation_form.evaluator_id → user_form.id (ON DELETE SET NULL)
 
 3. query_form (查询表) 1:N evaluation_form (评估表)
    - 一个查询可以有多个评估
-   - 外键: evaluation_form.query_id → query_form.id
+   - 外键: evaluation_form.query_id → query_form.id (ON DELETE CASCADE)
 
 4. evaluation_form (评估表) 1:N files_form (文件表)
    - 一个评估可以有多个相关文件
-   - 外键: files_form.evaluation_id → evaluation_form.id
+   - 外键: files_form.evaluation_id → evaluation_form.id (ON DELETE CASCADE)
+
+外键由 SQLite 执行（engine.py 中开启 PRAGMA foreign_keys），删除查询/评估时
+关联的评估/文件在同一条 DELETE 语句内被级联删除；ORM 关系使用 passive_deletes，
+不会先把子行加载到内存。外键列都建有索引，级联删除不需要扫描子表。
+早于外键约束的库的表没有 ON DELETE 子句，由 migrations.py 的 foreign_key_actions 迁移重建（cli migrate 显式执行），
+迁移完成（PRAGMA user_version 达到 engine.FOREIGN_KEYS_VERSION）之前引擎不开启外键约束。
+
+自然键（唯一索引，供 upsert.py 的 ON CONFLICT 使用）:
+- user_form.username
+- query_form.content_hash: detail_query 去首尾空白后的 sha256，由 ORM 事件与 upsert 自动维护
+- evaluation_form (query_id, agent, run_id): run_id 为空的旧评估不参与判重
+已有的库在 create_all 时自动补上新增的可空列与索引；表结构版本与迁移见 migrations.py。
+
+辅助表（不参与业务关系）:
+- import_manifest: 目录导入清单，记录已导入文件的路径、哈希与目标行，支持断点续导
+- change_log: 变更日志，由触发器在业务表增删改时写入，seq 单调递增，供增量同步使用
+- table_stats: 表统计，由触发器增量维护各业务表的行数与内容字节数，避免 COUNT(*) 全表扫描
+- media: 从轨迹中抽出的内联图片（data URI），按 sha256 去重，轨迹 JSON 中改为 /media/<sha256> 引用
+- work_item: 待评估的 (查询, agent) 任务队列，带租约，由 work_scheduler.py 领取；priority 冗余自
+  query_form.priority，查询优先级变化时由触发器同步
+- judge_cache: 自动评分的评委输出缓存，键为 (评委名, 评委版本, 轨迹哈希, 报告哈希)，见 scoring.py
+- evaluation_usage: 每条评估的用量（步数、出错步数、工具调用数、token、耗时），由触发器在写入轨迹时
+  用 SQLite JSON 函数抽取，不经过 Python 解析
+- usage_rollup: 按 agent / (查询, agent) / (日期, agent) 汇总的用量，由 evaluation_usage 上的触发器增量维护，
+  费用在读取时按价格表计算，见 usage_accounting.py
+- trajectory_diff: 两条评估轨迹的逐步对齐结果缓存，键为 (evaluation_a, evaluation_b)，按两条轨迹文本的哈希校验，
+  见 trajectory_diff.py
+- query_minhash / query_lsh: 查询文本的 MinHash 签名与 LSH 分桶，供近似重复查询检测（query_dedup.py）；
+  查询文本变化时由触发器删除旧签名，QueryForm 写入时或下次检索前重新计算
+- vector_index: 向量检索各集合（查询、报告）的状态：已用行数、文件代数、变更游标、全量扫描进度、倒排索引版本；
+  向量本身存放在数据库旁的 float32 内存映射文件中，见 vector_index.py
+- schema_migrations: 已执行的迁移及其回填进度（游标、行数），当前版本同时记在 PRAGMA user_version，见 migrations.py
 
 所有表的ORM模型都在这里定义，确保外键关系正确建立
 """
 
+import hashlib
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, LargeBinary, Enum
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, LargeBinary, Enum, Float, Index, event, text, inspect as sa_inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
+from .trajectory_store import TrajectoryText
+
 # 创建共享模型实例
 Base = declarative_base()
 
@@ -72,8 +107,8 @@ class UserModel(Base):
     updated_at = Column(String(50), nullable=True, comment="更新时间")
 
     # 关系定义
-    created_queries = relationship("QueryModel", back_populates="creator")
-    evaluations = relationship("EvaluationModel", back_populates="evaluator")
+    created_queries = relationship("QueryModel", back_populates="creator", passive_deletes=True)
+    evaluations = relationship("EvaluationModel", back_populates="evaluator", passive_deletes=True)
 
     def __repr__(self):
         return f"<UserModel(id={self.id}, username='{self.username}', nickname='{self.nickname}')>"
@@ -85,14 +120,15 @@ class QueryModel(Base):
     id = Column(Integer, primary_key=True, autoincrement=True, comment='查询ID')
     lazy_query = Column(Text, nullable=True, comment='简略query')
     detail_query = Column(Text, nullable=True, comment='详细query')
-    creator_id = Column(Integer, ForeignKey('user_form.id'), nullable=True, comment='创建人ID')
+    content_hash = Column(String(64), nullable=True, unique=True, index=True, comment='detail_query 内容哈希(自然键)')
+    creator_id = Column(Integer, ForeignKey('user_form.id', ondelete='SET NULL'), nullable=True, index=True, comment='创建人ID')
     priority = Column(Integer, nullable=True, comment='优先级')
     created_at = Column(String(50), nullable=False, comment='创建时间')
     updated_at = Column(String(50), nullable=True, comment='更新时间')
 
     # 关系定义
     creator = relationship("UserModel", back_populates="created_queries")
-    evaluations = relationship("EvaluationModel", back_populates="query")
+    evaluations = relationship("EvaluationModel", back_populates="query", cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f"<QueryModel(id={self.id}, creator_id={self.creator_id}, priority={self.priority})>"
@@ -101,12 +137,17 @@ class EvaluationModel(Base):
     """评估表单ORM模型"""
     __tablename__ = 'evaluation_form'
     
+    __table_args__ = (
+        Index('ux_evaluation_form_run', 'query_id', 'agent', 'run_id', unique=True),
+    )
+
     id = Column(Integer, primary_key=True, autoincrement=True, comment='评估ID')
-    query_id = Column(Integer, ForeignKey('query_form.id'), nullable=False, comment='查询ID')
+    query_id = Column(Integer, ForeignKey('query_form.id', ondelete='CASCADE'), nullable=False, index=True, comment='查询ID')
     agent = Column(String(100), nullable=True, comment='代理名称')
-    evaluator_id = Column(Integer, ForeignKey('user_form.id'), nullable=True, comment='评估人ID')
+    run_id = Column(String(100), nullable=True, comment='运行ID(与 query_id、agent 组成自然键)')
+    evaluator_id = Column(Integer, ForeignKey('user_form.id', ondelete='SET NULL'), nullable=True, index=True, comment='评估人ID')
     quality_score = Column(Integer, nullable=True, comment='质量分数')
-    trajectory = Column(Text, nullable=True, comment='轨迹')
+    trajectory = Column(TrajectoryText, nullable=True, comment='轨迹(前缀共享的紧凑格式，见 trajectory_store.py)')
     report_content = Column(Text, nullable=True, comment='评估报告(Markdown格式)')
     created_at = Column(String(50), nullable=False, comment='创建时间')
     updated_at = Column(String(50), nullable=True, comment='更新时间')
@@ -114,7 +155,7 @@ class EvaluationModel(Base):
     # 关系定义
     query = relationship("QueryModel", back_populates="evaluations")
     evaluator = relationship("UserModel", back_populates="evaluations")
-    files = relationship("FilesModel", back_populates="evaluation")
+    files = relationship("FilesModel", back_populates="evaluation", cascade="all, delete-orphan", passive_deletes=True)
 
     def __repr__(self):
         return f"<EvaluationModel(id={self.id}, query_id={self.query_id}, agent='{self.agent}')>"
@@ -124,10 +165,10 @@ class FilesModel(Base):
     __tablename__ = 'files_form'
     
     id = Column(Integer, primary_key=True, autoincrement=True, comment='文件ID')
-    evaluation_id = Column(Integer, ForeignKey('evaluation_form.id'), nullable=False, comment='评估ID')
+    evaluation_id = Column(Integer, ForeignKey('evaluation_form.id', ondelete='CASCADE'), nullable=False, index=True, comment='评估ID')
     filename = Column(String(255), nullable=False, comment='文件名')
     content = Column(LargeBinary, nullable=True, comment='文件内容')
-    file_type = Column(Enum("trajectory", "report", "deliverables", "pre_data", name="file_type_enum"), 
+    file_type = Column(Enum("trajectory", "report", "deliverable", "pre_data", name="file_type_enum"), 
                       nullable=False, comment='文件类型')
     file_size = Column(Integer, nullable=True, comment='文件大小(字节)')
     created_at = Column(String(50), nullable=False, comment='创建时间')
@@ -137,4 +178,515 @@ class FilesModel(Base):
     evaluation = relationship("EvaluationModel", back_populates="files")
 
     def __repr__(self):
-        return f"<FilesModel(id={self.id}, evaluation_id={self.evaluation_id}, filename='{self.filename}')>"
\ No newline at end of file
+        return f"<FilesModel(id={self.id}, evaluation_id={self.evaluation_id}, filename='{self.filename}')>"
+
+class ImportManifestModel(Base):
+    """导入清单ORM模型 - 记录目录导入过的文件，重复导入时跳过未变化的文件"""
+    __tablename__ = 'import_manifest'
+
+    path = Column(String(1024), primary_key=True, comment='文件/目录绝对路径')
+    kind = Column(String(20), nullable=False, comment='类型: query/run/trajectory/report/deliverable')
+    key = Column(String(255), nullable=True, index=True, comment='查找键(查询文件相对 queries/ 的路径，不含扩展名)')
+    sha256 = Column(String(64), nullable=True, comment='内容哈希')
+    file_size = Column(Integer, nullable=True, comment='文件大小(字节)')
+    mtime = Column(Float, nullable=True, comment='文件修改时间')
+    target_table = Column(String(50), nullable=False, comment='写入的表')
+    target_id = Column(Integer, nullable=False, comment='写入的行ID')
+    imported_at = Column(String(50), nullable=False, comment='导入时间')
+
+    def __repr__(self):
+        return f"<ImportManifestModel(path='{self.path}', kind='{self.kind}', target_id={self.target_id})>"
+
+
+class MediaModel(Base):
+    """媒体ORM模型 - 从轨迹中抽出的内联图片，按内容 sha256 寻址去重"""
+    __tablename__ = 'media'
+
+    sha256 = Column(String(64), primary_key=True, comment='内容哈希')
+    mime_type = Column(String(100), nullable=False, comment='MIME 类型')
+    content = Column(LargeBinary, nullable=False, comment='内容')
+    byte_size = Column(Integer, nullable=False, comment='字节数')
+    created_at = Column(String(50), nullable=False, comment='创建时间')
+
+    def __repr__(self):
+        return f"<MediaModel(sha256='{self.sha256[:12]}', mime_type='{self.mime_type}', byte_size={self.byte_size})>"
+
+class WorkItemModel(Base):
+    """评估任务ORM模型 - 待评估的 (查询, agent)，评估人与自动评分器通过 WorkScheduler 领取"""
+    __tablename__ = 'work_item'
+    __table_args__ = (
+        Index('ux_work_item_query_agent', 'query_id', 'agent', unique=True),
+        # 领取顺序 (priority DESC, id) 与索引顺序一致，领取只读取索引头部的 N 项
+        Index('ix_work_item_claim', 'status', text('priority DESC'), 'id'),
+        Index('ix_work_item_lease', 'status', 'lease_expires_at'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True, comment='任务ID(越小越早入队)')
+    query_id = Column(Integer, ForeignKey('query_form.id', ondelete='CASCADE'), nullable=False, comment='查询ID')
+    agent = Column(String(100), nullable=False, comment='代理名称')
+    priority = Column(Integer, nullable=False, default=0, comment='优先级(冗余自 query_form，越大越优先)')
+    status = Column(String(20), nullable=False, default='pending', comment='状态: pending/leased/done/failed')
+    lease_owner = Column(String(100), nullable=True, comment='租约持有者')
+    lease_token = Column(String(32), nullable=True, comment='租约令牌(每次领取重新生成)')
+    lease_expires_at = Column(Float, nullable=True, comment='租约到期时间(UNIX 秒)')
+    attempts = Column(Integer, nullable=False, default=0, comment='领取次数')
+    last_error = Column(Text, nullable=True, comment='最近一次失败原因')
+    evaluation_id = Column(Integer, ForeignKey('evaluation_form.id', ondelete='SET NULL'), nullable=True, comment='完成后关联的评估ID')
+    created_at = Column(String(50), nullable=False, comment='入队时间')
+    updated_at = Column(String(50), nullable=True, comment='更新时间')
+
+    def __repr__(self):
+        return f"<WorkItemModel(id={self.id}, query_id={self.query_id}, agent='{self.agent}', status='{self.status}')>"
+
+
+class JudgeCacheModel(Base):
+    """评委输出缓存ORM模型 - 同一评委版本对相同轨迹与报告的打分只计算一次"""
+    __tablename__ = 'judge_cache'
+
+    judge_name = Column(String(100), primary_key=True, comment='评委名称')
+    judge_version = Column(String(50), primary_key=True, comment='评委版本')
+    trajectory_hash = Column(String(64), primary_key=True, comment='存储的轨迹文本的 sha256')
+    report_hash = Column(String(64), primary_key=True, comment='报告内容的 sha256')
+    score = Column(Float, nullable=False, comment='分数(0-100)')
+    details = Column(Text, nullable=True, comment='评委输出明细(JSON)')
+    created_at = Column(String(50), nullable=False, comment='创建时间')
+
+    def __repr__(self):
+        return f"<JudgeCacheModel(judge_name='{self.judge_name}', judge_version='{self.judge_version}', score={self.score})>"
+
+
+class EvaluationUsageModel(Base):
+    """评估用量ORM模型 - 由 evaluation_form 上的触发器维护，每条评估一行"""
+    __tablename__ = 'evaluation_usage'
+
+    evaluation_id = Column(Integer, primary_key=True, comment='评估ID(不设外键，随评估删除由触发器清理)')
+    query_id = Column(Integer, nullable=False, comment='查询ID')
+    agent = Column(String(100), nullable=False, default='', comment='代理名称(空代理记为空串)')
+    day = Column(String(10), nullable=False, default='', comment='评估创建日期 YYYY-MM-DD')
+    quality_score = Column(Integer, nullable=True, comment='质量分数(冗余自 evaluation_form)')
+    steps = Column(Integer, nullable=False, default=0, comment='步数')
+    error_steps = Column(Integer, nullable=False, default=0, comment='出错步数')
+    tool_calls = Column(Integer, nullable=False, default=0, comment='工具调用数')
+    input_tokens = Column(Integer, nullable=False, default=0, comment='输入 token')
+    output_tokens = Column(Integer, nullable=False, default=0, comment='输出 token')
+    total_tokens = Column(Integer, nullable=False, default=0, comment='总 token')
+    duration_seconds = Column(Float, nullable=False, default=0, comment='各步耗时之和(秒)')
+
+    def __repr__(self):
+        return f"<EvaluationUsageModel(evaluation_id={self.evaluation_id}, agent='{self.agent}', total_tokens={self.total_tokens})>"
+
+
+class UsageRollupModel(Base):
+    """用量汇总ORM模型 - 由 evaluation_usage 上的触发器增量维护，读取汇总是主键查询"""
+    __tablename__ = 'usage_rollup'
+
+    scope = Column(String(10), primary_key=True, comment='汇总维度: agent/query/day')
+    key = Column(String(50), primary_key=True, comment='维度取值: agent 维度为空串，query 维度为查询ID，day 维度为日期')
+    agent = Column(String(100), primary_key=True, comment='代理名称')
+    evaluations = Column(Integer, nullable=False, default=0, comment='评估数')
+    scored = Column(Integer, nullable=False, default=0, comment='已打分评估数')
+    score_sum = Column(Float, nullable=False, default=0, comment='分数之和')
+    steps = Column(Integer, nullable=False, default=0, comment='步数')
+    error_steps = Column(Integer, nullable=False, default=0, comment='出错步数')
+    tool_calls = Column(Integer, nullable=False, default=0, comment='工具调用数')
+    input_tokens = Column(Integer, nullable=False, default=0, comment='输入 token')
+    output_tokens = Column(Integer, nullable=False, default=0, comment='输出 token')
+    total_tokens = Column(Integer, nullable=False, default=0, comment='总 token')
+    duration_seconds = Column(Float, nullable=False, default=0, comment='耗时之和(秒)')
+
+    def __repr__(self):
+        return f"<UsageRollupModel(scope='{self.scope}', key='{self.key}', agent='{self.agent}', evaluations={self.evaluations})>"
+
+
+class TrajectoryDiffModel(Base):
+    """轨迹对齐缓存ORM模型 - 评估对按 evaluation_a < evaluation_b 存一份，反向请求时翻转"""
+    __tablename__ = 'trajectory_diff'
+
+    evaluation_a = Column(Integer, ForeignKey('evaluation_form.id', ondelete='CASCADE'), primary_key=True, comment='评估A(ID较小)')
+    evaluation_b = Column(Integer, ForeignKey('evaluation_form.id', ondelete='CASCADE'), primary_key=True, index=True, comment='评估B(ID较大)')
+    trajectory_hash_a = Column(String(64), nullable=False, comment='计算时评估A轨迹文本的 sha256')
+    trajectory_hash_b = Column(String(64), nullable=False, comment='计算时评估B轨迹文本的 sha256')
+    version = Column(String(20), nullable=False, comment='对齐算法版本')
+    summary = Column(Text, nullable=False, comment='差异摘要(JSON)')
+    alignment = Column(Text, nullable=False, comment='逐步对齐(JSON 数组)')
+    created_at = Column(String(50), nullable=False, comment='计算时间')
+
+    def __repr__(self):
+        return f"<TrajectoryDiffModel(evaluation_a={self.evaluation_a}, evaluation_b={self.evaluation_b})>"
+
+
+class QueryMinHashModel(Base):
+    """查询 MinHash 签名ORM模型 - 每个已建索引的查询一行，文本为空时签名为 NULL"""
+    __tablename__ = 'query_minhash'
+
+    query_id = Column(Integer, ForeignKey('query_form.id', ondelete='CASCADE'), primary_key=True, comment='查询ID')
+    signature = Column(LargeBinary, nullable=True, comment='MinHash 签名(uint32 数组)')
+
+    def __repr__(self):
+        return f"<QueryMinHashModel(query_id={self.query_id})>"
+
+
+class QueryLshModel(Base):
+    """查询 LSH 分桶ORM模型 - 签名每一段(band)的哈希为一个桶，同桶的查询是相似候选"""
+    __tablename__ = 'query_lsh'
+    __table_args__ = (
+        Index('ix_query_lsh_query', 'query_id'),
+        # 主键即聚簇索引，少维护一棵 rowid B 树
+        {'sqlite_with_rowid': False},
+    )
+
+    band = Column(Integer, primary_key=True, comment='段号')
+    bucket = Column(Integer, primary_key=True, comment='该段签名的 64 位哈希')
+    query_id = Column(Integer, ForeignKey('query_form.id', ondelete='CASCADE'), primary_key=True, comment='查询ID')
+
+    def __repr__(self):
+        return f"<QueryLshModel(band={self.band}, bucket={self.bucket}, query_id={self.query_id})>"
+
+
+class VectorIndexModel(Base):
+    """向量索引状态ORM模型 - 每个集合一行，向量与行号到ID的映射在内存映射文件中，提交本行即提交文件中的写入"""
+    __tablename__ = 'vector_index'
+
+    collection = Column(String(50), primary_key=True, comment='集合: queries / reports')
+    embedder = Column(String(200), nullable=False, comment='嵌入器 名称:版本:维度，变化时重建')
+    dim = Column(Integer, nullable=False, comment='向量维度')
+    generation = Column(Integer, nullable=False, comment='文件代数，重建或压缩时递增')
+    capacity = Column(Integer, nullable=False, comment='映射文件容量(行)')
+    slots = Column(Integer, nullable=False, comment='已使用的行数(含墓碑)')
+    live = Column(Integer, nullable=False, comment='有效向量数')
+    change_cursor = Column(Integer, nullable=False, comment='已同步到的 change_log 序号')
+    scan_after = Column(Integer, nullable=True, comment='全量扫描已处理到的ID，NULL 表示扫描完成')
+    ivf_version = Column(Integer, nullable=False, comment='倒排索引版本，0 表示未训练')
+    n_lists = Column(Integer, nullable=False, comment='倒排索引的簇数')
+    updated_at = Column(String(50), nullable=False, comment='更新时间')
+
+    def __repr__(self):
+        return f"<VectorIndexModel(collection='{self.collection}', live={self.live})>"
+
+
+class ChangeLogModel(Base):
+    """变更日志ORM模型 - 由业务表上的触发器写入，客户端按 seq 游标增量同步"""
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        Index('ix_change_log_table_seq', 'table_name', 'seq'),
+        # AUTOINCREMENT：清理后序号也不会从头分配，客户端游标不会错过新变更
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = Column(Integer, primary_key=True, autoincrement=True, comment='变更序号(单调递增，不复用)')
+    table_name = Column(String(50), nullable=False, comment='变更的表')
+    row_id = Column(Integer, nullable=False, comment='变更的行ID')
+    op = Column(String(10), nullable=False, comment='操作: insert/update/delete')
+    changed_at = Column(String(50), nullable=False, comment='变更时间')
+
+    def __repr__(self):
+        return f"<ChangeLogModel(seq={self.seq}, table_name='{self.table_name}', row_id={self.row_id}, op='{self.op}')>"
+
+
+class TableStatsModel(Base):
+    """表统计ORM模型 - 由触发器增量维护，读取行数是 O(1) 的主键查询"""
+    __tablename__ = 'table_stats'
+
+    table_name = Column(String(50), primary_key=True, comment='表名')
+    row_count = Column(Integer, nullable=False, default=0, comment='行数')
+    byte_total = Column(Integer, nullable=False, default=0, comment='内容列字节总数')
+
+    def __repr__(self):
+        return f"<TableStatsModel(table_name='{self.table_name}', row_count={self.row_count})>"
+
+
+class SchemaMigrationModel(Base):
+    """迁移记录ORM模型 - 每个已执行 DDL 的迁移一行，回填游标随每批在同一事务中提交"""
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True, autoincrement=False, comment='迁移版本号')
+    name = Column(String(100), nullable=False, comment='迁移名称')
+    state = Column(String(20), nullable=False, comment='状态: backfilling / done')
+    cursor = Column(Text, nullable=True, comment='回填游标(JSON)，NULL 表示从头开始')
+    rows_done = Column(Integer, nullable=False, default=0, comment='已回填的行数')
+    applied_at = Column(String(50), nullable=False, comment='DDL 执行时间')
+    completed_at = Column(String(50), nullable=True, comment='回填完成时间')
+    seconds = Column(Float, nullable=False, default=0, comment='DDL 与回填累计耗时(秒)')
+
+    def __repr__(self):
+        return f"<SchemaMigrationModel(version={self.version}, name='{self.name}', state='{self.state}')>"
+
+
+# 需要记录变更的业务表
+CHANGE_TRACKED_TABLES = (
+    UserModel.__tablename__,
+    QueryModel.__tablename__,
+    EvaluationModel.__tablename__,
+    FilesModel.__tablename__,
+)
+
+
+def compute_query_hash(detail_query):
+    """查询的自然键：去掉首尾空白后的 detail_query 的 sha256"""
+    if detail_query is None:
+        return None
+    return hashlib.sha256(detail_query.strip().encode("utf-8")).hexdigest()
+
+
+@event.listens_for(QueryModel, "before_insert")
+@event.listens_for(QueryModel, "before_update")
+def _set_query_hash(mapper, connection, target):
+    """通过 ORM 写入查询时自动维护 content_hash"""
+    target.content_hash = compute_query_hash(target.detail_query)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _add_missing_columns(target, connection, **kw):
+    """create_all 不会给已存在的表补列，这里为已有的库补上新增的可空列"""
+    inspector = sa_inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    for table in target.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _ensure_indexes(target, connection, **kw):
+    """create_all 不会给已存在的表补建新声明的索引，这里统一补上"""
+    for table in target.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _install_change_triggers(target, connection, **kw):
+    """每次 create_all 之后确保变更触发器存在（已存在的库也会补上）"""
+    now = "strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')"
+    for table in CHANGE_TRACKED_TABLES:
+        for op, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            connection.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS trg_{table}_{op}_changes "
+                f"AFTER {op.upper()} ON {table} "
+                f"BEGIN "
+                f"INSERT INTO change_log (table_name, row_id, op, changed_at) "
+                f"VALUES ('{table}', {row}.id, '{op}', {now}); "
+                f"END"
+            ))
+
+
+# 维护 table_stats 的表，以及计入 byte_total 的内容列
+STATS_BYTE_COLUMNS = {
+    UserModel.__tablename__: (),
+    QueryModel.__tablename__: ("lazy_query", "detail_query"),
+    EvaluationModel.__tablename__: ("trajectory", "report_content"),
+    FilesModel.__tablename__: ("content",),
+    # 只计行数：与 query_form 的行数比较即可判断是否有查询尚未建立近似重复索引
+    QueryMinHashModel.__tablename__: (),
+}
+
+
+def _bytes_expr(row: str, columns: tuple) -> str:
+    if not columns:
+        return "0"
+    return " + ".join(f"COALESCE(length(CAST({row}.{column} AS BLOB)), 0)" for column in columns)
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _install_stats_triggers(target, connection, **kw):
+    """确保统计触发器存在；统计行缺失时（新安装或被清空）用一次全表扫描初始化"""
+    for table, columns in STATS_BYTE_COLUMNS.items():
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_insert_stats AFTER INSERT ON {table} BEGIN "
+            f"UPDATE table_stats SET row_count = row_count + 1, "
+            f"byte_total = byte_total + ({_bytes_expr('NEW', columns)}) WHERE table_name = '{table}'; "
+            f"END"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS trg_{table}_delete_stats AFTER DELETE ON {table} BEGIN "
+            f"UPDATE table_stats SET row_count = row_count - 1, "
+            f"byte_total = byte_total - ({_bytes_expr('OLD', columns)}) WHERE table_name = '{table}'; "
+            f"END"
+        ))
+        if columns:
+            connection.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS trg_{table}_update_stats "
+                f"AFTER UPDATE OF {', '.join(columns)} ON {table} BEGIN "
+                f"UPDATE table_stats SET byte_total = byte_total "
+                f"+ ({_bytes_expr('NEW', columns)}) - ({_bytes_expr('OLD', columns)}) "
+                f"WHERE table_name = '{table}'; "
+                f"END"
+            ))
+
+        exists = connection.execute(
+            text("SELECT 1 FROM table_stats WHERE table_name = :table"), {"table": table}
+        ).first()
+        if not exists:
+            byte_sum = f"COALESCE(SUM({_bytes_expr(table, columns)}), 0)"
+            connection.execute(text(
+                f"INSERT INTO table_stats (table_name, row_count, byte_total) "
+                f"SELECT '{table}', COUNT(*), {byte_sum} FROM {table}"
+            ))
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _install_query_index_triggers(target, connection, **kw):
+    """查询文本变化时删除旧的 MinHash 签名与分桶，任何写入路径下索引都不会返回过期结果"""
+    connection.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS trg_query_form_text_minhash "
+        "AFTER UPDATE OF lazy_query, detail_query ON query_form "
+        "WHEN NEW.lazy_query IS NOT OLD.lazy_query OR NEW.detail_query IS NOT OLD.detail_query BEGIN "
+        "DELETE FROM query_lsh WHERE query_id = NEW.id; "
+        "DELETE FROM query_minhash WHERE query_id = NEW.id; "
+        "END"
+    ))
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _install_work_triggers(target, connection, **kw):
+    """查询优先级变化时同步到 work_item，领取时无需联表"""
+    connection.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS trg_query_form_priority_work "
+        "AFTER UPDATE OF priority ON query_form BEGIN "
+        "UPDATE work_item SET priority = COALESCE(NEW.priority, 0) WHERE query_id = NEW.id; "
+        "END"
+    ))
+
+
+# evaluation_usage / usage_rollup 中按行累加的用量列
+USAGE_COLUMNS = (
+    "steps", "error_steps", "tool_calls", "input_tokens", "output_tokens", "total_tokens", "duration_seconds",
+)
+
+# usage_rollup 的汇总维度与各维度取值的表达式（row 为 NEW/OLD）
+ROLLUP_SCOPES = {
+    "agent": "''",
+    "query": "CAST({row}.query_id AS TEXT)",
+    "day": "{row}.day",
+}
+
+
+def _usage_source(row: str) -> str:
+    """遍历轨迹步骤的 json_each：紧凑格式取 $.steps，原始格式取 $，无法解析的文本视为空轨迹"""
+    column = f"{row}.trajectory"
+    return (
+        f"json_each(CASE WHEN json_valid({column}) THEN {column} ELSE '[]' END, "
+        f"CASE WHEN json_valid({column}) AND json_type({column}) = 'object' THEN '$.steps' ELSE '$' END)"
+    )
+
+
+# 每一步只解析一次：多路径 json_extract 把需要的四个字段取成一个小数组，后续取值都在小数组上进行；
+# 投影所在的子查询带 LIMIT -1，防止被展开到外层聚合里对每个引用重复解析
+STEP_USAGE_FIELDS = "json_extract(s.value, '$.token_usage', '$.timing', '$.tool_calls', '$.error')"
+
+
+def _usage_select(fields: str = "p.f") -> str:
+    """从 STEP_USAGE_FIELDS 投影出的各步字段聚合出 USAGE_COLUMNS 顺序的用量"""
+    def number(path):
+        # 只累加数值，字符串等其他类型按 0 计
+        return f"CASE WHEN json_type({fields}, '{path}') IN ('integer', 'real') THEN json_extract({fields}, '{path}') END"
+
+    return ", ".join((
+        f"COUNT({fields})",
+        f"COALESCE(SUM(json_type({fields}, '$[3]') != 'null' AND json_extract({fields}, '$[3]') IS NOT ''), 0)",
+        f"COALESCE(SUM(CASE WHEN json_type({fields}, '$[2]') = 'array' "
+        f"THEN json_array_length({fields}, '$[2]') ELSE 0 END), 0)",
+        f"COALESCE(SUM({number('$[0].input_tokens')}), 0)",
+        f"COALESCE(SUM({number('$[0].output_tokens')}), 0)",
+        f"COALESCE(SUM(COALESCE({number('$[0].total_tokens')}, "
+        f"COALESCE({number('$[0].input_tokens')}, 0) + COALESCE({number('$[0].output_tokens')}, 0))), 0)",
+        f"COALESCE(SUM(COALESCE({number('$[1].duration')}, "
+        f"{number('$[1].end_time')} - {number('$[1].start_time')})), 0.0)",
+    ))
+
+
+def _rollup_upsert(row: str, sign: str) -> str:
+    """把一行 evaluation_usage 计入（sign='+'）或移出（sign='-'）三个维度的汇总"""
+    columns = ("evaluations", "scored", "score_sum") + USAGE_COLUMNS
+    values = ("1", f"{row}.quality_score IS NOT NULL", f"COALESCE({row}.quality_score, 0)") + tuple(
+        f"{row}.{column}" for column in USAGE_COLUMNS
+    )
+    updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in columns)
+    statements = []
+    for scope, key in ROLLUP_SCOPES.items():
+        signed = ", ".join(f"{sign}({value})" for value in values)
+        statements.append(
+            f"INSERT INTO usage_rollup (scope, key, agent, {', '.join(columns)}) "
+            f"VALUES ('{scope}', {key.format(row=row)}, {row}.agent, {signed}) "
+            f"ON CONFLICT (scope, key, agent) DO UPDATE SET {updates}; "
+        )
+        if sign == "-":
+            statements.append(
+                f"DELETE FROM usage_rollup WHERE scope = '{scope}' AND key = {key.format(row=row)} "
+                f"AND agent = {row}.agent AND evaluations <= 0; "
+            )
+    return "".join(statements)
+
+
+def backfill_usage(connection, evaluation_ids=None) -> int:
+    """为缺少用量行的评估补上用量（触发器同时更新汇总），返回补上的行数"""
+    where = "u.evaluation_id IS NULL"
+    if evaluation_ids is not None:
+        ids = ", ".join(str(int(evaluation_id)) for evaluation_id in evaluation_ids) or "NULL"
+        where += f" AND e.id IN ({ids})"
+    steps = (
+        f"SELECT e.id, e.query_id, COALESCE(e.agent, '') AS agent, COALESCE(substr(e.created_at, 1, 10), '') AS day, "
+        f"e.quality_score, {STEP_USAGE_FIELDS} AS f "
+        f"FROM evaluation_form AS e LEFT JOIN evaluation_usage AS u ON u.evaluation_id = e.id "
+        f"LEFT JOIN {_usage_source('e')} AS s ON s.type = 'object' "
+        f"WHERE {where} LIMIT -1"
+    )
+    return connection.execute(text(
+        f"INSERT INTO evaluation_usage (evaluation_id, query_id, agent, day, quality_score, {', '.join(USAGE_COLUMNS)}) "
+        f"SELECT p.id, p.query_id, p.agent, p.day, p.quality_score, {_usage_select()} "
+        f"FROM ({steps}) AS p GROUP BY p.id"
+    )).rowcount
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _install_usage_triggers(target, connection, **kw):
+    """评估写入/修改/删除时维护 evaluation_usage，evaluation_usage 变化时增量维护 usage_rollup"""
+    usage = ", ".join(USAGE_COLUMNS)
+    steps = f"(SELECT {STEP_USAGE_FIELDS} AS f FROM {_usage_source('NEW')} AS s WHERE s.type = 'object' LIMIT -1) AS p"
+    stats = f"SELECT {_usage_select()} FROM {steps}"
+    triggers = {
+        "trg_evaluation_form_insert_usage": (
+            "AFTER INSERT ON evaluation_form BEGIN "
+            f"INSERT INTO evaluation_usage (evaluation_id, query_id, agent, day, quality_score, {usage}) "
+            f"SELECT NEW.id, NEW.query_id, COALESCE(NEW.agent, ''), COALESCE(substr(NEW.created_at, 1, 10), ''), "
+            f"NEW.quality_score, {_usage_select()} FROM {steps}; "
+            "END"
+        ),
+        # 只有轨迹真正变化时才重新抽取；打分等其他列的更新不解析 JSON
+        "trg_evaluation_form_trajectory_usage": (
+            "AFTER UPDATE OF trajectory ON evaluation_form WHEN NEW.trajectory IS NOT OLD.trajectory BEGIN "
+            f"UPDATE evaluation_usage SET ({usage}) = ({stats}) WHERE evaluation_id = NEW.id; "
+            "END"
+        ),
+        "trg_evaluation_form_update_usage": (
+            "AFTER UPDATE OF query_id, agent, quality_score, created_at ON evaluation_form "
+            "WHEN NEW.query_id IS NOT OLD.query_id OR NEW.agent IS NOT OLD.agent "
+            "OR NEW.quality_score IS NOT OLD.quality_score OR NEW.created_at IS NOT OLD.created_at BEGIN "
+            "UPDATE evaluation_usage SET query_id = NEW.query_id, agent = COALESCE(NEW.agent, ''), "
+            "day = COALESCE(substr(NEW.created_at, 1, 10), ''), quality_score = NEW.quality_score "
+            "WHERE evaluation_id = NEW.id; "
+            "END"
+        ),
+        "trg_evaluation_form_delete_usage": (
+            "AFTER DELETE ON evaluation_form BEGIN "
+            "DELETE FROM evaluation_usage WHERE evaluation_id = OLD.id; "
+            "END"
+        ),
+        "trg_evaluation_usage_insert_rollup": (
+            f"AFTER INSERT ON evaluation_usage BEGIN {_rollup_upsert('NEW', '+')} END"
+        ),
+        "trg_evaluation_usage_delete_rollup": (
+            f"AFTER DELETE ON evaluation_usage BEGIN {_rollup_upsert('OLD', '-')} END"
+        ),
+        "trg_evaluation_usage_update_rollup": (
+            f"AFTER UPDATE ON evaluation_usage BEGIN {_rollup_upsert('OLD', '-')}{_rollup_upsert('NEW', '+')} END"
+        ),
+    }
+    for name, body in triggers.items():
+        connection.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+    # 已有评估的用量由 migrations.py 的 evaluation_usage 回填分批补齐，不在这里一次性扫描全部轨迹
@@ -0,0 +1,411 @@
+"""
+近似重复查询检测
+
+查询库里积累了大量几乎相同的 lazy_query / detail_query，会让同一道题在 agent 平均分里被重复计权。
+这里为查询文本维护 MinHash 签名与 LSH 分桶索引：
+- 文本：detail_query（为空时用 lazy_query），NFKC 规范化、转小写、去掉空白与标点后取 UTF-8 字节 6-gram 作为 shingle
+- 签名：单次排列 MinHash（one permutation hashing）：每个 shingle 只计算一次 crc32，高 7 位选 128 个桶之一，
+  低 25 位取桶内最小值；空桶按右侧最近的非空桶填充并带上距离（rotation densification）。
+  纯 Python 每个查询只做 O(shingle 数) 次哈希，不需要 128 个独立哈希函数
+- 相似度：两个签名相同位置取值相等的比例，估计 shingle 集合的 Jaccard 相似度
+- LSH：签名取前 120 个值分 20 段、每段 6 个值，段哈希相同的查询互为候选，候选再按签名相似度过滤，不做两两比较；
+  相似度 0.8 的查询对至少落入同一个桶的概率约 99.8%，0.7 时约 92%，0.5 时只有约 27%，阈值低于 0.7 时会漏检。
+  每个查询在 query_lsh 中占 20 行，段数是召回率与写入量之间的折中
+- 增量维护：QueryForm 的 add_query / update_query / upsert_queries / update_queries 在写入后为新增或文本变化的查询
+  计算签名；文本变化由触发器删除旧签名，导入器等其他写入路径产生的未索引查询在下一次检索前补齐
+  （是否有待补齐的查询由 table_stats 中 query_form 与 query_minhash 的行数比较得出，不扫表）
+
+用法：
+    index = QueryDedupIndex("app.db")
+    index.find_similar_queries("如何用 Python 读取 CSV 文件", threshold=0.8)
+    report = index.dedup_report(threshold=0.8)
+    index.display_dedup_report(report)
+
+可用方法
+refresh
+find_similar_queries
+find_duplicates
+dedup_report
+display_dedup_report
+rebuild
+"""
+
+import re
+import time
+import unicodedata
+import zlib
+from array import array
+
+from sqlalchemy import select, delete, func, exists, and_, or_
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, escape, Table
+
+from .base_form import BaseForm
+from .models import QueryModel, QueryMinHashModel, QueryLshModel, EvaluationModel, TableStatsModel
+
+NUM_PERM = 128
+BIN_BITS = 7  # 2 ** BIN_BITS == NUM_PERM
+VALUE_BITS = 32 - BIN_BITS
+VALUE_MASK = (1 << VALUE_BITS) - 1
+BANDS = 20
+ROWS_PER_BAND = 6
+SHINGLE_BYTES = 6
+DEFAULT_THRESHOLD = 0.8
+# 同一个桶里的查询超过这个数时只与桶内第一个查询配对，避免大量完全相同的查询产生平方级候选
+MAX_BUCKET_PAIRS = 64
+BATCH_SIZE = 2000
+SQL_CHUNK = 500
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+MINHASH_INSERT_SQL = f"INSERT INTO {QueryMinHashModel.__tablename__} (query_id, signature) VALUES (?, ?)"
+LSH_INSERT_SQL = f"INSERT INTO {QueryLshModel.__tablename__} (band, bucket, query_id) VALUES (?, ?, ?)"
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 规范化、转小写、去掉空白与标点（只差空格、标点的查询视为相同）"""
+    return _NON_WORD.sub("", unicodedata.normalize("NFKC", text or "").lower())
+
+
+def query_text(lazy_query: str = None, detail_query: str = None) -> str:
+    """建索引使用的查询文本"""
+    return detail_query if detail_query and detail_query.strip() else (lazy_query or "")
+
+
+def minhash_signature(text: str) -> array:
+    """文本的 MinHash 签名（NUM_PERM 个 uint32），文本为空时返回 None"""
+    data = normalize_text(text).encode("utf-8")
+    if not data:
+        return None
+    empty = 1 << 32
+    last = max(len(data) - SHINGLE_BYTES, 0) + 1
+    hashes = [(zlib.crc32(data[start:start + SHINGLE_BYTES]) * 0x9E3779B1) & 0xFFFFFFFF for start in range(last)]
+    # 高位是桶号、低位是取值，降序遍历时每个桶最后写入的就是桶内最小值
+    minimums = {hashed >> VALUE_BITS: hashed & VALUE_MASK for hashed in sorted(hashes, reverse=True)}
+    bins = [minimums.get(position, empty) for position in range(NUM_PERM)]
+    # 空桶取右侧（循环）最近的非空桶的值，距离写进高位，与真实取值区分
+    if empty in bins:
+        filled = list(bins)
+        following, distance = None, 0
+        for position in reversed(range(2 * NUM_PERM)):
+            value = bins[position % NUM_PERM]
+            if value != empty:
+                following, distance = value, 0
+                continue
+            distance += 1
+            if position < NUM_PERM:
+                filled[position] = (distance << VALUE_BITS) | following
+        bins = filled
+    return array("I", bins)
+
+
+def signature_similarity(a: array, b: array) -> float:
+    """两个签名估计的 Jaccard 相似度"""
+    if a is None or b is None:
+        return 0.0
+    if a == b:
+        return 1.0
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+def band_buckets(signature: array) -> list:
+    """签名各段的 (段号, 64 位桶哈希)"""
+    data = signature.tobytes()
+    width = ROWS_PER_BAND * signature.itemsize
+    buckets = []
+    for band in range(BANDS):
+        chunk = data[band * width:(band + 1) * width]
+        # 两个不同初值的 crc32 拼成 64 位，再转为 SQLite 的有符号整数
+        bucket = (zlib.crc32(chunk) << 32) | zlib.crc32(chunk, 0x5BD1E995)
+        buckets.append((band, bucket - (1 << 64) if bucket >= 1 << 63 else bucket))
+    return buckets
+
+
+def _load_signature(blob) -> array:
+    if blob is None:
+        return None
+    signature = array("I")
+    signature.frombytes(blob)
+    return signature
+
+
+def index_queries(conn, query_ids: list = None, limit: int = None) -> int:
+    """为尚未建索引（新增或文本变化）的查询计算签名并写入分桶，返回建索引的查询数
+
+    query_ids 限定范围，默认所有未建索引的查询；limit 为本次最多处理的查询数
+    """
+    queries = QueryModel.__table__
+    minhash = QueryMinHashModel.__table__
+    stmt = (
+        select(queries.c.id, queries.c.lazy_query, queries.c.detail_query)
+        .where(~exists().where(minhash.c.query_id == queries.c.id))
+        .order_by(queries.c.id)
+    )
+    if query_ids is not None:
+        query_ids = [query_id for query_id in query_ids if query_id is not None]
+        if not query_ids:
+            return 0
+        stmt = stmt.where(queries.c.id.in_(query_ids))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    rows = conn.execute(stmt).all()
+    if not rows:
+        return 0
+    signature_rows, bucket_rows = [], []
+    for query_id, lazy_query, detail_query in rows:
+        signature = minhash_signature(query_text(lazy_query, detail_query))
+        signature_rows.append((query_id, None if signature is None else signature.tobytes()))
+        if signature is not None:
+            bucket_rows.extend((band, bucket, query_id) for band, bucket in band_buckets(signature))
+    # 每个查询 BANDS 行分桶，直接走驱动的 executemany；按主键排序后插入，B 树按顺序写页
+    if bucket_rows:
+        bucket_rows.sort()
+        conn.exec_driver_sql(LSH_INSERT_SQL, bucket_rows)
+    conn.exec_driver_sql(MINHASH_INSERT_SQL, signature_rows)
+    return len(rows)
+
+
+def pending_count(conn):
+    """尚未建索引的查询数，由 table_stats 中两表的行数相减得出（O(1)）；统计行缺失时返回 None"""
+    counts = dict(conn.execute(
+        select(TableStatsModel.table_name, TableStatsModel.row_count)
+        .where(TableStatsModel.table_name.in_([QueryModel.__tablename__, QueryMinHashModel.__tablename__]))
+    ).all())
+    if len(counts) < 2:
+        return None
+    return counts[QueryModel.__tablename__] - counts[QueryMinHashModel.__tablename__]
+
+
+class _DisjointSet:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        parent = self.parent.setdefault(item, item)
+        while parent != item:
+            grandparent = self.parent[parent]
+            self.parent[item] = grandparent
+            item, parent = parent, grandparent
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # 较小的ID（更早入库的查询）作为根，即簇的代表
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+class QueryDedupIndex(BaseForm):
+    """近似重复查询索引"""
+
+    def __init__(self, db_path="app.db"):
+        super().__init__(db_path, QueryMinHashModel)
+
+    def refresh(self, batch_size: int = BATCH_SIZE) -> int:
+        """为所有未建索引的查询补齐签名（分批提交），返回处理的查询数"""
+        total = 0
+        try:
+            # 每次检索前都会调用：签名行数与查询行数一致时跳过反连接扫描
+            with self.read_engine.connect() as conn:
+                if pending_count(conn) == 0:
+                    return 0
+            while True:
+                with self.engine.begin() as conn:
+                    indexed = index_queries(conn, limit=batch_size)
+                total += indexed
+                if indexed < batch_size:
+                    return total
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 更新查询索引失败: {e}[/red]")
+            return total
+
+    def _read_signatures(self, conn, query_ids) -> dict:
+        minhash = QueryMinHashModel.__table__
+        query_ids = list(query_ids)
+        signatures = {}
+        for start in range(0, len(query_ids), SQL_CHUNK):
+            rows = conn.execute(
+                select(minhash.c.query_id, minhash.c.signature)
+                .where(minhash.c.query_id.in_(query_ids[start:start + SQL_CHUNK]))
+            ).all()
+            signatures.update((query_id, _load_signature(blob)) for query_id, blob in rows)
+        return signatures
+
+    def find_similar_queries(self, text: str, threshold: float = DEFAULT_THRESHOLD,
+                             limit: int = 10, exclude_ids: list = None) -> list:
+        """与 text 近似重复的查询，按相似度从高到低
+
+        Returns:
+            [{query_id, similarity, lazy_query, detail_query}]
+        """
+        signature = minhash_signature(text)
+        if signature is None:
+            return []
+        self.refresh()
+        lsh = QueryLshModel.__table__
+        queries = QueryModel.__table__
+        excluded = set(exclude_ids or ())
+        try:
+            with self.read_engine.connect() as conn:
+                # 逐段 (band = ? AND bucket = ?) 用 OR 连接，规划器对每段做一次主键查找；
+                # 写成行值 IN 或加 DISTINCT 都会退化为扫描 query_id 索引
+                candidates = conn.execute(
+                    select(lsh.c.query_id).where(or_(*(
+                        and_(lsh.c.band == band, lsh.c.bucket == bucket) for band, bucket in band_buckets(signature)
+                    )))
+                ).scalars().all()
+                scored = []
+                for query_id, other in self._read_signatures(conn, set(candidates) - excluded).items():
+                    similarity = signature_similarity(signature, other)
+                    if similarity >= threshold:
+                        scored.append((similarity, query_id))
+                scored.sort(key=lambda item: (-item[0], item[1]))
+                scored = scored[:limit]
+                texts = {
+                    row.id: row for row in conn.execute(
+                        select(queries.c.id, queries.c.lazy_query, queries.c.detail_query)
+                        .where(queries.c.id.in_([query_id for _, query_id in scored]))
+                    )
+                }
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 查找相似查询失败: {e}[/red]")
+            return []
+        return [
+            {
+                "query_id": query_id,
+                "similarity": round(similarity, 4),
+                "lazy_query": texts[query_id].lazy_query,
+                "detail_query": texts[query_id].detail_query,
+            }
+            for similarity, query_id in scored if query_id in texts
+        ]
+
+    def find_duplicates(self, query_id: int, threshold: float = DEFAULT_THRESHOLD, limit: int = 10) -> list:
+        """与已有查询近似重复的其他查询"""
+        try:
+            with self.read_engine.connect() as conn:
+                row = conn.execute(
+                    select(QueryModel.lazy_query, QueryModel.detail_query).where(QueryModel.id == query_id)
+                ).first()
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 查询失败: {e}[/red]")
+            return []
+        if row is None:
+            return []
+        return self.find_similar_queries(
+            query_text(row.lazy_query, row.detail_query), threshold, limit, exclude_ids=[query_id]
+        )
+
+    def dedup_report(self, threshold: float = DEFAULT_THRESHOLD, max_bucket: int = MAX_BUCKET_PAIRS) -> dict:
+        """全库近似重复报告：同桶候选对 → 签名相似度过滤 → 并查集聚簇，时间近似线性
+
+        Returns:
+            {indexed, candidate_pairs, duplicate_pairs, duplicate_queries, seconds,
+             clusters: [{representative, query_ids, min_similarity, evaluations}]}，簇按大小从大到小
+        """
+        started = time.perf_counter()
+        self.refresh()
+        lsh = QueryLshModel.__table__
+        try:
+            with self.read_engine.connect() as conn:
+                indexed = conn.execute(select(func.count()).select_from(QueryMinHashModel.__table__)).scalar()
+                pairs = set()
+                members = func.group_concat(lsh.c.query_id)
+                buckets = conn.execute(
+                    select(members).group_by(lsh.c.band, lsh.c.bucket).having(func.count() > 1)
+                ).scalars()
+                for bucket in buckets:
+                    ids = sorted(int(query_id) for query_id in bucket.split(","))
+                    if len(ids) > max_bucket:
+                        pairs.update((ids[0], other) for other in ids[1:])
+                    else:
+                        pairs.update((a, b) for k, a in enumerate(ids) for b in ids[k + 1:])
+
+                signatures = self._read_signatures(conn, {query_id for pair in pairs for query_id in pair})
+                clusters = _DisjointSet()
+                edges = {}
+                for a, b in pairs:
+                    similarity = signature_similarity(signatures.get(a), signatures.get(b))
+                    if similarity >= threshold:
+                        clusters.union(a, b)
+                        edges[(a, b)] = similarity
+
+                groups = {}
+                for query_id in clusters.parent:
+                    groups.setdefault(clusters.find(query_id), []).append(query_id)
+                lowest = {}
+                for (a, b), similarity in edges.items():
+                    root = clusters.find(a)
+                    lowest[root] = min(lowest.get(root, 1.0), similarity)
+
+                evaluation_counts = {}
+                grouped_ids = [query_id for ids in groups.values() for query_id in ids]
+                for start in range(0, len(grouped_ids), SQL_CHUNK):
+                    evaluation_counts.update(conn.execute(
+                        select(EvaluationModel.query_id, func.count())
+                        .where(EvaluationModel.query_id.in_(grouped_ids[start:start + SQL_CHUNK]))
+                        .group_by(EvaluationModel.query_id)
+                    ).all())
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 生成去重报告失败: {e}[/red]")
+            return None
+
+        report_clusters = sorted(
+            (
+                {
+                    "representative": root,
+                    "query_ids": sorted(ids),
+                    "min_similarity": round(lowest[root], 4),
+                    "evaluations": sum(evaluation_counts.get(query_id, 0) for query_id in ids),
+                }
+                for root, ids in groups.items()
+            ),
+            key=lambda cluster: (-len(cluster["query_ids"]), cluster["representative"]),
+        )
+        return {
+            "indexed": indexed,
+            "candidate_pairs": len(pairs),
+            "duplicate_pairs": len(edges),
+            "duplicate_queries": sum(len(cluster["query_ids"]) - 1 for cluster in report_clusters),
+            "clusters": report_clusters,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def display_dedup_report(self, report: dict, limit: int = 20):
+        """展示去重报告中最大的若干个簇"""
+        if report is None:
+            return
+        console = Console()
+        console.print(
+            f"已索引 {report['indexed']} 个查询，候选对 {report['candidate_pairs']}，"
+            f"近似重复对 {report['duplicate_pairs']}，可合并查询 {report['duplicate_queries']}，耗时 {report['seconds']}s"
+        )
+        table = Table(title="近似重复查询簇")
+        table.add_column("代表查询", style="cyan", justify="right")
+        table.add_column("查询数", style="green", justify="right")
+        table.add_column("最低相似度", style="yellow", justify="right")
+        table.add_column("评估数", style="magenta", justify="right")
+        table.add_column("查询ID", style="white")
+        for cluster in report["clusters"][:limit]:
+            ids = cluster["query_ids"]
+            table.add_row(
+                str(cluster["representative"]), str(len(ids)), f"{cluster['min_similarity']:.2f}",
+                str(cluster["evaluations"]), escape(", ".join(map(str, ids[:10])) + (" …" if len(ids) > 10 else "")),
+            )
+        console.print(table)
+
+    def rebuild(self) -> int:
+        """清空签名与分桶后全部重建，返回建索引的查询数"""
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(delete(QueryLshModel.__table__))
+                conn.execute(delete(QueryMinHashModel.__table__))
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 清空查询索引失败: {e}[/red]")
+            return 0
+        return self.refresh()
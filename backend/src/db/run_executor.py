@@ -0,0 +1,410 @@
+"""
+agent 运行编排
+
+把一批查询分发给若干 agent 并发运行，运行结果（轨迹、报告、交付文件）直接写成评估：
+- asyncio 调度：每个 agent 有自己的并发上限（adapter.max_concurrency），另有全局上限
+- 每次运行有超时（adapter.timeout），失败或超时按指数退避重试，最多 max_attempts 次
+- 轨迹入库前经 trajectory_schema 校验并规范化，格式错误的运行直接记为失败（不重试）
+- 写入经 WriteQueue 的单写入者组提交，提交前已释放并发名额，记账开销不再限制吞吐
+
+同一次 run() 产生的评估共享一个 run_id（默认按时间生成），与 (query_id, agent) 组成自然键，
+重复执行同一批次不会产生重复评估。
+
+agent 适配器实现 async run(query) -> dict，返回
+    {"trajectory": 步骤数组或 JSON 文本, "report_content": str, "deliverables": [{"filename", "content"}]}
+内置适配器：
+- StubAgent: 本地桩 agent，按查询内容确定性地生成轨迹，可模拟延迟与失败，用于测试与压测
+- CallableAgent: 包装普通函数，在线程池或进程池中执行（CPU 密集的本地 agent 用进程池）
+- SubprocessAgent: 启动外部命令，查询文本写入 stdin，stdout 输出上面的 JSON
+
+用法：
+    executor = RunExecutor("app.db", [StubAgent("stub-a"), SubprocessAgent("cli", ["my-agent"])])
+    report = executor.run(query_ids)
+    executor.display_report(report)
+
+可用方法
+run
+run_async
+run_work_items
+display_report
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, Progress, TextColumn, BarColumn, TaskProgressColumn, TimeElapsedColumn, Table
+
+from .engine import create_read_engine
+from .models import QueryModel
+from .trajectory_schema import TrajectoryValidationError, normalize_trajectory_json
+from .write_queue import WriteQueue
+
+DEFAULT_TIMEOUT = 600.0
+DEFAULT_CONCURRENCY = 4
+
+
+class AgentRunError(RuntimeError):
+    """agent 运行失败（适配器抛出，可重试）"""
+
+
+# ---------- 适配器 ----------
+
+class AgentAdapter:
+    """agent 适配器基类
+
+    Attributes:
+        name: agent 名称，写入 evaluation_form.agent
+        max_concurrency: 该 agent 同时运行的上限
+        timeout: 单次运行超时（秒）
+    """
+
+    def __init__(self, name: str, max_concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+    async def run(self, query: dict) -> dict:
+        """运行一个查询；query 为 {id, detail_query, lazy_query, priority}"""
+        raise NotImplementedError
+
+
+class StubAgent(AgentAdapter):
+    """本地桩 agent：按 (agent, 查询内容) 确定性地生成轨迹与交付文件"""
+
+    def __init__(self, name: str = "stub", steps: int = 3, delay: float = 0.0,
+                 fail_times: int = 0, **kwargs):
+        """
+        Args:
+            steps: 每条轨迹的步骤数
+            delay: 每次运行的模拟耗时（秒）
+            fail_times: 每个查询的前 fail_times 次运行抛出 AgentRunError（模拟不稳定的 agent）
+        """
+        super().__init__(name, **kwargs)
+        self.steps = steps
+        self.delay = delay
+        self.fail_times = fail_times
+        self.calls = {}
+        self.active = 0
+        self.max_active = 0
+
+    async def run(self, query: dict) -> dict:
+        self.calls[query["id"]] = self.calls.get(query["id"], 0) + 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            if self.calls[query["id"]] <= self.fail_times:
+                raise AgentRunError(f"{self.name} 模拟失败（第 {self.calls[query['id']]} 次）")
+            return self.build_result(query)
+        finally:
+            self.active -= 1
+
+    def build_result(self, query: dict) -> dict:
+        text = query.get("detail_query") or ""
+        seed = hashlib.sha256(f"{self.name}\0{text}".encode("utf-8")).hexdigest()
+        rng = random.Random(seed)
+        history = [{"role": "user", "content": [{"type": "text", "text": text}]}]
+        start = time.time()
+        steps = []
+        for i in range(1, self.steps + 1):
+            input_tokens, output_tokens = rng.randint(100, 2000), rng.randint(10, 500)
+            output = {"role": "assistant", "content": f"{self.name} 第 {i} 步"}
+            steps.append({
+                "step": i,
+                "task": text if i == 1 else None,
+                "timing": {"start_time": start, "end_time": start + 0.001, "duration": 0.001},
+                "token_usage": {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                "total_tokens": input_tokens + output_tokens},
+                "model_input_messages": list(history),
+                "tool_calls": [],
+                "model_output_message": output,
+                "error": None,
+            })
+            history.append(output)
+            start += 0.001
+        answer = f"# {self.name}\n\n{text}\n\n结论编号 {seed[:8]}\n".encode("utf-8")
+        return {
+            "trajectory": steps,
+            "report_content": f"# {self.name} 报告\n\n共 {self.steps} 步。",
+            "deliverables": [{"filename": "answer.md", "content": answer}],
+        }
+
+
+class CallableAgent(AgentAdapter):
+    """包装同步函数 fn(query) -> dict；use_processes=True 时在进程池中执行（fn 需可被 pickle）
+
+    注意：超时只能让编排器放弃等待，线程/进程中的函数会继续执行到结束
+    """
+
+    def __init__(self, name: str, fn, use_processes: bool = False, **kwargs):
+        super().__init__(name, **kwargs)
+        self.fn = fn
+        self.use_processes = use_processes
+        self._pool = None
+
+    async def run(self, query: dict) -> dict:
+        if self._pool is None:
+            pool_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            self._pool = pool_class(max_workers=self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, self.fn, query)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class SubprocessAgent(AgentAdapter):
+    """外部命令 agent：查询文本写入 stdin，stdout 输出结果 JSON；超时时终止进程"""
+
+    def __init__(self, name: str, command: list, **kwargs):
+        super().__init__(name, **kwargs)
+        self.command = list(command)
+
+    async def run(self, query: dict) -> dict:
+        process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await process.communicate((query.get("detail_query") or "").encode("utf-8"))
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        if process.returncode != 0:
+            raise AgentRunError(f"{self.name} 退出码 {process.returncode}: {stderr.decode('utf-8', 'replace')[-500:]}")
+        try:
+            return json.loads(stdout)
+        except ValueError as e:
+            raise AgentRunError(f"{self.name} 输出不是 JSON: {e}") from e
+
+
+# ---------- 编排 ----------
+
+class RunExecutor:
+    """agent 运行编排器"""
+
+    def __init__(
+        self, db_path: str = "app.db", adapters: list = None, max_concurrency: int = 64,
+        max_attempts: int = 3, retry_backoff: float = 0.5, validate: bool = True,
+        run_id: str = None, write_queue_options: dict = None
+    ):
+        """
+        Args:
+            adapters: AgentAdapter 列表，名称不能重复
+            max_concurrency: 所有 agent 合计的并发上限
+            max_attempts: 每个 (查询, agent) 最多运行次数（含首次）
+            retry_backoff: 首次重试前的等待秒数，之后每次翻倍
+            validate: 入库前校验并规范化轨迹
+            run_id: 本批运行的 run_id，默认按时间生成
+            write_queue_options: 传给 WriteQueue 的参数（max_batch、max_latency 等）
+        """
+        adapters = list(adapters or [])
+        names = [adapter.name for adapter in adapters]
+        if len(set(names)) != len(names):
+            raise ValueError("agent 名称不能重复")
+        self.db_path = db_path
+        self.adapters = {adapter.name: adapter for adapter in adapters}
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.validate = validate
+        self.run_id = run_id or f"run-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.write_queue_options = write_queue_options or {}
+
+    def _load_queries(self, queries) -> list:
+        """queries 可以是 QueryModel 对象、{id, detail_query} dict 或查询ID"""
+        loaded, ids = [], []
+        for query in queries:
+            if isinstance(query, int):
+                ids.append(query)
+            elif isinstance(query, dict):
+                loaded.append(query)
+            else:
+                loaded.append({
+                    "id": query.id, "detail_query": query.detail_query,
+                    "lazy_query": query.lazy_query, "priority": query.priority,
+                })
+        if ids:
+            engine = create_read_engine(self.db_path)
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(
+                        select(QueryModel.id, QueryModel.detail_query, QueryModel.lazy_query, QueryModel.priority)
+                        .where(QueryModel.id.in_(ids))
+                    ).mappings().all()
+            finally:
+                engine.dispose()
+            by_id = {row["id"]: dict(row) for row in rows}
+            missing = [query_id for query_id in ids if query_id not in by_id]
+            if missing:
+                raise ValueError(f"查询不存在: {missing[:10]}")
+            loaded.extend(by_id[query_id] for query_id in ids)
+        return loaded
+
+    def run(self, queries, agents: list = None, show_progress: bool = False) -> dict:
+        """同步入口：运行 queries × agents（默认全部 agent），返回报告"""
+        return asyncio.run(self.run_async(queries, agents, show_progress=show_progress))
+
+    async def run_async(self, queries, agents: list = None, show_progress: bool = False) -> dict:
+        """运行 queries × agents（默认全部 agent），返回报告 dict"""
+        queries = self._load_queries(queries)
+        agents = list(agents) if agents is not None else list(self.adapters)
+        return await self._run_pairs([(query, name) for query in queries for name in agents], show_progress)
+
+    async def _run_pairs(self, pairs: list, show_progress: bool = False, on_result=None) -> dict:
+        """运行 [(query, agent)]
+
+        Args:
+            on_result: 每个 (查询, agent) 结束后调用 on_result(query, agent, evaluation_id, error)，
+                evaluation_id 为写入提交后的评估ID（失败时为 None）
+        """
+        agents = list(dict.fromkeys(name for _, name in pairs))
+        unknown = [name for name in agents if name not in self.adapters]
+        if unknown:
+            raise ValueError(f"未注册的 agent: {', '.join(unknown)}")
+
+        report = {
+            "run_id": self.run_id, "runs": len(pairs), "succeeded": 0, "failed": 0,
+            "retries": 0, "timeouts": 0, "evaluation_ids": {}, "errors": [],
+            "per_agent": {name: {"succeeded": 0, "failed": 0, "run_seconds": 0.0} for name in agents},
+        }
+        limits = {name: asyncio.Semaphore(self.adapters[name].max_concurrency) for name in agents}
+        overall = asyncio.Semaphore(self.max_concurrency)
+        start = time.perf_counter()
+
+        progress = Progress(
+            TextColumn("[cyan]运行 agent"), BarColumn(), TaskProgressColumn(), TimeElapsedColumn(),
+            disable=not show_progress,
+        )
+        with progress, WriteQueue(self.db_path, **self.write_queue_options) as writes:
+            task_id = progress.add_task("runs", total=report["runs"])
+
+            async def one(query, name):
+                evaluation_id = None
+                async with limits[name], overall:
+                    result, error = await self._run_with_retries(self.adapters[name], query, report)
+                if result is not None:
+                    # 运行协程只提交写操作；等待提交时已释放并发名额
+                    try:
+                        future = writes.add_evaluation(
+                            query_id=query["id"], agent=name, run_id=self.run_id,
+                            trajectory=result["trajectory"], report_content=result.get("report_content"),
+                            deliverables=result.get("deliverables"),
+                        )
+                        evaluation_id = await asyncio.wrap_future(future)
+                    except (SQLAlchemyError, ValueError) as e:
+                        error = f"写入失败: {e}"
+                if error is None:
+                    report["succeeded"] += 1
+                    report["per_agent"][name]["succeeded"] += 1
+                    report["evaluation_ids"][(query["id"], name)] = evaluation_id
+                else:
+                    report["failed"] += 1
+                    report["per_agent"][name]["failed"] += 1
+                    report["errors"].append((query["id"], name, error))
+                progress.advance(task_id)
+                if on_result is not None:
+                    on_result(query, name, evaluation_id, error)
+
+            await asyncio.gather(*(one(query, name) for query, name in pairs))
+
+        for adapter in self.adapters.values():
+            if hasattr(adapter, "close"):
+                adapter.close()
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        report["runs_per_s"] = round(report["runs"] / report["seconds"], 2) if report["seconds"] else 0.0
+        return report
+
+    async def _run_with_retries(self, adapter: AgentAdapter, query: dict, report: dict):
+        """返回 (规范化后的结果, None) 或 (None, 错误信息)"""
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt > 1:
+                report["retries"] += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 2))
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(adapter.run(query), adapter.timeout)
+            except asyncio.TimeoutError:
+                report["timeouts"] += 1
+                error = f"超时（{adapter.timeout}s）"
+                continue
+            except Exception as e:  # 适配器的任何异常都按可重试失败处理
+                error = f"{type(e).__name__}: {e}"
+                continue
+            finally:
+                report["per_agent"][adapter.name]["run_seconds"] += time.perf_counter() - started
+            try:
+                return self._prepare(result), None
+            except (TrajectoryValidationError, ValueError, TypeError) as e:
+                return None, f"结果格式错误: {e}"
+        return None, error
+
+    def _prepare(self, result: dict) -> dict:
+        if not isinstance(result, dict):
+            raise ValueError("适配器应返回 dict")
+        trajectory = result.get("trajectory")
+        if trajectory is not None and not isinstance(trajectory, (str, bytes)):
+            trajectory = json.dumps(trajectory, ensure_ascii=False)
+        if trajectory is not None and self.validate:
+            trajectory = normalize_trajectory_json(trajectory)
+        elif isinstance(trajectory, bytes):
+            trajectory = trajectory.decode("utf-8")
+        return dict(result, trajectory=trajectory)
+
+    def run_work_items(self, scheduler, owner: str, batch_size: int = 32, show_progress: bool = False) -> dict:
+        """从 WorkScheduler 领取本编排器已注册 agent 的任务并运行，直到队列为空
+
+        成功的任务标记为完成并关联评估，失败的任务释放回队列（由调度器按领取次数决定是否放弃）
+        """
+        totals = {"runs": 0, "succeeded": 0, "failed": 0, "batches": 0}
+        while True:
+            items = scheduler.claim(owner, n=batch_size, agents=list(self.adapters))
+            if not items:
+                return totals
+            by_key = {(item["query_id"], item["agent"]): item for item in items}
+            queries = {query["id"]: query for query in self._load_queries(list({item["query_id"] for item in items}))}
+
+            def settle(query, agent, evaluation_id, error):
+                item = by_key[(query["id"], agent)]
+                if error is None:
+                    scheduler.complete(item["id"], item["lease_token"], evaluation_id=evaluation_id)
+                else:
+                    scheduler.release(item["id"], item["lease_token"], error=error)
+
+            pairs = [(queries[item["query_id"]], item["agent"]) for item in items]
+            report = asyncio.run(self._run_pairs(pairs, show_progress, on_result=settle))
+            for key in ("runs", "succeeded", "failed"):
+                totals[key] += report[key]
+            totals["batches"] += 1
+
+    def display_report(self, report: dict):
+        """展示运行报告"""
+        console = Console()
+        table = Table(title=f"agent 运行报告 ({report['run_id']})")
+        table.add_column("agent", style="cyan")
+        table.add_column("成功", style="green", justify="right")
+        table.add_column("失败", style="red", justify="right")
+        table.add_column("运行耗时 (s)", style="yellow", justify="right")
+        for name, stats in report["per_agent"].items():
+            table.add_row(name, str(stats["succeeded"]), str(stats["failed"]), f"{stats['run_seconds']:.2f}")
+        console.print(table)
+        console.print(
+            f"共 {report['runs']} 次运行，成功 {report['succeeded']}，失败 {report['failed']}，"
+            f"重试 {report['retries']}，超时 {report['timeouts']}，"
+            f"耗时 {report['seconds']}s（{report['runs_per_s']} 次/秒）"
+        )
+        for query_id, agent, error in report["errors"][:10]:
+            console.print(f"[red]✗ 查询 {query_id} / {agent}: {error}[/red]")
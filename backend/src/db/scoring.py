@@ -0,0 +1,406 @@
+"""
+自动评分
+
+对评估批量打分并写回 evaluation_form.quality_score，评委（judge）可插拔：
+- RuleJudge: 规则检查（轨迹非空、无出错步骤、有最终输出、报告非空……），按权重给分
+- LocalJudge: 确定性的本地替身评委，按轨迹与报告的特征打分，无需外部服务，用于测试与离线环境
+- ModelJudge: 模型评委，调用方提供 complete(prompt) -> str（例如封装某个模型 API），从回复中解析分数
+
+流水线：
+- 按 id 分页读取评估（只读引擎），每个评委的输入按 batch_size 分批，不同评委、不同批次在线程池中并行
+- 评委输出缓存在 judge_cache 表，键为 (评委名, 评委版本, 轨迹哈希, 报告哈希)；
+  轨迹哈希直接对库中存储的文本计算，命中缓存的评估不需要解析轨迹
+- 调整某个评委后只需提升它的 version，重新评分时只有该评委会重新计算，其余全部命中缓存
+- 多个评委的分数按权重平均后取整写回，分数未变化的评估不会被更新
+
+用法：
+    pipeline = ScoringPipeline("app.db", [RuleJudge(), LocalJudge(weight=2)])
+    report = pipeline.score(only_unscored=True)
+    pipeline.display_report(report)
+
+可用方法
+score
+display_report
+"""
+
+import hashlib
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, Table
+
+from .engine import create_sqlite_engine, create_read_engine
+from .models import EvaluationModel, QueryModel, JudgeCacheModel
+from .trajectory_store import load_trajectory
+
+DEFAULT_BATCH_SIZE = 32
+PAGE_SIZE = 500
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def content_hash(text) -> str:
+    """缓存键使用的内容哈希（None 与空字符串相同）"""
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    return hashlib.sha256(text or b"").hexdigest()
+
+
+def _clamp(score) -> float:
+    return max(0.0, min(100.0, float(score)))
+
+
+# ---------- 评委 ----------
+
+class Judge:
+    """评委基类
+
+    Attributes:
+        name: 评委名称（缓存键的一部分）
+        version: 评委版本，修改评分逻辑后提升版本使旧缓存失效
+        weight: 合成总分时的权重
+        batch_size: 每批交给 score_batch 的评估数
+    """
+
+    name = "judge"
+    version = "1"
+
+    def __init__(self, name: str = None, version: str = None, weight: float = 1.0, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.name = name or self.name
+        self.version = str(version or self.version)
+        self.weight = weight
+        self.batch_size = batch_size
+
+    def score_batch(self, items: list) -> list:
+        """对一批评估打分
+
+        Args:
+            items: [{evaluation_id, query, agent, trajectory(步骤列表或 None), report_content}]
+
+        Returns:
+            与 items 一一对应的 [{"score": 0-100, "details": dict}]
+        """
+        return [self.score_one(item) for item in items]
+
+    def score_one(self, item: dict) -> dict:
+        raise NotImplementedError
+
+
+def _steps(item: dict) -> list:
+    trajectory = item.get("trajectory")
+    return trajectory if isinstance(trajectory, list) else []
+
+
+def _final_output(steps: list) -> str:
+    if not steps or not isinstance(steps[-1], dict):
+        return ""
+    message = steps[-1].get("model_output_message") or {}
+    content = message.get("content") if isinstance(message, dict) else None
+    if isinstance(content, list):
+        return " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content or ""
+
+
+DEFAULT_RULES = (
+    ("has_trajectory", lambda item: bool(_steps(item)), 1.0),
+    ("no_step_errors", lambda item: not any(isinstance(s, dict) and s.get("error") for s in _steps(item)), 1.0),
+    ("has_final_output", lambda item: bool(_final_output(_steps(item)).strip()), 1.0),
+    ("has_report", lambda item: bool((item.get("report_content") or "").strip()), 1.0),
+)
+
+
+class RuleJudge(Judge):
+    """规则评委：每条规则 (名称, 检查函数, 权重)，检查函数返回 bool 或 0-1 的分值"""
+
+    name = "rules"
+
+    def __init__(self, rules=DEFAULT_RULES, **kwargs):
+        super().__init__(**kwargs)
+        self.rules = tuple(rules)
+
+    def score_one(self, item: dict) -> dict:
+        total = sum(weight for _, _, weight in self.rules) or 1.0
+        results = {}
+        earned = 0.0
+        for rule_name, check, weight in self.rules:
+            value = float(check(item))
+            results[rule_name] = value
+            earned += weight * value
+        return {"score": _clamp(100 * earned / total), "details": results}
+
+
+class LocalJudge(Judge):
+    """确定性的本地替身评委：步骤完成度、出错率、报告充实度、token 效率的加权组合"""
+
+    name = "local"
+
+    def __init__(self, target_steps: int = 8, target_report_chars: int = 400, **kwargs):
+        super().__init__(**kwargs)
+        self.target_steps = target_steps
+        self.target_report_chars = target_report_chars
+
+    def score_one(self, item: dict) -> dict:
+        steps = _steps(item)
+        errors = sum(1 for step in steps if isinstance(step, dict) and step.get("error"))
+        tokens = sum(
+            (step.get("token_usage") or {}).get("total_tokens") or 0
+            for step in steps if isinstance(step, dict)
+        )
+        report = item.get("report_content") or ""
+        features = {
+            "completion": min(1.0, len(steps) / self.target_steps) if steps else 0.0,
+            "reliability": 1.0 - errors / len(steps) if steps else 0.0,
+            "report": min(1.0, len(report.strip()) / self.target_report_chars),
+            "efficiency": 1.0 / (1.0 + tokens / 100_000),
+        }
+        score = 100 * (0.3 * features["completion"] + 0.3 * features["reliability"]
+                       + 0.3 * features["report"] + 0.1 * features["efficiency"])
+        return {"score": _clamp(score), "details": {key: round(value, 4) for key, value in features.items()}}
+
+
+DEFAULT_PROMPT = (
+    "你是智能体评测的评委。根据任务、智能体轨迹摘要与最终报告，给出 0-100 的整数分数，"
+    "只在第一行输出分数。\n\n任务:\n{query}\n\n轨迹摘要:\n{summary}\n\n报告:\n{report}\n"
+)
+SCORE_RE = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+class ModelJudge(Judge):
+    """模型评委：complete(prompt) -> str 由调用方提供，批内请求在线程池中并发发送"""
+
+    name = "model"
+
+    def __init__(self, complete, prompt_template: str = DEFAULT_PROMPT, max_workers: int = 8,
+                 max_summary_steps: int = 20, **kwargs):
+        super().__init__(**kwargs)
+        self.complete = complete
+        self.prompt_template = prompt_template
+        self.max_workers = max_workers
+        self.max_summary_steps = max_summary_steps
+
+    def build_prompt(self, item: dict) -> str:
+        lines = []
+        for step in _steps(item)[:self.max_summary_steps]:
+            if not isinstance(step, dict):
+                continue
+            calls = [call.get("function", {}).get("name", "?") for call in step.get("tool_calls") or []]
+            line = f"{step.get('step')}. 工具: {', '.join(calls) or '无'}"
+            if step.get("error"):
+                line += f"；错误: {step['error']}"
+            lines.append(line)
+        return self.prompt_template.format(
+            query=item.get("query") or "", summary="\n".join(lines) or "（无轨迹）",
+            report=item.get("report_content") or "（无报告）",
+        )
+
+    def score_one(self, item: dict) -> dict:
+        reply = self.complete(self.build_prompt(item))
+        match = SCORE_RE.search(reply or "")
+        if not match:
+            raise ValueError(f"无法从评委回复中解析分数: {reply[:200]!r}")
+        return {"score": _clamp(match.group()), "details": {"reply": reply[:2000]}}
+
+    def score_batch(self, items: list) -> list:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self.score_one, items))
+
+
+# ---------- 流水线 ----------
+
+class ScoringPipeline:
+    """批量评分流水线"""
+
+    def __init__(self, db_path: str = "app.db", judges: list = None, max_workers: int = 4, write_scores: bool = True):
+        """
+        Args:
+            judges: Judge 列表，名称不能重复
+            max_workers: 并行执行评委批次的线程数
+            write_scores: 是否把合成分数写回 quality_score
+        """
+        judges = list(judges or [LocalJudge()])
+        names = [judge.name for judge in judges]
+        if len(set(names)) != len(names):
+            raise ValueError("评委名称不能重复")
+        self.db_path = db_path
+        self.judges = judges
+        self.max_workers = max_workers
+        self.write_scores = write_scores
+        self.engine = create_sqlite_engine(db_path)
+        self.read_engine = create_read_engine(db_path)
+
+    def __del__(self):
+        for engine in (getattr(self, "engine", None), getattr(self, "read_engine", None)):
+            if engine is not None:
+                engine.dispose()
+
+    def _pages(self, evaluation_ids, only_unscored: bool, agents):
+        """按 id 分页读取评估"""
+        table = EvaluationModel.__table__
+        cursor = 0
+        while True:
+            stmt = (
+                select(table.c.id, table.c.agent, table.c.trajectory, table.c.report_content,
+                       table.c.quality_score, QueryModel.detail_query)
+                .join(QueryModel.__table__, QueryModel.id == table.c.query_id)
+                .where(table.c.id > cursor).order_by(table.c.id).limit(PAGE_SIZE)
+            )
+            if evaluation_ids is not None:
+                stmt = stmt.where(table.c.id.in_(list(evaluation_ids)))
+            if only_unscored:
+                stmt = stmt.where(table.c.quality_score.is_(None))
+            if agents is not None:
+                stmt = stmt.where(table.c.agent.in_(list(agents)))
+            with self.read_engine.connect() as conn:
+                rows = conn.execute(stmt).mappings().all()
+            if not rows:
+                return
+            yield rows
+            cursor = rows[-1]["id"]
+
+    def _cached(self, conn, judge: Judge, keys: set) -> dict:
+        """读取缓存 {(轨迹哈希, 报告哈希): (score, details)}"""
+        table = JudgeCacheModel.__table__
+        found = {}
+        trajectory_hashes = list({key[0] for key in keys})
+        for start in range(0, len(trajectory_hashes), PAGE_SIZE):
+            rows = conn.execute(
+                select(table.c.trajectory_hash, table.c.report_hash, table.c.score, table.c.details)
+                .where(table.c.judge_name == judge.name, table.c.judge_version == judge.version)
+                .where(table.c.trajectory_hash.in_(trajectory_hashes[start:start + PAGE_SIZE]))
+            ).all()
+            for row in rows:
+                key = (row.trajectory_hash, row.report_hash)
+                if key in keys:
+                    found[key] = (row.score, row.details)
+        return found
+
+    def score(self, evaluation_ids: list = None, only_unscored: bool = False, agents: list = None) -> dict:
+        """对评估评分
+
+        Args:
+            evaluation_ids: 只评这些评估，默认全部
+            only_unscored: 只评 quality_score 为空的评估
+            agents: 只评这些 agent 的评估
+
+        Returns:
+            {evaluations, updated, failed, seconds, judges: {评委: {hits, misses, errors}}, scores: {评估ID: 分数}}
+        """
+        report = {
+            "evaluations": 0, "updated": 0, "failed": 0, "scores": {}, "errors": [],
+            "judges": {judge.name: {"hits": 0, "misses": 0, "errors": 0} for judge in self.judges},
+        }
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for rows in self._pages(evaluation_ids, only_unscored, agents):
+                    self._score_page(rows, pool, report)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 评分失败: {e}[/red]")
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        return report
+
+    def _score_page(self, rows: list, pool: ThreadPoolExecutor, report: dict):
+        keys = {row["id"]: (content_hash(row["trajectory"]), content_hash(row["report_content"])) for row in rows}
+        results = {judge.name: {} for judge in self.judges}
+        with self.read_engine.connect() as conn:
+            cached = {judge.name: self._cached(conn, judge, set(keys.values())) for judge in self.judges}
+
+        # 只有未命中缓存的评估需要解析轨迹
+        items, jobs = {}, []
+        for judge in self.judges:
+            misses = []
+            for row in rows:
+                key = keys[row["id"]]
+                if key in cached[judge.name]:
+                    results[judge.name][row["id"]] = cached[judge.name][key][0]
+                    report["judges"][judge.name]["hits"] += 1
+                else:
+                    if row["id"] not in items:
+                        items[row["id"]] = {
+                            "evaluation_id": row["id"], "query": row["detail_query"], "agent": row["agent"],
+                            "trajectory": load_trajectory(row["trajectory"]), "report_content": row["report_content"],
+                        }
+                    misses.append(items[row["id"]])
+            report["judges"][judge.name]["misses"] += len(misses)
+            for index in range(0, len(misses), judge.batch_size):
+                batch = misses[index:index + judge.batch_size]
+                jobs.append((judge, batch, pool.submit(judge.score_batch, batch)))
+
+        cache_rows = []
+        for judge, batch, future in jobs:
+            try:
+                outputs = future.result()
+                if len(outputs) != len(batch):
+                    raise ValueError(f"评委 {judge.name} 返回了 {len(outputs)} 个结果，应为 {len(batch)}")
+            except Exception as e:  # 评委失败只影响该批次，其余评委照常写入缓存
+                report["judges"][judge.name]["errors"] += len(batch)
+                report["errors"].append((judge.name, [item["evaluation_id"] for item in batch], str(e)))
+                continue
+            for item, output in zip(batch, outputs):
+                score = _clamp(output["score"])
+                results[judge.name][item["evaluation_id"]] = score
+                trajectory_hash, report_hash = keys[item["evaluation_id"]]
+                cache_rows.append({
+                    "judge_name": judge.name, "judge_version": judge.version,
+                    "trajectory_hash": trajectory_hash, "report_hash": report_hash, "score": score,
+                    "details": json.dumps(output.get("details") or {}, ensure_ascii=False), "created_at": _now(),
+                })
+
+        updates = []
+        for row in rows:
+            scored = [(judge.weight, results[judge.name][row["id"]])
+                      for judge in self.judges if row["id"] in results[judge.name]]
+            report["evaluations"] += 1
+            if len(scored) != len(self.judges):
+                report["failed"] += 1
+                continue
+            total_weight = sum(weight for weight, _ in scored) or 1.0
+            final = int(round(sum(weight * score for weight, score in scored) / total_weight))
+            report["scores"][row["id"]] = final
+            if final != row["quality_score"]:
+                updates.append({"b_id": row["id"], "b_score": final})
+
+        with self.engine.begin() as conn:
+            if cache_rows:
+                stmt = sqlite_insert(JudgeCacheModel.__table__)
+                conn.execute(stmt.on_conflict_do_update(
+                    index_elements=["judge_name", "judge_version", "trajectory_hash", "report_hash"],
+                    set_={"score": stmt.excluded.score, "details": stmt.excluded.details},
+                ), cache_rows)
+            if updates and self.write_scores:
+                table = EvaluationModel.__table__
+                conn.execute(
+                    update(table).where(table.c.id == bindparam("b_id"))
+                    .values(quality_score=bindparam("b_score"), updated_at=_now()),
+                    updates,
+                )
+                report["updated"] += len(updates)
+
+    def display_report(self, report: dict):
+        """展示评分报告"""
+        console = Console()
+        table = Table(title="自动评分报告")
+        table.add_column("评委", style="cyan")
+        table.add_column("版本", style="white")
+        table.add_column("缓存命中", style="green", justify="right")
+        table.add_column("重新计算", style="yellow", justify="right")
+        table.add_column("失败", style="red", justify="right")
+        for judge in self.judges:
+            stats = report["judges"][judge.name]
+            table.add_row(judge.name, judge.version, str(stats["hits"]), str(stats["misses"]), str(stats["errors"]))
+        console.print(table)
+        console.print(
+            f"共 {report['evaluations']} 条评估，更新分数 {report['updated']} 条，"
+            f"未能评分 {report['failed']} 条，耗时 {report['seconds']}s"
+        )
+        for judge_name, evaluation_ids, error in report["errors"][:10]:
+            console.print(f"[red]✗ {judge_name} 评估 {evaluation_ids[:5]}: {error}[/red]")
@@ -0,0 +1,95 @@
+"""
+表统计
+
+避免每次展示都对大表执行 SELECT COUNT(*)：
+- cached: 读取由触发器增量维护的 table_stats（精确，O(1)）；没有统计行的辅助表退化为 estimate
+- estimate: 读取 ANALYZE 生成的 sqlite_stat1，没有时用 MAX(rowid) - MIN(rowid) + 1 估算（O(log n)）
+- exact: 逐表 COUNT(*)（全表扫描）
+
+存储占用通过 dbstat 虚拟表统计（表本身 + 其索引），SQLite 未编译 dbstat 时返回 None。
+"""
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+COUNT_MODES = ("cached", "estimate", "exact")
+
+
+def get_row_counts(conn, tables: list, mode: str = "cached") -> dict:
+    """返回 {表名: (行数, 是否精确)}"""
+    if mode not in COUNT_MODES:
+        raise ValueError(f"count_mode 必须为 {', '.join(COUNT_MODES)} 之一")
+
+    counts = {}
+    if mode == "exact":
+        for table in tables:
+            counts[table] = (conn.execute(text(f'SELECT COUNT(*) FROM "{table}"')).scalar(), True)
+        return counts
+
+    remaining = list(tables)
+    if mode == "cached":
+        cached = _read_table_stats(conn)
+        for table in tables:
+            if table in cached:
+                counts[table] = (cached[table]["row_count"], True)
+        remaining = [table for table in tables if table not in counts]
+
+    stat1 = _read_sqlite_stat1(conn)
+    for table in remaining:
+        if table in stat1:
+            counts[table] = (stat1[table], False)
+        else:
+            counts[table] = (_rowid_estimate(conn, table), False)
+    return counts
+
+
+def get_byte_totals(conn) -> dict:
+    """返回 {表名: 内容列字节总数}，来自 table_stats"""
+    return {table: row["byte_total"] for table, row in _read_table_stats(conn).items()}
+
+
+def get_storage_sizes(conn):
+    """返回 {表名: 占用字节数(含索引)}；dbstat 不可用时返回 None"""
+    try:
+        rows = conn.execute(text(
+            "SELECT m.tbl_name AS table_name, SUM(s.pgsize) AS size "
+            "FROM dbstat AS s JOIN sqlite_master AS m ON s.name = m.name "
+            "WHERE s.aggregate = 1 GROUP BY m.tbl_name"
+        )).all()
+    except SQLAlchemyError:
+        return None
+    return {row.table_name: row.size for row in rows}
+
+
+def _read_table_stats(conn) -> dict:
+    try:
+        rows = conn.execute(text("SELECT table_name, row_count, byte_total FROM table_stats")).all()
+    except SQLAlchemyError:
+        return {}
+    return {row.table_name: row._asdict() for row in rows}
+
+
+def _read_sqlite_stat1(conn) -> dict:
+    """sqlite_stat1.stat 的第一个数字是表（或索引）的近似行数"""
+    try:
+        rows = conn.execute(text("SELECT tbl, stat FROM sqlite_stat1")).all()
+    except SQLAlchemyError:
+        return {}
+    estimates = {}
+    for row in rows:
+        try:
+            estimates[row.tbl] = max(estimates.get(row.tbl, 0), int(row.stat.split()[0]))
+        except (ValueError, IndexError, AttributeError):
+            continue
+    return estimates
+
+
+def _rowid_estimate(conn, table: str) -> int:
+    try:
+        row = conn.execute(text(f'SELECT MIN(rowid), MAX(rowid) FROM "{table}"')).first()
+    except SQLAlchemyError:
+        # WITHOUT ROWID 表（如 query_lsh）没有 rowid，只能计数
+        return conn.execute(text(f'SELECT COUNT(*) FROM "{table}"')).scalar()
+    if row is None or row[0] is None:
+        return 0
+    return row[1] - row[0] + 1
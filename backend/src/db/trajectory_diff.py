@@ -0,0 +1,436 @@
+"""
+轨迹对比
+
+两个 agent 在同一查询上的运行逐步对齐，说明差异出在哪一步、哪一类内容：
+- 每一步先归约为几个字段摘要：工具调用（名称 + 参数，不含每次运行都不同的调用ID）、模型输出、
+  错误、本步新追加的输入消息（工具结果等），以及工具名称序列
+- 对齐：全局序列对齐，字段完全相同记为 equal（+2），工具名称序列相同但内容不同记为 changed（+1），
+  其余不配对，空位 -1；用 Hirschberg 分治算法，时间 O(nm)、内存 O(n + m)，
+  对齐前先剥掉两条轨迹共同的前缀与后缀，相似的运行只对齐中间分叉的部分
+- 工具调用序列另外按最长公共子序列（位并行计算）统计共有调用数，并统计各自独有的调用
+- 结果为紧凑的差异摘要 + 逐步对齐行（只含步号、工具名与不同的字段），查看器按页读取，
+  需要某一步全文时再用 EvaluationForm.get_trajectory_step 取
+- 缓存在 trajectory_diff 表，评估对按 ID 从小到大存一份，按两条轨迹文本的哈希校验，轨迹修改后自动重算
+
+用法：
+    differ = TrajectoryDiff("app.db")
+    page = differ.get_alignment_page(12, 34, offset=0, limit=50)
+    differ.display_diff(12, 34)
+
+可用方法
+diff
+get_diff_summary
+get_alignment_page
+compare_on_query
+clear_cache
+display_diff
+"""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import select, delete, func, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, escape, Table
+
+from .base_form import BaseForm
+from .models import TrajectoryDiffModel, EvaluationModel
+from .scoring import content_hash
+from .trajectory_store import CompactTrajectory, encode_trajectory, load_trajectory
+
+DIFF_VERSION = "1"
+STEP_FIELDS = ("tool_calls", "model_output_message", "error", "new_messages")
+
+MATCH_SCORE = 2
+CHANGED_SCORE = 1
+MISMATCH_SCORE = -3  # 比两个空位（-2）更差，名称序列不同的步骤永不配对
+GAP_SCORE = -1
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _canonical(value) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def _tool_name(call) -> str:
+    if not isinstance(call, dict):
+        return "?"
+    function = call.get("function")
+    if isinstance(function, dict) and function.get("name"):
+        return function["name"]
+    return call.get("name") or "?"
+
+
+def _tool_signature(calls) -> list:
+    """工具调用去掉调用ID后的 (名称, 参数)"""
+    signature = []
+    for call in calls:
+        function = call.get("function") if isinstance(call, dict) else None
+        arguments = function.get("arguments") if isinstance(function, dict) else None
+        signature.append([_tool_name(call), arguments])
+    return signature
+
+
+def step_features(trajectory) -> list:
+    """把轨迹的每一步归约为 {"tools": 工具名称元组, 各 STEP_FIELDS: 规范化 JSON 文本}
+
+    trajectory 可以是步骤数组或 CompactTrajectory；新追加的消息按与上一步历史的共享前缀计算
+    """
+    if not isinstance(trajectory, CompactTrajectory):
+        trajectory = CompactTrajectory(encode_trajectory(list(trajectory or [])))
+    message_keys = [_canonical(message) for message in trajectory.messages]
+    features = []
+    previous = []
+    for index, step in enumerate(trajectory.steps):
+        step = step if isinstance(step, dict) else {}
+        history = trajectory.history_ids(index)
+        prefix = 0
+        limit = min(len(history), len(previous))
+        while prefix < limit and history[prefix] == previous[prefix]:
+            prefix += 1
+        previous = history
+        calls = step.get("tool_calls") if isinstance(step.get("tool_calls"), list) else []
+        features.append({
+            "tools": tuple(_tool_name(call) for call in calls),
+            "tool_calls": _canonical(_tool_signature(calls)),
+            "model_output_message": _canonical(step.get("model_output_message")),
+            "error": _canonical(step.get("error") or None),
+            "new_messages": "\n".join(message_keys[i] for i in history[prefix:]),
+        })
+    return features
+
+
+def _last_row(a, b, score, gap) -> list:
+    """a 与 b 的每个前缀的最优对齐得分（Needleman-Wunsch 的最后一行），只保留两行"""
+    previous = [k * gap for k in range(len(b) + 1)]
+    for i in a:
+        diagonal = previous[0]
+        left = diagonal + gap
+        current = [left]
+        for up, pair in zip(previous[1:], [score(i, j) for j in b]):
+            # 等价于 max(diagonal + pair, up + gap, left + gap)，内层循环避免函数调用
+            best = diagonal + pair
+            if up + gap > best:
+                best = up + gap
+            if left + gap > best:
+                best = left + gap
+            left = best
+            current.append(best)
+            diagonal = up
+        previous = current
+    return previous
+
+
+def align_sequences(n: int, m: int, score, gap: float = GAP_SCORE) -> list:
+    """Hirschberg 全局对齐：返回 [(i 或 None, j 或 None)]，score(i, j) 为第 i、j 项配对得分
+
+    时间 O(nm)，额外内存 O(n + m)
+    """
+    pairs = []
+
+    def solve(a: range, b: range):
+        if not a:
+            pairs.extend((None, j) for j in b)
+        elif not b:
+            pairs.extend((i, None) for i in a)
+        elif len(a) == 1:
+            i = a[0]
+            best, best_j = gap * (len(b) + 1), None
+            for j in b:
+                candidate = score(i, j) + gap * (len(b) - 1)
+                if candidate > best:
+                    best, best_j = candidate, j
+            if best_j is None:
+                pairs.append((i, None))
+            pairs.extend((i if j == best_j else None, j) for j in b)
+        else:
+            mid = len(a) // 2
+            left = _last_row(a[:mid], b, score, gap)
+            right = _last_row(a[mid:][::-1], b[::-1], score, gap)
+            width = len(b)
+            split = max(range(width + 1), key=lambda k: left[k] + right[width - k])
+            solve(a[:mid], b[:split])
+            solve(a[mid:], b[split:])
+
+    solve(range(n), range(m))
+    return pairs
+
+
+def _common_subsequence(a: list, b: list) -> int:
+    """最长公共子序列长度：位并行算法（Hyyrö 2004），b 的每个位置占整数的一位，每个 a 元素一次整数运算"""
+    masks = {}
+    for position, item in enumerate(b):
+        masks[item] = masks.get(item, 0) | (1 << position)
+    full = (1 << len(b)) - 1
+    row = full
+    for item in a:
+        matches = row & masks.get(item, 0)
+        row = ((row + matches) | (row - matches)) & full
+    return len(b) - bin(row).count("1")
+
+
+def _count_tools(names) -> dict:
+    counts = {}
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def diff_trajectories(steps_a, steps_b) -> dict:
+    """对齐两条轨迹，返回 {"summary": 差异摘要, "alignment": 逐步对齐行}"""
+    features_a, features_b = step_features(steps_a), step_features(steps_b)
+
+    # 完全相同的步骤编号为同一个整数，比较时不必逐字段比较字符串
+    signatures = {}
+
+    def signature(feature):
+        return signatures.setdefault(tuple(feature[field] for field in STEP_FIELDS), len(signatures))
+
+    full_a = [signature(feature) for feature in features_a]
+    full_b = [signature(feature) for feature in features_b]
+    n, m = len(full_a), len(full_b)
+
+    head = 0
+    while head < min(n, m) and full_a[head] == full_b[head]:
+        head += 1
+    tail = 0
+    while tail < min(n, m) - head and full_a[n - 1 - tail] == full_b[m - 1 - tail]:
+        tail += 1
+
+    def score(i, j):
+        i, j = head + i, head + j
+        if full_a[i] == full_b[j]:
+            return MATCH_SCORE
+        if features_a[i]["tools"] == features_b[j]["tools"]:
+            return CHANGED_SCORE
+        return MISMATCH_SCORE
+
+    middle = align_sequences(n - head - tail, m - head - tail, score)
+    pairs = (
+        [(k, k) for k in range(head)]
+        + [(None if i is None else head + i, None if j is None else head + j) for i, j in middle]
+        + [(n - tail + k, m - tail + k) for k in range(tail)]
+    )
+
+    alignment = []
+    counts = {"equal": 0, "changed": 0, "delete": 0, "insert": 0}
+    for i, j in pairs:
+        if i is None:
+            op, fields = "insert", []
+        elif j is None:
+            op, fields = "delete", []
+        else:
+            fields = [field for field in STEP_FIELDS if features_a[i][field] != features_b[j][field]]
+            op = "changed" if fields else "equal"
+        counts[op] += 1
+        alignment.append({
+            "op": op,
+            "step_a": i,
+            "step_b": j,
+            "tools_a": None if i is None else list(features_a[i]["tools"]),
+            "tools_b": None if j is None else list(features_b[j]["tools"]),
+            "fields": fields,
+        })
+
+    tools_a = [name for feature in features_a for name in feature["tools"]]
+    tools_b = [name for feature in features_b for name in feature["tools"]]
+    counts_a, counts_b = _count_tools(tools_a), _count_tools(tools_b)
+    last_a = features_a[-1]["model_output_message"] if features_a else None
+    last_b = features_b[-1]["model_output_message"] if features_b else None
+    summary = {
+        "steps_a": n,
+        "steps_b": m,
+        "equal": counts["equal"],
+        "changed": counts["changed"],
+        "only_a": counts["delete"],
+        "only_b": counts["insert"],
+        # 相同步骤计 1、changed 计 0.5，按两条轨迹的总步数归一
+        "similarity": round((2 * counts["equal"] + counts["changed"]) / (n + m), 4) if n + m else 1.0,
+        "first_divergence": next((k for k, row in enumerate(alignment) if row["op"] != "equal"), None),
+        "tool_calls_a": len(tools_a),
+        "tool_calls_b": len(tools_b),
+        "common_tool_calls": _common_subsequence(tools_a, tools_b),
+        "tools_only_a": {name: count - counts_b.get(name, 0) for name, count in counts_a.items()
+                         if count > counts_b.get(name, 0)},
+        "tools_only_b": {name: count - counts_a.get(name, 0) for name, count in counts_b.items()
+                         if count > counts_a.get(name, 0)},
+        "errors_a": sum(1 for feature in features_a if feature["error"] != "null"),
+        "errors_b": sum(1 for feature in features_b if feature["error"] != "null"),
+        "final_output_equal": last_a == last_b,
+    }
+    return {"summary": summary, "alignment": alignment}
+
+
+def _swap_key(key: str) -> str:
+    if key.endswith("_a"):
+        return key[:-2] + "_b"
+    if key.endswith("_b"):
+        return key[:-2] + "_a"
+    return key
+
+
+def flip_diff(result: dict) -> dict:
+    """把 A 对 B 的对比结果翻转为 B 对 A"""
+    summary = {_swap_key(key): value for key, value in result["summary"].items()}
+    summary["only_a"], summary["only_b"] = result["summary"]["only_b"], result["summary"]["only_a"]
+    ops = {"insert": "delete", "delete": "insert"}
+    alignment = [
+        {_swap_key(key): (ops.get(value, value) if key == "op" else value) for key, value in row.items()}
+        for row in result["alignment"]
+    ]
+    return {"summary": summary, "alignment": alignment}
+
+
+class TrajectoryDiff(BaseForm):
+    """评估轨迹对比（带缓存）"""
+
+    def __init__(self, db_path="app.db"):
+        super().__init__(db_path, TrajectoryDiffModel)
+
+    def _compute(self, low: int, high: int, texts: dict, hashes: dict) -> dict:
+        result = diff_trajectories(
+            load_trajectory(texts[low], lazy=True) or [], load_trajectory(texts[high], lazy=True) or []
+        )
+        values = {
+            "evaluation_a": low, "evaluation_b": high,
+            "trajectory_hash_a": hashes[low], "trajectory_hash_b": hashes[high],
+            "version": DIFF_VERSION, "summary": json.dumps(result["summary"], ensure_ascii=False),
+            "alignment": json.dumps(result["alignment"], ensure_ascii=False, separators=(",", ":")),
+            "created_at": _now(),
+        }
+        stmt = sqlite_insert(TrajectoryDiffModel.__table__).values(values)
+        update_columns = {key: stmt.excluded[key] for key in values if key not in ("evaluation_a", "evaluation_b")}
+        with self.engine.begin() as conn:
+            conn.execute(stmt.on_conflict_do_update(index_elements=["evaluation_a", "evaluation_b"], set_=update_columns))
+        return result
+
+    def diff(self, evaluation_a: int, evaluation_b: int, use_cache: bool = True) -> dict:
+        """对比两条评估的轨迹，返回 {"summary", "alignment"}；评估不存在时返回 None"""
+        low, high = sorted((evaluation_a, evaluation_b))
+        table = TrajectoryDiffModel.__table__
+        try:
+            with self.read_engine.connect() as conn:
+                texts = dict(conn.execute(
+                    select(EvaluationModel.id, EvaluationModel.trajectory).where(EvaluationModel.id.in_([low, high]))
+                ).all())
+                if len(texts) < len({low, high}):
+                    console = Console()
+                    console.print(f"[yellow]评估 {evaluation_a} 或 {evaluation_b} 不存在[/yellow]")
+                    return None
+                hashes = {evaluation_id: content_hash(text) for evaluation_id, text in texts.items()}
+                cached = None
+                if use_cache:
+                    cached = conn.execute(
+                        select(table.c.summary, table.c.alignment).where(
+                            table.c.evaluation_a == low, table.c.evaluation_b == high,
+                            table.c.trajectory_hash_a == hashes[low], table.c.trajectory_hash_b == hashes[high],
+                            table.c.version == DIFF_VERSION,
+                        )
+                    ).first()
+            if cached is not None:
+                result = {"summary": json.loads(cached.summary), "alignment": json.loads(cached.alignment)}
+            else:
+                result = self._compute(low, high, texts, hashes)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 轨迹对比失败: {e}[/red]")
+            return None
+        return result if evaluation_a == low else flip_diff(result)
+
+    def get_diff_summary(self, evaluation_a: int, evaluation_b: int) -> dict:
+        """只返回差异摘要"""
+        result = self.diff(evaluation_a, evaluation_b)
+        return None if result is None else result["summary"]
+
+    def get_alignment_page(self, evaluation_a: int, evaluation_b: int,
+                           offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> dict:
+        """分页读取逐步对齐：{summary, total, offset, limit, rows}"""
+        result = self.diff(evaluation_a, evaluation_b)
+        if result is None:
+            return None
+        offset = max(offset, 0)
+        return {
+            "summary": result["summary"],
+            "total": len(result["alignment"]),
+            "offset": offset,
+            "limit": limit,
+            "rows": result["alignment"][offset:offset + limit],
+        }
+
+    def compare_on_query(self, query_id: int, agent_a: str, agent_b: str) -> dict:
+        """对比两个 agent 在同一查询上最新一次评估的轨迹，结果附带两条评估的ID"""
+        try:
+            with self.read_engine.connect() as conn:
+                latest = dict(conn.execute(
+                    select(EvaluationModel.agent, func.max(EvaluationModel.id))
+                    .where(EvaluationModel.query_id == query_id, EvaluationModel.agent.in_([agent_a, agent_b]))
+                    .group_by(EvaluationModel.agent)
+                ).all())
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 查询评估失败: {e}[/red]")
+            return None
+        missing = [agent for agent in (agent_a, agent_b) if agent not in latest]
+        if missing:
+            console = Console()
+            console.print(f"[yellow]查询 {query_id} 没有 {', '.join(missing)} 的评估[/yellow]")
+            return None
+        result = self.diff(latest[agent_a], latest[agent_b])
+        if result is not None:
+            result.update(evaluation_a=latest[agent_a], evaluation_b=latest[agent_b])
+        return result
+
+    def clear_cache(self, evaluation_id: int = None) -> int:
+        """清空对比缓存（或只清与某条评估相关的），返回删除的行数"""
+        table = TrajectoryDiffModel.__table__
+        stmt = delete(table)
+        if evaluation_id is not None:
+            stmt = stmt.where(or_(table.c.evaluation_a == evaluation_id, table.c.evaluation_b == evaluation_id))
+        try:
+            with self.engine.begin() as conn:
+                return conn.execute(stmt).rowcount
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 清空对比缓存失败: {e}[/red]")
+            return 0
+
+    def display_diff(self, evaluation_a: int, evaluation_b: int, offset: int = 0, limit: int = DEFAULT_PAGE_SIZE):
+        """展示差异摘要与一页逐步对齐"""
+        page = self.get_alignment_page(evaluation_a, evaluation_b, offset, limit)
+        if page is None:
+            return
+        summary = page["summary"]
+        console = Console()
+        console.print(
+            f"评估 {evaluation_a} ({summary['steps_a']} 步) vs 评估 {evaluation_b} ({summary['steps_b']} 步)："
+            f"相同 {summary['equal']}，不同 {summary['changed']}，仅A {summary['only_a']}，仅B {summary['only_b']}，"
+            f"相似度 {summary['similarity']:.2f}"
+        )
+        styles = {"equal": "green", "changed": "yellow", "delete": "red", "insert": "cyan"}
+        table = Table(title=f"逐步对齐 {page['offset'] + 1}-{page['offset'] + len(page['rows'])} / {page['total']}")
+        table.add_column("操作", style="white")
+        table.add_column("A 步", justify="right")
+        table.add_column("A 工具", style="white")
+        table.add_column("B 步", justify="right")
+        table.add_column("B 工具", style="white")
+        table.add_column("不同字段", style="yellow")
+
+        def step(index):
+            return "-" if index is None else str(index + 1)
+
+        def tools(names):
+            return "-" if names is None else (escape(", ".join(names)) or "(无)")
+
+        for row in page["rows"]:
+            table.add_row(
+                f"[{styles[row['op']]}]{row['op']}[/{styles[row['op']]}]",
+                step(row["step_a"]), tools(row["tools_a"]), step(row["step_b"]), tools(row["tools_b"]),
+                ", ".join(row["fields"]),
+            )
+        console.print(table)
@@ -0,0 +1,355 @@
+"""
+轨迹解析与校验
+
+轨迹是步骤数组，每一步包含 step / task / timing / token_usage / model_input_messages /
+tool_calls / model_output_message / error。入库前用带类型的步骤结构解析：
+- 安装了 msgspec 时用其解码 JSON 并转换为 Struct 校验类型（错误信息转换为与回退路径相同的中文格式）
+- 否则回退到标准库 json + 逐字段校验，两条路径产出相同的规范化结果与错误信息
+  （JSON 语法错误除外，其细节来自各自的解析器）
+
+格式错误的轨迹抛出 TrajectoryValidationError（ValueError 子类），错误信息带 JSON 路径，
+例如 "$[3].token_usage.input_tokens: 应为 int"。
+
+规范化规则：
+- 步骤字段按上面的顺序输出，缺省字段为 None（tool_calls / model_input_messages 缺省为 []，
+  model_input_messages 为 null 时同样规范化为 []）
+- token_usage 中 input_tokens / output_tokens 缺省为 0，为 null 或非整数时报错
+- step 缺省时按位置补为 1..n；token_usage.total_tokens 缺省时补为 input + output；
+  timing.duration 缺省且有起止时间时补为 end_time - start_time
+- 消息、工具调用中值为 None 的可选字段省略
+- 未声明的字段（例如 observations、action_output、reasoning_content）原样保留，排在声明字段之后；
+  error 可以是字符串或对象
+
+用法：
+    steps = parse_trajectory(data)              # 规范化后的步骤 dict 列表
+    text = normalize_trajectory_json(data)      # 规范化后的 JSON 文本
+"""
+
+import json
+import re
+from typing import Any, Optional, Union
+
+try:
+    import msgspec
+except ImportError:  # 可选依赖，缺失时使用标准库
+    msgspec = None
+
+STEP_FIELDS = (
+    "step", "task", "timing", "token_usage", "model_input_messages",
+    "tool_calls", "model_output_message", "error",
+)
+
+
+# 各层对象声明的字段与需要递归的子对象，未声明的字段按原样保留
+_SCHEMA = {
+    "step": (STEP_FIELDS, {
+        "timing": "timing", "token_usage": "token_usage", "model_input_messages": "message",
+        "tool_calls": "tool_call", "model_output_message": "message",
+    }),
+    "timing": (("start_time", "end_time", "duration"), {}),
+    "token_usage": (("input_tokens", "output_tokens", "total_tokens"), {}),
+    "message": (("role", "content", "name", "tool_calls", "tool_call_id"), {"tool_calls": "tool_call"}),
+    "tool_call": (("id", "type", "function"), {"function": "function"}),
+    "function": (("name", "arguments"), {}),
+}
+
+
+class TrajectoryValidationError(ValueError):
+    """轨迹格式错误"""
+
+
+def _keep_unknown(result: dict, raw: dict, kind: str) -> dict:
+    """把 raw 中未声明的字段补回规范化结果 result（原地修改）"""
+    fields, children = _SCHEMA[kind]
+    for key, value in raw.items():
+        if key not in fields:
+            result[key] = value
+    for key, child in children.items():
+        normalized, original = result.get(key), raw.get(key)
+        if isinstance(normalized, dict) and isinstance(original, dict):
+            _keep_unknown(normalized, original, child)
+        elif isinstance(normalized, list) and isinstance(original, list):
+            for item, raw_item in zip(normalized, original):
+                if isinstance(item, dict) and isinstance(raw_item, dict):
+                    _keep_unknown(item, raw_item, child)
+    return result
+
+
+# ---------- msgspec 结构 ----------
+
+if msgspec is not None:
+
+    class Timing(msgspec.Struct):
+        start_time: Optional[Union[float, str]] = None
+        end_time: Optional[Union[float, str]] = None
+        duration: Optional[float] = None
+
+    class TokenUsage(msgspec.Struct):
+        input_tokens: int = 0
+        output_tokens: int = 0
+        total_tokens: Optional[int] = None
+
+    class FunctionCall(msgspec.Struct, omit_defaults=True):
+        name: str
+        arguments: Optional[Union[str, dict[str, Any]]] = None
+
+    class ToolCall(msgspec.Struct, omit_defaults=True):
+        id: Optional[str] = None
+        type: Optional[str] = None
+        function: Optional[FunctionCall] = None
+
+    class Message(msgspec.Struct, omit_defaults=True):
+        role: str
+        content: Optional[Union[str, list[dict[str, Any]]]] = None
+        name: Optional[str] = None
+        tool_calls: Optional[list[ToolCall]] = None
+        tool_call_id: Optional[str] = None
+
+    class Step(msgspec.Struct):
+        step: Optional[int] = None
+        task: Optional[str] = None
+        timing: Optional[Timing] = None
+        token_usage: Optional[TokenUsage] = None
+        model_input_messages: Optional[list[Message]] = []
+        tool_calls: Optional[list[ToolCall]] = []
+        model_output_message: Optional[Message] = None
+        error: Optional[Union[str, dict[str, Any]]] = None
+
+    _decoder = msgspec.json.Decoder()
+    _encoder = msgspec.json.Encoder()
+
+
+def _decode_typed(data) -> list:
+    """解码并校验，返回补全缺省值、保留未声明字段的步骤 dict 列表"""
+    try:
+        raw = _decoder.decode(data)
+    except msgspec.DecodeError as e:
+        raise TrajectoryValidationError(f"JSON 解析失败: {e}") from e
+    try:
+        steps = msgspec.convert(raw, list[Step])
+    except msgspec.ValidationError as e:
+        raise TrajectoryValidationError(_translate_msgspec_error(str(e))) from e
+    for index, step in enumerate(steps):
+        if step.step is None:
+            step.step = index + 1
+        if step.model_input_messages is None:
+            step.model_input_messages = []
+        usage = step.token_usage
+        if usage is not None:
+            usage.total_tokens = _check_usage(
+                usage.input_tokens, usage.output_tokens, usage.total_tokens, index
+            )
+        timing = step.timing
+        if timing is not None and timing.duration is None:
+            timing.duration = _duration(timing.start_time, timing.end_time)
+    return [_keep_unknown(step, original, "step") for step, original in zip(msgspec.to_builtins(steps), raw)]
+
+
+def _translate_msgspec_error(message: str) -> str:
+    """把 msgspec 的错误（形如 "Expected `int`, got `str` - at `$[3].token_usage.input_tokens`"）
+    转换为回退路径的格式（"$[3].token_usage.input_tokens: 应为 int"）"""
+    detail, path = message.rsplit(" - at `", 1) if " - at `" in message else (message, "$`")
+    path = path.rstrip("`")
+    missing = re.match(r"Object missing required field `(\w+)`", detail)
+    if missing:
+        return f"{path}.{missing.group(1)}: 缺少必填字段"
+    expected = re.match(r"Expected `(.+?)`, got `", detail)
+    if expected:
+        name = expected.group(1).replace(" | null", "")
+        if path == "$" and name == "array":
+            return "$: 轨迹应为数组"
+        return f"{path}: 应为 {name}"
+    return f"{path}: {detail}"
+
+
+# ---------- 标准库回退 ----------
+
+def _fail(path: str, message: str):
+    raise TrajectoryValidationError(f"{path}: {message}")
+
+
+def _check_type(value, types, path: str, name: str, optional: bool = True):
+    if value is None:
+        if not optional:
+            _fail(path, f"应为 {name}")
+        return None
+    # bool 是 int 的子类，这里与 msgspec 一致地拒绝
+    if isinstance(value, bool) and bool not in types:
+        _fail(path, f"应为 {name}")
+    if not isinstance(value, types):
+        _fail(path, f"应为 {name}")
+    return value
+
+
+def _as_float(value):
+    """与 msgspec 一致：float 字段中的整数转为 float"""
+    return float(value) if isinstance(value, int) else value
+
+
+def _check_required(obj: dict, key: str, types, path: str, name: str):
+    """必填字段：缺失与值为 null 分别报错，与 msgspec 一致"""
+    if key not in obj:
+        _fail(f"{path}.{key}", "缺少必填字段")
+    return _check_type(obj[key], types, f"{path}.{key}", name, optional=False)
+
+
+def _check_object(value, path: str) -> dict:
+    if not isinstance(value, dict):
+        _fail(path, "应为 object")
+    return value
+
+
+def _check_tool_call(value, path: str) -> dict:
+    value = _check_object(value, path)
+    result = {}
+    if value.get("id") is not None:
+        result["id"] = _check_type(value["id"], (str,), f"{path}.id", "str")
+    if value.get("type") is not None:
+        result["type"] = _check_type(value["type"], (str,), f"{path}.type", "str")
+    function = value.get("function")
+    if function is not None:
+        function = _check_object(function, f"{path}.function")
+        call = {"name": _check_required(function, "name", (str,), f"{path}.function", "str")}
+        if function.get("arguments") is not None:
+            call["arguments"] = _check_type(function["arguments"], (str, dict), f"{path}.function.arguments", "str | object")
+        result["function"] = call
+    return result
+
+
+def _check_message(value, path: str) -> dict:
+    value = _check_object(value, path)
+    result = {"role": _check_required(value, "role", (str,), path, "str")}
+    content = value.get("content")
+    if content is not None:
+        _check_type(content, (str, list), f"{path}.content", "str | array")
+        if isinstance(content, list):
+            for i, block in enumerate(content):
+                _check_object(block, f"{path}.content[{i}]")
+        result["content"] = content
+    for key in ("name", "tool_call_id"):
+        if value.get(key) is not None:
+            result[key] = _check_type(value[key], (str,), f"{path}.{key}", "str")
+    if value.get("tool_calls") is not None:
+        calls = _check_type(value["tool_calls"], (list,), f"{path}.tool_calls", "array")
+        result["tool_calls"] = [_check_tool_call(call, f"{path}.tool_calls[{i}]") for i, call in enumerate(calls)]
+    return result
+
+
+def _check_step(value, path: str) -> dict:
+    value = _check_object(value, path)
+    step = {
+        "step": _check_type(value.get("step"), (int,), f"{path}.step", "int"),
+        "task": _check_type(value.get("task"), (str,), f"{path}.task", "str"),
+        "timing": None,
+        "token_usage": None,
+        "model_input_messages": [],
+        "tool_calls": [],
+        "model_output_message": None,
+        "error": _check_type(value.get("error"), (str, dict), f"{path}.error", "str | object"),
+    }
+    timing = value.get("timing")
+    if timing is not None:
+        timing = _check_object(timing, f"{path}.timing")
+        step["timing"] = {
+            key: _as_float(_check_type(timing.get(key), (int, float, str), f"{path}.timing.{key}", "float | str"))
+            for key in ("start_time", "end_time")
+        }
+        step["timing"]["duration"] = _as_float(
+            _check_type(timing.get("duration"), (int, float), f"{path}.timing.duration", "float")
+        )
+    usage = value.get("token_usage")
+    if usage is not None:
+        usage = _check_object(usage, f"{path}.token_usage")
+        step["token_usage"] = {
+            key: _check_type(usage.get(key, 0), (int,), f"{path}.token_usage.{key}", "int", optional=False)
+            for key in ("input_tokens", "output_tokens")
+        }
+        step["token_usage"]["total_tokens"] = _check_type(
+            usage.get("total_tokens"), (int,), f"{path}.token_usage.total_tokens", "int"
+        )
+    messages = value.get("model_input_messages")
+    if messages is not None:
+        _check_type(messages, (list,), f"{path}.model_input_messages", "array")
+        step["model_input_messages"] = [
+            _check_message(message, f"{path}.model_input_messages[{i}]") for i, message in enumerate(messages)
+        ]
+    if "tool_calls" in value:
+        calls = value["tool_calls"]
+        if calls is None:
+            step["tool_calls"] = None
+        else:
+            _check_type(calls, (list,), f"{path}.tool_calls", "array")
+            step["tool_calls"] = [_check_tool_call(call, f"{path}.tool_calls[{i}]") for i, call in enumerate(calls)]
+    if value.get("model_output_message") is not None:
+        step["model_output_message"] = _check_message(value["model_output_message"], f"{path}.model_output_message")
+    return step
+
+
+def _decode_stdlib(data) -> list:
+    try:
+        steps = json.loads(data)
+    except (ValueError, TypeError) as e:
+        raise TrajectoryValidationError(f"JSON 解析失败: {e}") from e
+    if not isinstance(steps, list):
+        _fail("$", "轨迹应为数组")
+    return [_keep_unknown(_check_step(step, f"$[{i}]"), step, "step") for i, step in enumerate(steps)]
+
+
+# ---------- 对外接口 ----------
+
+def _check_usage(input_tokens, output_tokens, total_tokens, index: int):
+    """检查 token 数非负，返回（补全后的）total_tokens"""
+    for key, value in (("input_tokens", input_tokens), ("output_tokens", output_tokens),
+                       ("total_tokens", total_tokens)):
+        if value is not None and value < 0:
+            _fail(f"$[{index}].token_usage.{key}", "不能为负数")
+    return input_tokens + output_tokens if total_tokens is None else total_tokens
+
+
+def _duration(start, end):
+    if isinstance(start, (int, float)) and isinstance(end, (int, float)):
+        return end - start
+    return None
+
+
+def _finalize(steps: list) -> list:
+    """标准库路径：补全缺省值并做跨字段检查，规则与 _decode_typed 相同"""
+    for index, step in enumerate(steps):
+        if step["step"] is None:
+            step["step"] = index + 1
+        usage = step["token_usage"]
+        if usage is not None:
+            usage["total_tokens"] = _check_usage(
+                usage["input_tokens"], usage["output_tokens"], usage["total_tokens"], index
+            )
+        timing = step["timing"]
+        if timing is not None and timing["duration"] is None:
+            timing["duration"] = _duration(timing["start_time"], timing["end_time"])
+    return steps
+
+
+def _use_msgspec(use_msgspec) -> bool:
+    if use_msgspec is None:
+        return msgspec is not None
+    if use_msgspec and msgspec is None:
+        raise ImportError("未安装 msgspec: pip install msgspec")
+    return use_msgspec
+
+
+def parse_trajectory(data, use_msgspec: bool = None) -> list:
+    """解析并校验轨迹（bytes 或 str），返回规范化后的步骤 dict 列表
+
+    Args:
+        use_msgspec: 是否使用 msgspec，默认在已安装时使用
+    """
+    if _use_msgspec(use_msgspec):
+        return _decode_typed(data)
+    return _finalize(_decode_stdlib(data))
+
+
+def normalize_trajectory_json(data, use_msgspec: bool = None) -> str:
+    """解析、校验并重新序列化为紧凑 JSON 文本（保留未声明的字段）"""
+    if _use_msgspec(use_msgspec):
+        return _encoder.encode(_decode_typed(data)).decode("utf-8")
+    steps = _finalize(_decode_stdlib(data))
+    return json.dumps(steps, ensure_ascii=False, separators=(",", ":"))
@@ -0,0 +1,218 @@
+"""
+轨迹前缀共享存储
+
+轨迹是步骤数组，每一步的 model_input_messages 都是完整的对话历史，
+第 N 步的历史几乎总是第 N-1 步的历史再追加一两条消息，原样存储时体积随步数平方增长。
+
+紧凑格式把每条不同的消息只存一次，每一步只记录 "与上一步历史共享的前缀长度 + 新追加的消息编号"：
+    {
+        "format": "prefix/1",
+        "messages": [消息0, 消息1, ...],
+        "steps": [
+            {"step": 1, ..., "model_input_messages": {"$prefix": 0, "$append": [0, 1]}, ...},
+            {"step": 2, ..., "model_input_messages": {"$prefix": 2, "$append": [2, 3]}, ...}
+        ]
+    }
+存储与解析都是 O(n)；还原时同一条消息在各步之间共享同一个对象，可整体还原（decode_trajectory）
+也可按步惰性还原（CompactTrajectory.step）。步骤的其他字段与字段顺序保持不变。
+
+TrajectoryText 列类型在写入时自动压缩（ORM、Core、批量写入、upsert 都经过它），
+读取时返回库中存储的文本，不做还原：列表、详情等只需元数据的读取不为每行付出解析与重新序列化的代价。
+因此 EvaluationModel.trajectory（ORM 对象属性与 Core 查询结果）是紧凑格式文本，不是原始步骤数组的 JSON；
+需要步骤时调用表单的 get_trajectory / get_trajectory_step 或 load_trajectory，
+需要原始 JSON 文本时调用 unpack_trajectory_text（cli export --expand-trajectories 即如此）。
+无法解析为轨迹数组的文本原样存储。
+"""
+
+import json
+
+from sqlalchemy import Text
+from sqlalchemy.types import TypeDecorator
+
+from .media_extract import DATA_URI_MARKER, extract_images, media_collector
+
+FORMAT = "prefix/1"
+MESSAGES_KEY = "model_input_messages"
+
+
+def _message_key(message) -> str:
+    return json.dumps(message, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def is_compact(doc) -> bool:
+    return isinstance(doc, dict) and doc.get("format") == FORMAT
+
+
+def encode_trajectory(steps: list) -> dict:
+    """把步骤数组编码为紧凑格式"""
+    messages, index = [], {}
+    encoded_steps = []
+    previous = []
+    for step in steps:
+        history = step.get(MESSAGES_KEY) if isinstance(step, dict) else None
+        if not isinstance(history, list):
+            encoded_steps.append(step)
+            continue
+        ids = []
+        for message in history:
+            key = _message_key(message)
+            if key not in index:
+                index[key] = len(messages)
+                messages.append(message)
+            ids.append(index[key])
+        prefix = 0
+        limit = min(len(ids), len(previous))
+        while prefix < limit and ids[prefix] == previous[prefix]:
+            prefix += 1
+        reference = {"$prefix": prefix, "$append": ids[prefix:]}
+        encoded_steps.append({key: (reference if key == MESSAGES_KEY else value) for key, value in step.items()})
+        previous = ids
+    return {"format": FORMAT, "messages": messages, "steps": encoded_steps}
+
+
+class CompactTrajectory:
+    """紧凑轨迹的惰性视图：只在访问某一步时还原该步的 model_input_messages"""
+
+    def __init__(self, doc: dict):
+        if not is_compact(doc):
+            raise ValueError("不是紧凑格式的轨迹")
+        self.messages = doc["messages"]
+        self.steps = doc["steps"]
+        self._histories = {}
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        for index in range(len(self.steps)):
+            yield self.step(index)
+
+    def history_ids(self, index: int) -> list:
+        """第 index 步（从 0 开始）的消息编号列表；沿引用链回溯到最近一个已还原的步骤"""
+        if index in self._histories:
+            return self._histories[index]
+        chain = []
+        cursor = index
+        while cursor >= 0 and cursor not in self._histories:
+            chain.append(cursor)
+            cursor -= 1
+        ids = list(self._histories[cursor]) if cursor >= 0 else []
+        for position in reversed(chain):
+            reference = self._reference(position)
+            if reference is not None:
+                ids = ids[:reference["$prefix"]] + reference["$append"]
+            self._histories[position] = ids
+        return self._histories[index]
+
+    def step(self, index: int) -> dict:
+        """还原第 index 步（从 0 开始）"""
+        step = self.steps[index]
+        if self._reference(index) is None:
+            return step
+        history = [self.messages[i] for i in self.history_ids(index)]
+        return {key: (history if key == MESSAGES_KEY else value) for key, value in step.items()}
+
+    def to_list(self) -> list:
+        return list(self)
+
+    def _reference(self, index: int):
+        step = self.steps[index]
+        if isinstance(step, dict):
+            reference = step.get(MESSAGES_KEY)
+            if isinstance(reference, dict) and "$prefix" in reference:
+                return reference
+        return None
+
+
+def decode_trajectory(doc) -> list:
+    """把紧凑格式还原为步骤数组；传入普通步骤数组时原样返回"""
+    if is_compact(doc):
+        return CompactTrajectory(doc).to_list()
+    return doc
+
+
+def _is_trajectory(doc) -> bool:
+    return isinstance(doc, list) and any(isinstance(step, dict) and MESSAGES_KEY in step for step in doc)
+
+
+def pack_trajectory_text(text, media: dict = None):
+    """把轨迹 JSON 文本压缩为紧凑格式文本；非轨迹文本、已压缩文本原样返回
+
+    media 不为 None 时把内联图片抽出放入其中（{sha256: (mime, bytes)}），JSON 中只保留引用，
+    由调用方在写入文本的同一事务中写入 media 表（见 media_extract.py）；为 None 时图片保持内联。
+    """
+    if not text:
+        return text
+    try:
+        doc = json.loads(text)
+    except (ValueError, TypeError):
+        return text
+    extracted = extract_images(doc) if media is not None and DATA_URI_MARKER in text else {}
+    if media is not None:
+        media.update(extracted)
+    if _is_trajectory(doc):
+        return json.dumps(encode_trajectory(doc), ensure_ascii=False, separators=(",", ":"))
+    if extracted:
+        return json.dumps(doc, ensure_ascii=False, separators=(",", ":"))
+    return text
+
+
+def unpack_trajectory_text(text):
+    """把紧凑格式文本还原为原始轨迹 JSON 文本；其他文本原样返回"""
+    if not text or not text.lstrip().startswith("{"):
+        return text
+    try:
+        doc = json.loads(text)
+    except (ValueError, TypeError):
+        return text
+    if not is_compact(doc):
+        return text
+    return json.dumps(decode_trajectory(doc), ensure_ascii=False)
+
+
+def pack_trajectory_bytes(content: bytes, media: dict = None) -> bytes:
+    """files_form 中轨迹文件内容（UTF-8 字节）的压缩；非 UTF-8 内容原样返回，media 同 pack_trajectory_text"""
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content
+    packed = pack_trajectory_text(text, media)
+    return content if packed is text else packed.encode("utf-8")
+
+
+def unpack_trajectory_bytes(content: bytes) -> bytes:
+    """pack_trajectory_bytes 的逆操作"""
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content
+    unpacked = unpack_trajectory_text(text)
+    return content if unpacked is text else unpacked.encode("utf-8")
+
+
+def load_trajectory(text, lazy: bool = False):
+    """解析存储的轨迹文本
+
+    Returns:
+        步骤数组；lazy=True 且为紧凑格式时返回 CompactTrajectory；无法解析时返回 None
+    """
+    if not text:
+        return None
+    try:
+        doc = json.loads(text)
+    except (ValueError, TypeError):
+        return None
+    if is_compact(doc):
+        return CompactTrajectory(doc) if lazy else decode_trajectory(doc)
+    return doc
+
+
+class TrajectoryText(TypeDecorator):
+    """写入时自动转为紧凑格式的轨迹文本列；读取时不还原（见模块说明）"""
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        # 只有注册了 install_media_flush 的引擎正在执行语句时才抽取图片，由该语句所在的事务写入
+        return pack_trajectory_text(value, media_collector(dialect))
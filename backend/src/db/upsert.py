@@ -0,0 +1,113 @@
+"""
+原子 upsert
+
+把"先 SELECT 判断是否存在，再 INSERT 或 UPDATE"的两步操作合并为一条
+INSERT … ON CONFLICT (自然键) DO UPDATE … RETURNING id：
+- 并发写入同一自然键时不会出现竞态（不会重复插入，也不会因唯一约束报错）
+- 一次往返即可拿到新插入或已存在行的 ID
+- 多行时走 executemany，RETURNING 结果按传入顺序返回
+
+自然键必须对应表上的主键、唯一约束或唯一索引（SQLite 的 ON CONFLICT 要求如此），
+默认自然键见 NATURAL_KEYS：
+- user_form: username
+- query_form: content_hash（detail_query 的 sha256，见 models.compute_query_hash）
+- evaluation_form: (query_id, agent, run_id)
+
+自然键列的值不能为 NULL：唯一索引中 NULL 互不相等，永远不会触发冲突。
+"""
+
+from datetime import datetime
+
+from sqlalchemy import UniqueConstraint
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .models import UserModel, QueryModel, EvaluationModel, compute_query_hash
+
+NATURAL_KEYS = {
+    UserModel.__tablename__: ("username",),
+    QueryModel.__tablename__: ("content_hash",),
+    EvaluationModel.__tablename__: ("query_id", "agent", "run_id"),
+}
+
+# 冲突时保留原值的列
+PRESERVED_COLUMNS = ("id", "created_at")
+
+
+def unique_keys(table) -> list:
+    """表上所有可作为 ON CONFLICT 目标的列组合"""
+    keys = [tuple(column.name for column in table.primary_key.columns)]
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint):
+            keys.append(tuple(column.name for column in constraint.columns))
+    for index in table.indexes:
+        if index.unique:
+            keys.append(tuple(column.name for column in index.columns))
+    return keys
+
+
+def prepare_rows(model, rows: list) -> list:
+    """补齐派生列（查询的 content_hash）与时间戳"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    prepared = []
+    for row in rows:
+        row = dict(row)
+        if model is QueryModel and "detail_query" in row:
+            row["content_hash"] = compute_query_hash(row["detail_query"])
+        row.setdefault("created_at", now)
+        prepared.append(row)
+    return prepared
+
+
+def upsert_rows(conn, model, rows: list, key=None, update_columns=None) -> list:
+    """按自然键插入或更新多行，返回与 rows 顺序一致的 ID 列表
+
+    Args:
+        conn: 处于事务中的连接（engine.begin()）
+        model: ORM 模型
+        rows: 行 dict 列表，所有行的列集合必须相同
+        key: 自然键列名，默认取 NATURAL_KEYS
+        update_columns: 冲突时更新的列，默认为除自然键、id、created_at 外的所有传入列
+    """
+    table = model.__table__
+    key = tuple(key or NATURAL_KEYS.get(table.name, ()))
+    if not key:
+        raise ValueError(f"表 '{table.name}' 没有默认自然键，请指定 key")
+    if set(key) not in [set(candidate) for candidate in unique_keys(table)]:
+        raise ValueError(f"({', '.join(key)}) 不是表 '{table.name}' 的主键或唯一索引")
+    if not rows:
+        return []
+
+    rows = prepare_rows(model, rows)
+    columns = set(rows[0])
+    for row in rows:
+        if set(row) != columns:
+            raise ValueError("upsert 的所有行必须包含相同的列")
+        missing = [name for name in key if row.get(name) is None]
+        if missing:
+            raise ValueError(f"自然键列不能为空: {', '.join(missing)}")
+    unknown = [name for name in columns if name not in table.c]
+    if unknown:
+        raise ValueError(f"表 '{table.name}' 没有字段: {', '.join(unknown)}")
+
+    if update_columns is None:
+        update_columns = [name for name in columns if name not in key and name not in PRESERVED_COLUMNS]
+    stmt = sqlite_insert(table)
+    set_ = {name: stmt.excluded[name] for name in update_columns}
+    if "updated_at" in table.c:
+        set_["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    stmt = stmt.on_conflict_do_update(index_elements=list(key), set_=set_)
+    result = conn.execute(stmt.returning(table.c.id, sort_by_parameter_order=True), rows)
+    return [row.id for row in result]
+
+
+def insert_ignore(conn, model, row: dict, key=None):
+    """INSERT … ON CONFLICT DO NOTHING RETURNING id，已存在时返回 None"""
+    table = model.__table__
+    key = tuple(key or NATURAL_KEYS.get(table.name, ()))
+    stmt = (
+        sqlite_insert(table)
+        .values(**prepare_rows(model, [row])[0])
+        .on_conflict_do_nothing(index_elements=list(key))
+        .returning(table.c.id)
+    )
+    return conn.execute(stmt).scalar()
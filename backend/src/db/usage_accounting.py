@@ -0,0 +1,214 @@
+"""
+用量与费用统计
+
+轨迹每一步带有 timing.duration 与 token_usage，这里把它们汇总成可直接查询的用量：
+- 抽取：evaluation_form 上的触发器在写入/修改轨迹时用 SQLite JSON 函数抽取每条评估的步数、出错步数、
+  工具调用数、输入/输出/总 token 与耗时，写入 evaluation_usage（ORM、Core、WriteQueue、导入器、upsert 都覆盖）
+- 汇总：evaluation_usage 上的触发器增量维护 usage_rollup，维度为 agent、(查询, agent)、(日期, agent)，
+  同时累计已打分评估数与分数之和；读取汇总是主键查询，不再解析任何轨迹
+- 费用：汇总只存 token，费用在读取时按价格表计算，修改价格不需要重算历史数据
+  价格表格式（美元 / 百万 token）：
+      {"agent-a": {"input": 3.0, "output": 15.0}, "default": {"input": 1.0, "output": 2.0}}
+  轨迹只记录 total_tokens、未区分输入输出的部分按 "total" 价格计费（未设置时按输入价格）
+
+用法：
+    accounting = UsageAccounting("app.db", prices={"agent-a": {"input": 3, "output": 15}})
+    accounting.get_agent_usage()
+    accounting.cheapest_agents(tolerance=2)  # 平均分与最高分相差 2 分以内的 agent 中按单次费用排序
+    accounting.display_agent_usage()
+
+可用方法
+get_evaluation_usage
+get_agent_usage
+get_query_usage
+get_daily_usage
+cheapest_agents
+rebuild
+display_agent_usage
+"""
+
+import json
+
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, Table
+
+from .base_form import BaseForm
+from .models import EvaluationUsageModel, UsageRollupModel, USAGE_COLUMNS, backfill_usage
+
+TOKENS_PER_PRICE_UNIT = 1_000_000
+
+
+class PriceTable:
+    """agent → 每百万 token 的价格，未列出的 agent 使用 default"""
+
+    def __init__(self, prices: dict = None):
+        prices = dict(prices or {})
+        self.default = prices.pop("default", {})
+        self.prices = prices
+
+    @classmethod
+    def from_file(cls, path: str) -> "PriceTable":
+        """从 JSON 文件读取价格表"""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def price(self, agent: str) -> dict:
+        return self.prices.get(agent, self.default)
+
+    def cost(self, agent: str, input_tokens: int, output_tokens: int, total_tokens: int) -> float:
+        """按价格计算费用（美元）"""
+        price = self.price(agent)
+        input_price = price.get("input", 0.0)
+        unsplit = max(total_tokens - input_tokens - output_tokens, 0)
+        return (
+            input_tokens * input_price
+            + output_tokens * price.get("output", 0.0)
+            + unsplit * price.get("total", input_price)
+        ) / TOKENS_PER_PRICE_UNIT
+
+
+def _mean(total, count):
+    return total / count if count else None
+
+
+class UsageAccounting(BaseForm):
+    """用量与费用统计"""
+
+    def __init__(self, db_path="app.db", prices=None):
+        """
+        Args:
+            prices: PriceTable、价格字典或价格表 JSON 文件路径，默认不计费（费用为 0）
+        """
+        super().__init__(db_path, EvaluationUsageModel)
+        if isinstance(prices, str):
+            prices = PriceTable.from_file(prices)
+        elif not isinstance(prices, PriceTable):
+            prices = PriceTable(prices)
+        self.prices = prices
+
+    def _summarize(self, row) -> dict:
+        """把一行汇总换算成总量、均值与费用"""
+        evaluations = row["evaluations"]
+        summary = {column: row[column] for column in ("agent", "evaluations", "scored") + USAGE_COLUMNS}
+        summary["mean_score"] = _mean(row["score_sum"], row["scored"])
+        summary["mean_steps"] = _mean(row["steps"], evaluations)
+        summary["mean_tokens"] = _mean(row["total_tokens"], evaluations)
+        summary["mean_duration_seconds"] = _mean(row["duration_seconds"], evaluations)
+        summary["cost"] = self.prices.cost(row["agent"], row["input_tokens"], row["output_tokens"], row["total_tokens"])
+        summary["cost_per_evaluation"] = _mean(summary["cost"], evaluations)
+        return summary
+
+    def _read_rollups(self, scope: str, keys=None, agents: list = None, action: str = "获取用量汇总") -> list:
+        table = UsageRollupModel.__table__
+        stmt = select(table).where(table.c.scope == scope)
+        if keys is not None:
+            stmt = stmt.where(keys)
+        if agents is not None:
+            stmt = stmt.where(table.c.agent.in_(list(agents)))
+        try:
+            with self.read_engine.connect() as conn:
+                rows = conn.execute(stmt.order_by(table.c.key, table.c.agent)).mappings().all()
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ {action}失败: {e}[/red]")
+            return []
+        summaries = []
+        for row in rows:
+            summary = self._summarize(row)
+            if scope != "agent":
+                summary["key"] = row["key"]
+            summaries.append(summary)
+        return summaries
+
+    def get_evaluation_usage(self, evaluation_id: int) -> dict:
+        """单条评估的用量与费用，评估不存在时返回 None"""
+        try:
+            with self.read_engine.connect() as conn:
+                row = conn.execute(
+                    select(EvaluationUsageModel.__table__).where(EvaluationUsageModel.evaluation_id == evaluation_id)
+                ).mappings().first()
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 获取评估用量失败: {e}[/red]")
+            return None
+        if row is None:
+            return None
+        usage = dict(row)
+        usage["cost"] = self.prices.cost(row["agent"], row["input_tokens"], row["output_tokens"], row["total_tokens"])
+        return usage
+
+    def get_agent_usage(self, agents: list = None) -> list:
+        """各 agent 的用量汇总 [{agent, evaluations, scored, mean_score, total_tokens, mean_tokens, cost, ...}]"""
+        return self._read_rollups("agent", agents=agents, action="获取 agent 用量")
+
+    def get_query_usage(self, query_id: int = None, agents: list = None) -> list:
+        """各 (查询, agent) 的用量汇总，key 为查询ID（字符串）"""
+        keys = UsageRollupModel.key == str(query_id) if query_id is not None else None
+        return self._read_rollups("query", keys, agents, action="获取查询用量")
+
+    def get_daily_usage(self, start: str = None, end: str = None, agents: list = None) -> list:
+        """各 (日期, agent) 的用量汇总，key 为 YYYY-MM-DD，start/end 为闭区间"""
+        keys = None
+        if start is not None:
+            keys = UsageRollupModel.key >= start
+        if end is not None:
+            upper = UsageRollupModel.key <= end
+            keys = upper if keys is None else keys & upper
+        return self._read_rollups("day", keys, agents, action="获取每日用量")
+
+    def cheapest_agents(self, tolerance: float = 0.0, min_scored: int = 1) -> list:
+        """质量相当的 agent 按单次评估费用从低到高排序
+
+        Args:
+            tolerance: 平均分不低于 (最高平均分 - tolerance) 视为质量相当
+            min_scored: 已打分评估数少于该值的 agent 不参与比较
+        """
+        candidates = [row for row in self.get_agent_usage() if row["scored"] >= max(min_scored, 1)]
+        if not candidates:
+            return []
+        best = max(row["mean_score"] for row in candidates)
+        tied = [row for row in candidates if row["mean_score"] >= best - tolerance]
+        return sorted(tied, key=lambda row: (row["cost_per_evaluation"], -row["mean_score"], row["agent"]))
+
+    def rebuild(self) -> int:
+        """丢弃现有用量与汇总，从全部评估重新抽取，返回评估数（触发器缺失或数据被手工改动后使用）"""
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(delete(EvaluationUsageModel.__table__))
+                conn.execute(delete(UsageRollupModel.__table__))
+                rebuilt = backfill_usage(conn)
+            console = Console()
+            console.print(f"[green]✓ 已重建 {rebuilt} 条评估的用量[/green]")
+            return rebuilt
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 重建用量失败: {e}[/red]")
+            return 0
+
+    def display_agent_usage(self, agents: list = None):
+        """展示各 agent 的用量与费用"""
+        rows = self.get_agent_usage(agents)
+        console = Console()
+        table = Table(title="agent 用量与费用")
+        table.add_column("agent", style="cyan")
+        table.add_column("评估数", style="white", justify="right")
+        table.add_column("平均分", style="green", justify="right")
+        table.add_column("平均步数", style="white", justify="right")
+        table.add_column("出错步", style="red", justify="right")
+        table.add_column("工具调用", style="white", justify="right")
+        table.add_column("平均 token", style="yellow", justify="right")
+        table.add_column("平均耗时(s)", style="yellow", justify="right")
+        table.add_column("费用($)", style="magenta", justify="right")
+        table.add_column("单次费用($)", style="magenta", justify="right")
+
+        def fmt(value, digits=1):
+            return "-" if value is None else f"{value:.{digits}f}"
+
+        for row in rows:
+            table.add_row(
+                row["agent"] or "-", str(row["evaluations"]), fmt(row["mean_score"]), fmt(row["mean_steps"]),
+                str(row["error_steps"]), str(row["tool_calls"]), fmt(row["mean_tokens"], 0),
+                fmt(row["mean_duration_seconds"], 2), fmt(row["cost"], 4), fmt(row["cost_per_evaluation"], 4),
+            )
+        console.print(table)
@@ -0,0 +1,807 @@
+"""
+本地向量检索
+
+为查询文本与评估报告建立嵌入向量索引，用于"找和这个类似的查询""找提到类似失败的报告"：
+- 集合: queries（query_form，detail_query 为空时用 lazy_query）、reports（evaluation_form.report_content）
+- 嵌入器可插拔，只在 CPU 上运行：
+  - HashingEmbedder: 默认的回退实现，词与字符 3-gram 的带符号特征哈希，无需模型与额外依赖
+  - FunctionEmbedder: 包装调用方提供的 fn(texts) -> 矩阵，例如本地 sentence-transformers 模型的 encode
+  向量 L2 归一化后存储，分数即余弦相似度；嵌入器的名称、版本或维度变化时自动重建
+- 存储: 每个集合一组内存映射文件（默认 <db>.vectors/ 目录）：float32 向量矩阵、行号对应的 ID（int64，墓碑为 -1）、
+  文本 crc32；vector_index 表记录已用行数与容量、文件代数、变更游标与扫描进度，先写文件再提交这一行，
+  中断时多写的行不会被读到；文件在每次同步结束时落盘，操作系统崩溃丢失的写入可用 rebuild 恢复
+- 增量更新: 按 change_log 游标同步（见 change_feed.py），表单、导入器、原生 SQL 的写入都会被应用：
+  新增追加一行；文本变化时旧行置为墓碑并追加新行（crc32 未变时跳过，只改分数等字段不会重新嵌入）；删除置为墓碑。
+  墓碑超过 1/4 时压缩为新一代文件。首次建立时按 ID 分页全量扫描，每页一个事务，中断后从断点继续。
+  检索前自动同步，没有新变更时只多一次主键查找；变更日志被清理到游标之后时无法增量同步，会整体重建
+- 检索: 默认精确检索，对全部向量做一次矩阵-向量乘法再用 argpartition 取 top-k（100 万 × 256 维约 120ms）；
+  train_ivf 训练倒排索引（球面 k-means，默认 √n 个簇，100 万向量约 9s）后只计算最近 nprobe 个簇内的向量
+  （100 万向量约 6ms，含检索前的同步检查），之后新增的向量按最近的簇中心归入倒排表；exact=True 时仍走精确检索
+
+依赖 numpy（可选依赖）：pip install "backend[analytics]"
+
+用法：
+    index = VectorIndex("app.db")
+    index.search("queries", "如何用 Python 读取 CSV 文件", k=5)
+    index.search_similar("reports", evaluation_id, k=10)
+    index.train_ivf("reports")
+
+可用方法
+sync
+search
+search_similar
+train_ivf
+rebuild
+get_stats
+display_stats
+"""
+
+import glob
+import math
+import os
+import re
+import unicodedata
+import zlib
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import select, update, func, text
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, Table
+
+from .base_form import BaseForm
+from .change_feed import last_change_seq
+from .models import QueryModel, EvaluationModel, ChangeLogModel, VectorIndexModel
+from .query_dedup import query_text
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+DEFAULT_DIM = 256
+MAX_CHARS = 20_000
+EMBED_BATCH = 256
+SCAN_PAGE = 256
+CHANGE_PAGE = 2000
+SQL_CHUNK = 500
+INITIAL_CAPACITY = 1024
+COMPACT_RATIO = 0.25
+COMPACT_MIN_SLOTS = 1024
+COPY_CHUNK = 65_536
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 40
+# 训练后追加的行不在缓存的倒排表里，检索时逐行判断；超过这个数时重建倒排表缓存
+IVF_TAIL_ROWS = 16_384
+SNIPPET_CHARS = 200
+
+STATE_INSERT_SQL = text(
+    "INSERT INTO vector_index (collection, embedder, dim, generation, capacity, slots, live, "
+    "change_cursor, scan_after, ivf_version, n_lists, updated_at) "
+    "SELECT :collection, :embedder, :dim, 1, 0, 0, 0, COALESCE(MAX(seq), 0), 0, 0, 0, :now FROM change_log "
+    "WHERE true ON CONFLICT (collection) DO NOTHING"
+)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('向量检索需要 numpy: pip install "backend[analytics]"')
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _report_text(row) -> str:
+    return row.report_content
+
+
+def _query_text(row) -> str:
+    return query_text(row.lazy_query, row.detail_query)
+
+
+# 集合 -> (模型, 读取的列, 由行得到文本的函数, 检索结果附带的列)
+COLLECTIONS = {
+    "queries": (QueryModel, ("lazy_query", "detail_query"), _query_text, ("lazy_query", "detail_query")),
+    "reports": (EvaluationModel, ("report_content",), _report_text, ("query_id", "agent", "report_content")),
+}
+
+
+def normalize_rows(matrix):
+    """逐行 L2 归一化（float32），零向量保持为零"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.maximum(norms, 1e-12, out=norms)
+    return matrix / norms
+
+
+# ---------- 嵌入器 ----------
+
+class Embedder:
+    """嵌入器基类
+
+    Attributes:
+        name / version: 记录在索引状态中，修改嵌入逻辑后提升版本使索引重建
+        dim: 向量维度
+    """
+
+    name = "embedder"
+    version = "1"
+    dim = DEFAULT_DIM
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.version}:{self.dim}"
+
+    def embed(self, texts: list):
+        """返回 len(texts) × dim 的矩阵，无需归一化"""
+        raise NotImplementedError
+
+
+# 中日韩文字没有空格分词：连续的表意文字/假名/谚文单独成段，按字符二元组取特征
+_CJK = "\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN = re.compile(f"[{_CJK}]+|[^\\W{_CJK}]+")
+_CJK_START = re.compile(f"[{_CJK}]")
+
+
+class HashingEmbedder(Embedder):
+    """特征哈希嵌入：每个词及其字符 n-gram（中日韩文字为字符二元组）哈希到 dim 维中的一维并带 ±1 符号，
+    计数取对数压缩
+
+    字符 n-gram 让词形变化、拼写差异与不分词的中文也能匹配；不需要训练，结果确定
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = DEFAULT_DIM, ngram: int = 3, cache_size: int = 200_000):
+        self.dim = dim
+        self.ngram = ngram
+        self.version = f"1-n{ngram}"
+        # 词的分布高度重复，按词缓存特征后每个词只查一次字典
+        self._word_features = lru_cache(maxsize=cache_size)(self._features)
+
+    def _features(self, word: str) -> tuple:
+        """一个词的特征列号与符号：(列号元组, 符号元组)"""
+        if _CJK_START.match(word):
+            grams = [word[start:start + 2] for start in range(max(1, len(word) - 1))]
+            hashes = []
+        else:
+            padded = f"<{word}>"
+            grams = [padded[start:start + self.ngram] for start in range(max(1, len(padded) - self.ngram + 1))]
+            hashes = [zlib.crc32(word.encode("utf-8"), 0x9E3779B9)]
+        hashes.extend(zlib.crc32(gram.encode("utf-8")) for gram in grams)
+        return tuple(h % self.dim for h in hashes), tuple(1.0 if h >> 31 else -1.0 for h in hashes)
+
+    def embed(self, texts: list):
+        columns, signs, ends = [], [], []
+        for content in texts:
+            for word in _TOKEN.findall(unicodedata.normalize("NFKC", content or "").lower()):
+                word_columns, word_signs = self._word_features(word)
+                columns.extend(word_columns)
+                signs.extend(word_signs)
+            ends.append(len(columns))
+        rows = np.repeat(np.arange(len(texts)), np.diff(ends, prepend=0))
+        flat = rows * self.dim + np.asarray(columns, dtype=np.int64)
+        counts = np.bincount(flat, weights=signs, minlength=len(texts) * self.dim).reshape(len(texts), self.dim)
+        return (np.sign(counts) * np.log1p(np.abs(counts))).astype(np.float32)
+
+
+class FunctionEmbedder(Embedder):
+    """包装 fn(texts) -> 矩阵 的嵌入函数，例如 SentenceTransformer(...).encode"""
+
+    def __init__(self, fn, dim: int, name: str = "function", version: str = "1"):
+        self.fn = fn
+        self.dim = dim
+        self.name = name
+        self.version = str(version)
+
+    def embed(self, texts: list):
+        matrix = np.asarray(self.fn(list(texts)), dtype=np.float32)
+        if matrix.shape != (len(texts), self.dim):
+            raise ValueError(f"嵌入函数返回的形状 {matrix.shape} 与 ({len(texts)}, {self.dim}) 不符")
+        return matrix
+
+
+# ---------- 内存映射文件 ----------
+
+class _VectorFiles:
+    """一个集合某一代的内存映射文件：向量、行号对应的 ID、文本 crc32，训练过倒排索引时另有簇中心与每行所属的簇
+
+    文件名带代数：压缩与重建写入新一代文件，提交状态后再删除旧文件，已打开旧文件的读者不受影响
+    """
+
+    def __init__(self, directory: str, collection: str, state: dict, centroids=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.collection = collection
+        self.generation = state["generation"]
+        self.ivf_version = state["ivf_version"]
+        self.dim = state["dim"]
+        self.capacity = state["capacity"]
+        self.centroids = centroids
+        if centroids is not None:
+            np.save(self.path(self.ivf_suffix(self.ivf_version, "npy")), centroids)
+        self._map_all()
+
+    def path(self, suffix: str, generation: int = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.directory, f"{self.collection}-{generation}{suffix}")
+
+    def ivf_suffix(self, version: int, kind: str) -> str:
+        return f"-ivf{version}.{kind}"
+
+    def _map(self, suffix: str, dtype, columns: int = None):
+        shape = (self.capacity,) if columns is None else (self.capacity, columns)
+        path = self.path(suffix)
+        size = math.prod(shape) * np.dtype(dtype).itemsize
+        with open(path, "ab") as handle:
+            if handle.tell() < size:
+                handle.truncate(size)
+        if size == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _map_all(self):
+        self.vectors = self._map(".vec", np.float32, self.dim)
+        self.ids = self._map(".ids", np.int64)
+        self.crcs = self._map(".crc", np.uint32)
+        self.lists = None
+        if self.ivf_version:
+            self.lists = self._map(self.ivf_suffix(self.ivf_version, "lists"), np.int32)
+            if self.centroids is None:
+                self.centroids = np.load(self.path(self.ivf_suffix(self.ivf_version, "npy")))
+
+    def flush(self):
+        for array in (self.vectors, self.ids, self.crcs, self.lists):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def grow(self, rows: int):
+        """扩容到至少 rows 行（按倍增），文件在末尾补零"""
+        if rows > self.capacity:
+            self.remap(max(rows, self.capacity * 2, INITIAL_CAPACITY))
+
+    def remap(self, capacity: int):
+        self.flush()
+        self.capacity = capacity
+        self._map_all()
+
+    def remove_generation(self, generation: int):
+        for path in glob.glob(glob.escape(self.path(".", generation)) + "*") + \
+                glob.glob(glob.escape(self.path("-ivf", generation)) + "*"):
+            os.remove(path)
+
+    def remove_ivf(self, version: int):
+        for kind in ("lists", "npy"):
+            path = self.path(self.ivf_suffix(version, kind))
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _nearest(data, centroids, chunk: int = 8192):
+    """每行最相近（内积最大）的簇中心"""
+    result = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk):
+        result[start:start + chunk] = np.argmax(np.asarray(data[start:start + chunk]) @ centroids.T, axis=1)
+    return result
+
+
+def spherical_kmeans(data, n_clusters: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0):
+    """球面 k-means：簇中心为簇内单位向量之和再归一化，空簇用随机样本重新播种"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(data, centroids)
+        order = np.argsort(assign, kind="stable")
+        sorted_assign = assign[order]
+        starts = np.flatnonzero(np.r_[True, sorted_assign[1:] != sorted_assign[:-1]])
+        sums = np.zeros_like(centroids)
+        sums[sorted_assign[starts]] = np.add.reduceat(data[order], starts, axis=0)
+        empty = np.bincount(assign, minlength=n_clusters) == 0
+        if empty.any():
+            sums[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+# ---------- 索引 ----------
+
+class VectorIndex(BaseForm):
+    """本地向量检索索引"""
+
+    def __init__(self, db_path="app.db", embedder: Embedder = None, vector_dir: str = None):
+        _require_numpy()
+        super().__init__(db_path, VectorIndexModel)
+        self.embedder = embedder or HashingEmbedder()
+        self.vector_dir = vector_dir or f"{db_path}.vectors"
+        self._files = {}
+        # 集合 -> (缓存键, 缓存覆盖的行数, 按簇排序的行号, 各簇在其中的起点)
+        self._inverted = {}
+
+    # ----- 状态与文件 -----
+
+    @staticmethod
+    def _collections(collections) -> list:
+        if collections is None:
+            return list(COLLECTIONS)
+        unknown = set(collections) - set(COLLECTIONS)
+        if unknown:
+            raise ValueError(f"未知的集合: {', '.join(sorted(unknown))}，可用: {', '.join(COLLECTIONS)}")
+        return list(collections)
+
+    @staticmethod
+    def _read_state(conn, collection: str):
+        row = conn.execute(
+            select(VectorIndexModel.__table__).where(VectorIndexModel.collection == collection)
+        ).first()
+        return None if row is None else row._asdict()
+
+    @staticmethod
+    def _save_state(conn, state: dict):
+        values = {key: value for key, value in state.items() if key != "collection"}
+        values["updated_at"] = _now()
+        conn.execute(
+            update(VectorIndexModel.__table__)
+            .where(VectorIndexModel.collection == state["collection"])
+            .values(**values)
+        )
+
+    def _open(self, collection: str, state: dict) -> _VectorFiles:
+        """按状态打开（或重新打开）映射文件：其他进程扩容、压缩或重新训练后，这里的映射随之更新"""
+        files = self._files.get(collection)
+        if files is None or (files.generation, files.ivf_version) != (state["generation"], state["ivf_version"]):
+            files = self._files[collection] = _VectorFiles(self.vector_dir, collection, state)
+        elif files.capacity < state["capacity"]:
+            files.remap(state["capacity"])
+        return files
+
+    @staticmethod
+    def _history_lost(conn, cursor: int) -> bool:
+        """游标之后的变更是否有一部分已被清理：最早的记录在游标之后（日志清空时为下一个序号），
+        或已分配的序号比游标还小（库被换成了更早的备份）"""
+        # min 与 max 分开查询：同一条语句里同时出现时 SQLite 不会用主键直接取两端，而是全表扫描
+        oldest = conn.execute(select(func.min(ChangeLogModel.seq))).scalar()
+        issued = last_change_seq(conn)
+        if oldest is None:
+            oldest = issued + 1
+        return oldest - 1 > cursor or issued < cursor
+
+    def _lock_state(self, conn, collection: str) -> tuple:
+        """在写事务中取得（必要时新建或重置）集合状态；返回 (状态, 需在提交后删除的旧代数)"""
+        conn.execute(STATE_INSERT_SQL, {
+            "collection": collection, "embedder": self.embedder.key, "dim": self.embedder.dim, "now": _now(),
+        })
+        state = self._read_state(conn, collection)
+        if state["embedder"] == self.embedder.key and not self._history_lost(conn, state["change_cursor"]):
+            return state, None
+        console = Console()
+        if state["embedder"] != self.embedder.key:
+            console.print(f"[yellow]{collection}: 嵌入器由 {state['embedder']} 变为 {self.embedder.key}，重建向量索引[/yellow]")
+        else:
+            console.print(f"[yellow]{collection}: 变更日志已清理到索引游标之后，重建向量索引[/yellow]")
+        old_generation = state["generation"]
+        return self._reset_state(conn, state), old_generation
+
+    def _reset_state(self, conn, state: dict) -> dict:
+        state.update(
+            embedder=self.embedder.key, dim=self.embedder.dim, generation=state["generation"] + 1,
+            capacity=0, slots=0, live=0, scan_after=0, ivf_version=0, n_lists=0,
+            change_cursor=last_change_seq(conn),
+        )
+        return state
+
+    def _finish(self, collection: str, old_generation):
+        if old_generation is not None:
+            self._files[collection].remove_generation(old_generation)
+
+    # ----- 同步 -----
+
+    def _needs_sync(self, collection: str) -> bool:
+        with self.read_engine.connect() as conn:
+            state = self._read_state(conn, collection)
+            if state is None or state["embedder"] != self.embedder.key or state["scan_after"] is not None:
+                return True
+            model = COLLECTIONS[collection][0]
+            pending = conn.execute(
+                select(ChangeLogModel.seq)
+                .where(ChangeLogModel.table_name == model.__tablename__, ChangeLogModel.seq > state["change_cursor"])
+                .limit(1)
+            ).first()
+            return pending is not None or self._history_lost(conn, state["change_cursor"])
+
+    def sync(self, collections: list = None) -> dict:
+        """应用变更日志中尚未同步的新增、修改与删除，并继续未完成的全量扫描
+
+        Returns:
+            {集合: {"embedded": 新嵌入的行数, "removed": 置为墓碑的行数}}
+        """
+        report = {}
+        try:
+            for collection in self._collections(collections):
+                report[collection] = self._sync_collection(collection)
+        except (SQLAlchemyError, OSError) as e:
+            console = Console()
+            console.print(f"[red]✗ 同步向量索引失败: {e}[/red]")
+        return report
+
+    def _sync_collection(self, collection: str) -> dict:
+        counts = {"embedded": 0, "removed": 0}
+        if not self._needs_sync(collection):
+            return counts
+        while True:
+            # 每页一个写事务：先取写锁再读状态，并发的同步不会写到同一行号
+            with self.engine.begin() as conn:
+                state, old_generation = self._lock_state(conn, collection)
+                files = self._open(collection, state)
+                progressed = (
+                    self._apply_changes(conn, collection, state, files, counts)
+                    or self._scan_page(conn, collection, state, files, counts)
+                )
+                self._save_state(conn, state)
+            self._finish(collection, old_generation)
+            if not progressed:
+                break
+        # 映射文件的写入进程退出后仍在页缓存中，其他进程立即可见；落盘（msync）只在一次同步结束时做一次
+        files.flush()
+        if state["slots"] >= COMPACT_MIN_SLOTS and state["slots"] - state["live"] > COMPACT_RATIO * state["slots"]:
+            self._compact(collection)
+        return counts
+
+    def _apply_changes(self, conn, collection: str, state: dict, files: _VectorFiles, counts: dict) -> bool:
+        """应用一页变更；全量扫描未完成时，扫描位置之后的行留给扫描处理"""
+        model = COLLECTIONS[collection][0]
+        changes = conn.execute(
+            select(ChangeLogModel.seq, ChangeLogModel.row_id)
+            .where(ChangeLogModel.table_name == model.__tablename__, ChangeLogModel.seq > state["change_cursor"])
+            .order_by(ChangeLogModel.seq)
+            .limit(CHANGE_PAGE)
+        ).all()
+        if not changes:
+            return False
+        state["change_cursor"] = changes[-1].seq
+        scan_after = state["scan_after"]
+        row_ids = sorted({row_id for _, row_id in changes if scan_after is None or row_id <= scan_after})
+        if row_ids:
+            self._refresh_rows(conn, collection, row_ids, state, files, counts)
+        return True
+
+    def _scan_page(self, conn, collection: str, state: dict, files: _VectorFiles, counts: dict) -> bool:
+        if state["scan_after"] is None:
+            return False
+        model, columns, document, _ = COLLECTIONS[collection]
+        table = model.__table__
+        rows = conn.execute(
+            select(table.c.id, *(table.c[column] for column in columns))
+            .where(table.c.id > state["scan_after"])
+            .order_by(table.c.id)
+            .limit(SCAN_PAGE)
+        ).all()
+        items = []
+        for row in rows:
+            content = (document(row) or "")[:MAX_CHARS]
+            if content.strip():
+                items.append((row.id, content, zlib.crc32(content.encode("utf-8"))))
+        # 扫描位置之后的行不可能已在索引中，直接追加
+        self._append(items, state, files, counts)
+        state["scan_after"] = rows[-1].id if len(rows) == SCAN_PAGE else None
+        return True
+
+    def _refresh_rows(self, conn, collection: str, row_ids: list, state: dict, files: _VectorFiles, counts: dict):
+        """按行的当前文本更新索引：已删除或文本为空的置墓碑，文本变化的置墓碑后重新嵌入，未变化的跳过"""
+        model, columns, document, _ = COLLECTIONS[collection]
+        table = model.__table__
+        contents = {}
+        for start in range(0, len(row_ids), SQL_CHUNK):
+            for row in conn.execute(
+                select(table.c.id, *(table.c[column] for column in columns))
+                .where(table.c.id.in_(row_ids[start:start + SQL_CHUNK]))
+            ):
+                content = (document(row) or "")[:MAX_CHARS]
+                if content.strip():
+                    contents[row.id] = content
+
+        used = files.ids[:state["slots"]]
+        slots = np.flatnonzero(np.isin(used, np.asarray(row_ids, dtype=np.int64), kind="table")) if len(used) else []
+        current = {int(used[slot]): slot for slot in slots}
+        items = []
+        for row_id in row_ids:
+            content = contents.get(row_id)
+            crc = None if content is None else zlib.crc32(content.encode("utf-8"))
+            slot = current.get(row_id)
+            if slot is not None:
+                if crc is not None and int(files.crcs[slot]) == crc:
+                    continue
+                files.ids[slot] = -1
+                state["live"] -= 1
+                counts["removed"] += 1
+            if content is not None:
+                items.append((row_id, content, crc))
+        self._append(items, state, files, counts)
+
+    def _embed(self, texts: list):
+        return normalize_rows(self.embedder.embed(texts))
+
+    def _append(self, items: list, state: dict, files: _VectorFiles, counts: dict):
+        for start in range(0, len(items), EMBED_BATCH):
+            batch = items[start:start + EMBED_BATCH]
+            vectors = self._embed([content for _, content, _ in batch])
+            begin, end = state["slots"], state["slots"] + len(batch)
+            files.grow(end)
+            state["capacity"] = files.capacity
+            files.vectors[begin:end] = vectors
+            files.ids[begin:end] = [row_id for row_id, _, _ in batch]
+            files.crcs[begin:end] = [crc for _, _, crc in batch]
+            if files.lists is not None:
+                files.lists[begin:end] = _nearest(vectors, files.centroids)
+            state["slots"] = end
+            state["live"] += len(batch)
+            counts["embedded"] += len(batch)
+
+    def _compact(self, collection: str):
+        """把有效行按原顺序复制到新一代文件，提交状态后删除旧文件"""
+        with self.engine.begin() as conn:
+            state, old_generation = self._lock_state(conn, collection)
+            files = self._open(collection, state)
+            # 取锁时若已因变更日志被清理而重置，索引为空，只需提交重置；否则复制有效行
+            if old_generation is None:
+                old_generation = state["generation"]
+                slots = state["slots"]
+                state = dict(state, generation=old_generation + 1, capacity=max(state["live"], INITIAL_CAPACITY))
+                target = _VectorFiles(self.vector_dir, collection, state, centroids=files.centroids)
+                written = 0
+                for start in range(0, slots, COPY_CHUNK):
+                    end = min(start + COPY_CHUNK, slots)
+                    keep = np.flatnonzero(files.ids[start:end] >= 0) + start
+                    stop = written + len(keep)
+                    target.vectors[written:stop] = files.vectors[keep]
+                    target.ids[written:stop] = files.ids[keep]
+                    target.crcs[written:stop] = files.crcs[keep]
+                    if files.lists is not None:
+                        target.lists[written:stop] = files.lists[keep]
+                    written = stop
+                target.flush()
+                state.update(slots=written, live=written)
+                self._files[collection] = target
+            self._save_state(conn, state)
+        self._finish(collection, old_generation)
+
+    def rebuild(self, collections: list = None) -> int:
+        """丢弃现有向量，重新全量扫描，返回索引中的向量数"""
+        total = 0
+        try:
+            for collection in self._collections(collections):
+                with self.engine.begin() as conn:
+                    state, old_generation = self._lock_state(conn, collection)
+                    if old_generation is None:
+                        old_generation = state["generation"]
+                        state = self._reset_state(conn, state)
+                    self._open(collection, state)
+                    self._save_state(conn, state)
+                self._finish(collection, old_generation)
+                self._sync_collection(collection)
+                with self.read_engine.connect() as conn:
+                    total += self._read_state(conn, collection)["live"]
+        except (SQLAlchemyError, OSError) as e:
+            console = Console()
+            console.print(f"[red]✗ 重建向量索引失败: {e}[/red]")
+        return total
+
+    # ----- 倒排索引 -----
+
+    def train_ivf(self, collection: str, n_lists: int = None, iterations: int = KMEANS_ITERATIONS,
+                  sample_size: int = None, seed: int = 0) -> bool:
+        """训练倒排索引：在抽样向量上做球面 k-means，再把每个向量归入最近的簇
+
+        训练与归簇不持有写锁；提交前再为训练期间新追加的行归簇
+        """
+        try:
+            self._collections([collection])
+            self._sync_collection(collection)
+            with self.read_engine.connect() as conn:
+                state = self._read_state(conn, collection)
+            if state is None or state["live"] == 0:
+                console = Console()
+                console.print(f"[yellow]{collection} 没有可训练的向量[/yellow]")
+                return False
+            files = self._open(collection, state)
+            live_slots = np.flatnonzero(files.ids[:state["slots"]] >= 0)
+            n_lists = min(n_lists or max(1, int(math.sqrt(len(live_slots)))), len(live_slots))
+            sample_size = min(sample_size or n_lists * KMEANS_SAMPLE_PER_LIST, len(live_slots))
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(live_slots, sample_size, replace=False))
+            centroids = spherical_kmeans(np.asarray(files.vectors[sample]), n_lists, iterations, seed)
+
+            version = state["ivf_version"] + 1
+            trained = dict(state, ivf_version=version, n_lists=n_lists)
+            target = _VectorFiles(self.vector_dir, collection, trained, centroids=centroids)
+            target.lists[:state["slots"]] = _nearest(files.vectors[:state["slots"]], centroids)
+
+            with self.engine.begin() as conn:
+                current, old_generation = self._lock_state(conn, collection)
+                if old_generation is not None or current["generation"] != state["generation"]:
+                    console = Console()
+                    console.print(f"[yellow]{collection} 在训练期间被重建或压缩，请重新训练[/yellow]")
+                    target.remove_ivf(version)
+                    self._finish(collection, old_generation)
+                    return False
+                target.grow(current["capacity"])
+                if current["slots"] > state["slots"]:
+                    target.lists[state["slots"]:current["slots"]] = _nearest(
+                        files.vectors[state["slots"]:current["slots"]], centroids
+                    )
+                target.flush()
+                current.update(ivf_version=version, n_lists=n_lists)
+                self._save_state(conn, current)
+            self._files[collection] = target
+            if state["ivf_version"]:
+                target.remove_ivf(state["ivf_version"])
+            console = Console()
+            console.print(f"[green]✓ {collection} 倒排索引训练完成：{n_lists} 个簇，抽样 {sample_size} 个向量[/green]")
+            return True
+        except (SQLAlchemyError, OSError) as e:
+            console = Console()
+            console.print(f"[red]✗ 训练倒排索引失败: {e}[/red]")
+            return False
+
+    def _probe(self, collection: str, state: dict, files: _VectorFiles, vector, nprobe: int):
+        """最近 nprobe 个簇内的行号（升序）；缓存之后追加的行单独判断所属簇"""
+        slots = state["slots"]
+        key = (state["generation"], state["ivf_version"])
+        cached = self._inverted.get(collection)
+        if cached is None or cached[0] != key or slots - cached[1] > IVF_TAIL_ROWS:
+            lists = np.asarray(files.lists[:slots])
+            order = np.argsort(lists, kind="stable")
+            offsets = np.searchsorted(lists[order], np.arange(state["n_lists"] + 1))
+            cached = self._inverted[collection] = (key, slots, order, offsets)
+        _, covered, order, offsets = cached
+
+        centroid_scores = files.centroids @ vector
+        if nprobe < len(centroid_scores):
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(len(centroid_scores))
+        parts = [order[offsets[cluster]:offsets[cluster + 1]] for cluster in probe]
+        if slots > covered:
+            tail = np.arange(covered, slots)
+            parts.append(tail[np.isin(files.lists[covered:slots], probe)])
+        candidates = np.concatenate(parts)
+        candidates.sort()
+        return candidates
+
+    # ----- 检索 -----
+
+    def search(self, collection: str, content: str, k: int = 10, exact: bool = False,
+               nprobe: int = DEFAULT_NPROBE, sync: bool = True) -> list:
+        """与文本最相近的 k 行，按余弦相似度从高到低
+
+        Returns:
+            queries: [{id, score, lazy_query, detail_query}]
+            reports: [{id, score, query_id, agent, snippet}]
+        """
+        self._collections([collection])
+        if not (content or "").strip():
+            return []
+        vector = self._embed([content[:MAX_CHARS]])[0]
+        return self._search_vector(collection, vector, k, exact, nprobe, sync, exclude_id=None)
+
+    def search_similar(self, collection: str, row_id: int, k: int = 10, exact: bool = False,
+                       nprobe: int = DEFAULT_NPROBE, sync: bool = True) -> list:
+        """与已索引的某一行最相近的 k 行（不含该行本身），该行不在索引中时返回空列表"""
+        self._collections([collection])
+        if sync:
+            self.sync([collection])
+        try:
+            with self.read_engine.connect() as conn:
+                state = self._read_state(conn, collection)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 读取向量索引失败: {e}[/red]")
+            return []
+        if state is None:
+            return []
+        files = self._open(collection, state)
+        slots = np.flatnonzero(files.ids[:state["slots"]] == row_id)
+        if not len(slots):
+            return []
+        vector = np.array(files.vectors[slots[-1]])
+        return self._search_vector(collection, vector, k, exact, nprobe, sync=False, exclude_id=row_id)
+
+    def _search_vector(self, collection, vector, k, exact, nprobe, sync, exclude_id) -> list:
+        if sync:
+            self.sync([collection])
+        model, _, _, detail_columns = COLLECTIONS[collection]
+        table = model.__table__
+        try:
+            with self.read_engine.connect() as conn:
+                state = self._read_state(conn, collection)
+                if state is None or state["live"] == 0 or k <= 0:
+                    return []
+                files = self._open(collection, state)
+                if exact or not state["n_lists"]:
+                    ids = files.ids[:state["slots"]]
+                    scores = files.vectors[:state["slots"]] @ vector
+                else:
+                    candidates = self._probe(collection, state, files, vector, nprobe)
+                    ids = files.ids[candidates]
+                    scores = files.vectors[candidates] @ vector
+                invalid = ids < 0
+                if exclude_id is not None:
+                    invalid |= ids == exclude_id
+                scores[invalid] = -np.inf
+                top = min(k, len(scores))
+                hits = []
+                if top:
+                    best = np.argpartition(-scores, top - 1)[:top]
+                    best = best[np.argsort(-scores[best], kind="stable")]
+                    hits = [(int(ids[position]), float(scores[position]))
+                            for position in best if np.isfinite(scores[position])]
+
+                details = {}
+                if hits:
+                    rows = conn.execute(
+                        select(table.c.id, *(table.c[column] for column in detail_columns))
+                        .where(table.c.id.in_([row_id for row_id, _ in hits]))
+                    )
+                    details = {row.id: row._asdict() for row in rows}
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 向量检索失败: {e}[/red]")
+            return []
+
+        results = []
+        for row_id, score in hits:
+            row = details.get(row_id)
+            if row is None:
+                continue
+            if "report_content" in row:
+                row["snippet"] = (row.pop("report_content") or "")[:SNIPPET_CHARS]
+            row["score"] = round(score, 6)
+            results.append(row)
+        return results
+
+    # ----- 统计 -----
+
+    def get_stats(self) -> list:
+        """各集合的索引状态：向量数、墓碑数、映射文件大小、倒排索引簇数、是否仍在全量扫描"""
+        try:
+            with self.read_engine.connect() as conn:
+                states = [row._asdict() for row in conn.execute(select(VectorIndexModel.__table__))]
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 获取向量索引状态失败: {e}[/red]")
+            return []
+        stats = []
+        for state in states:
+            prefix = os.path.join(self.vector_dir, f"{state['collection']}-{state['generation']}")
+            file_bytes = sum(os.path.getsize(path) for path in glob.glob(glob.escape(prefix) + "[.-]*"))
+            stats.append({
+                "collection": state["collection"],
+                "embedder": state["embedder"],
+                "vectors": state["live"],
+                "tombstones": state["slots"] - state["live"],
+                "file_bytes": file_bytes,
+                "n_lists": state["n_lists"],
+                "scanning": state["scan_after"] is not None,
+                "change_cursor": state["change_cursor"],
+                "updated_at": state["updated_at"],
+            })
+        return stats
+
+    def display_stats(self, stats: list = None):
+        """展示各集合的索引状态"""
+        stats = self.get_stats() if stats is None else stats
+        console = Console()
+        if not stats:
+            console.print("[yellow]尚未建立向量索引[/yellow]")
+            return
+        table = Table(title="向量索引")
+        for column in ("集合", "嵌入器", "向量数", "墓碑", "文件大小(MB)", "倒排簇数", "状态", "更新时间"):
+            table.add_column(column)
+        for row in stats:
+            table.add_row(
+                row["collection"], row["embedder"], str(row["vectors"]), str(row["tombstones"]),
+                f"{row['file_bytes'] / 1024 / 1024:.1f}", str(row["n_lists"] or "-"),
+                "扫描中" if row["scanning"] else "已同步", row["updated_at"],
+            )
+        console.print(table)
@@ -0,0 +1,237 @@
+"""
+评估任务调度
+
+把待评估的 (查询, agent) 放进 work_item 队列，评估人与自动评分器通过 claim 并发领取，
+不再手工挑选、互相撞车：
+- 领取顺序：查询优先级（数值越大越优先，未设置视为 0）从高到低，同优先级按入队先后
+- 租约：领取后在 lease_seconds 内有效，到期未完成的任务在下一次领取时自动回到队列；
+  长任务可调用 heartbeat 续租
+- 原子性：领取是一条 UPDATE ... WHERE id IN (SELECT ... LIMIT n) RETURNING 语句，
+  SQLite 同一时刻只有一个写者，并发领取不会拿到同一任务；每次领取生成新的 lease_token，
+  完成/释放/续租都要校验令牌，租约过期后被他人领走的任务原持有者无法再提交
+- 无全表扫描：领取与回收都沿 (status, priority DESC, id) 与 (status, lease_expires_at) 索引
+  读取头部若干行，代价与队列长度无关
+
+用法：
+    scheduler = WorkScheduler("app.db", lease_seconds=600)
+    scheduler.enqueue(agents=["agent-a", "agent-b"])
+    for item in scheduler.claim("evaluator-1", n=5):
+        ...  # 评估 item["query_id"], item["agent"]
+        scheduler.complete(item["id"], item["lease_token"], evaluation_id=...)
+
+可用方法
+enqueue
+claim
+heartbeat
+complete
+release
+reclaim_expired
+get_queue_stats
+display_queue_stats
+"""
+
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select, update, func, exists, literal, case, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from .lazy_rich import Console, Table
+
+from .base_form import BaseForm
+from .models import WorkItemModel, QueryModel, EvaluationModel
+
+STATUSES = ("pending", "leased", "done", "failed")
+DEFAULT_LEASE_SECONDS = 600
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class WorkScheduler(BaseForm):
+    """评估任务调度器"""
+
+    def __init__(self, db_path="app.db", lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        """
+        Args:
+            lease_seconds: 默认租约时长（秒）
+            max_attempts: 最多领取次数，超过后任务标记为 failed 不再派发
+        """
+        super().__init__(db_path, WorkItemModel)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, agents: list, query_ids: list = None, skip_evaluated: bool = True) -> int:
+        """为查询 × agent 创建任务（已存在的跳过），返回新入队的任务数
+
+        Args:
+            agents: agent 名称列表
+            query_ids: 查询ID列表，默认全部查询
+            skip_evaluated: 跳过该 agent 已有打分评估的查询
+        """
+        table = WorkItemModel.__table__
+        try:
+            created = 0
+            with self.engine.begin() as conn:
+                for agent in agents:
+                    source = select(
+                        QueryModel.id, func.coalesce(QueryModel.priority, 0), literal(agent), literal(_now())
+                    ).where(QueryModel.id.isnot(None))  # INSERT ... SELECT ... ON CONFLICT 需要 WHERE 消除语法歧义
+                    if query_ids is not None:
+                        source = source.where(QueryModel.id.in_(list(query_ids)))
+                    if skip_evaluated:
+                        source = source.where(~exists().where(and_(
+                            EvaluationModel.query_id == QueryModel.id,
+                            EvaluationModel.agent == agent,
+                            EvaluationModel.quality_score.isnot(None),
+                        )))
+                    result = conn.execute(
+                        sqlite_insert(table)
+                        .from_select(["query_id", "priority", "agent", "created_at"], source)
+                        .on_conflict_do_nothing(index_elements=["query_id", "agent"])
+                    )
+                    created += max(result.rowcount, 0)
+            console = Console()
+            console.print(f"[green]✓ 已入队 {created} 个评估任务[/green]")
+            return created
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 入队失败: {e}[/red]")
+            return 0
+
+    def reclaim_expired(self, conn=None) -> int:
+        """把租约已过期的任务放回队列（领取次数用尽的标记为 failed），返回处理的任务数"""
+        table = WorkItemModel.__table__
+        expired = and_(table.c.status == "leased", table.c.lease_expires_at < time.time())
+        values = {"lease_owner": None, "lease_token": None, "lease_expires_at": None, "updated_at": _now()}
+
+        def run(conn):
+            failed = conn.execute(
+                update(table).where(expired, table.c.attempts >= self.max_attempts)
+                .values(status="failed", last_error="租约过期", **values)
+            ).rowcount
+            pending = conn.execute(
+                update(table).where(expired).values(status="pending", **values)
+            ).rowcount
+            return failed + pending
+
+        if conn is not None:
+            return run(conn)
+        try:
+            with self.engine.begin() as conn:
+                return run(conn)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 回收过期租约失败: {e}[/red]")
+            return 0
+
+    def claim(self, owner: str, n: int = 1, lease_seconds: float = None, agents: list = None) -> list:
+        """原子地领取最多 n 个任务
+
+        Args:
+            owner: 领取者标识（评估人用户名、评分器实例名等）
+            lease_seconds: 本次租约时长，默认使用构造时的 lease_seconds
+            agents: 只领取这些 agent 的任务
+
+        Returns:
+            [{id, query_id, agent, priority, attempts, lease_token, lease_expires_at}]，按领取顺序排列
+        """
+        table = WorkItemModel.__table__
+        lease = self.lease_seconds if lease_seconds is None else lease_seconds
+        try:
+            with self.engine.begin() as conn:
+                self.reclaim_expired(conn)
+                candidates = (
+                    select(table.c.id).where(table.c.status == "pending")
+                    .order_by(table.c.priority.desc(), table.c.id).limit(n)
+                )
+                if agents is not None:
+                    candidates = candidates.where(table.c.agent.in_(list(agents)))
+                token = uuid.uuid4().hex
+                rows = conn.execute(
+                    update(table).where(table.c.id.in_(candidates.scalar_subquery()))
+                    .values(
+                        status="leased", lease_owner=owner, lease_token=token,
+                        lease_expires_at=time.time() + lease, attempts=table.c.attempts + 1, updated_at=_now(),
+                    )
+                    .returning(
+                        table.c.id, table.c.query_id, table.c.agent, table.c.priority,
+                        table.c.attempts, table.c.lease_token, table.c.lease_expires_at,
+                    )
+                ).mappings().all()
+            return sorted((dict(row) for row in rows), key=lambda row: (-row["priority"], row["id"]))
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 领取任务失败: {e}[/red]")
+            return []
+
+    def _update_leased(self, item_id: int, lease_token: str, action: str, values: dict) -> bool:
+        """仅当任务仍由该令牌持有时更新"""
+        table = WorkItemModel.__table__
+        try:
+            with self.engine.begin() as conn:
+                updated = conn.execute(
+                    update(table).where(
+                        table.c.id == item_id, table.c.status == "leased", table.c.lease_token == lease_token
+                    ).values(updated_at=_now(), **values)
+                ).rowcount
+            if not updated:
+                console = Console()
+                console.print(f"[yellow]任务 {item_id} 的租约已失效，{action}未生效[/yellow]")
+            return bool(updated)
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ {action}失败: {e}[/red]")
+            return False
+
+    def heartbeat(self, item_id: int, lease_token: str, lease_seconds: float = None) -> bool:
+        """续租：把到期时间延长到现在起 lease_seconds 秒后"""
+        lease = self.lease_seconds if lease_seconds is None else lease_seconds
+        return self._update_leased(item_id, lease_token, "续租", {"lease_expires_at": time.time() + lease})
+
+    def complete(self, item_id: int, lease_token: str, evaluation_id: int = None) -> bool:
+        """标记任务完成，可关联产出的评估"""
+        return self._update_leased(item_id, lease_token, "完成任务", {
+            "status": "done", "evaluation_id": evaluation_id,
+            "lease_owner": None, "lease_token": None, "lease_expires_at": None,
+        })
+
+    def release(self, item_id: int, lease_token: str, error: str = None) -> bool:
+        """放弃任务：放回队列，领取次数用尽时标记为 failed"""
+        table = WorkItemModel.__table__
+        status = case((table.c.attempts >= self.max_attempts, "failed"), else_="pending")
+        return self._update_leased(item_id, lease_token, "释放任务", {
+            "status": status, "last_error": error,
+            "lease_owner": None, "lease_token": None, "lease_expires_at": None,
+        })
+
+    def get_queue_stats(self) -> dict:
+        """各状态的任务数 {status: count}"""
+        table = WorkItemModel.__table__
+        try:
+            with self.read_engine.connect() as conn:
+                rows = conn.execute(select(table.c.status, func.count()).group_by(table.c.status)).all()
+            stats = dict.fromkeys(STATUSES, 0)
+            stats.update({status: count for status, count in rows})
+            return stats
+        except SQLAlchemyError as e:
+            console = Console()
+            console.print(f"[red]✗ 获取队列统计失败: {e}[/red]")
+            return None
+
+    def display_queue_stats(self):
+        """展示队列状态"""
+        stats = self.get_queue_stats()
+        if stats is None:
+            return
+        console = Console()
+        table = Table(title="评估任务队列")
+        table.add_column("状态", style="cyan")
+        table.add_column("任务数", style="green", justify="right")
+        for status, count in stats.items():
+            table.add_row(status, str(count))
+        console.print(table)
@@ -0,0 +1,343 @@
+"""
+单写入者队列（组提交）
+
+SQLite 同一时刻只允许一个写入者，而表单方法在调用线程里逐条提交，
+并发运行多个 agent 时每行一次 fsync、写锁来回争抢。WriteQueue 把写操作
+交给一个专用写线程：
+- 调用方提交操作后立即拿到 Future，不等待写锁
+- 写线程每次取出至多 max_batch 个操作（第一个操作到达后最多再等 max_latency 秒），
+  在一个事务内写入并提交一次，吞吐随批大小增长而不是受限于 fsync 频率
+- 连续的同类插入合并为一条 executemany … RETURNING，提交后 Future 得到新行的 ID
+- 批内某个操作失败时整批回滚，再逐个单独提交，失败的操作只影响自己的 Future
+- stop() 之后（以及停止过程中）提交的操作直接抛出 RuntimeError，已进入队列的操作都会在写线程退出前完成
+
+用法：
+    with WriteQueue("app.db") as queue:
+        futures = [queue.add_evaluation(query_id=1, agent="a", trajectory=t) for t in trajectories]
+        ids = [future.result() for future in futures]
+        queue.update_evaluation(ids[0], quality_score=90)
+
+可用方法
+start
+stop
+flush
+submit
+add_evaluation
+add_file
+update_evaluation
+update_query
+update_file
+update_user
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
+
+from sqlalchemy import insert, update
+
+from .engine import create_sqlite_engine
+from .models import UserModel, QueryModel, EvaluationModel, FilesModel, compute_query_hash
+from .media_extract import write_media
+from .trajectory_store import pack_trajectory_bytes
+
+_STOP = object()
+
+FILE_TYPES = ("trajectory", "report", "deliverable", "pre_data")
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _resolve(future: Future, result=None, error: Exception = None):
+    """设置 Future 的结果；调用方已取消的 Future 直接跳过，不能让写线程因 InvalidStateError 退出"""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class WriteOp:
+    """一个待写入的操作: kind 为 insert / update，insert 的结果为新ID，update 的结果为更新行数"""
+
+    __slots__ = ("kind", "model", "values", "row_id", "children", "media", "future")
+
+    def __init__(
+        self, kind: str, model, values: dict, row_id: int = None, children: list = None, media: dict = None
+    ):
+        self.kind = kind
+        self.model = model
+        self.values = values
+        self.row_id = row_id
+        self.children = children or []
+        # 提交前从轨迹文件内容中抽出的图片，与该操作在同一事务中写入 media 表
+        self.media = media or {}
+        self.future = Future()
+
+    def group_key(self):
+        """可以合并为一条 executemany 的操作具有相同的 group_key"""
+        if self.kind != "insert" or self.children:
+            return None
+        return (self.model, tuple(sorted(self.values)))
+
+
+class WriteQueue:
+    """单写入者组提交队列"""
+
+    def __init__(
+        self, db_path: str = "app.db", max_batch: int = 256,
+        max_latency: float = 0.01, max_queue: int = 10000
+    ):
+        """
+        Args:
+            db_path: 数据库路径
+            max_batch: 每个事务最多包含的操作数
+            max_latency: 第一个操作到达后最多等待多少秒凑批，决定最坏提交延迟
+            max_queue: 队列容量，满时 submit 阻塞（背压）
+        """
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.engine = create_sqlite_engine(db_path)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        # 判断是否接受提交与放入队列在同一把锁内完成，stop() 放入 _STOP 之后不会再有操作排在它后面
+        self._submit_lock = threading.Lock()
+        self._accepting = False
+        self._stats_lock = threading.Lock()
+        self.stats = {"submitted": 0, "committed": 0, "failed": 0, "batches": 0, "max_batch": 0, "seconds": 0.0}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        """启动写线程"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+            self._thread.start()
+            with self._submit_lock:
+                self._accepting = True
+
+    def stop(self, timeout: float = 30.0):
+        """写完队列中已提交的操作后停止写线程；之后的提交抛出 RuntimeError"""
+        with self._lock:
+            if not self._thread:
+                return
+            with self._submit_lock:
+                self._accepting = False
+                self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+        self.engine.dispose()
+
+    def flush(self, timeout: float = None):
+        """等待此前提交的所有操作落盘；写线程未运行或中途退出时抛出 RuntimeError"""
+        marker = Future()
+        thread = self._enqueue(marker, timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = 0.1 if deadline is None else max(0.0, min(0.1, deadline - time.monotonic()))
+            try:
+                return marker.result(wait)
+            except FutureTimeoutError:
+                if not thread.is_alive() and not marker.done():
+                    raise RuntimeError("写线程已退出，队列中的操作不会再被写入")
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+
+    # ---------- 提交 ----------
+
+    def submit(self, op: WriteOp) -> Future:
+        """提交一个操作，返回 Future"""
+        self._enqueue(op)
+        with self._stats_lock:
+            self.stats["submitted"] += 1
+        return op.future
+
+    def _enqueue(self, item, timeout: float = None):
+        """放入队列并返回写线程；未启动、正在停止或写线程已退出时抛出 RuntimeError"""
+        with self._submit_lock:
+            thread = self._thread
+            if not self._accepting or not thread or not thread.is_alive():
+                raise RuntimeError("写线程未启动或已停止，请先调用 start()")
+            self._queue.put(item, timeout=timeout)
+        return thread
+
+    def add_evaluation(
+        self, query_id: int, agent: str = None, evaluator_id: int = None,
+        quality_score: int = None, trajectory: str = None, report_content: str = None,
+        deliverables: list = None, run_id: str = None
+    ) -> Future:
+        """添加评估（可带交付文件，与 EvaluationForm.add_evaluation 参数一致），Future 结果为评估ID"""
+        children = []
+        for file in deliverables or []:
+            if not isinstance(file, dict) or not isinstance(file.get("content"), bytes):
+                raise ValueError("每个交付文件必须为包含 bytes content 的 dict")
+            children.append(self._file_values(
+                None, file.get("filename"), "deliverable", file["content"], file.get("file_size")
+            ))
+        values = {
+            "query_id": query_id,
+            "agent": agent,
+            "run_id": run_id,
+            "evaluator_id": evaluator_id,
+            "quality_score": quality_score,
+            "trajectory": trajectory,
+            "report_content": report_content,
+            "created_at": _now(),
+        }
+        return self.submit(WriteOp("insert", EvaluationModel, values, children=children))
+
+    def add_file(
+        self, evaluation_id: int, filename: str, file_type: str,
+        content: bytes = None, file_size: int = None
+    ) -> Future:
+        """添加文件，Future 结果为文件ID"""
+        if file_type not in FILE_TYPES:
+            raise ValueError(f"无效的文件类型: {file_type}，有效类型: {', '.join(FILE_TYPES)}")
+        values = self._file_values(evaluation_id, filename, file_type, content, file_size)
+        media = {}
+        if file_type == "trajectory" and content:
+            values["content"] = pack_trajectory_bytes(content, media)
+        return self.submit(WriteOp("insert", FilesModel, values, media=media))
+
+    def update_evaluation(self, evaluation_id: int, **values) -> Future:
+        """更新评估，Future 结果为更新行数"""
+        return self._update(EvaluationModel, evaluation_id, values)
+
+    def update_query(self, query_id: int, **values) -> Future:
+        """更新查询，Future 结果为更新行数"""
+        if "detail_query" in values:
+            values["content_hash"] = compute_query_hash(values["detail_query"])
+        return self._update(QueryModel, query_id, values)
+
+    def update_file(self, file_id: int, **values) -> Future:
+        """更新文件，Future 结果为更新行数"""
+        return self._update(FilesModel, file_id, values)
+
+    def update_user(self, user_id: int, **values) -> Future:
+        """更新用户，Future 结果为更新行数"""
+        return self._update(UserModel, user_id, values)
+
+    def _update(self, model, row_id: int, values: dict) -> Future:
+        unknown = [key for key in values if key not in model.__table__.c or key == "id"]
+        if unknown:
+            raise ValueError(f"表 '{model.__tablename__}' 不可更新字段: {', '.join(unknown)}")
+        values["updated_at"] = _now()
+        return self.submit(WriteOp("update", model, values, row_id=row_id))
+
+    @staticmethod
+    def _file_values(evaluation_id, filename, file_type, content, file_size) -> dict:
+        if not isinstance(filename, str):
+            raise ValueError("filename 必须为字符串")
+        return {
+            "evaluation_id": evaluation_id,
+            "filename": filename,
+            "content": content,
+            "file_type": file_type,
+            "file_size": file_size if file_size is not None else (len(content) if content is not None else None),
+            "created_at": _now(),
+        }
+
+    # ---------- 写线程 ----------
+
+    def _run(self):
+        running = True
+        while running:
+            batch, markers = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.max_latency
+            while True:
+                if item is _STOP:
+                    running = False
+                    break
+                if isinstance(item, Future):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write_batch(batch)
+            for marker in markers:
+                _resolve(marker, None)
+
+    def _write_batch(self, batch: list):
+        start = time.perf_counter()
+        committed = failed = 0
+        try:
+            with self.engine.begin() as conn:
+                results = self._apply(conn, batch)
+        except Exception:
+            # 整批回滚后逐个提交，把失败隔离到单个操作（任何异常都必须落到 Future 上，不能让写线程退出）
+            for op in batch:
+                try:
+                    with self.engine.begin() as conn:
+                        result = self._apply(conn, [op])[0]
+                except Exception as e:
+                    failed += 1
+                    _resolve(op.future, error=e)
+                else:
+                    committed += 1
+                    _resolve(op.future, result)
+        else:
+            for op, result in zip(batch, results):
+                _resolve(op.future, result)
+            committed = len(batch)
+        with self._stats_lock:
+            self.stats["committed"] += committed
+            self.stats["failed"] += failed
+            self.stats["batches"] += 1
+            self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+            self.stats["seconds"] += time.perf_counter() - start
+
+    def _apply(self, conn, batch: list) -> list:
+        """在同一事务内按提交顺序执行，连续的同类插入合并为一条 executemany"""
+        results = []
+        index = 0
+        while index < len(batch):
+            op = batch[index]
+            key = op.group_key()
+            end = index + 1
+            if key is not None:
+                while end < len(batch) and batch[end].group_key() == key:
+                    end += 1
+            group = batch[index:end]
+            for item in group:
+                write_media(conn, item.media)
+            if op.kind == "insert":
+                table = op.model.__table__
+                result = conn.execute(
+                    insert(table).returning(table.c.id, sort_by_parameter_order=True),
+                    [item.values for item in group],
+                )
+                ids = [row.id for row in result]
+                if op.children:
+                    children = [dict(child, evaluation_id=ids[0]) for child in op.children]
+                    conn.execute(insert(FilesModel.__table__), children)
+                results.extend(ids)
+            else:
+                table = op.model.__table__
+                result = conn.execute(update(table).where(table.c.id == op.row_id).values(**op.values))
+                results.append(result.rowcount)
+            index = end
+        return results
@@ -0,0 +1,65 @@
+"""
+测试 agent 对比统计
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from src.db import UserForm, QueryForm, EvaluationForm
+from src.db.agent_compare import AgentComparison, build_score_matrix, resample_counts
+
+
+def test_build_matrix_averages_repeated_runs():
+    agents, query_ids, matrix = build_score_matrix(["b", "a", "a", "b"], [2, 1, 1, 1], [50, 60, 80, 40])
+    assert agents == ["a", "b"] and list(query_ids) == [1, 2]
+    assert matrix[0, 0] == 70 and np.isnan(matrix[0, 1]) and matrix[1, 1] == 50
+
+
+def test_vectorized_bootstrap_matches_explicit_resampling():
+    rng = np.random.default_rng(1)
+    matrix = rng.normal(60, 10, (3, 200))
+    matrix[1] += 5
+    matrix[2, :50] = np.nan
+    comparison = AgentComparison(["a", "b", "c"], np.arange(200), matrix, n_boot=300, seed=3)
+
+    counts = resample_counts(200, 300, 3)
+    assert (counts.sum(axis=1) == 200).all()
+    # 逐次重抽样的参考实现：a 与 c 在共享查询上的差值
+    shared = ~np.isnan(matrix[2])
+    diff = np.where(shared, matrix[0] - matrix[2], 0.0)
+    reference = (counts @ diff) / (counts @ shared)
+    low, high = np.quantile(reference, [0.025, 0.975])
+
+    rows = {(row["agent_a"], row["agent_b"]): row for row in comparison.compare_pairs()}
+    pair = rows[("a", "c")]
+    assert pair["n_shared"] == 150
+    assert pair["ci_low"] == pytest.approx(low, abs=1e-3) and pair["ci_high"] == pytest.approx(high, abs=1e-3)
+    assert rows[("a", "b")]["mean_diff"] < 0 and rows[("a", "b")]["p_value"] < 0.01
+    assert rows[("a", "b")]["win_rate"] < 0.5
+
+    summary = comparison.agent_summary()
+    assert summary[0]["agent"] == "b" and summary[0]["ci_low"] < summary[0]["mean"] < summary[0]["ci_high"]
+    agents, wins = comparison.win_rate_matrix()
+    assert wins[0, 1] == pytest.approx(rows[("a", "b")]["win_rate"])
+    assert wins[0, 1] + wins[1, 0] == pytest.approx(1.0)
+
+    in_processes = comparison.compare_pairs(processes=2, block_size=1)
+    assert in_processes == comparison.compare_pairs(block_size=1)
+
+
+def test_from_database(tmp_path):
+    db_path = str(tmp_path / "compare.db")
+    UserForm(db_path)._create_tables()
+    query_form = QueryForm(db_path)
+    evaluation_form = EvaluationForm(db_path)
+    for i in range(1, 6):
+        query_form.add_query(detail_query=f"q{i}")
+        evaluation_form.add_evaluation(i, agent="x", quality_score=60 + i)
+        evaluation_form.add_evaluation(i, agent="y", quality_score=50 + i)
+    evaluation_form.add_evaluation(1, agent="z")  # 未打分的评估不参与
+
+    comparison = AgentComparison.from_database(db_path, n_boot=100)
+    assert comparison.agents == ["x", "y"]
+    (pair,) = comparison.compare_pairs()
+    assert pair["mean_diff"] == 10 and pair["win_rate"] == 1.0
@@ -36,7 +36,7 @@ def test_user_form():
     
     # 显示所有用户
     console.print("\n[green]4. 显示所有用户[/green]")
-    user_form.display_UserForm()
+    user_form.display_lines()
 
 def test_query_form():
     """测试查询表单功能"""
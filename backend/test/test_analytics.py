@@ -0,0 +1,75 @@
+"""
+测试 DuckDB 分析报表
+"""
+
+import json
+
+import pytest
+
+from src.db import DatabaseManager, UserForm, QueryForm, EvaluationForm
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("numpy")
+
+
+def _trajectory(*tokens):
+    # 带 model_input_messages，写入时会被压缩为紧凑格式
+    return json.dumps([
+        {"step": i, "token_usage": {"input_tokens": t, "output_tokens": 1, "total_tokens": t + 1},
+         "model_input_messages": [{"role": "user", "content": "任务"}] * i}
+        for i, t in enumerate(tokens, 1)
+    ])
+
+
+def _seed(db_path):
+    UserForm(db_path)._create_tables()
+    query_form = QueryForm(db_path)
+    query_form.add_query(detail_query="高", priority=1)
+    query_form.add_query(detail_query="低", priority=2)
+    evaluation_form = EvaluationForm(db_path)
+    evaluation_form.add_evaluation(1, agent="a", quality_score=90, trajectory=_trajectory(10, 20))
+    evaluation_form.add_evaluation(1, agent="a", quality_score=70, trajectory=_trajectory(5))
+    evaluation_form.add_evaluation(2, agent="b", quality_score=35, trajectory="not json")
+    evaluation_form.add_evaluation(2, agent="b")
+
+
+@pytest.mark.parametrize("source", ["auto", "copy"])
+def test_canned_reports(tmp_path, source):
+    db_path = str(tmp_path / "analytics.db")
+    _seed(db_path)
+    manager = DatabaseManager(db_path)
+
+    scores = manager.analytics_report("score_distribution", engine_options={"source": source})
+    by_agent = {row["agent"]: row for row in scores}
+    assert by_agent["a"]["runs"] == 2 and by_agent["a"]["mean"] == 80
+    assert by_agent["a"]["histogram"] == {70: 1, 90: 1}
+    assert by_agent["b"]["runs"] == 2 and by_agent["b"]["scored"] == 1
+
+    usage = {row["priority"]: row for row in manager.analytics_report("token_usage_by_priority",
+                                                                      engine_options={"source": source})}
+    assert usage[1]["input_tokens"] == 35 and usage[1]["total_tokens"] == 38 and usage[1]["steps"] == 3
+    assert usage[2]["evaluations"] == 2 and usage[2]["total_tokens"] == 0
+
+
+def test_parquet_round_trip(tmp_path):
+    db_path = str(tmp_path / "analytics.db")
+    _seed(db_path)
+    manager = DatabaseManager(db_path)
+    with manager.get_analytics(source="copy") as analytics:
+        paths = analytics.export_parquet(str(tmp_path / "parquet"))
+    assert set(paths) == {"user_form", "query_form", "evaluation_form", "files_form"}
+
+    rows = manager.analytics_report(
+        "score_distribution", engine_options={"source": "parquet", "parquet_dir": str(tmp_path / "parquet")}
+    )
+    assert {row["agent"] for row in rows} == {"a", "b"}
+
+
+def test_copy_handles_special_characters_in_path(tmp_path):
+    # 只读 URI 中的 #、% 需要百分号编码，否则会被当作片段或转义
+    directory = tmp_path / "runs #1 100%"
+    directory.mkdir()
+    db_path = str(directory / "analytics.db")
+    _seed(db_path)
+    scores = DatabaseManager(db_path).analytics_report("score_distribution", engine_options={"source": "copy"})
+    assert {row["agent"] for row in scores} == {"a", "b"}
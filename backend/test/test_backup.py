@@ -0,0 +1,32 @@
+"""
+测试在线备份与恢复
+"""
+
+import os
+
+from src.db import DatabaseManager, UserForm, QueryForm
+
+
+def test_backup_and_restore(tmp_path):
+    db_path = str(tmp_path / "live.db")
+    UserForm(db_path)._create_tables()
+    query_form = QueryForm(db_path)
+    for i in range(50):
+        query_form.add_query(detail_query=f"查询 {i} " + "内容" * 200)
+
+    manager = DatabaseManager(db_path)
+    compressed = manager.backup(str(tmp_path / "b1.db.gz"), show_progress=False, step_pages=4)
+    assert compressed["steps"] > 1
+    assert compressed["output_bytes"] < compressed["backup_bytes"]
+    snapshot = manager.backup(str(tmp_path / "b2.db"), method="vacuum", compress=False, show_progress=False)
+    assert os.path.exists(snapshot["dest"])
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".partial")]
+
+    query_form.delete_queries({"id": list(range(1, 41))})
+    assert len(query_form.list_all_queries()) == 10
+
+    assert manager.restore(compressed["dest"])["restored_bytes"] == compressed["backup_bytes"]
+    assert len(query_form.list_all_queries()) == 50
+    manager.restore(snapshot["dest"])
+    assert len(query_form.list_all_queries()) == 50
+    assert manager.restore(str(tmp_path / "missing.db.gz")) is None
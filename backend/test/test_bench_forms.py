@@ -0,0 +1,46 @@
+"""
+测试基准测试套件与合成数据生成器
+"""
+
+from bench.synthetic import SyntheticDataGenerator
+from bench.bench_forms import FormBenchmark, compare_results
+
+
+def test_synthetic_data_is_reproducible():
+    """相同种子生成相同数据，轨迹符合查看器格式"""
+    first = SyntheticDataGenerator(seed=7).trajectory()
+    second = SyntheticDataGenerator(seed=7).trajectory()
+    assert first == second
+
+    step = first[-1]
+    for key in ("step", "task", "timing", "token_usage", "model_input_messages",
+                "tool_calls", "model_output_message", "error"):
+        assert key in step
+    # 每一步的历史包含上一步的全部消息
+    assert first[-2]["model_input_messages"] == step["model_input_messages"][:len(first[-2]["model_input_messages"])]
+
+
+def test_seed_database_returns_ids(tmp_path):
+    gen = SyntheticDataGenerator(seed=1, file_size=128)
+    ids = gen.seed_database(str(tmp_path / "seed.db"), users=3, queries=10, evaluations=10, files=5)
+    assert len(ids["user_ids"]) == 3
+    assert len(ids["query_ids"]) == 10
+    assert len(ids["evaluation_ids"]) == 10
+    assert len(ids["file_ids"]) == 5
+
+
+def test_form_benchmark_small_scale(tmp_path):
+    benchmark = FormBenchmark(scales=[50], ops=3, list_repeats=1, memory_ops=1,
+                              file_size=64, work_dir=str(tmp_path))
+    result = benchmark.run()
+
+    methods = result["scales"]["50"]["methods"]
+    assert "EvaluationForm.add_evaluation" in methods
+    assert "FilesForm.list_all_files" in methods
+    stats = methods["QueryForm.get_query_by_id"]
+    assert stats["ops"] == 3
+    assert stats["failures"] == 0
+    assert stats["peak_memory_kb"] is not None
+
+    rows = compare_results(result, result)
+    assert rows and all(not regressed for *_, regressed in rows)
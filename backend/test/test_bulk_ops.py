@@ -0,0 +1,56 @@
+"""
+测试批量更新/删除与外键级联
+"""
+
+from src.db import UserForm, QueryForm, EvaluationForm, FilesForm
+from src.db.models import EvaluationModel
+
+
+def _setup(db_path):
+    user_form = UserForm(db_path)
+    user_form._create_tables()
+    user_form.add_user("judge", "pw", "judge")
+    query_form = QueryForm(db_path)
+    for i in range(2):
+        query_form.add_query(detail_query=f"q{i}", creator_id=1)
+    evaluation_form = EvaluationForm(db_path)
+    files_form = FilesForm(db_path)
+    for query_id in (1, 2):
+        for agent, score in (("old-agent", 40), ("new-agent", 90)):
+            evaluation_form.add_evaluation(query_id=query_id, agent=agent, evaluator_id=1, quality_score=score)
+    for evaluation in evaluation_form.list_all_evaluations():
+        files_form.add_file(evaluation.id, f"{evaluation.id}.md", "report", content=b"r")
+    return user_form, query_form, evaluation_form, files_form
+
+
+def test_set_based_update_and_cascading_delete(tmp_path):
+    user_form, query_form, evaluation_form, files_form = _setup(str(tmp_path / "bulk.db"))
+
+    assert evaluation_form.update_evaluations(EvaluationModel.quality_score < 50, {"quality_score": 0}) == 2
+    assert evaluation_form.update_evaluations({"agent": ["new-agent"], "query_id": 1}, {"quality_score": 100}) == 1
+    scores = sorted(e.quality_score for e in evaluation_form.list_all_evaluations())
+    assert scores == [0, 0, 90, 100]
+    assert all(e.updated_at for e in evaluation_form.list_all_evaluations() if e.quality_score in (0, 100))
+
+    # 删除某个智能体的全部评估，文件随之级联删除
+    assert evaluation_form.delete_evaluations({"agent": "old-agent"}) == 2
+    assert {e.agent for e in evaluation_form.list_all_evaluations()} == {"new-agent"}
+    assert len(files_form.list_all_files()) == 2
+
+    # 单个删除同样级联
+    assert query_form.delete_query(1)
+    assert [e.query_id for e in evaluation_form.list_all_evaluations()] == [2]
+    assert len(files_form.list_all_files()) == 1
+
+    # 删除用户时关联字段置空
+    assert user_form.delete_users({"username": "judge"}) == 1
+    assert query_form.get_query_by_id(2).creator_id is None
+    assert evaluation_form.list_all_evaluations()[0].evaluator_id is None
+
+
+def test_bulk_operations_reject_unsafe_conditions(tmp_path):
+    _, query_form, _, files_form = _setup(str(tmp_path / "bulk.db"))
+    assert files_form.delete_files({}) == 0
+    assert files_form.update_files({"no_such_column": 1}, {"file_size": 1}) == 0
+    assert query_form.update_queries({"id": 1}, {"no_such_column": 1}) == 0
+    assert len(files_form.list_all_files()) == 4
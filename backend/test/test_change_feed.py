@@ -0,0 +1,90 @@
+"""
+测试变更订阅
+"""
+
+from sqlalchemy import event, text
+
+from src.db import ChangeFeed, QueryForm, EvaluationForm
+
+
+def test_change_feed_tracks_form_and_raw_writes(tmp_path):
+    db_path = str(tmp_path / "feed.db")
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    evaluation_form = EvaluationForm(db_path)
+    feed = ChangeFeed(db_path)
+    start = feed.current_cursor()
+
+    query_form.add_query(detail_query="q1")
+    evaluation_form.add_evaluation(query_id=1, agent="a")
+    evaluation_form.add_evaluation(query_id=1, agent="b")
+    evaluation_form.update_evaluation(1, quality_score=80)
+    evaluation_form.delete_evaluation(2)
+    # 绕过表单的原生写入同样会被记录
+    with evaluation_form.engine.begin() as conn:
+        conn.execute(text("UPDATE query_form SET priority = 3 WHERE id = 1"))
+
+    changes = feed.get_changes(since=start)["changes"]
+    assert [(c["table_name"], c["row_id"], c["op"]) for c in changes] == [
+        ("query_form", 1, "insert"),
+        ("evaluation_form", 1, "insert"),
+        ("evaluation_form", 2, "insert"),
+        ("evaluation_form", 1, "update"),
+        ("evaluation_form", 2, "delete"),
+        ("query_form", 1, "update"),
+    ]
+
+    batch = feed.get_changed_rows(since=start, tables=["evaluation_form"])
+    assert [row["quality_score"] for row in batch["upserts"]["evaluation_form"]] == [80]
+    assert batch["deletes"] == {"evaluation_form": [2]}
+    assert not batch["has_more"]
+
+    # 从游标继续只拿到新的变更
+    query_form.add_query(detail_query="q2")
+    later = feed.get_changes(since=batch["cursor"], tables=["query_form"])
+    assert [(c["row_id"], c["op"]) for c in later["changes"]] == [(1, "update"), (2, "insert")]
+
+    assert feed.prune(later["cursor"]) == len(changes) + 1
+    assert feed.get_changes(since=0)["changes"] == []
+
+    # 清空后序号不复用：游标停在 later 的客户端仍能看到新变更
+    assert feed.current_cursor() == later["cursor"]
+    query_form.add_query(detail_query="q3")
+    assert [c["seq"] for c in feed.get_changes(since=later["cursor"])["changes"]] == [later["cursor"] + 1]
+
+
+def test_change_feed_paging(tmp_path):
+    db_path = str(tmp_path / "feed.db")
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    for i in range(5):
+        query_form.add_query(detail_query=f"q{i}")
+
+    feed = ChangeFeed(db_path)
+    first = feed.get_changes(since=0, limit=3)
+    second = feed.get_changes(since=first["cursor"], limit=3)
+    assert first["has_more"] and not second["has_more"]
+    assert len(first["changes"]) + len(second["changes"]) == 5
+
+
+def test_changed_rows_read_from_one_snapshot(tmp_path):
+    db_path = str(tmp_path / "feed.db")
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    query_form.add_query(detail_query="q1")
+    feed = ChangeFeed(db_path)
+
+    # 读完变更页、读取行之前插入一次写入：行状态必须与变更页处于同一快照
+    def write_between(conn, cursor, statement, *args):
+        if "FROM query_form" in statement and not written:
+            written.append(True)
+            with query_form.engine.begin() as writer:
+                writer.execute(text("UPDATE query_form SET priority = 3 WHERE id = 1"))
+
+    written = []
+    event.listen(feed.read_engine, "before_cursor_execute", write_between)
+    batch = feed.get_changed_rows(since=0)
+    event.remove(feed.read_engine, "before_cursor_execute", write_between)
+    assert written
+    assert [row["priority"] for row in batch["upserts"]["query_form"]] == [None]
+    assert [c["op"] for c in feed.get_changes(since=batch["cursor"])["changes"]] == ["update"]
@@ -0,0 +1,153 @@
+"""
+测试数据库管理命令行
+"""
+
+import base64
+import json
+import os
+import sqlite3
+
+import pytest
+
+from src.db import UserForm, QueryForm, EvaluationForm, FilesForm
+from src.db import cli, database
+from src.db.engine import create_read_engine
+from src.db.models import Base
+
+STEPS = [
+    {"step": 1, "model_input_messages": [{"role": "user", "content": "hi"}], "model_output_message": {"content": "a"}},
+    {"step": 2, "model_input_messages": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "a"}],
+     "model_output_message": {"content": "b"}},
+]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "cli.db")
+    UserForm(path)._create_tables()
+    return path
+
+
+def test_export_streams_batches(db_path, tmp_path):
+    QueryForm(db_path).upsert_queries([{"detail_query": f"query {i}\nline"} for i in range(5)])
+    EvaluationForm(db_path).add_evaluation(1, agent="a", trajectory=json.dumps(STEPS))
+    FilesForm(db_path).add_file(1, "out.bin", "deliverable", content=b"\x00\xffdata")
+
+    out = str(tmp_path / "queries.jsonl")
+    assert cli.main(["--db", db_path, "export", "query_form", "-o", out, "--batch-size", "2"]) == 0
+    with open(out, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["id"] for row in rows] == [1, 2, 3, 4, 5] and rows[0]["detail_query"] == "query 0\nline"
+
+    csv_out = str(tmp_path / "queries.csv")
+    assert cli.main(["--db", db_path, "export", "query_form", "-o", csv_out, "--format", "csv",
+                     "--columns", "detail_query,priority", "--batch-size", "2"]) == 0
+    with open(csv_out, encoding="utf-8", newline="") as f:
+        text = f.read()
+    assert text.startswith("detail_query,priority\r\n") and text.count("detail_query") == 1
+
+    with open(str(tmp_path / "files.jsonl"), "wb") as f:
+        report = cli.export_table(db_path, "files_form", f)
+    assert report["rows"] == 1 and report["bytes"] > 0
+    [row] = [json.loads(line) for line in open(str(tmp_path / "files.jsonl"), encoding="utf-8")]
+    assert base64.b64decode(row["content"]) == b"\x00\xffdata"
+
+    with open(str(tmp_path / "evals.jsonl"), "wb") as f:
+        cli.export_table(db_path, "evaluation_form", f, columns=["id", "trajectory"], expand_trajectories=True)
+    [row] = [json.loads(line) for line in open(str(tmp_path / "evals.jsonl"), encoding="utf-8")]
+    assert json.loads(row["trajectory"]) == STEPS
+
+    assert cli.main(["--db", db_path, "export", "no_such_table", "-o", out]) == 1
+    assert cli.main(["--db", str(tmp_path / "missing.db"), "export", "query_form"]) == 1
+    # 库文件存在但没有表：数据库错误同样返回 1
+    open(str(tmp_path / "empty.db"), "wb").close()
+    assert cli.main(["--db", str(tmp_path / "empty.db"), "export", "query_form", "-o", out]) == 1
+
+
+def test_list_pages_with_keyset_and_offset(db_path, capsys):
+    QueryForm(db_path).upsert_queries([{"detail_query": f"query {i}"} for i in range(7)])
+
+    first = cli.list_page(db_path, "query_form", page_size=3, columns=["detail_query"])
+    assert [row["detail_query"] for row in first["rows"]] == ["query 0", "query 1", "query 2"]
+    assert first["next_after"] == [3]
+    last = cli.list_page(db_path, "query_form", page_size=3, after=["6"])
+    assert [row["id"] for row in last["rows"]] == [7] and last["next_after"] is None
+    assert cli.list_page(db_path, "query_form", page_size=3, page=2)["rows"][0]["id"] == 4
+
+    # 复合主键按元组比较，逐批读取不重不漏
+    table = Base.metadata.tables["query_lsh"]
+    engine = create_read_engine(db_path)
+    keys = [tuple(row.values()) for rows, _ in cli.iter_batches(engine, table, 16) for row in rows]
+    engine.dispose()
+    assert keys == sorted(set(keys)) and len(keys) == 7 * 20
+
+    capsys.readouterr()
+    assert cli.main(["--db", db_path, "list", "query_form", "--page-size", "2", "--json"]) == 0
+    assert [json.loads(line)["id"] for line in capsys.readouterr().out.splitlines()] == [1, 2]
+    assert cli.main(["--db", db_path, "list", "query_form", "--columns", "nope"]) == 1
+
+
+def test_import_reports_progress(db_path, tmp_path):
+    folder = tmp_path / "queries"
+    folder.mkdir()
+    for i in range(5):
+        (folder / f"q{i}.txt").write_text(f"question {i}", encoding="utf-8")
+    UserForm(db_path).add_user(username="admin", password="x", nickname="admin")
+
+    assert cli.main(["--db", db_path, "import", str(folder), "--only", "queries", "--username", "admin",
+                     "--batch-size", "2", "--parse-workers", "0"]) == 0
+    queries = QueryForm(db_path).list_all_queries()
+    assert len(queries) == 5 and {query.creator_id for query in queries} == {1}
+    assert cli.main(["--db", db_path, "import", str(folder), "--only", "queries", "--username", "nobody"]) == 1
+
+    from src.db.importer import DirectoryImporter
+    calls = []
+    (folder / "q9.txt").write_text("question 9", encoding="utf-8")
+    DirectoryImporter(db_path, batch_size=2, progress=lambda *args: calls.append(args)).import_queries(str(folder))
+    assert calls == [("queries", 1, 1)]
+
+
+def test_reset_requires_confirmation(db_path, tmp_path, monkeypatch):
+    QueryForm(db_path).add_query(detail_query="keep me")
+    assert cli.main(["--db", db_path, "reset"]) == 1
+    assert cli.main(["--db", db_path, "restore", "x.db.gz"]) == 1
+    assert len(QueryForm(db_path).list_all_queries()) == 1
+
+    # database.py 的 main 只展示信息，不再重置数据库
+    monkeypatch.chdir(tmp_path)
+    os.replace(db_path, str(tmp_path / "app.db"))
+    assert database.main() == 0
+    assert len(QueryForm("app.db").list_all_queries()) == 1
+
+    # 未检查点的写入还留在 WAL 中（连接未关闭）：重置时 -wal / -shm 一并删除，不会被重放到新库
+    held = sqlite3.connect("app.db")
+    held.execute("INSERT INTO query_form (detail_query, created_at) VALUES ('stale', 'now')")
+    held.commit()
+    assert os.path.exists("app.db-wal")
+    with monkeypatch.context() as patch:
+        patch.setattr(database.DatabaseManager, "create_database", lambda self: True)
+        assert cli.main(["reset", "--yes"]) == 0
+        assert not [name for name in os.listdir(tmp_path) if name.startswith("app.db")]
+    held.close()
+    assert cli.main(["reset", "--yes"]) == 0
+    assert QueryForm("app.db").list_all_queries() == []
+
+
+def test_maintenance_and_backup_commands(db_path, tmp_path):
+    queries = QueryForm(db_path)
+    queries.upsert_queries([{"detail_query": "x" * 2000 + str(i)} for i in range(200)])
+    with queries.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM query_form WHERE id > 10")
+    from src.db.maintenance import MaintenanceScheduler
+    report = MaintenanceScheduler(db_path).run_full_vacuum()
+    assert report["freed_pages"] > 0 and report["file_size_after"] < report["file_size_before"]
+    assert cli.main(["--db", db_path, "vacuum", "--full"]) == 0
+    assert cli.main(["--db", db_path, "maintain"]) == 0
+    assert cli.main(["--db", db_path, "stats", "--json", "--no-storage"]) == 0
+
+    backup = str(tmp_path / "b.db.gz")
+    assert cli.main(["--db", db_path, "backup", "-o", backup]) == 0
+    with queries.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM query_form")
+    assert cli.main(["--db", db_path, "restore", backup, "--yes"]) == 0
+    assert len(QueryForm(db_path).list_all_queries()) == 10
@@ -0,0 +1,115 @@
+"""
+测试目录批量导入
+"""
+
+import json
+import os
+
+from src.db.importer import DirectoryImporter
+from src.db.Forms.query_form import QueryForm
+from src.db.Forms.evaluation_form import EvaluationForm
+from src.db.Forms.files_form import FilesForm
+from src.db.trajectory_store import load_trajectory
+
+
+def _make_tree(root):
+    (root / "queries").mkdir(parents=True)
+    (root / "queries" / "query-1.txt").write_text("第一个查询", encoding="utf-8")
+    (root / "queries" / "query-2.txt").write_text("第二个查询", encoding="utf-8")
+    run = root / "runs" / "query-1" / "agent-a"
+    (run / "deliverables" / "sub").mkdir(parents=True)
+    (run / "trajectory.json").write_text(json.dumps([{"step": 1, "task": "t"}]), encoding="utf-8")
+    (run / "report.md").write_text("# 报告", encoding="utf-8")
+    (run / "deliverables" / "out.txt").write_bytes(b"result")
+    (run / "deliverables" / "sub" / "data.csv").write_bytes(b"a,b\n1,2\n")
+    bad = root / "runs" / "query-2" / "agent-b"
+    (bad / "deliverables").mkdir(parents=True)
+    (bad / "trajectory.json").write_text("{\"not\": \"a list\"}", encoding="utf-8")
+    (bad / "deliverables" / "partial.txt").write_bytes(b"partial")
+    return run
+
+
+def test_import_directory_and_resume(tmp_path):
+    db_path = str(tmp_path / "import.db")
+    run = _make_tree(tmp_path / "data")
+
+    importer = DirectoryImporter(db_path, batch_size=2, parse_workers=0)
+    stats = importer.import_directory(str(tmp_path / "data"))
+    assert stats["imported"] == 2 + 1 + 2  # 2 个查询、1 个评估、2 个交付文件
+    assert stats["failed"] == 1  # 格式错误的轨迹：整个运行跳过
+
+    evaluations = EvaluationForm(db_path).list_all_evaluations()
+    by_agent = {e.agent: e for e in evaluations}
+    # 轨迹经 trajectory_schema 规范化：缺省字段补为 None / []
+    step = load_trajectory(by_agent["agent-a"].trajectory)[0]
+    assert (step["step"], step["task"], step["tool_calls"], step["error"]) == (1, "t", [], None)
+    assert by_agent["agent-a"].report_content == "# 报告"
+    assert "agent-b" not in by_agent
+    files = FilesForm(db_path).get_files_by_evaluation(by_agent["agent-a"].id)
+    assert sorted(f.filename for f in files) == ["out.txt", "sub/data.csv"]
+
+    # 重新运行：未变化的文件全部跳过，变化的文件更新原有行
+    (run / "deliverables" / "out.txt").write_bytes(b"new result")
+    stats = DirectoryImporter(db_path, parse_workers=0).import_directory(str(tmp_path / "data"))
+    assert stats["imported"] == 0
+    assert stats["updated"] == 1
+    assert len(QueryForm(db_path).list_all_queries()) == 2
+    contents = {f.filename: f.content for f in FilesForm(db_path).list_all_files()}
+    assert contents["out.txt"] == b"new result" and "partial.txt" not in contents
+
+    # 修正轨迹后重新运行：跳过的运行连同交付文件一起导入
+    bad = tmp_path / "data" / "runs" / "query-2" / "agent-b"
+    (bad / "trajectory.json").write_text(json.dumps([{"task": "t"}]), encoding="utf-8")
+    stats = DirectoryImporter(db_path, parse_workers=0).import_directory(str(tmp_path / "data"))
+    assert (stats["imported"], stats["failed"]) == (2, 0)
+    assert "agent-b" in {e.agent for e in EvaluationForm(db_path).list_all_evaluations()}
+
+
+def test_import_with_process_pool(tmp_path):
+    db_path = str(tmp_path / "import.db")
+    _make_tree(tmp_path / "data")
+    stats = DirectoryImporter(db_path, parse_workers=2).import_directory(str(tmp_path / "data"))
+    assert (stats["imported"], stats["failed"]) == (5, 1)
+
+
+def test_nested_query_keys_and_import_counts(tmp_path):
+    db_path = str(tmp_path / "import.db")
+    root = tmp_path / "data"
+    for folder, text in (("a", "查询 A"), ("b", "查询 B")):
+        (root / "queries" / folder).mkdir(parents=True)
+        (root / "queries" / folder / "q1.txt").write_text(text, encoding="utf-8")
+    # 内容与 a/q1 相同：合并到同一行，不计入 imported
+    (root / "queries" / "copy.txt").write_text("查询 A", encoding="utf-8")
+    for key in ("a/q1", "b/q1"):
+        run = root / "runs" / key / "agent-a"
+        run.mkdir(parents=True)
+        (run / "report.md").write_text(f"# {key}", encoding="utf-8")
+
+    stats = DirectoryImporter(db_path, parse_workers=0).import_directory(str(root))
+    assert stats["imported"] == 2 + 2 and stats["failed"] == 0
+    queries = {q.id: q.detail_query for q in QueryForm(db_path).list_all_queries()}
+    reports = {queries[e.query_id]: e.report_content for e in EvaluationForm(db_path).list_all_evaluations()}
+    assert reports == {"查询 A": "# a/q1", "查询 B": "# b/q1"}
+
+
+def test_edited_query_files_do_not_rewrite_shared_queries(tmp_path):
+    db_path = str(tmp_path / "import.db")
+    queries = tmp_path / "data" / "queries"
+    queries.mkdir(parents=True)
+    (queries / "a.txt").write_text("相同内容", encoding="utf-8")
+    (queries / "b.txt").write_text("相同内容", encoding="utf-8")
+    (queries / "c.txt").write_text("C 的内容", encoding="utf-8")
+    (queries / "d.txt").write_text("D 的内容", encoding="utf-8")
+    stats = DirectoryImporter(db_path, parse_workers=0).import_queries(str(queries))
+    assert stats["imported"] == 3
+
+    # a 与 b 共用一行：修改 a 不能改写 b 指向的查询；c 改成与 d 相同的内容不能让整批失败
+    (queries / "a.txt").write_text("A 的新内容", encoding="utf-8")
+    (queries / "c.txt").write_text("D 的内容", encoding="utf-8")
+    importer = DirectoryImporter(db_path, parse_workers=0)
+    stats = importer.import_queries(str(queries))
+    assert stats["failed"] == 0 and stats["updated"] == 2
+
+    texts = {q.id: q.detail_query for q in QueryForm(db_path).list_all_queries()}
+    targets = {os.path.basename(path): texts[row["target_id"]] for path, row in importer.manifest.items()}
+    assert targets == {"a.txt": "A 的新内容", "b.txt": "相同内容", "c.txt": "D 的内容", "d.txt": "D 的内容"}
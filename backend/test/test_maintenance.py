@@ -0,0 +1,75 @@
+"""
+测试在线维护
+"""
+
+from sqlalchemy import event
+
+from src.db import DatabaseManager, QueryForm
+from src.db.maintenance import MaintenanceScheduler
+
+
+def _fill(db_path, n=300):
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    with query_form.engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO query_form (detail_query, created_at) VALUES (?, '2025-01-01 00:00:00')",
+            [("x" * 2000,) for _ in range(n)],
+        )
+    return query_form
+
+
+def test_incremental_vacuum_reclaims_deleted_pages(tmp_path):
+    db_path = str(tmp_path / "m.db")
+    query_form = _fill(db_path)
+    with query_form.engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM query_form")
+
+    scheduler = MaintenanceScheduler(db_path, vacuum_step_pages=16, vacuum_step_sleep=0)
+    before = scheduler.get_space_info()
+    assert before["auto_vacuum"] == "incremental"
+    assert before["freelist_count"] > 0
+
+    report = scheduler.run_incremental_vacuum()
+    assert report["skipped"] is None
+    assert report["freed_pages"] == before["freelist_count"]
+    assert report["bytes_reclaimed"] == before["freelist_count"] * before["page_size"]
+    # 最近的写入还在 WAL 中：文件大小包含 WAL，回收前的大小不会只剩一页
+    assert report["file_size_before"] >= before["file_size"] + before["wal_size"] > before["page_size"]
+    assert scheduler.get_space_info()["freelist_count"] == 0
+
+
+def test_run_pending_schedules_tasks(tmp_path):
+    db_path = str(tmp_path / "m.db")
+    _fill(db_path, n=20)
+    scheduler = MaintenanceScheduler(db_path, vacuum_interval=None, integrity_interval=3600)
+    reports = scheduler.run_pending()
+    assert [r["task"] for r in reports] == ["checkpoint", "analyze", "integrity"]
+    analyze = reports[1]
+    assert "queries_by_creator" in analyze["probes"]
+    assert reports[2]["ok"]
+    # 间隔未到，不会重复执行
+    assert scheduler.run_pending() == []
+
+    scheduler.start(tick=0.01)
+    scheduler.stop()
+
+
+def test_analyze_only_explains_probe_queries(tmp_path):
+    db_path = str(tmp_path / "m.db")
+    _fill(db_path, n=20)
+    scheduler = MaintenanceScheduler(db_path)
+    statements = []
+    event.listen(scheduler.engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    report = scheduler.run_analyze()
+    assert report["probes"]["queries_by_creator"]["plan_after"]
+    probes = [sql for sql in statements if " FROM " in sql and "sqlite_master" not in sql]
+    assert probes and all(sql.startswith("EXPLAIN QUERY PLAN") for sql in probes)
+
+
+def test_database_manager_run_maintenance(tmp_path):
+    db_path = str(tmp_path / "m.db")
+    _fill(db_path, n=5)
+    reports = DatabaseManager(db_path).run_maintenance()
+    assert {r["task"] for r in reports} == {"checkpoint", "vacuum", "analyze", "integrity"}
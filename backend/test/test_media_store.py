@@ -0,0 +1,125 @@
+"""
+测试轨迹内联图片抽取与媒体存储
+"""
+
+import base64
+import json
+import sqlite3
+
+from src.db import UserForm, QueryForm, EvaluationForm, FilesForm, MediaStore
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+DATA_URI = "data:image/png;base64," + base64.b64encode(PNG).decode("ascii")
+
+
+def _steps(n):
+    image = {"role": "user", "content": [
+        {"type": "text", "text": "看图"},
+        {"type": "image_url", "image_url": {"url": DATA_URI}},
+    ]}
+    history = [image]
+    steps = []
+    for i in range(n):
+        history = history + [{"role": "assistant", "content": f"第 {i} 步"}]
+        steps.append({"step": i + 1, "model_input_messages": list(history)})
+    return steps
+
+
+def test_images_extracted_once_and_served(tmp_path):
+    db_path = str(tmp_path / "media.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+    raw = json.dumps(_steps(5))
+
+    evaluation_form = EvaluationForm(db_path)
+    evaluation_form.add_evaluation(1, agent="a", trajectory=raw)
+    evaluation_form.add_evaluation(1, agent="b", trajectory=raw)
+    stored = evaluation_form.get_evaluation_by_id(1).trajectory
+    assert "base64" not in stored and len(stored) < len(PNG)
+
+    store = MediaStore(db_path)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*), SUM(byte_size) FROM media").fetchone() == (1, len(PNG))
+    conn.close()
+
+    sha = stored.split("/media/")[1][:64]
+    status, headers, body = store.get_media_response(sha)
+    assert status == 200 and body == PNG and "immutable" in headers["Cache-Control"]
+    assert store.get_media_response(sha, if_none_match=headers["ETag"])[0] == 304
+    assert store.get_media_response("0" * 64)[0] == 404
+
+    rebuilt = json.loads(store.inline_trajectory(json.dumps(evaluation_form.get_trajectory(1))))
+    assert rebuilt == json.loads(raw)
+
+    # 引用全部删除后图片可以清理
+    evaluation_form.delete_evaluations({"agent": ["a", "b"]})
+    assert store.prune_unreferenced() == 1
+
+
+def test_backfill_existing_rows(tmp_path):
+    db_path = str(tmp_path / "legacy.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+    EvaluationForm(db_path).add_evaluation(1, agent="a")
+    FilesForm(db_path).add_file(1, "t.json", "report", content=b"{}")
+    raw = json.dumps(_steps(3))
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE evaluation_form SET trajectory = ?", (raw,))
+    conn.execute("UPDATE files_form SET file_type = 'trajectory', content = ?", (raw.encode(),))
+    conn.commit()
+    conn.close()
+
+    stats = MediaStore(db_path).extract_existing(batch_size=1)
+    assert stats["evaluations"] == 1 and stats["files"] == 1
+    assert stats["bytes_after"] * 10 < stats["bytes_before"]
+    assert "base64" not in EvaluationForm(db_path).get_evaluation_by_id(1).trajectory
+    assert json.loads(FilesForm(db_path).get_file_content(1))[2]["step"] == 3
+
+
+def test_unhooked_engine_keeps_images_inline(tmp_path):
+    from sqlalchemy import create_engine, update
+    from src.db.models import EvaluationModel
+
+    db_path = str(tmp_path / "plain.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+    evaluation_form = EvaluationForm(db_path)
+    evaluation_form.add_evaluation(1, agent="a")
+    raw = json.dumps(_steps(2))
+
+    # 没有注册媒体事件的引擎：图片保持内联，不残留到之后的写入
+    plain = create_engine(f"sqlite:///{db_path}")
+    with plain.begin() as conn:
+        conn.execute(update(EvaluationModel.__table__).values(trajectory=raw))
+    plain.dispose()
+    assert DATA_URI in evaluation_form.get_evaluation_by_id(1).trajectory
+    evaluation_form.add_evaluation(1, agent="b")
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM media").fetchone() == (0,)
+    conn.close()
+
+    # 轨迹文件内容中的图片与文件在同一事务中写入
+    files_form = FilesForm(db_path)
+    assert files_form.add_file(1, "trajectory.json", "trajectory", content=raw.encode())
+    assert json.loads(files_form.get_file_content(1)) != json.loads(raw)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM media").fetchone() == (1,)
+    conn.close()
+    assert MediaStore(db_path).extract_existing()["evaluations"] == 1
+    assert "base64" not in evaluation_form.get_evaluation_by_id(1).trajectory
+
+
+def test_prune_rechecks_references_when_deleting(tmp_path, monkeypatch):
+    from src.db import media_store
+
+    db_path = str(tmp_path / "race.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+    EvaluationForm(db_path).add_evaluation(1, agent="a", trajectory=json.dumps(_steps(2)))
+    FilesForm(db_path).add_file(1, "t.json", "trajectory", content=json.dumps(_steps(1)).encode())
+
+    # 模拟扫描快照之后才提交的引用：扫描看不到任何引用，删除时的复查必须保留图片
+    monkeypatch.setattr(media_store, "media_refs", lambda text: set())
+    assert MediaStore(db_path).prune_unreferenced() == 0
+    EvaluationForm(db_path).delete_evaluations({"agent": ["a"]})
+    assert MediaStore(db_path).prune_unreferenced() == 1
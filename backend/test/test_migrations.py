@@ -0,0 +1,185 @@
+"""
+测试表结构版本与分批迁移
+"""
+
+import json
+import re
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.schema import CreateTable
+
+from src.db import UserForm, QueryForm, EvaluationForm, FilesForm, ChangeFeed, MigrationRunner
+from src.db import cli, migrations
+from src.db.engine import create_sqlite_engine, FOREIGN_KEYS_VERSION
+from src.db.migrations import SCHEMA_VERSION
+from src.db.models import Base
+
+
+def _step(input_tokens=10, output_tokens=5):
+    return {
+        "task": "t",
+        "timing": {"start_time": 0, "end_time": 1, "duration": 1},
+        "token_usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+    }
+
+
+def _make_legacy(db_path, queries=5):
+    """建一个“迁移之前”的库：有数据、没有版本号、content_hash 与用量都还没回填"""
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    for i in range(queries):
+        query_form.add_query(detail_query=f"q{i}")
+    if queries:
+        EvaluationForm(db_path).add_evaluation(1, agent="a", trajectory=json.dumps([_step()]))
+    with query_form.engine.begin() as conn:
+        conn.execute(text("UPDATE query_form SET content_hash = NULL"))
+        conn.execute(text("DELETE FROM evaluation_usage"))
+        conn.execute(text("DROP TABLE schema_migrations"))
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+    query_form.engine.dispose()
+
+
+def _scalar(runner, sql):
+    with runner.engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+
+def test_fresh_database_at_latest_version(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "fresh.db")
+    assert QueryForm(db_path)._create_tables()
+    runner = MigrationRunner(db_path)
+    assert runner.current_version() == SCHEMA_VERSION
+    assert {row["state"] for row in runner.get_status()["migrations"]} == {"done"}
+
+    # 版本一致时启动检查不再执行 create_all
+    def fail(conn):
+        raise AssertionError("create_all should not run")
+
+    monkeypatch.setattr(migrations, "_create_all", fail)
+    assert QueryForm(db_path)._create_tables()
+
+
+def test_legacy_database_backfilled_in_batches(tmp_path):
+    db_path = str(tmp_path / "legacy.db")
+    _make_legacy(db_path)
+    runner = MigrationRunner(db_path, batch_size=2)
+    assert runner.current_version() == 0
+
+    assert runner.ensure()
+    # 启动检查不执行 manual 迁移（重建外键表），停在它之前的版本
+    assert runner.current_version() == runner.automatic_latest == SCHEMA_VERSION - 1
+    assert _scalar(runner, "SELECT COUNT(*) FROM query_form WHERE content_hash IS NULL") == 0
+    assert _scalar(runner, "SELECT total_tokens FROM evaluation_usage") == 15
+    status = {row["name"]: row for row in runner.get_status()["migrations"]}
+    assert status["query_content_hash"]["rows_done"] == 5 and status["query_content_hash"]["state"] == "done"
+    assert status["foreign_key_actions"]["state"] == "pending"
+    assert runner.ensure(manual=True)
+    assert runner.current_version() == SCHEMA_VERSION
+
+
+def test_interrupted_backfill_resumes(tmp_path):
+    db_path = str(tmp_path / "resume.db")
+    _make_legacy(db_path)
+    runner = MigrationRunner(db_path, batch_size=2)
+    assert runner.ensure(backfill="defer")
+    assert runner.current_version() == 1
+
+    # 第一批提交后中断
+    report = runner.run_backfills(progress=lambda name, done, total: runner.stop())
+    assert not report["done"] and report["batches"] == 1
+    assert runner.current_version() == 1
+    assert _scalar(runner, "SELECT COUNT(*) FROM query_form WHERE content_hash IS NULL") == 3
+    assert _scalar(runner, "SELECT cursor FROM schema_migrations WHERE version = 2") == "2"
+
+    # 下次启动从游标继续
+    resumed = MigrationRunner(db_path, batch_size=2)
+    assert resumed.ensure()
+    assert resumed.current_version() == resumed.automatic_latest
+    assert _scalar(resumed, "SELECT rows_done FROM schema_migrations WHERE version = 2") == 5
+
+
+def test_background_backfill_and_cli(tmp_path, capsys):
+    db_path = str(tmp_path / "background.db")
+    _make_legacy(db_path)
+    runner = MigrationRunner(db_path, batch_size=2)
+    assert runner.ensure(backfill="background")
+    runner._thread.join(10)
+    assert runner.current_version() == runner.automatic_latest
+
+    _make_legacy(str(tmp_path / "cli.db"))
+    assert cli.main(["--db", str(tmp_path / "cli.db"), "migrate", "--batch-size", "2"]) == 0
+    assert MigrationRunner(str(tmp_path / "cli.db")).current_version() == SCHEMA_VERSION
+    assert cli.main(["--db", str(tmp_path / "cli.db"), "migrate", "--status"]) == 0
+    assert "query_content_hash" in capsys.readouterr().out
+
+
+def test_duplicate_legacy_queries_keep_one_hash(tmp_path):
+    db_path = str(tmp_path / "dup.db")
+    _make_legacy(db_path, queries=0)
+    runner = MigrationRunner(db_path)
+    with runner.engine.begin() as conn:
+        conn.execute(text("INSERT INTO query_form (detail_query, created_at) VALUES ('same', '2024-01-01'), ('same', '2024-01-01')"))
+    assert runner.ensure()
+    assert _scalar(runner, "SELECT COUNT(content_hash) FROM query_form WHERE detail_query = 'same'") == 1
+
+
+def test_change_log_rebuilt_with_autoincrement(tmp_path):
+    db_path = str(tmp_path / "changes.db")
+    _make_legacy(db_path, queries=3)
+    runner = MigrationRunner(db_path)
+    # 旧版本的 change_log：普通 INTEGER PRIMARY KEY，清理后序号会从头分配
+    with runner.engine.begin() as conn:
+        conn.execute(text("DROP TABLE change_log"))
+        conn.execute(text(
+            "CREATE TABLE change_log (seq INTEGER NOT NULL PRIMARY KEY, table_name VARCHAR(50) NOT NULL, "
+            "row_id INTEGER NOT NULL, op VARCHAR(10) NOT NULL, changed_at VARCHAR(50) NOT NULL)"
+        ))
+        conn.execute(text("INSERT INTO change_log VALUES (7, 'query_form', 1, 'insert', '2024-01-01')"))
+    assert runner.ensure()
+
+    feed = ChangeFeed(db_path)
+    assert feed.get_changes()["changes"][0]["seq"] == 7
+    last = feed.current_cursor()
+    feed.prune(last)
+    assert feed.get_changes()["changes"] == [] and feed.current_cursor() == last
+    QueryForm(db_path).add_query(detail_query="after prune")
+    assert [change["seq"] for change in feed.get_changes(since=last)["changes"]] == [last + 1]
+
+
+def test_foreign_keys_rebuilt_before_enforcement(tmp_path):
+    db_path = str(tmp_path / "fk.db")
+    engine = create_sqlite_engine(db_path)
+    # 早于外键约束的库：外键没有 ON DELETE 子句
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            ddl = str(CreateTable(table).compile(dialect=conn.dialect))
+            conn.exec_driver_sql(re.sub(r" ON DELETE (CASCADE|SET NULL)", "", ddl))
+        conn.execute(text("INSERT INTO user_form (username, password, nickname, created_at) VALUES ('u', 'p', 'n', 'now')"))
+        conn.execute(text("INSERT INTO query_form (detail_query, creator_id, created_at) VALUES ('q', 1, 'now')"))
+        conn.execute(text("INSERT INTO evaluation_form (query_id, evaluator_id, created_at) VALUES (1, 1, 'now')"))
+        conn.execute(text("INSERT INTO files_form (evaluation_id, filename, file_type, created_at) "
+                          "VALUES (1, 'f', 'deliverable', 'now')"))
+        # 迁移完成前不开启外键约束
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 0
+
+    # 启动检查不重建表（大库上会长时间持有写锁），外键约束保持关闭
+    runner = MigrationRunner(db_path, engine=engine)
+    assert runner.ensure()
+    assert runner.current_version() == FOREIGN_KEYS_VERSION - 1
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 0
+        assert {row[6] for row in conn.exec_driver_sql("PRAGMA foreign_key_list(evaluation_form)")} == {"NO ACTION"}
+
+    # 显式迁移（cli migrate）重建后开启
+    assert cli.main(["--db", db_path, "migrate"]) == 0
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+        actions = {row[3]: row[6] for row in conn.exec_driver_sql("PRAGMA foreign_key_list(evaluation_form)")}
+        assert actions == {"query_id": "CASCADE", "evaluator_id": "SET NULL"}
+        assert conn.execute(text("SELECT detail_query FROM query_form")).scalar() == "q"
+
+    assert UserForm(db_path).delete_user("u")
+    assert QueryForm(db_path).get_query_by_id(1).creator_id is None
+    assert EvaluationForm(db_path).delete_evaluation(1)
+    assert FilesForm(db_path).list_all_files() == []
@@ -0,0 +1,102 @@
+"""
+测试近似重复查询检测
+"""
+
+import random
+
+import pytest
+from sqlalchemy import text
+
+from src.db import UserForm, QueryForm
+from src.db.query_dedup import QueryDedupIndex, minhash_signature, signature_similarity
+
+BASE = "Write a Python function that reads a CSV file and returns the average of the price column, ignoring empty rows."
+VARIANT = "Write a python function that reads a CSV file and returns the average of the 'price' column, ignoring blank rows!"
+OTHER = "Explain the difference between TCP and UDP with examples of when to use each protocol."
+
+
+def _shingle_jaccard(a, b, width=6):
+    from src.db.query_dedup import normalize_text
+    a, b = normalize_text(a).encode(), normalize_text(b).encode()
+    sa = {a[i:i + width] for i in range(len(a) - width + 1)}
+    sb = {b[i:i + width] for i in range(len(b) - width + 1)}
+    return len(sa & sb) / len(sa | sb)
+
+
+def test_signature_estimates_jaccard():
+    rng = random.Random(0)
+    words = [f"w{k}" for k in range(60)]
+    errors = []
+    for _ in range(30):
+        a = " ".join(rng.choice(words) for _ in range(80))
+        b = " ".join(word if rng.random() < 0.8 else rng.choice(words) for word in a.split())
+        errors.append(abs(signature_similarity(minhash_signature(a), minhash_signature(b)) - _shingle_jaccard(a, b)))
+    assert sum(errors) / len(errors) < 0.05
+
+    assert minhash_signature("  ") is None
+    assert signature_similarity(minhash_signature("用 Python 读取 CSV"), minhash_signature("用Python读取CSV。")) == 1.0
+    assert len(minhash_signature("ab")) == 128
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "dedup.db")
+    UserForm(path)._create_tables()
+    return path
+
+
+def test_index_maintained_on_add_and_update(db_path):
+    queries = QueryForm(db_path)
+    queries.add_query(detail_query=BASE)
+    queries.add_query(lazy_query="short", detail_query=OTHER)
+    index = QueryDedupIndex(db_path)
+    with index.engine.begin() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM query_minhash")).scalar() == 2
+
+    [match] = index.find_similar_queries(VARIANT, threshold=0.5)
+    assert match["query_id"] == 1 and match["similarity"] >= 0.5 and match["detail_query"] == BASE
+    assert index.find_similar_queries(VARIANT, threshold=0.5, exclude_ids=[1]) == []
+
+    queries.update_query(2, detail_query=VARIANT)
+    assert index.find_duplicates(1, threshold=0.5)[0]["query_id"] == 2
+    queries.update_query(2, detail_query=OTHER)
+    assert index.find_duplicates(1, threshold=0.5) == []
+
+
+def test_other_write_paths_indexed_before_search(db_path):
+    queries = QueryForm(db_path)
+    queries.upsert_queries([{"detail_query": BASE}, {"detail_query": OTHER}])
+    assert queries.update_queries({"id": 2}, {"detail_query": VARIANT}) == 1
+    index = QueryDedupIndex(db_path)
+    assert [row["query_id"] for row in index.find_similar_queries(BASE, threshold=0.5)] == [1, 2]
+
+    # 绕过 QueryForm 的写入由触发器作废签名，下一次检索前补齐
+    with index.engine.begin() as conn:
+        conn.execute(text("UPDATE query_form SET detail_query = :q WHERE id = 2"), {"q": OTHER})
+        conn.execute(text("INSERT INTO query_form (detail_query, created_at) VALUES (:q, '2026-01-01')"), {"q": VARIANT})
+    assert [row["query_id"] for row in index.find_similar_queries(BASE, threshold=0.5)] == [1, 3]
+
+
+def test_dedup_report_clusters(db_path):
+    rng = random.Random(1)
+    words = [f"token{k}" for k in range(500)]
+    rows = []
+    for group in range(20):
+        base = [rng.choice(words) for _ in range(40)]
+        for copy in range(1 + group % 3):
+            text_words = list(base)
+            text_words[rng.randrange(len(text_words))] = f"changed{copy}"
+            rows.append({"detail_query": " ".join(text_words) + f" #{group}"})
+    QueryForm(db_path).upsert_queries(rows)
+    with QueryDedupIndex(db_path).engine.begin() as conn:
+        conn.execute(text("INSERT INTO query_form (lazy_query, created_at) VALUES ('', '2026-01-01')"))
+
+    index = QueryDedupIndex(db_path)
+    report = index.dedup_report(threshold=0.7)
+    assert report["indexed"] == len(rows) + 1
+    assert report["duplicate_queries"] == sum(group % 3 for group in range(20))
+    assert [len(cluster["query_ids"]) for cluster in report["clusters"]].count(3) == 6
+    assert all(cluster["representative"] == cluster["query_ids"][0] for cluster in report["clusters"])
+
+    assert index.rebuild() == len(rows) + 1
+    assert index.dedup_report(threshold=0.7)["duplicate_pairs"] == report["duplicate_pairs"]
@@ -0,0 +1,52 @@
+"""
+测试只读引擎与快照会话
+"""
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from src.db import UserForm, QueryForm
+from src.db.models import QueryModel
+
+
+def test_reads_use_read_only_snapshot(tmp_path):
+    db_path = str(tmp_path / "read.db")
+    UserForm(db_path)._create_tables()
+    query_form = QueryForm(db_path)
+    query_form.add_query(detail_query="q1")
+
+    # get_*/list_* 走只读引擎，写入后立即可见
+    assert [query.detail_query for query in query_form.list_all_queries()] == ["q1"]
+
+    with query_form.read_session() as session:
+        before = session.query(QueryModel).count()
+        query_form.add_query(detail_query="q2")
+        # 同一个只读会话内看到的是快照
+        assert session.query(QueryModel).count() == before == 1
+    assert len(query_form.list_all_queries()) == 2
+
+    with query_form.read_engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("DELETE FROM query_form"))
+
+
+def test_read_engine_quotes_path_and_creates_missing_db(tmp_path):
+    from src.db.engine import create_read_engine
+
+    folder = tmp_path / "dir #1 %"
+    folder.mkdir()
+    db_path = str(folder / "new db.db")
+    engine = create_read_engine(db_path)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM sqlite_master")).scalar() == 0
+    engine.dispose()
+
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    query_form.add_query(detail_query="q1")
+    engine = create_read_engine(db_path)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT detail_query FROM query_form")).scalar() == "q1"
+    engine.dispose()
+    assert sorted(p.name for p in folder.iterdir() if p.suffix == ".db") == ["new db.db"]
@@ -0,0 +1,75 @@
+"""
+测试 agent 运行编排
+"""
+
+import sys
+
+from src.db import UserForm, QueryForm, EvaluationForm, FilesForm, WorkScheduler
+from src.db.run_executor import RunExecutor, StubAgent, CallableAgent, SubprocessAgent
+
+
+def _setup(tmp_path, n=8):
+    db_path = str(tmp_path / "runs.db")
+    UserForm(db_path)._create_tables()
+    query_form = QueryForm(db_path)
+    for i in range(n):
+        query_form.add_query(detail_query=f"查询 {i}", priority=i % 2)
+    return db_path
+
+
+def _echo_agent(query):
+    return {"trajectory": [{"task": query["detail_query"]}], "report_content": "ok"}
+
+
+def test_fan_out_with_limits_retries_and_timeouts(tmp_path):
+    db_path = _setup(tmp_path)
+    steady = StubAgent("steady", steps=4, delay=0.01, max_concurrency=2)
+    flaky = StubAgent("flaky", fail_times=1, max_concurrency=3)
+    slow = StubAgent("slow", delay=1.0, timeout=0.05)
+    executor = RunExecutor(db_path, [steady, flaky, slow, CallableAgent("fn", _echo_agent)],
+                           max_attempts=2, retry_backoff=0.0, run_id="batch-1")
+
+    report = executor.run(list(range(1, 9)))
+    assert report["runs"] == 32
+    assert report["succeeded"] == 24 and report["failed"] == 8
+    assert report["timeouts"] == 16 and report["retries"] == 16
+    assert steady.max_active <= 2 and flaky.max_active <= 3
+    assert {agent for _, agent, _ in report["errors"]} == {"slow"}
+
+    evaluations = EvaluationForm(db_path).list_all_evaluations()
+    assert len(evaluations) == 24
+    assert {e.run_id for e in evaluations} == {"batch-1"}
+    evaluation_id = report["evaluation_ids"][(3, "steady")]
+    steps = EvaluationForm(db_path).get_trajectory(evaluation_id)
+    assert len(steps) == 4 and steps[0]["task"] == "查询 2"
+    files = FilesForm(db_path).get_files_by_evaluation(evaluation_id)
+    assert [f.filename for f in files] == ["answer.md"]
+
+    # 同一批次重复执行不会产生重复评估
+    again = RunExecutor(db_path, [StubAgent("steady")], run_id="batch-1").run([1])
+    assert again["failed"] == 1 and len(EvaluationForm(db_path).list_all_evaluations()) == 24
+
+
+def test_invalid_trajectory_and_subprocess(tmp_path):
+    db_path = _setup(tmp_path, n=2)
+    bad = CallableAgent("bad", lambda query: {"trajectory": [{"step": "one"}]})
+    script = "import sys, json; print(json.dumps({'trajectory': [{'task': sys.stdin.read()}]}))"
+    cli = SubprocessAgent("cli", [sys.executable, "-c", script], timeout=30)
+    report = RunExecutor(db_path, [bad, cli], retry_backoff=0.0).run([1, 2])
+
+    assert report["per_agent"]["cli"]["succeeded"] == 2
+    assert report["per_agent"]["bad"]["failed"] == 2
+    assert all("结果格式错误" in error for _, _, error in report["errors"])
+    assert report["retries"] == 0
+
+
+def test_run_work_items(tmp_path):
+    db_path = _setup(tmp_path, n=6)
+    scheduler = WorkScheduler(db_path, max_attempts=1)
+    scheduler.enqueue(["stub", "flaky"])
+    executor = RunExecutor(db_path, [StubAgent("stub"), StubAgent("flaky", fail_times=5)],
+                           max_attempts=1, retry_backoff=0.0)
+
+    totals = executor.run_work_items(scheduler, "runner-1", batch_size=4)
+    assert totals["runs"] == 12 and totals["succeeded"] == 6
+    assert scheduler.get_queue_stats() == {"pending": 0, "leased": 0, "done": 6, "failed": 6}
@@ -0,0 +1,75 @@
+"""
+测试自动评分流水线
+"""
+
+from src.db import UserForm, QueryForm, EvaluationForm, ScoringPipeline
+from src.db.run_executor import RunExecutor, StubAgent
+from src.db.scoring import RuleJudge, LocalJudge, ModelJudge
+
+
+def _setup(tmp_path, n=5):
+    db_path = str(tmp_path / "scoring.db")
+    UserForm(db_path)._create_tables()
+    query_form = QueryForm(db_path)
+    for i in range(n):
+        query_form.add_query(detail_query=f"查询 {i}")
+    RunExecutor(db_path, [StubAgent("a", steps=4), StubAgent("b", steps=8)]).run(list(range(1, n + 1)))
+    EvaluationForm(db_path).add_evaluation(1, agent="empty")
+    return db_path
+
+
+class CountingModel:
+    def __init__(self, reply="分数: 72"):
+        self.reply = reply
+        self.calls = 0
+
+    def __call__(self, prompt):
+        self.calls += 1
+        assert "查询" in prompt
+        return self.reply
+
+
+def test_scores_written_and_cached(tmp_path):
+    db_path = _setup(tmp_path)
+    model = CountingModel()
+    judges = [RuleJudge(), LocalJudge(weight=2), ModelJudge(model, batch_size=4)]
+    report = ScoringPipeline(db_path, judges).score()
+
+    assert report["evaluations"] == 11 and report["updated"] == 11 and report["failed"] == 0
+    assert model.calls == 11
+    assert all(stats == {"hits": 0, "misses": 11, "errors": 0} for stats in report["judges"].values())
+    evaluations = {e.id: e for e in EvaluationForm(db_path).list_all_evaluations()}
+    assert all(evaluations[eid].quality_score == score for eid, score in report["scores"].items())
+    empty = next(e for e in evaluations.values() if e.agent == "empty")
+    assert report["scores"][empty.id] < min(s for eid, s in report["scores"].items() if eid != empty.id)
+
+    # 未改动时全部命中缓存，分数不变不更新
+    again = ScoringPipeline(db_path, [RuleJudge(), LocalJudge(weight=2), ModelJudge(model)]).score()
+    assert model.calls == 11 and again["updated"] == 0 and again["scores"] == report["scores"]
+
+    # 只提升模型评委版本：只有它重新计算
+    model.reply = "10"
+    bumped = ScoringPipeline(db_path, [RuleJudge(), LocalJudge(weight=2), ModelJudge(model, version="2")]).score()
+    assert model.calls == 22
+    assert bumped["judges"]["rules"]["hits"] == 11 and bumped["judges"]["model"]["misses"] == 11
+    assert bumped["updated"] == 11
+
+    # 报告变化只让该评估重新计算
+    evaluation_id = next(iter(report["scores"]))
+    EvaluationForm(db_path).update_evaluation(evaluation_id, report_content="新的报告")
+    changed = ScoringPipeline(db_path, [LocalJudge(weight=2)]).score()
+    assert changed["judges"]["local"] == {"hits": 10, "misses": 1, "errors": 0}
+
+
+def test_judge_failure_is_isolated(tmp_path):
+    db_path = _setup(tmp_path, n=2)
+
+    def broken(prompt):
+        raise RuntimeError("服务不可用")
+
+    report = ScoringPipeline(db_path, [LocalJudge(), ModelJudge(broken, batch_size=2)]).score(agents=["a", "b"])
+    assert report["failed"] == 4 and report["updated"] == 0
+    assert report["judges"]["model"]["errors"] == 4
+    # 成功的评委输出已缓存
+    retry = ScoringPipeline(db_path, [LocalJudge()]).score(agents=["a", "b"], only_unscored=True)
+    assert retry["judges"]["local"]["hits"] == 4 and retry["updated"] == 4
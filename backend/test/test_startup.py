@@ -0,0 +1,77 @@
+"""
+测试延迟导入与启动耗时基准
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+from bench.bench_startup import parse_importtime, summarize, run_scenario, SCENARIOS
+
+
+def _run(code):
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return proc.stdout.strip().splitlines()[-1]
+
+
+def test_package_import_loads_nothing_heavy():
+    loaded = _run(
+        "import sys, src.db, src.db.Forms\n"
+        "print(sorted(m for m in ('sqlalchemy', 'rich', 'numpy', 'msgspec') if m in sys.modules))"
+    )
+    assert loaded == "[]"
+
+
+def test_form_defers_engines_and_rich(tmp_path):
+    db = str(tmp_path / "lazy.db")
+    result = _run(
+        "import os, sys\n"
+        "from src.db import QueryForm\n"
+        f"form = QueryForm({db!r})\n"
+        "print(sorted(m for m in ('rich', 'numpy') if m in sys.modules), form._engine is None, os.path.exists(form.db_path))"
+    )
+    assert result == "[] True False"
+
+
+def test_lazy_exports_resolve(tmp_path):
+    import src.db
+    from src.db import Forms
+    from src.db.Forms.query_form import QueryForm
+
+    assert src.db.QueryForm is QueryForm and Forms.QueryForm is QueryForm
+    assert "VectorIndex" in dir(src.db)
+    with pytest.raises(AttributeError):
+        src.db.NoSuchForm
+    with pytest.raises(ImportError):
+        from src.db import NoSuchForm  # noqa: F401
+
+    form = QueryForm(str(tmp_path / "q.db"))
+    assert form._create_tables() and form.add_query(detail_query="q")
+    assert form._read_engine is None
+    assert form.engine is form.engine and form.Session.kw["bind"] is form.engine
+    assert form.get_query_by_id(1) is not None and form._read_engine is not None
+
+
+def test_parse_importtime_and_budget():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     _json\n"
+        "import time:       300 |        420 |   json\n"
+        "import time:      1000 |       1500 | src.db\n"
+    )
+    rows = parse_importtime(stderr)
+    assert [(row["module"], row["depth"]) for row in rows] == [("_json", 2), ("json", 1), ("src.db", 0)]
+
+    runs = [{"elapsed_ms": ms, "imports": rows} for ms in (5, 30, 10)]
+    summary = summarize(runs, budget_ms=20, forbidden=("json", "rich"), top=2)
+    assert summary["elapsed_ms"] == 10 and not summary["over_budget"]
+    assert summary["forbidden_loaded"] == ["json"]
+    assert [row["module"] for row in summary["top_modules"]] == ["src.db", "json"]
+
+
+def test_run_scenario(tmp_path):
+    statement, _, _ = SCENARIOS["import_package"]
+    result = run_scenario(statement, str(tmp_path / "s.db"))
+    assert result["elapsed_ms"] > 0
+    assert any(row["module"] == "src.db" for row in result["imports"])
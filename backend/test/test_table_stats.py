@@ -0,0 +1,59 @@
+"""
+测试表统计（触发器维护的行数与字节数）
+"""
+
+from sqlalchemy import text
+
+from src.db import DatabaseManager, QueryForm, EvaluationForm, FilesForm
+
+
+def test_cached_counts_match_exact(tmp_path):
+    db_path = str(tmp_path / "stats.db")
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    for i in range(3):
+        query_form.add_query(detail_query=f"查询{i}")
+    EvaluationForm(db_path).add_evaluation(query_id=1, agent="a", trajectory="[]")
+    files_form = FilesForm(db_path)
+    files_form.add_file(evaluation_id=1, filename="a.bin", file_type="report", content=b"x" * 100)
+    files_form.add_file(evaluation_id=1, filename="b.bin", file_type="report", content=b"y" * 50)
+    files_form.update_file(2, content=b"z" * 10)
+    files_form.delete_file(1)
+    query_form.delete_query(3)
+
+    manager = DatabaseManager(db_path)
+    cached = {s["name"]: s for s in manager.get_database_info()["table_stats"]}
+    exact = dict(manager.get_database_info(count_mode="exact")["tables"])
+
+    for name in ("query_form", "evaluation_form", "files_form", "user_form"):
+        assert cached[name]["exact"]
+        assert cached[name]["rows"] == exact[name]
+    assert cached["files_form"]["content_bytes"] == 10
+    assert cached["query_form"]["content_bytes"] == len("查询0".encode()) * 2
+    assert cached["files_form"]["storage_bytes"] > 0
+
+    # 同一个引擎被复用
+    engine = manager.engine
+    manager.get_database_info()
+    assert manager.engine is engine
+
+    assert query_form.get_structure()["row_count"] == 2
+
+
+def test_stats_initialized_for_existing_rows(tmp_path):
+    """已有数据的库第一次安装触发器时用一次扫描初始化统计"""
+    db_path = str(tmp_path / "stats.db")
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    query_form.add_query(detail_query="q")
+    with query_form.engine.begin() as conn:
+        conn.execute(text("DELETE FROM table_stats"))
+    query_form._create_tables(repair=True)
+    query_form.add_query(detail_query="q2")
+    assert query_form.get_structure()["row_count"] == 2
+
+    estimate = DatabaseManager(db_path).get_database_info(count_mode="estimate", include_storage=False)
+    estimated = {s["name"]: s for s in estimate["table_stats"]}
+    assert not estimated["query_form"]["exact"]
+    assert estimated["query_form"]["rows"] == 2
+    assert estimated["query_form"]["storage_bytes"] is None
@@ -0,0 +1,132 @@
+"""
+测试轨迹对比
+"""
+
+import json
+import random
+
+import pytest
+from sqlalchemy import text
+
+from src.db import UserForm, QueryForm, EvaluationForm
+from src.db.trajectory_diff import (
+    TrajectoryDiff, align_sequences, diff_trajectories, flip_diff, _common_subsequence
+)
+
+
+def _step(tool=None, output="ok", args="{}", error=None, result=None):
+    history = [{"role": "user", "content": "q"}]
+    if result is not None:
+        history.append({"role": "tool", "content": result})
+    return {
+        "task": "t",
+        "model_input_messages": history,
+        "tool_calls": [] if tool is None else [
+            {"id": f"call-{random.random()}", "type": "function", "function": {"name": tool, "arguments": args}}
+        ],
+        "model_output_message": {"role": "assistant", "content": output},
+        "error": error,
+    }
+
+
+def _alignment_score(pairs, score, gap):
+    return sum(gap if i is None or j is None else score(i, j) for i, j in pairs)
+
+
+def _optimal_score(n, m, score, gap):
+    table = [[k * gap for k in range(m + 1)]]
+    for i in range(1, n + 1):
+        row = [i * gap]
+        for j in range(1, m + 1):
+            row.append(max(table[i - 1][j - 1] + score(i - 1, j - 1), table[i - 1][j] + gap, row[j - 1] + gap))
+        table.append(row)
+    return table[n][m]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_hirschberg_is_optimal(seed):
+    rng = random.Random(seed)
+    a = [rng.choice("abcd") for _ in range(rng.randint(0, 30))]
+    b = [rng.choice("abcd") for _ in range(rng.randint(0, 30))]
+
+    def score(i, j):
+        return 2 if a[i] == b[j] else -3
+
+    pairs = align_sequences(len(a), len(b), score)
+    assert [i for i, _ in pairs if i is not None] == list(range(len(a)))
+    assert [j for _, j in pairs if j is not None] == list(range(len(b)))
+    assert _alignment_score(pairs, score, -1) == _optimal_score(len(a), len(b), score, -1)
+
+
+def test_bit_parallel_common_subsequence():
+    rng = random.Random(7)
+    for _ in range(50):
+        a = [rng.choice("abc") for _ in range(rng.randint(0, 40))]
+        b = [rng.choice("abcd") for _ in range(rng.randint(0, 40))]
+        expected = -_optimal_score(len(a), len(b), lambda i, j: 0 if a[i] == b[j] else -2, -1)
+        assert _common_subsequence(a, b) == (len(a) + len(b) - expected) // 2
+
+
+def test_diff_aligns_steps():
+    a = [_step("search"), _step("read", result="r1"), _step("read", args='{"p": 2}', result="r2"), _step(output="done")]
+    b = [_step("search"), _step("read", result="r1"), _step("calc", result="r1"), _step(output="other")]
+    result = diff_trajectories(a, b)
+
+    ops = [(row["op"], row["step_a"], row["step_b"]) for row in result["alignment"]]
+    assert ops == [("equal", 0, 0), ("equal", 1, 1), ("delete", 2, None), ("insert", None, 2), ("changed", 3, 3)]
+    assert result["alignment"][-1]["fields"] == ["model_output_message"]
+
+    summary = result["summary"]
+    assert (summary["equal"], summary["changed"], summary["only_a"], summary["only_b"]) == (2, 1, 1, 1)
+    assert summary["first_divergence"] == 2 and not summary["final_output_equal"]
+    assert summary["common_tool_calls"] == 2
+    assert summary["tools_only_a"] == {"read": 1} and summary["tools_only_b"] == {"calc": 1}
+
+    flipped = flip_diff(result)
+    assert flipped["summary"] == diff_trajectories(b, a)["summary"]
+    assert flipped["summary"]["tools_only_a"] == {"calc": 1}
+
+
+def test_identical_runs_ignore_call_ids():
+    steps = [_step("search"), _step("read", result="x"), _step(output="done")]
+    result = diff_trajectories(steps, json.loads(json.dumps(steps).replace("call-", "other-")))
+    assert result["summary"]["similarity"] == 1.0 and result["summary"]["first_divergence"] is None
+
+
+@pytest.fixture
+def evaluations(tmp_path):
+    db_path = str(tmp_path / "diff.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+    form = EvaluationForm(db_path)
+    form.add_evaluation(1, agent="a", trajectory=json.dumps([_step("search"), _step(output="x")]))
+    form.add_evaluation(1, agent="b", trajectory=json.dumps([_step("search"), _step("read"), _step(output="x")]))
+    return db_path
+
+
+def test_cached_diff_and_paging(evaluations):
+    differ = TrajectoryDiff(evaluations)
+    forward = differ.diff(1, 2)
+    assert forward["summary"]["only_b"] == 1
+
+    with differ.engine.begin() as conn:
+        assert conn.execute(text("SELECT evaluation_a, evaluation_b FROM trajectory_diff")).all() == [(1, 2)]
+    backward = differ.get_alignment_page(2, 1, offset=1, limit=1)
+    assert backward["total"] == 3 and backward["summary"]["only_a"] == 1
+    assert backward["rows"] == [{"op": "delete", "step_a": 1, "step_b": None,
+                                 "tools_a": ["read"], "tools_b": None, "fields": []}]
+
+    result = differ.compare_on_query(1, "b", "a")
+    assert (result["evaluation_a"], result["evaluation_b"]) == (2, 1)
+    assert differ.compare_on_query(1, "a", "missing") is None
+    assert differ.diff(1, 99) is None
+
+
+def test_cache_invalidated_when_trajectory_changes(evaluations):
+    differ = TrajectoryDiff(evaluations)
+    assert differ.get_diff_summary(1, 2)["equal"] == 2
+    with differ.engine.begin() as conn:
+        conn.execute(text("UPDATE evaluation_form SET trajectory = :t WHERE id = 2"),
+                     {"t": json.dumps([_step("search"), _step(output="x")])})
+    assert differ.get_diff_summary(1, 2)["similarity"] == 1.0
+    assert differ.clear_cache(evaluation_id=2) == 1
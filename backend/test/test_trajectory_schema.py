@@ -0,0 +1,116 @@
+"""
+测试轨迹解析与校验
+"""
+
+import json
+
+import pytest
+
+from bench.synthetic import SyntheticDataGenerator
+from bench.bench_trajectory import run_benchmark, synthetic_corpus
+from src.db import UserForm, QueryForm, EvaluationForm
+from src.db.trajectory_schema import (
+    STEP_FIELDS, TrajectoryValidationError, msgspec, parse_trajectory, normalize_trajectory_json
+)
+
+MODES = [False] + ([True] if msgspec is not None else [])
+
+
+@pytest.mark.parametrize("use_msgspec", MODES)
+def test_normalizes_steps(use_msgspec):
+    raw = [{
+        "task": "t",
+        "timing": {"start_time": 1, "end_time": 3},
+        "token_usage": {"input_tokens": 3, "output_tokens": 4},
+        "model_input_messages": [{"role": "user", "content": [{"type": "text", "text": "hi"}], "extra": 1}],
+        "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "search", "arguments": "{}"}}],
+        "model_output_message": {"role": "assistant", "content": "ok", "reasoning_content": "think"},
+        "error": {"type": "Timeout", "message": "tool timed out"},
+        "observations": ["page"],
+        "action_output": None,
+    }]
+    step = parse_trajectory(json.dumps(raw), use_msgspec=use_msgspec)[0]
+
+    # 声明的字段按固定顺序在前，未声明的字段原样保留在后
+    assert tuple(step) == STEP_FIELDS + ("observations", "action_output")
+    assert step["observations"] == ["page"] and step["action_output"] is None
+    assert step["step"] == 1
+    assert step["timing"] == {"start_time": 1.0, "end_time": 3.0, "duration": 2.0}
+    assert step["token_usage"]["total_tokens"] == 7
+    assert step["model_input_messages"] == [{"role": "user", "content": [{"type": "text", "text": "hi"}], "extra": 1}]
+    assert step["model_output_message"]["reasoning_content"] == "think"
+    assert step["error"] == {"type": "Timeout", "message": "tool timed out"}
+    assert json.loads(normalize_trajectory_json(json.dumps(raw), use_msgspec=use_msgspec)) == [step]
+
+
+def test_both_paths_agree_on_synthetic_runs():
+    steps = SyntheticDataGenerator(seed=3).trajectory(n_steps=12)
+    data = json.dumps(steps).encode("utf-8")
+    fallback = parse_trajectory(data, use_msgspec=False)
+    assert fallback == steps
+    if msgspec is not None:
+        assert parse_trajectory(data, use_msgspec=True) == fallback
+        assert json.loads(normalize_trajectory_json(data, use_msgspec=True)) == fallback
+
+
+@pytest.mark.parametrize("use_msgspec", MODES)
+@pytest.mark.parametrize("data, path", [
+    ('{"not": "a list"}', "$"),
+    ('[{"token_usage": {"input_tokens": "many"}}]', "$[0].token_usage.input_tokens"),
+    ('[{"token_usage": {"input_tokens": -1}}]', "$[0].token_usage.input_tokens"),
+    ('[{"model_input_messages": [{"content": "no role"}]}]', "$[0].model_input_messages[0]"),
+    ('[{"step": true}]', "$[0].step"),
+    ('[{"step": 1}', None),
+])
+def test_rejects_malformed_runs(use_msgspec, data, path):
+    with pytest.raises(TrajectoryValidationError) as info:
+        parse_trajectory(data, use_msgspec=use_msgspec)
+    if path is not None:
+        assert str(info.value).startswith(path)
+
+
+@pytest.mark.skipif(msgspec is None, reason="需要 msgspec 才能对比两条路径")
+@pytest.mark.parametrize("data", [
+    '[{"token_usage": {"input_tokens": null, "output_tokens": 1}}]',
+    '[{"token_usage": {"output_tokens": 1.5}}]',
+    '[{"token_usage": {"total_tokens": "x"}}]',
+    '[{"model_input_messages": {}}]',
+    '[{"model_input_messages": [{"content": "no role"}]}]',
+    '[{"model_input_messages": [{"role": null}]}]',
+    '[{"timing": {"start_time": []}}]',
+    '[{"tool_calls": [{"function": {}}]}]',
+    '[{"error": 1}]',
+    '{"not": "a list"}',
+])
+def test_both_paths_reject_with_same_message(data):
+    messages = []
+    for use_msgspec in (False, True):
+        with pytest.raises(TrajectoryValidationError) as info:
+            parse_trajectory(data, use_msgspec=use_msgspec)
+        messages.append(str(info.value))
+    assert messages[0] == messages[1]
+
+
+@pytest.mark.parametrize("use_msgspec", MODES)
+def test_null_messages_normalized(use_msgspec):
+    step = parse_trajectory('[{"model_input_messages": null, "tool_calls": null}]', use_msgspec=use_msgspec)[0]
+    assert step["model_input_messages"] == [] and step["tool_calls"] is None
+
+
+def test_add_evaluation_validates(tmp_path):
+    db_path = str(tmp_path / "schema.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+    form = EvaluationForm(db_path)
+
+    assert not form.add_evaluation(1, agent="bad", trajectory='[{"step": "one"}]', validate=True)
+    assert form.add_evaluation(1, agent="ok", trajectory='[{"task": "t"}]', validate=True)
+    stored = form.get_trajectory(form.list_all_evaluations()[0].id)
+    assert stored[0]["step"] == 1 and stored[0]["tool_calls"] == []
+
+
+def test_benchmark_small_corpus():
+    result = run_benchmark(synthetic_corpus(0.2), repeats=1)
+    assert result["corpus"]["mb"] >= 0.2
+    assert "parse_trajectory[stdlib]" in result["methods"]
+    assert all(stats["failures"] == 0 and stats["mb_per_s"] > 0 for stats in result["methods"].values())
@@ -0,0 +1,50 @@
+"""
+测试前缀共享的轨迹存储
+"""
+
+import json
+
+from bench.synthetic import SyntheticDataGenerator
+from src.db import UserForm, QueryForm, EvaluationForm, FilesForm
+from src.db.trajectory_store import (
+    pack_trajectory_text, unpack_trajectory_text, load_trajectory, CompactTrajectory
+)
+
+
+def test_pack_round_trip_is_linear():
+    steps = SyntheticDataGenerator(seed=1).trajectory(n_steps=40)
+    original = json.dumps(steps, ensure_ascii=False)
+    packed = pack_trajectory_text(original)
+
+    assert len(packed) * 5 < len(original)
+    assert json.loads(unpack_trajectory_text(packed)) == steps
+    assert unpack_trajectory_text(original) == original
+    assert pack_trajectory_text(packed) == packed
+    assert pack_trajectory_text("not json") == "not json"
+
+    lazy = load_trajectory(packed, lazy=True)
+    assert isinstance(lazy, CompactTrajectory)
+    assert lazy.step(25) == steps[25]
+    assert lazy.step(3) == steps[3]
+    assert list(lazy) == steps
+
+
+def test_forms_store_compact_and_rebuild(tmp_path):
+    db_path = str(tmp_path / "trajectory.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+    steps = SyntheticDataGenerator(seed=2).trajectory(n_steps=12)
+    raw = json.dumps(steps, ensure_ascii=False)
+
+    evaluation_form = EvaluationForm(db_path)
+    evaluation_form.add_evaluation(query_id=1, agent="a", trajectory=raw)
+    # .trajectory 是存储的紧凑文本，读取时不还原；步骤数组由 get_trajectory 显式还原
+    stored = evaluation_form.get_evaluation_by_id(1).trajectory
+    assert len(stored) < len(raw) and json.loads(stored)["format"] == "prefix/1"
+    assert evaluation_form.get_trajectory(1) == steps
+    assert evaluation_form.get_trajectory_step(1, 11) == steps[11]
+    assert evaluation_form.get_trajectory_step(1, 12) is None
+
+    files_form = FilesForm(db_path)
+    files_form.add_file(1, "trajectory.json", "trajectory", content=raw.encode("utf-8"))
+    assert json.loads(files_form.get_file_content(1)) == steps
@@ -0,0 +1,60 @@
+"""
+测试按自然键的原子 upsert
+"""
+
+import sqlite3
+
+from src.db import UserForm, QueryForm, EvaluationForm
+from src.db.models import compute_query_hash
+
+
+def test_upsert_by_natural_keys(tmp_path):
+    db_path = str(tmp_path / "upsert.db")
+    user_form = UserForm(db_path)
+    user_form._create_tables()
+
+    assert user_form.add_user("alice", "pw", "Alice") is True
+    assert user_form.add_user("alice", "pw2", "Alice2") is False
+    assert user_form.upsert_user("alice", "pw3", "A") == 1
+    assert user_form.get_user_by_username("alice").password == "pw3"
+
+    query_form = QueryForm(db_path)
+    first = query_form.upsert_query("  求和  ", priority=1)
+    assert query_form.upsert_query("求和", priority=3) == first
+    ids = query_form.upsert_queries([
+        {"detail_query": "a", "priority": 1},
+        {"detail_query": "b", "priority": 1},
+        {"detail_query": "a", "priority": 2},
+    ])
+    assert ids[0] == ids[2] and len(set(ids)) == 2
+    query = query_form.get_query_by_id(first)
+    assert query.priority == 3
+    assert query.content_hash == compute_query_hash("求和")
+    # 内容已存在时 add_query 不重复插入，返回已有查询的ID
+    assert query_form.add_query(detail_query=" 求和", priority=9) == first
+    assert query_form.get_query_by_id(first).priority == 3
+
+    evaluation_form = EvaluationForm(db_path)
+    run = evaluation_form.upsert_evaluation(first, "agent-a", "run-1", quality_score=50)
+    assert evaluation_form.upsert_evaluation(first, "agent-a", "run-1", quality_score=80) == run
+    assert evaluation_form.upsert_evaluation(first, "agent-a", "run-2") != run
+    assert evaluation_form.get_evaluation_by_id(run).quality_score == 80
+    # 自然键不完整时拒绝写入
+    assert evaluation_form.upsert_evaluations([{"query_id": first, "agent": "agent-a"}]) == []
+
+
+def test_existing_database_gains_new_columns(tmp_path):
+    db_path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "CREATE TABLE query_form (id INTEGER PRIMARY KEY, lazy_query TEXT, detail_query TEXT,"
+        " creator_id INTEGER, priority INTEGER, created_at TEXT NOT NULL, updated_at TEXT)"
+    )
+    conn.commit()
+    conn.close()
+
+    query_form = QueryForm(db_path)
+    query_form._create_tables()
+    assert query_form.upsert_query("旧库中的查询") == 1
+    columns = [column[1] for column in query_form.get_structure()["columns"]]
+    assert "content_hash" in columns
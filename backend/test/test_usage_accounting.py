@@ -0,0 +1,113 @@
+"""
+测试用量与费用统计
+"""
+
+import json
+
+import pytest
+from sqlalchemy import text
+
+from src.db import UserForm, QueryForm, EvaluationForm, UsageAccounting
+from src.db.usage_accounting import PriceTable
+
+
+def _step(input_tokens=10, output_tokens=5, duration=1.5, tool_calls=0, error=None, **extra):
+    step = {
+        "task": "t",
+        "timing": {"start_time": 0, "end_time": duration, "duration": duration},
+        "token_usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        "model_input_messages": [{"role": "user", "content": "hi"}],
+        "tool_calls": [{"id": f"c{i}", "type": "function"} for i in range(tool_calls)],
+        "error": error,
+    }
+    step.update(extra)
+    return step
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "usage.db")
+    UserForm(path)._create_tables()
+    queries = QueryForm(path)
+    queries.add_query(detail_query="q1")
+    queries.add_query(detail_query="q2")
+    return path
+
+
+def test_extracts_usage_on_insert(db_path):
+    form = EvaluationForm(db_path)
+    trajectory = [_step(tool_calls=2), _step(input_tokens=1, output_tokens=2, duration=0.5, error="boom")]
+    form.add_evaluation(1, agent="a", trajectory=json.dumps(trajectory))
+    form.add_evaluation(2, agent="a", trajectory="not json")
+
+    accounting = UsageAccounting(db_path)
+    usage = accounting.get_evaluation_usage(1)
+    assert usage["steps"] == 2 and usage["error_steps"] == 1 and usage["tool_calls"] == 2
+    assert (usage["input_tokens"], usage["output_tokens"], usage["total_tokens"]) == (11, 7, 18)
+    assert usage["duration_seconds"] == pytest.approx(2.0)
+    assert accounting.get_evaluation_usage(2)["steps"] == 0
+    assert accounting.get_evaluation_usage(99) is None
+
+
+def test_rollups_follow_updates_and_deletes(db_path):
+    form = EvaluationForm(db_path)
+    form.add_evaluation(1, agent="a", trajectory=json.dumps([_step()]))
+    form.add_evaluation(2, agent="a", trajectory=json.dumps([_step(), _step()]))
+    form.add_evaluation(2, agent="b", trajectory=json.dumps([_step()]))
+    accounting = UsageAccounting(db_path)
+
+    [agent_a] = accounting.get_agent_usage(["a"])
+    assert agent_a["evaluations"] == 2 and agent_a["steps"] == 3 and agent_a["total_tokens"] == 45
+    assert agent_a["mean_tokens"] == 22.5 and agent_a["mean_score"] is None
+
+    with accounting.engine.begin() as conn:
+        conn.execute(text("UPDATE evaluation_form SET quality_score = 80 WHERE id = 1"))
+        conn.execute(text("UPDATE evaluation_form SET trajectory = :t WHERE id = 2"), {"t": json.dumps([_step()])})
+        conn.execute(text("DELETE FROM evaluation_form WHERE id = 3"))
+
+    [agent_a] = accounting.get_agent_usage()
+    assert agent_a["agent"] == "a" and agent_a["steps"] == 2 and agent_a["mean_score"] == 80
+    assert {row["key"] for row in accounting.get_query_usage()} == {"1", "2"}
+    assert accounting.get_query_usage(query_id=2, agents=["b"]) == []
+    assert [row["evaluations"] for row in accounting.get_daily_usage(start="2000-01-01")] == [2]
+
+    with accounting.engine.begin() as conn:
+        expected = conn.execute(text("SELECT * FROM usage_rollup ORDER BY scope, key, agent")).all()
+    assert accounting.rebuild() == 2
+    with accounting.engine.begin() as conn:
+        assert conn.execute(text("SELECT * FROM usage_rollup ORDER BY scope, key, agent")).all() == expected
+
+
+def test_cost_and_cheapest_at_equal_quality(db_path):
+    form = EvaluationForm(db_path)
+    for agent, score, tokens in (("big", 90, 1000), ("small", 89, 100), ("weak", 50, 10)):
+        form.add_evaluation(1, agent=agent, quality_score=score,
+                            trajectory=json.dumps([_step(input_tokens=tokens, output_tokens=tokens)]))
+    prices = {"big": {"input": 10, "output": 30}, "default": {"input": 1, "output": 2}}
+    accounting = UsageAccounting(db_path, prices=prices)
+
+    usage = {row["agent"]: row for row in accounting.get_agent_usage()}
+    assert usage["big"]["cost"] == pytest.approx(1000 * 40 / 1e6)
+    assert usage["small"]["cost_per_evaluation"] == pytest.approx(100 * 3 / 1e6)
+
+    assert [row["agent"] for row in accounting.cheapest_agents()] == ["big"]
+    assert [row["agent"] for row in accounting.cheapest_agents(tolerance=2)] == ["small", "big"]
+    assert accounting.cheapest_agents(min_scored=2) == []
+
+
+def test_price_table_charges_unsplit_tokens():
+    prices = PriceTable({"a": {"input": 1, "output": 4, "total": 2}, "default": {"input": 1}})
+    assert prices.cost("a", 0, 0, 1_000_000) == 2
+    assert prices.cost("other", 0, 0, 1_000_000) == 1
+    assert prices.cost("a", 500_000, 500_000, 1_000_000) == 2.5
+
+
+def test_backfills_existing_database(db_path):
+    EvaluationForm(db_path).add_evaluation(1, agent="a", trajectory=json.dumps([_step()]))
+    accounting = UsageAccounting(db_path)
+    with accounting.engine.begin() as conn:
+        conn.execute(text("DELETE FROM evaluation_usage"))
+        assert conn.execute(text("SELECT COUNT(*) FROM usage_rollup")).scalar() == 0
+
+    UserForm(db_path)._create_tables(repair=True)
+    assert accounting.get_agent_usage()[0]["total_tokens"] == 15
@@ -0,0 +1,188 @@
+"""
+测试本地向量检索
+"""
+
+import os
+
+import pytest
+from sqlalchemy import text
+
+np = pytest.importorskip("numpy")
+
+from src.db import UserForm, QueryForm, EvaluationForm, ChangeFeed
+from src.db import vector_index
+from src.db.vector_index import VectorIndex, HashingEmbedder, FunctionEmbedder, spherical_kmeans
+
+
+class CountingEmbedder(HashingEmbedder):
+    """记录嵌入过的文本，可在第 fail_after 批时抛出异常模拟中断"""
+
+    def __init__(self, fail_after=None, **kwargs):
+        super().__init__(**kwargs)
+        self.texts = []
+        self.fail_after = fail_after
+
+    def embed(self, texts):
+        if self.fail_after is not None:
+            self.fail_after -= 1
+            if self.fail_after < 0:
+                raise RuntimeError("interrupted")
+        self.texts.extend(texts)
+        return super().embed(texts)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "vectors.db")
+    UserForm(path)._create_tables()
+    return path
+
+
+def test_hashing_embedder_similarity():
+    embedder = HashingEmbedder(dim=128)
+    vectors = vector_index.normalize_rows(embedder.embed([
+        "the agent failed to parse the CSV file",
+        "Agent failed parsing the csv files!",
+        "weather forecast for tomorrow in Paris",
+        "读取 CSV 文件失败",
+        "读取CSV文件时失败了",
+        "",
+    ]))
+    assert vectors.shape == (6, 128) and vectors.dtype == np.float32
+    assert vectors[0] @ vectors[1] > 0.5 > vectors[0] @ vectors[2]
+    assert vectors[3] @ vectors[4] > 0.5
+    assert not vectors[5].any()
+    assert np.array_equal(vectors[0], vector_index.normalize_rows(HashingEmbedder(dim=128).embed(["the agent failed to parse the CSV file"]))[0])
+
+    with pytest.raises(ValueError):
+        FunctionEmbedder(lambda texts: np.zeros((len(texts), 3)), dim=4).embed(["a"])
+
+
+def test_incremental_updates_from_any_write_path(db_path):
+    queries = QueryForm(db_path)
+    queries.add_query(detail_query="How do I read a CSV file with pandas?")
+    queries.add_query(detail_query="Explain TCP vs UDP")
+    queries.add_query(lazy_query="sort a list of dictionaries by key in python")
+    embedder = CountingEmbedder()
+    index = VectorIndex(db_path, embedder=embedder, vector_dir=os.path.join(os.path.dirname(db_path), "vec"))
+
+    [best, *_] = index.search("queries", "read csv file using pandas")
+    assert best["id"] == 1 and best["detail_query"].startswith("How do I read")
+    assert len(embedder.texts) == 4
+
+    with index.engine.begin() as conn:
+        conn.execute(text("UPDATE query_form SET detail_query = 'reading CSV files with pandas' WHERE id = 2"))
+        conn.execute(text("UPDATE query_form SET priority = 5 WHERE id = 1"))
+        conn.execute(text("DELETE FROM query_form WHERE id = 3"))
+    results = index.search("queries", "read csv file using pandas", k=5)
+    assert sorted(row["id"] for row in results) == [1, 2]
+    # 只改优先级的查询 1 不会重新嵌入
+    assert sorted(embedder.texts[4:]) == ["read csv file using pandas", "reading CSV files with pandas"]
+
+    [stats] = index.get_stats()
+    assert stats["vectors"] == 2 and stats["tombstones"] == 2 and not stats["scanning"]
+    assert index.search_similar("queries", 1, k=5)[0]["id"] == 2
+    assert index.search_similar("queries", 3) == []
+
+
+def test_reports_and_reopened_index(db_path):
+    QueryForm(db_path).add_query(detail_query="q")
+    form = EvaluationForm(db_path)
+    form.add_evaluation(1, agent="a", report_content="The tool call timed out while fetching the web page.")
+    form.add_evaluation(1, agent="b", report_content="Completed successfully, all tests passed.")
+    form.add_evaluation(1, agent="c")
+    vector_dir = os.path.join(os.path.dirname(db_path), "vec")
+
+    index = VectorIndex(db_path, vector_dir=vector_dir)
+    [hit, *_] = index.search("reports", "request timed out when fetching page")
+    assert (hit["id"], hit["agent"], hit["query_id"]) == (1, "a", 1) and hit["snippet"].startswith("The tool call")
+
+    form.add_evaluation(1, agent="d", report_content="Fetching the web page timed out again.")
+    other = VectorIndex(db_path, vector_dir=vector_dir)
+    assert [row["id"] for row in other.search_similar("reports", 1, k=1)] == [4]
+    # 另一个实例写入后，原实例重新映射文件即可读到
+    assert sorted(row["id"] for row in index.search("reports", "web page timed out", k=2, sync=False)) == [1, 4]
+
+    with pytest.raises(ValueError):
+        index.search("files", "x")
+
+
+def test_compaction_keeps_results(db_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "COMPACT_MIN_SLOTS", 8)
+    queries = QueryForm(db_path)
+    queries.upsert_queries([{"detail_query": f"question number {i} about topic {i % 5}"} for i in range(20)])
+    vector_dir = os.path.join(os.path.dirname(db_path), "vec")
+    index = VectorIndex(db_path, vector_dir=vector_dir)
+    before = index.search("queries", "question number 7 about topic 2", k=3)
+
+    with index.engine.begin() as conn:
+        conn.execute(text("DELETE FROM query_form WHERE id > 12"))
+    after = index.search("queries", "question number 7 about topic 2", k=3)
+    assert after[0] == before[0] and all(row["id"] <= 12 for row in after)
+
+    [stats] = index.get_stats()
+    assert stats["vectors"] == 12 and stats["tombstones"] == 0
+    assert sorted(os.listdir(vector_dir)) == ["queries-2.crc", "queries-2.ids", "queries-2.vec"]
+
+
+def test_ivf_search_and_appends_after_training(db_path):
+    rng = np.random.default_rng(0)
+    centers = vector_index.normalize_rows(rng.normal(size=(8, 16)))
+
+    def embed(texts):
+        # 文本 "c<簇>-<序号>" 映射到对应簇中心附近，便于检验召回
+        cluster = [int(t.split("-")[0][1:]) for t in texts]
+        seeds = [int(t.split("-")[1]) for t in texts]
+        noise = np.stack([np.random.default_rng(seed).normal(size=16) for seed in seeds]) * 0.1
+        return centers[cluster] + noise
+
+    embedder = FunctionEmbedder(embed, dim=16, name="clusters")
+    queries = QueryForm(db_path)
+    queries.upsert_queries([{"detail_query": f"c{i % 8}-{i}"} for i in range(400)])
+    index = VectorIndex(db_path, embedder=embedder, vector_dir=os.path.join(os.path.dirname(db_path), "vec"))
+    assert index.train_ivf("queries", n_lists=8, seed=1)
+
+    exact = index.search("queries", "c3-5000", k=5, exact=True)
+    approximate = index.search("queries", "c3-5000", k=5, nprobe=2)
+    assert [row["id"] for row in approximate] == [row["id"] for row in exact]
+
+    queries.add_query(detail_query="c3-5000")
+    [top] = index.search("queries", "c3-5000", k=1, nprobe=1)
+    assert top["id"] == 401 and top["score"] == pytest.approx(1.0)
+    assert index.get_stats()[0]["n_lists"] == 8
+
+
+def test_spherical_kmeans_separates_clusters():
+    rng = np.random.default_rng(2)
+    centers = vector_index.normalize_rows(rng.normal(size=(4, 8)))
+    data = vector_index.normalize_rows(np.repeat(centers, 50, axis=0) + rng.normal(size=(200, 8)) * 0.05)
+    centroids = spherical_kmeans(data, 4, seed=0)
+    assert np.sort((centroids @ centers.T).max(axis=0)).min() > 0.95
+
+
+def test_resumable_scan_and_rebuild(db_path, monkeypatch):
+    monkeypatch.setattr(vector_index, "SCAN_PAGE", 4)
+    QueryForm(db_path).upsert_queries([{"detail_query": f"query {i}"} for i in range(10)])
+    vector_dir = os.path.join(os.path.dirname(db_path), "vec")
+
+    with pytest.raises(RuntimeError):
+        VectorIndex(db_path, embedder=CountingEmbedder(fail_after=1), vector_dir=vector_dir).sync()
+    index = VectorIndex(db_path, embedder=CountingEmbedder(), vector_dir=vector_dir)
+    [stats] = [row for row in index.get_stats() if row["collection"] == "queries"]
+    assert stats["vectors"] == 4 and stats["scanning"]
+    assert index.sync(["queries"])["queries"]["embedded"] == 6
+    assert len(index.embedder.texts) == 6
+
+    # 变更日志被清理到游标之后：无法增量同步，整体重建
+    QueryForm(db_path).add_query(detail_query="query 10")
+    feed = ChangeFeed(db_path)
+    feed.prune(feed.current_cursor())
+    assert index.sync(["queries"])["queries"]["embedded"] == 11
+
+    wider = VectorIndex(db_path, embedder=HashingEmbedder(dim=64), vector_dir=vector_dir)
+    assert wider.search("queries", "query 3", k=1)[0]["id"] == 4
+    assert wider.rebuild(["queries"]) == 11
+    # 旧一代文件在状态提交后删除
+    assert sorted(path for path in os.listdir(vector_dir) if path.startswith("queries-")) == [
+        "queries-4.crc", "queries-4.ids", "queries-4.vec"
+    ]
@@ -0,0 +1,84 @@
+"""
+测试评估任务调度
+"""
+
+import sqlite3
+import threading
+import time
+
+from src.db import UserForm, QueryForm, EvaluationForm, WorkScheduler
+
+
+def _setup(tmp_path, n=12):
+    db_path = str(tmp_path / "work.db")
+    UserForm(db_path)._create_tables()
+    query_form = QueryForm(db_path)
+    for i in range(n):
+        query_form.add_query(detail_query=f"q{i}", priority=i % 3)
+    return db_path
+
+
+def test_claim_order_lease_and_tokens(tmp_path):
+    db_path = _setup(tmp_path)
+    EvaluationForm(db_path).add_evaluation(1, agent="a", quality_score=80)
+    scheduler = WorkScheduler(db_path, lease_seconds=60, max_attempts=2)
+
+    assert scheduler.enqueue(["a", "b"]) == 23  # 查询 1 已有 agent a 的打分评估
+    assert scheduler.enqueue(["a", "b"]) == 0
+
+    items = scheduler.claim("e1", n=4)
+    assert [item["priority"] for item in items] == [2, 2, 2, 2]
+    assert [item["id"] for item in items] == sorted(item["id"] for item in items)
+
+    first, second = items[0], items[1]
+    assert not scheduler.complete(first["id"], "wrong-token")
+    assert scheduler.complete(first["id"], first["lease_token"], evaluation_id=1)
+    assert not scheduler.complete(first["id"], first["lease_token"])
+    assert scheduler.release(second["id"], second["lease_token"], error="超时")
+    assert scheduler.get_queue_stats() == {"pending": 20, "leased": 2, "done": 1, "failed": 0}
+
+    # 查询优先级变化由触发器同步到任务
+    QueryForm(db_path).update_query(items[2]["query_id"], priority=9)
+    promoted = scheduler.claim("e2", n=1)
+    assert promoted[0]["query_id"] == items[2]["query_id"] and promoted[0]["priority"] == 9
+
+    # 过期的租约在下一次领取时回收；领取次数用尽的任务标记为 failed
+    short = scheduler.claim("e2", n=30, lease_seconds=0.01)
+    assert len(short) == 19
+    time.sleep(0.05)
+    again = scheduler.claim("e3", n=30)
+    assert {item["id"] for item in again} == {item["id"] for item in short if item["attempts"] < 2}
+    assert scheduler.get_queue_stats()["failed"] == 1  # 被释放过一次的任务
+
+
+def test_concurrent_claims_never_overlap(tmp_path):
+    db_path = _setup(tmp_path, n=60)
+    WorkScheduler(db_path).enqueue(["a", "b", "c"])
+    claimed, lock = [], threading.Lock()
+
+    def worker(name):
+        scheduler = WorkScheduler(db_path)
+        while True:
+            items = scheduler.claim(name, n=3)
+            if not items:
+                return
+            with lock:
+                claimed.extend(item["id"] for item in items)
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(claimed) == 180
+    assert len(set(claimed)) == 180
+
+
+def test_claim_uses_index(tmp_path):
+    db_path = _setup(tmp_path, n=1)
+    conn = sqlite3.connect(db_path)
+    plan = " ".join(row[-1] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM work_item WHERE status = 'pending' ORDER BY priority DESC, id LIMIT 5"
+    ))
+    conn.close()
+    assert "ix_work_item_claim" in plan and "TEMP B-TREE" not in plan
@@ -0,0 +1,66 @@
+"""
+测试单写入者组提交队列
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.db import UserForm, QueryForm, EvaluationForm, FilesForm, WriteQueue
+
+
+def test_group_commit_resolves_ids(tmp_path):
+    db_path = str(tmp_path / "queue.db")
+    UserForm(db_path)._create_tables()
+    QueryForm(db_path).add_query(detail_query="q")
+
+    with WriteQueue(db_path, max_batch=64, max_latency=0.05) as queue:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = list(pool.map(
+                lambda i: queue.add_evaluation(query_id=1, agent=f"agent-{i % 4}", quality_score=i), range(200)
+            ))
+        ids = [future.result(timeout=10) for future in futures]
+        file_id = queue.add_file(ids[0], "r.md", "report", content=b"report").result(timeout=10)
+        with_files = queue.add_evaluation(
+            query_id=1, agent="agent-x", deliverables=[{"filename": "out.txt", "content": b"x"}]
+        ).result(timeout=10)
+        # 外键不存在的行只让自己的 Future 失败
+        bad = queue.add_evaluation(query_id=999, agent="ghost")
+        assert queue.update_evaluation(ids[1], quality_score=100).result(timeout=10) == 1
+        with pytest.raises(Exception):
+            bad.result(timeout=10)
+
+    assert len(set(ids)) == 200
+    assert queue.stats["committed"] == 203
+    assert queue.stats["failed"] == 1
+    assert queue.stats["batches"] < 203
+    evaluation_form = EvaluationForm(db_path)
+    assert evaluation_form.get_evaluation_by_id(ids[1]).quality_score == 100
+    assert evaluation_form.get_evaluation_by_id(ids[7]).quality_score == 7
+    files_form = FilesForm(db_path)
+    assert files_form.get_file_by_id(file_id).file_size == 6
+    assert [f.filename for f in files_form.get_files_by_evaluation(with_files)] == ["out.txt"]
+
+
+def test_submit_requires_started_queue(tmp_path):
+    queue = WriteQueue(str(tmp_path / "idle.db"))
+    with pytest.raises(RuntimeError):
+        queue.add_file(1, "a", "report", content=b"")
+    with pytest.raises(RuntimeError):
+        queue.flush()
+
+
+def test_submit_after_stop_rejected(tmp_path):
+    db_path = str(tmp_path / "stop.db")
+    QueryForm(db_path)._create_tables()
+    queue = WriteQueue(db_path)
+    queue.start()
+    futures = [queue.add_file(1, f"f{i}", "report", content=b"x") for i in range(20)]
+    queue.flush()
+    queue.stop()
+    assert all(f.done() for f in futures)
+    assert queue.stats["committed"] + queue.stats["failed"] == queue.stats["submitted"] == 20
+    with pytest.raises(RuntimeError):
+        queue.add_file(1, "late", "report", content=b"")
+    with pytest.raises(RuntimeError):
+        queue.flush()
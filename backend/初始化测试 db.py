@@ -1,8 +1,7 @@
-import os
-
 from rich.console import Console
 
 from src.db import UserForm, QueryForm, EvaluationForm, FilesForm, DatabaseManager
+from src.db.importer import DirectoryImporter
 
 console = Console()
 
@@ -36,37 +35,15 @@ def add_user():
         console.print("[bold red]用户user1已存在[/bold red]")
 
 def batch_add_queries(query_form: QueryForm, user_form: UserForm, folder_path: str, priority: int = 1, username: str = "admin"):
-    """批量导入 query 文本到数据库"""
+    """批量导入 query 文本到数据库（遍历整个目录，已导入且未变化的文件会被跳过）"""
     user = user_form.get_user_by_username(username)
     if not user:
         print(f"用户 {username} 不存在")
         return
 
-    for i in range(1, 26):
-        filename = f"query-{i}.txt"
-        file_path = os.path.join(folder_path, filename)
-
-        if not os.path.exists(file_path):
-            print(f"[跳过] 未找到文件: {file_path}")
-            continue
-
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-
-        if not content:
-            print(f"[跳过] 文件内容为空: {filename}")
-            continue
-
-        success = query_form.add_query(
-            detail_query=content,
-            creator_id=user.id,
-            priority=priority
-        )
-
-        if success:
-            print(f"[✓] 成功导入: {filename}")
-        else:
-            print(f"[✗] 导入失败: {filename}")
+    importer = DirectoryImporter(query_form.db_path, creator_id=user.id, priority=priority)
+    stats = importer.import_queries(folder_path)
+    importer.display_stats(stats)
 
 def reset():
     db._reset_database()